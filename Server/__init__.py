@@ -1,8 +1,25 @@
 # -------------------------------------------------- local imports --------------------------------------------------- #
 
-from Server.server import main, app
+from typing import TYPE_CHECKING, Any
+
 from Server.config.read_config import Config
 
+if TYPE_CHECKING:
+    from Server.server import main, app
+
+# --------------------------------------------------- lazy imports --------------------------------------------------- #
+
+def __getattr__(name: str) -> Any:
+    """ `main` and `app` pull in fastapi and the whole model stack, they are only imported on first access so
+        `import Server` (and `start.py`'s pre-flight checks) stay cheap
+    """
+    if name in ("main", "app"):
+        import Server.server
+        return getattr(Server.server, name) #                                                                   return #
+
+    raise AttributeError(f"module 'Server' has no attribute '{name}'")
+# end                                                                                                      __getattr__ #
+
 # ------------------------------------------------------ public ------------------------------------------------------ #
 
 __all__ = [
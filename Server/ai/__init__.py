@@ -1,11 +1,16 @@
 # -------------------------------------------------- local imports --------------------------------------------------- #
 
 from Server.ai.context.chat_context import ChatContext
-from Server.ai.core.errors          import ModelFailedToLoad, ModelNotFoundError, ModelTookTooLongToLoad, ModelTypeNotSupported
+from Server.ai.context.images       import ImageStore
+from Server.ai.context.sessions     import SessionManager
+from Server.ai.context.transfer     import ContextImporter, export_session
+from Server.ai.core.errors          import ModelFailedToLoad, ModelNotFoundError, ModelTookTooLongToLoad, ModelTypeNotSupported, SessionBusyError, SessionNotFoundError
 from Server.ai.start.installer      import prelude
 from Server.ai.utils.utils          import UTILS
 from Server.ai.core.model_loader    import Model, Hub
-from Server.ai.core.data_structures import AudioData, ImageData, TranscribedText, TrainingRequest, BaseChatConfig, ChatRequest, ChatResponse
+from Server.ai.core.model_registry  import ModelRegistry, ModelSpec, RoutingRule
+from Server.ai.utils.metrics        import Metrics
+from Server.ai.core.data_structures import AudioData, ImageData, TranscribedText, TrainingRequest, BaseChatConfig, ChatRequest, ChatResponse, KnowledgeText, TokenizeRequest, EmbeddingsRequest
 
 # ------------------------------------------------------ public ------------------------------------------------------ #
 
@@ -15,6 +20,8 @@ __all__ = [
     "ModelNotFoundError",
     "ModelTookTooLongToLoad",
     "ModelTypeNotSupported",
+    "SessionBusyError",
+    "SessionNotFoundError",
     
     # data structures
     "AudioData",
@@ -24,11 +31,22 @@ __all__ = [
     "BaseChatConfig",
     "ChatRequest",
     "ChatResponse",
+    "KnowledgeText",
+    "TokenizeRequest",
+    "EmbeddingsRequest",
     
     # classes
-    "Hub"
+    "Hub",
     "Model",
+    "ModelRegistry",
+    "ModelSpec",
+    "RoutingRule",
+    "Metrics",
     "UTILS",
     "prelude",
     "ChatContext",
+    "SessionManager",
+    "ImageStore",
+    "ContextImporter",
+    "export_session",
 ]
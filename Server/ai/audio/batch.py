@@ -0,0 +1,407 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import os
+import sys
+import json
+import hashlib
+import time
+import argparse
+import importlib
+
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from pathlib            import Path
+from typing             import Any, Callable, Optional
+
+import numpy as np
+
+from Server.config.read_config import Config
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.audio.decoding    import SAMPLE_RATE, decode_file
+from Server.ai.audio.segmenter   import FRAME
+from Server.ai.audio.transcriber import whisper_model
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ------------------------------------------------------ batch ------------------------------------------------------- #
+
+MANIFEST_VERSION: int = 1
+
+# (mono float32 samples at 16 kHz) -> [(start, end, text)] with times in seconds from the start of the samples
+SegmentModel = Callable[[np.ndarray], list[tuple[float, float, str]]]
+
+def whisper_segments(model: str, directory: str, threads: int = 1) -> SegmentModel:
+    """ a whisper.cpp model returning its timestamped segments, one segment per chunk if the binding hides them """
+    transcribe = whisper_model(model, Path(directory), threads)
+    whisper    = transcribe.__self__                                                                    # type:ignore
+
+    def segments(audio: np.ndarray) -> list[tuple[float, float, str]]:
+        text: str = transcribe(audio)
+
+        try:
+            context = whisper.context
+            return [
+                (context.full_get_segment_t0(i) / 100, context.full_get_segment_t1(i) / 100,
+                 context.full_get_segment_text(i))
+                for i in range(context.full_n_segments())
+            ] #                                                                                                 return #
+        except AttributeError:
+            return [(0.0, len(audio) / SAMPLE_RATE, text)] #                                                    return #
+
+    return segments #                                                                                           return #
+# end                                                                                             whisper_segments #
+
+def split_points(samples: np.ndarray, chunk_seconds: float, search_seconds: float = 5.0) -> list[int]:
+    """ split_points
+        split_points - cuts a recording into chunks of at most `chunk_seconds`, each cut placed at the quietest
+                       300 ms of the `search_seconds` before the chunk would run out, so no word is cut in half
+
+        Returns:
+            list[int]: the sample offsets of the chunk boundaries, the first is 0 and the last `len(samples)`
+    """
+    frames: int        = len(samples) // FRAME
+    energy: np.ndarray = np.empty(frames, dtype=np.float32)
+
+    for start in range(0, frames, 1 << 16): # a block at a time, a lecture does not fit in RAM as float32 twice
+        block: np.ndarray = samples[start * FRAME:min(frames, start + (1 << 16)) * FRAME].astype(np.float32)
+        energy[start:start + len(block) // FRAME] = np.mean(block.reshape(-1, FRAME) ** 2, axis=1)
+
+    smooth: np.ndarray = np.convolve(energy, np.ones(10, dtype=np.float32) / 10, mode="same")
+    chunk:  int        = max(1, int(chunk_seconds * SAMPLE_RATE // FRAME))
+    search: int        = max(1, min(chunk - 1, int(search_seconds * SAMPLE_RATE // FRAME)))
+    cuts:   list[int]  = [0]
+
+    while frames - cuts[-1] > chunk:
+        low: int = cuts[-1] + chunk - search
+        cuts.append(low + int(np.argmin(smooth[low:cuts[-1] + chunk])))
+
+    return [cut * FRAME for cut in cuts] + [len(samples)] #                                                     return #
+# end                                                                                                 split_points #
+
+# one model per worker process, loaded by `_load_worker` when the process starts
+_model: Optional[SegmentModel] = None
+
+def _load_worker(factory: str, options: dict[str, Any]) -> None:
+    global _model
+    module, _, name = factory.partition(":")
+    _model = getattr(importlib.import_module(module), name)(**options)
+# end                                                                                                 _load_worker #
+
+def _transcribe_chunk(pcm: str, start: int, end: int) -> tuple[list[tuple[float, float, str]], float]:
+    audio:   np.ndarray = np.memmap(pcm, dtype="<i2", mode="r")[start:end].astype(np.float32) / 32768
+    started: float      = time.perf_counter()
+    return _model(audio), time.perf_counter() - started #                                       type:ignore # return #
+# end                                                                                            _transcribe_chunk #
+
+class Recording:
+    """ Recording
+        Recording - the on disk state of one file of a `TranscriptionJob`, everything is kept next to the output
+                    so an interrupted job picks up where it stopped
+
+        ```
+        <output>/<key>.manifest.json    the source's size and mtime, the chunk boundaries, whether it is complete
+        <output>/<key>.pcm              the decoded audio, deleted once the transcript is written
+        <output>/<key>.progress.jsonl   one line per transcribed chunk, in completion order
+        <output>/<key>.jsonl            the stitched transcript: {"source", "start", "end", "text"} per segment
+        ```
+
+        `<key>` is the file's stem and a short hash of its absolute path, `week1/lecture.mp3` and
+        `week2/lecture.mp3` (or `talk.wav` and `talk.m4a`) get state files of their own.
+    """
+
+    def __init__(self, path: Path, output: Path, chunk_seconds: float) -> None:
+        self.path:     Path                                          = path
+        self.key:      str                                           = (
+            f"{path.stem}-{hashlib.sha1(str(path.resolve()).encode()).hexdigest()[:8]}"
+        )
+        self.pcm:      Path                                          = output / f"{self.key}.pcm"
+        self.manifest: Path                                          = output / f"{self.key}.manifest.json"
+        self.progress: Path                                          = output / f"{self.key}.progress.jsonl"
+        self.result:   Path                                          = output / f"{self.key}.jsonl"
+        self.chunk:    float                                         = chunk_seconds
+        self.cuts:     list[int]                                     = []
+        self.done:     dict[int, list[tuple[float, float, str]]]     = {}
+        self.complete: bool                                          = False
+    # end                                                                                                     __init__ #
+
+    def prepare(self) -> None:
+        """ resumes from the manifest if it still describes the source, decodes and splits the file otherwise """
+        stat: os.stat_result = self.path.stat()
+        key:  dict[str, Any] = {"version": MANIFEST_VERSION, "source": str(self.path.resolve()),
+                                "size": stat.st_size, "mtime": stat.st_mtime, "chunk_seconds": self.chunk}
+
+        manifest: dict[str, Any] = {}
+        if self.manifest.exists():
+            with open(self.manifest, "r") as file:
+                manifest = json.load(file)
+
+        if manifest and all(manifest.get(name) == value for name, value in key.items()):
+            self.cuts     = manifest["cuts"]
+            self.complete = manifest["complete"] and self.result.exists()
+
+            if not self.complete and self.pcm.exists() and os.path.getsize(self.pcm) // 2 == self.cuts[-1]:
+                self._load_progress()
+                logger.info(f"resuming {self.path.name}: {len(self.done)} of {self.chunks} chunks done")
+                return #                                                                                        return #
+
+            if self.complete:
+                return #                                                                                        return #
+
+        decode_file(self.path, self.pcm)
+        self.cuts     = split_points(np.memmap(self.pcm, dtype="<i2", mode="r"), self.chunk)
+        self.complete = False
+        self.done     = {}
+        self.progress.unlink(missing_ok=True)
+        self._write_manifest(key)
+    # end                                                                                                      prepare #
+
+    def record(self, index: int, segments: list[tuple[float, float, str]]) -> None:
+        """ appends a finished chunk to the progress file, durable before the next chunk is counted """
+        self.done[index] = segments
+
+        with open(self.progress, "a") as file:
+            file.write(json.dumps({"chunk": index, "segments": segments}) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+    # end                                                                                                       record #
+
+    def finish(self) -> str:
+        """ writes the stitched transcript, marks the manifest complete and returns the full text """
+        lines: list[str] = []
+        texts: list[str] = []
+
+        for index in range(self.chunks):
+            offset: float = self.cuts[index] / SAMPLE_RATE
+            for start, end, text in self.done[index]:
+                if not (text := text.strip()):
+                    continue
+                texts.append(text)
+                lines.append(json.dumps({"source": self.path.name, "start": round(offset + start, 2),
+                                         "end": round(offset + end, 2), "text": text}))
+
+        temp_path: Path = self.result.with_suffix(".tmp")
+        with open(temp_path, "w") as file:
+            file.write("\n".join(lines) + ("\n" if lines else ""))
+        os.replace(temp_path, self.result)
+
+        with open(self.manifest, "r") as file:
+            manifest: dict[str, Any] = json.load(file)
+        self._write_manifest({**manifest, "complete": True})
+
+        self.pcm.unlink(missing_ok=True)
+        self.progress.unlink(missing_ok=True)
+        self.complete = True
+        return " ".join(texts) #                                                                                return #
+    # end                                                                                                       finish #
+
+    @property
+    def chunks(self) -> int:
+        return len(self.cuts) - 1
+    # end                                                                                                       chunks #
+
+    def _load_progress(self) -> None:
+        self.done = {}
+        if not self.progress.exists():
+            return #                                                                                            return #
+
+        with open(self.progress, "rb") as file:
+            data: bytes = file.read()
+
+        # drop the line being written when the job was interrupted, the next record must start on its own line
+        complete: int = data.rfind(b"\n") + 1
+        if complete < len(data):
+            os.truncate(self.progress, complete)
+
+        for line in data[:complete].splitlines():
+            entry: dict[str, Any] = json.loads(line)
+            self.done[entry["chunk"]] = [tuple(segment) for segment in entry["segments"]]               # type:ignore
+    # end                                                                                               _load_progress #
+
+    def _write_manifest(self, key: dict[str, Any]) -> None:
+        temp_path: Path = self.manifest.with_suffix(".tmp")
+        with open(temp_path, "w") as file:
+            json.dump({"complete": False, **key, "cuts": self.cuts}, file)
+        os.replace(temp_path, self.manifest)
+    # end                                                                                              _write_manifest #
+# end                                                                                                        Recording #
+
+class TranscriptionJob:
+    """ TranscriptionJob
+        TranscriptionJob - transcribes recorded lectures offline: every file is split at silences into chunks and
+                           the chunks of all files are transcribed in parallel by `workers` processes, each with
+                           its own model, then stitched back into one timestamped transcript per file
+
+        ```python
+        >>> job = TranscriptionJob([Path("thermo-3.mp3")], Path("transcripts"), workers=8)
+        >>> job.run()
+        {'files': 1, 'audio_seconds': 4512.3, 'wall_seconds': 301.2, 'real_time_factor': 0.067, ...}
+        ```
+
+        Args:
+            paths (list[Path]): the recordings
+            output (Path): where transcripts, manifests and progress files are written
+            workers (int): transcription processes
+            chunk_seconds (float): the longest chunk, whisper transcribes 30 s windows
+            factory (str): `module:function` returning a `SegmentModel`, called once in every worker
+            options (dict[str, Any]): keyword arguments of `factory`
+            index (bool): add every finished transcript to the knowledge base
+    """
+
+    def __init__(self,
+                 paths: list[Path],
+                 output: Path,
+                 /,
+                 workers: int = 1,
+                 chunk_seconds: float = 30.0,
+                 factory: str = "Server.ai.audio.batch:whisper_segments",
+                 options: Optional[dict[str, Any]] = None,
+                 index: bool = False) -> None:
+        output.mkdir(parents=True, exist_ok=True)
+
+        self.__recordings: list[Recording]  = [Recording(path, output, chunk_seconds) for path in paths]
+        self.__workers:    int              = max(1, workers)
+        self.__factory:    str              = factory
+        self.__options:    dict[str, Any]   = options or {}
+        self.__index:      bool             = index
+        self.__prepared:   bool             = False
+    # end                                                                                                     __init__ #
+
+    def prepare(self) -> None:
+        """ decodes and splits new recordings and loads the progress of interrupted ones """
+        for recording in self.__recordings:
+            recording.prepare()
+
+        self.__prepared = True
+    # end                                                                                                      prepare #
+
+    def run(self, progress: Optional[Callable[[float], None]] = None) -> dict[str, Any]:
+        """ TranscriptionJob.run
+            run - transcribes every chunk not transcribed by an earlier run of the job
+
+            Args:
+                progress (Optional[Callable[[float], None]]): called with the seconds of audio of every chunk done
+
+            Returns:
+                dict[str, Any]: audio and wall seconds of this run, its real time factor and the parallel speedup
+                                (seconds spent transcribing / wall seconds)
+        """
+        if not self.__prepared:
+            self.prepare()
+
+        pending: list[tuple[Recording, int]] = self._pending()
+
+        start:         float = time.perf_counter()
+        audio_seconds: float = 0.0
+        busy_seconds:  float = 0.0
+
+        if pending:
+            with ProcessPoolExecutor(min(self.__workers, len(pending)), initializer=_load_worker,
+                                     initargs=(self.__factory, self.__options)) as pool:
+                # longest chunks first keeps every worker busy until the end
+                pending.sort(key=lambda item: item[0].cuts[item[1]] - item[0].cuts[item[1] + 1])
+                futures: dict[Future, tuple[Recording, int]] = {
+                    pool.submit(_transcribe_chunk, str(recording.pcm), recording.cuts[index],
+                                recording.cuts[index + 1]): (recording, index)
+                    for recording, index in pending
+                }
+
+                for future in as_completed(futures):
+                    recording, index = futures[future]
+                    segments, seconds = future.result()
+                    recording.record(index, segments)
+
+                    chunk_seconds: float = (recording.cuts[index + 1] - recording.cuts[index]) / SAMPLE_RATE
+                    audio_seconds += chunk_seconds
+                    busy_seconds  += seconds
+                    if progress is not None:
+                        progress(chunk_seconds)
+
+                    if len(recording.done) == recording.chunks:
+                        self._finish(recording)
+
+        for recording in self.__recordings: # chunks all done by an earlier run that stopped before stitching
+            if not recording.complete and len(recording.done) == recording.chunks:
+                self._finish(recording)
+
+        wall_seconds: float = time.perf_counter() - start
+        return {
+            "files":            len(self.__recordings),
+            "workers":          self.__workers,
+            "chunks":           len(pending),
+            "audio_seconds":    round(audio_seconds, 2),
+            "wall_seconds":     round(wall_seconds, 2),
+            "real_time_factor": round(wall_seconds / audio_seconds, 4) if audio_seconds else None,
+            "speedup":          round(busy_seconds / wall_seconds, 2) if wall_seconds and busy_seconds else None,
+        } #                                                                                                     return #
+    # end                                                                                                          run #
+
+    @property
+    def audio_seconds(self) -> float:
+        """ the audio still to transcribe, known once the job is prepared """
+        return sum(
+            (recording.cuts[index + 1] - recording.cuts[index]) / SAMPLE_RATE for recording, index in self._pending()
+        ) #                                                                                                     return #
+    # end                                                                                                audio_seconds #
+
+    def _pending(self) -> list[tuple[Recording, int]]:
+        return [
+            (recording, index)
+            for recording in self.__recordings if not recording.complete
+            for index in range(recording.chunks) if index not in recording.done
+        ] #                                                                                                     return #
+    # end                                                                                                     _pending #
+
+    def _finish(self, recording: Recording) -> None:
+        text: str = recording.finish()
+        logger.info(f"transcript of {recording.path.name} written to {recording.result}")
+
+        if self.__index and text:
+            from Server.ai.knowledge.base import KnowledgeBase
+            KnowledgeBase.shared().ingest_text(recording.key, text, kind="transcript")
+    # end                                                                                                      _finish #
+# end                                                                                                 TranscriptionJob #
+
+def main() -> int:
+    """ python -m Server.ai.audio.batch lecture-1.mp3 lecture-2.wav [--out transcripts] [--workers 8] [--index]
+
+        run it again with the same arguments after an interruption, finished chunks are not transcribed twice
+    """
+    from rich.logging import RichHandler
+    from tqdm         import tqdm
+
+    logging.basicConfig(level="INFO", format="%(message)s", datefmt="[%X]", handlers=[RichHandler()])
+    Config.load("server.toml")
+
+    parser = argparse.ArgumentParser(description="offline lecture transcription")
+    parser.add_argument("files",           type=Path, nargs="+")
+    parser.add_argument("--out",           type=Path,  default=Path("transcripts"))
+    parser.add_argument("--workers",       type=int,   default=Config.transcription_batch_workers or os.cpu_count())
+    parser.add_argument("--chunk-seconds", type=float, default=Config.transcription_batch_chunk_seconds)
+    parser.add_argument("--model",         default=Config.transcription_model)
+    parser.add_argument("--threads",       type=int,   default=1, help="threads of every worker's model")
+    parser.add_argument("--index",         action="store_true", help="add the transcripts to the knowledge base")
+    args = parser.parse_args()
+
+    job = TranscriptionJob(
+        args.files, args.out,
+        workers       = args.workers,
+        chunk_seconds = args.chunk_seconds,
+        options       = {"model": args.model, "directory": Config.transcription_models_dir, "threads": args.threads},
+        index         = args.index,
+    )
+
+    job.prepare()
+    with tqdm(total=round(job.audio_seconds, 2), unit="s", desc="transcribing") as bar:
+        report: dict[str, Any] = job.run(progress=lambda seconds: bar.update(round(seconds, 2)))
+
+    print(json.dumps(report, indent=4))
+    return 0 #                                                                                                  return #
+# end                                                                                                         main #
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import os
+import wave
+import shutil
+import threading
+import subprocess
+
+from pathlib import Path
+
+import numpy as np
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- decoding ------------------------------------------------------ #
+
+SAMPLE_RATE: int            = 16_000 # what whisper expects, every decoder produces mono float32 at this rate
+FORMATS:     tuple[str, ...] = ("pcm16", "f32", "opus")
+
+class Resampler:
+    """ Resampler
+        Resampler - linear interpolation from `rate` to `SAMPLE_RATE` over a stream of chunks, the position
+                    between two input samples is carried over so chunk boundaries leave no clicks or gaps
+    """
+
+    def __init__(self, rate: int) -> None:
+        self.__step:     float = rate / SAMPLE_RATE
+        self.__position: float      = 0.0 # of the next output sample, relative to `__last`
+        self.__last:     np.ndarray = np.zeros(0, dtype=np.float32) # the last input sample of the previous chunk
+    # end                                                                                                     __init__ #
+
+    def __call__(self, samples: np.ndarray) -> np.ndarray:
+        if self.__step == 1.0 or not len(samples):
+            return samples #                                                                                    return #
+
+        joined: np.ndarray = np.concatenate([self.__last, samples])
+        points: np.ndarray = np.arange(self.__position, len(joined) - 1, self.__step)
+
+        self.__position = (points[-1] + self.__step if len(points) else self.__position) - (len(joined) - 1)
+        self.__last     = joined[-1:]
+
+        return np.interp(points, np.arange(len(joined)), joined).astype(np.float32) #                           return #
+    # end                                                                                                     __call__ #
+# end                                                                                                        Resampler #
+
+class PcmDecoder:
+    """ PcmDecoder
+        PcmDecoder - interleaved little endian pcm (`pcm16` or `f32`) to mono float32 at `SAMPLE_RATE`, a sample
+                     split across two chunks is kept until the rest of it arrives
+    """
+
+    def __init__(self, format: str = "pcm16", sample_rate: int = SAMPLE_RATE, channels: int = 1) -> None:
+        self.__dtype:     np.dtype  = np.dtype("<i2") if format == "pcm16" else np.dtype("<f4")
+        self.__channels:  int       = channels
+        self.__frame:     int       = self.__dtype.itemsize * channels
+        self.__remainder: bytes     = b""
+        self.__resample:  Resampler = Resampler(sample_rate)
+    # end                                                                                                     __init__ #
+
+    def feed(self, data: bytes) -> np.ndarray:
+        data = self.__remainder + data
+        usable: int = len(data) - len(data) % self.__frame
+        self.__remainder = data[usable:]
+
+        samples: np.ndarray = np.frombuffer(data[:usable], dtype=self.__dtype).astype(np.float32)
+        if self.__dtype.kind == "i":
+            samples /= 32768.0
+
+        if self.__channels > 1:
+            samples = samples.reshape(-1, self.__channels).mean(axis=1)
+
+        return self.__resample(samples) #                                                                       return #
+    # end                                                                                                         feed #
+
+    def finish(self) -> np.ndarray:
+        return np.zeros(0, dtype=np.float32) #                                                                  return #
+    # end                                                                                                       finish #
+
+    def close(self) -> None:
+        pass
+    # end                                                                                                        close #
+# end                                                                                                       PcmDecoder #
+
+class FfmpegDecoder:
+    """ FfmpegDecoder
+        FfmpegDecoder - compressed audio (ogg / webm opus as recorded by browsers and phones) decoded by an ffmpeg
+                        process, bytes are written to its stdin as they arrive and a reader thread collects the pcm
+                        it has decoded so far
+    """
+
+    def __init__(self) -> None:
+        if (ffmpeg := shutil.which("ffmpeg")) is None:
+            raise ValueError("decoding opus audio needs ffmpeg on the PATH, send pcm16 instead")
+
+        self.__process: subprocess.Popen = subprocess.Popen(
+            [ffmpeg, "-loglevel", "error", "-i", "pipe:0",
+             "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        self.__lock:    threading.Lock = threading.Lock()
+        self.__decoded: bytearray      = bytearray()
+        self.__pcm:     PcmDecoder     = PcmDecoder("pcm16")
+
+        self.__reader: threading.Thread = threading.Thread(target=self._read, daemon=True, name="ffmpeg_reader")
+        self.__reader.start()
+    # end                                                                                                     __init__ #
+
+    def feed(self, data: bytes) -> np.ndarray:
+        try:
+            self.__process.stdin.write(data)                                                            # type:ignore
+            self.__process.stdin.flush()                                                                # type:ignore
+        except BrokenPipeError:
+            raise ValueError("ffmpeg could not decode the audio")
+
+        return self._take() #                                                                                   return #
+    # end                                                                                                         feed #
+
+    def finish(self) -> np.ndarray:
+        try:
+            self.__process.stdin.close()                                                                # type:ignore
+        except BrokenPipeError:
+            pass
+
+        self.__reader.join()
+        self.__process.wait()
+        return self._take() #                                                                                   return #
+    # end                                                                                                       finish #
+
+    def close(self) -> None:
+        if self.__process.poll() is None:
+            self.__process.kill()
+    # end                                                                                                        close #
+
+    def _read(self) -> None:
+        while chunk := self.__process.stdout.read1(65536):                                              # type:ignore
+            with self.__lock:
+                self.__decoded.extend(chunk)
+    # end                                                                                                        _read #
+
+    def _take(self) -> np.ndarray:
+        with self.__lock:
+            data: bytes = bytes(self.__decoded)
+            self.__decoded.clear()
+
+        return self.__pcm.feed(data) #                                                                          return #
+    # end                                                                                                        _take #
+# end                                                                                                    FfmpegDecoder #
+
+def decoder(format: str, sample_rate: int = SAMPLE_RATE, channels: int = 1) -> "PcmDecoder | FfmpegDecoder":
+    """ decoder
+        decoder - the decoder for a stream of `format` audio
+
+        Raises:
+            ValueError: if the format is unknown or opus is requested without ffmpeg installed
+    """
+    if format not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+
+    if format == "opus":
+        return FfmpegDecoder() #                                                                                return #
+
+    if sample_rate <= 0 or channels <= 0:
+        raise ValueError("sample_rate and channels must be positive")
+
+    return PcmDecoder(format, sample_rate, channels) #                                                          return #
+# end                                                                                                      decoder #
+
+def decode_file(path: Path, target: Path) -> int:
+    """ decode_file
+        decode_file - decodes a recording into raw 16 bit mono pcm at `SAMPLE_RATE`, so workers can memory map
+                      their part of a long lecture instead of each decoding (or being sent) all of it
+
+        16 bit mono wav files at 16 kHz are copied, everything else is decoded by ffmpeg
+
+        Returns:
+            int: the number of samples written
+
+        Raises:
+            ValueError: if the file is not a plain wav file and ffmpeg is not installed or can not decode it
+    """
+    try:
+        with wave.open(str(path), "rb") as recording:
+            if (recording.getsampwidth(), recording.getnchannels(), recording.getframerate()) == (2, 1, SAMPLE_RATE):
+                with open(target, "wb") as file:
+                    while frames := recording.readframes(1 << 20):
+                        file.write(frames)
+                return os.path.getsize(target) // 2 #                                                           return #
+    except (wave.Error, EOFError):
+        pass # not a plain wav file
+
+    if (ffmpeg := shutil.which("ffmpeg")) is None:
+        raise ValueError(f"decoding {path.name} needs ffmpeg on the PATH, convert it to 16 kHz mono wav instead")
+
+    result: subprocess.CompletedProcess = subprocess.run(
+        [ffmpeg, "-loglevel", "error", "-y", "-i", str(path),
+         "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), str(target)],
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        raise ValueError(f"ffmpeg could not decode {path.name}: {result.stderr.decode(errors='replace')[-500:]}")
+
+    return os.path.getsize(target) // 2 #                                                                       return #
+# end                                                                                                  decode_file #
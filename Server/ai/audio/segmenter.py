@@ -0,0 +1,181 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+from collections import deque
+from typing      import Optional
+
+import numpy as np
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.audio.decoding import SAMPLE_RATE
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- segmenter ----------------------------------------------------- #
+
+FRAME:        int   = SAMPLE_RATE * 30 // 1000 # 30 ms frames
+FLOOR_FRAMES: int   = 100                       # the noise floor is the quietest frame of the last 3 s
+FLOOR_PRIOR:  float = -50.0                     # dBFS assumed before 3 s of audio were heard
+
+class Segment:
+    """ a stretch of speech, `final` once the speaker paused (or it grew too long), a snapshot of the open one
+        otherwise
+    """
+    __slots__ = ("index", "start", "audio", "final")
+
+    def __init__(self, index: int, start: int, audio: np.ndarray, final: bool) -> None:
+        self.index: int        = index
+        self.start: int        = start # in samples since the stream began
+        self.audio: np.ndarray = audio
+        self.final: bool       = final
+    # end                                                                                                     __init__ #
+
+    @property
+    def start_seconds(self) -> float:
+        return self.start / SAMPLE_RATE
+    # end                                                                                                start_seconds #
+
+    @property
+    def end_seconds(self) -> float:
+        return (self.start + len(self.audio)) / SAMPLE_RATE
+    # end                                                                                                  end_seconds #
+# end                                                                                                          Segment #
+
+class Segmenter:
+    """ Segmenter
+        Segmenter - energy based voice activity detection over 30 ms frames. a frame is speech when it is
+                    `threshold_db` louder than the noise floor, the quietest frame of the last 3 seconds (speech
+                    always has gaps between words), so a fan or a lecture hall's hum does not count as speech
+
+        speech opens a segment once it lasted `min_speech_ms` (with `pad_ms` of audio before it, so the first
+        syllable is not cut), a pause of `min_silence_ms` closes it. while a segment is open a partial snapshot
+        is emitted every `partial_interval` seconds of new audio
+
+        ```python
+        >>> segmenter = Segmenter()
+        >>> for segment in segmenter.feed(samples):    # mono float32 at 16 kHz
+        ...     print(segment.index, segment.final, segment.end_seconds)
+        0 False 1.23
+        0 True 2.87
+        ```
+
+        Args:
+            threshold_db (float): how much louder than the noise floor a speech frame is
+            min_speech_ms (int): speech needed to open a segment, shorter clicks and coughs are ignored
+            min_silence_ms (int): silence that closes a segment
+            max_segment_s (float): segments are cut at this length, whisper works on 30 s windows
+            pad_ms (int): audio kept before and after the speech of a segment
+            partial_interval (float): seconds of new audio between partial snapshots, 0 disables them
+    """
+
+    def __init__(self,
+                 threshold_db: float = 10.0,
+                 min_speech_ms: int = 200,
+                 min_silence_ms: int = 500,
+                 max_segment_s: float = 30.0,
+                 pad_ms: int = 200,
+                 partial_interval: float = 1.0) -> None:
+        self.__threshold:   float = threshold_db
+        self.__min_speech:  int   = max(1, min_speech_ms // 30)
+        self.__min_silence: int   = max(1, min_silence_ms // 30)
+        self.__max_frames:  int   = int(max_segment_s * 1000 // 30)
+        self.__pad:         int   = pad_ms // 30
+        self.__partial:     int   = int(partial_interval * 1000 // 30)
+
+        self.__buffer:   np.ndarray                 = np.zeros(0, dtype=np.float32) # less than a frame
+        self.__position: int                        = 0    # samples consumed as frames
+        self.__energies: deque[float]               = deque([FLOOR_PRIOR] * FLOOR_FRAMES, maxlen=FLOOR_FRAMES)
+        self.__recent:   deque[np.ndarray]          = deque(maxlen=self.__pad + self.__min_speech)
+        self.__speech:   int                        = 0    # consecutive speech frames while no segment is open
+
+        self.__index:    int                        = 0
+        self.__frames:   Optional[list[np.ndarray]] = None # of the open segment
+        self.__start:    int                        = 0    # in samples
+        self.__silence:  int                        = 0    # trailing silent frames of the open segment
+        self.__emitted:  int                        = 0    # frames of the open segment at the last partial
+    # end                                                                                                     __init__ #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def feed(self, samples: np.ndarray) -> list[Segment]:
+        """ consumes mono float32 samples at `SAMPLE_RATE`, returns the partial and final segments they produced """
+        samples = np.concatenate([self.__buffer, samples]) if len(self.__buffer) else samples
+        usable:   int           = len(samples) - len(samples) % FRAME
+        segments: list[Segment] = []
+
+        self.__buffer = samples[usable:]
+
+        for offset in range(0, usable, FRAME):
+            if (segment := self._frame(samples[offset:offset + FRAME])) is not None:
+                segments.append(segment)
+
+        return segments #                                                                                       return #
+    # end                                                                                                         feed #
+
+    def finish(self) -> list[Segment]:
+        """ closes the open segment at the end of the stream """
+        if self.__frames is None:
+            return [] #                                                                                         return #
+
+        if len(self.__buffer):
+            self.__frames.append(self.__buffer)
+            self.__buffer = np.zeros(0, dtype=np.float32)
+
+        return [self._close(trim=False)] #                                                                      return #
+    # end                                                                                                       finish #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _frame(self, frame: np.ndarray) -> Optional[Segment]:
+        energy: float = 10 * np.log10(float(np.mean(frame * frame)) + 1e-10)
+        start:  int   = self.__position
+        self.__position += FRAME
+
+        self.__energies.append(energy)
+        speech: bool = energy > min(self.__energies) + self.__threshold and energy > -60.0
+
+        if self.__frames is None:
+            self.__recent.append(frame)
+            self.__speech = self.__speech + 1 if speech else 0
+
+            if self.__speech < self.__min_speech:
+                return None #                                                                                   return #
+
+            # open with the speech so far and the padding before it
+            self.__frames  = list(self.__recent)
+            self.__start   = start + FRAME - len(self.__frames) * FRAME
+            self.__silence = 0
+            self.__emitted = 0
+            self.__recent.clear()
+            return None #                                                                                       return #
+
+        self.__frames.append(frame)
+        self.__silence = 0 if speech else self.__silence + 1
+
+        if self.__silence >= self.__min_silence or len(self.__frames) >= self.__max_frames:
+            return self._close(trim=self.__silence >= self.__min_silence) #                                     return #
+
+        if self.__partial and len(self.__frames) - self.__emitted >= self.__partial:
+            self.__emitted = len(self.__frames)
+            return Segment(self.__index, self.__start, np.concatenate(self.__frames), final=False) #            return #
+
+        return None #                                                                                           return #
+    # end                                                                                                       _frame #
+
+    def _close(self, trim: bool) -> Segment:
+        frames: list[np.ndarray] = self.__frames                                                       # type:ignore
+        if trim: # keep `pad_ms` of the pause
+            frames = frames[:len(frames) - self.__silence + self.__pad]
+
+        segment: Segment = Segment(self.__index, self.__start, np.concatenate(frames), final=True)
+
+        self.__index  += 1
+        self.__frames  = None
+        self.__speech  = 0
+        return segment #                                                                                        return #
+    # end                                                                                                       _close #
+# end                                                                                                        Segmenter #
@@ -0,0 +1,169 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import time
+import threading
+
+from concurrent.futures import Future
+from typing             import Callable, Optional
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.config.read_config      import Config
+from Server.ai.audio.decoding       import SAMPLE_RATE, decoder
+from Server.ai.audio.segmenter      import Segment, Segmenter
+from Server.ai.audio.transcriber    import Transcriber
+from Server.ai.core.data_structures import AudioData, TranscribedText
+from Server.ai.utils.metrics        import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ----------------------------------------------------- stream ------------------------------------------------------- #
+
+def segmenter_from_config() -> Segmenter:
+    return Segmenter(
+        threshold_db     = Config.transcription_vad_threshold_db,
+        min_speech_ms    = Config.transcription_min_speech_ms,
+        min_silence_ms   = Config.transcription_min_silence_ms,
+        max_segment_s    = Config.transcription_max_segment_s,
+        pad_ms           = Config.transcription_pad_ms,
+        partial_interval = Config.transcription_partial_interval,
+    ) #                                                                                                         return #
+# end                                                                                            segmenter_from_config #
+
+class TranscriptionStream:
+    """ TranscriptionStream
+        TranscriptionStream - one live recording: audio chunks are decoded, cut into speech segments and every
+                              segment is transcribed on the `Transcriber` pool while the next one is still being
+                              spoken. results are handed to `on_result` from the pool's threads
+
+        finals are delivered in segment order, each exactly once. partials are best effort: one per stream is in
+        flight at a time, none is queued when the pool is busy and a partial that completes after a newer one
+        (or after its final) is dropped
+
+        ```python
+        >>> stream = TranscriptionStream(Transcriber.shared(), AudioData(format="pcm16"), print)
+        >>> stream.feed(chunk)     # as the audio arrives
+        segment=0 text=' The second law' final=False start=0.39 end=1.41
+        >>> stream.finish()        # blocks until every final was delivered
+        segment=0 text=' The second law says entropy never decreases.' final=True start=0.39 end=3.12
+        ```
+
+        Args:
+            transcriber (Transcriber): the worker pool
+            audio (AudioData): the format of the chunks
+            on_result (Callable[[TranscribedText], None]): receives every partial and final result
+            segmenter (Optional[Segmenter]): the voice activity detection, `[transcription]` settings by default
+    """
+
+    def __init__(self,
+                 transcriber: Transcriber,
+                 audio: AudioData,
+                 on_result: Callable[[TranscribedText], None],
+                 segmenter: Optional[Segmenter] = None) -> None:
+        self.__transcriber: Transcriber                       = transcriber
+        self.__decoder                                        = decoder(audio.format, audio.sample_rate, audio.channels)
+        self.__segmenter:   Segmenter                         = segmenter or segmenter_from_config()
+        self.__on_result:   Callable[[TranscribedText], None] = on_result
+        self.__lock:        threading.Lock                    = threading.Lock()
+        self.__delivered:   threading.Condition               = threading.Condition(self.__lock)
+
+        self.__finals:      dict[int, Future]                 = {} # segment -> transcript future
+        self.__done:        dict[int, TranscribedText]        = {} # finals waiting for an earlier one
+        self.__next_final:  int                               = 0
+        self.__partial:     Optional[Future]                  = None
+        self.__latest:      dict[int, float]                  = {} # segment -> end of its newest partial sent
+        self.__started:     float                             = time.perf_counter()
+        self.__audio:       int                               = 0  # samples decoded
+    # end                                                                                                     __init__ #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def feed(self, data: bytes) -> None:
+        """ decodes and segments a chunk of audio, blocks while the pool has no room for a final segment """
+        samples = self.__decoder.feed(data)
+        self.__audio += len(samples)
+
+        for segment in self.__segmenter.feed(samples):
+            self._submit(segment)
+    # end                                                                                                         feed #
+
+    def finish(self) -> None:
+        """ ends the stream, closes the open segment and waits until every final was delivered """
+        samples = self.__decoder.finish()
+        self.__audio += len(samples)
+
+        for segment in self.__segmenter.feed(samples) + self.__segmenter.finish():
+            self._submit(segment)
+
+        # a future's waiters wake up before its callbacks ran, so wait for the deliveries themselves
+        with self.__delivered:
+            self.__delivered.wait_for(lambda: self.__next_final == len(self.__finals))
+        Metrics.observe("transcription.stream_seconds", time.perf_counter() - self.__started)
+        Metrics.increment("transcription.streamed_audio_seconds", self.__audio / SAMPLE_RATE)
+    # end                                                                                                       finish #
+
+    def close(self) -> None:
+        """ abandons the stream, e.g. when the client disconnected """
+        self.__decoder.close()
+        for future in self.__finals.values():
+            future.cancel()
+    # end                                                                                                        close #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _submit(self, segment: Segment) -> None:
+        if not segment.final:
+            with self.__lock:
+                if self.__partial is not None and not self.__partial.done():
+                    return #                                                                                    return #
+
+            if (future := self.__transcriber.submit(segment.audio, block=False)) is not None:
+                self.__partial = future
+                future.add_done_callback(lambda done: self._deliver(segment, done))
+            return #                                                                                            return #
+
+        future = self.__transcriber.submit(segment.audio)
+        self.__finals[segment.index] = future                                                           # type:ignore
+        future.add_done_callback(lambda done: self._deliver(segment, done))                             # type:ignore
+    # end                                                                                                      _submit #
+
+    def _deliver(self, segment: Segment, future: Future) -> None:
+        if future.cancelled():
+            return #                                                                                            return #
+
+        try:
+            text: str = future.result()
+        except Exception as e:
+            logger.error(f"transcribing segment {segment.index} failed: {e}")
+            Metrics.increment("transcription.errors")
+            text = ""
+
+        result: TranscribedText = TranscribedText(
+            segment = segment.index,
+            text    = text,
+            final   = segment.final,
+            start   = round(segment.start_seconds, 3),
+            end     = round(segment.end_seconds, 3),
+        )
+
+        with self.__lock:
+            if not segment.final:
+                # stale if its segment was finalized meanwhile or a newer partial already went out
+                if segment.index < self.__next_final or self.__latest.get(segment.index, 0.0) >= result.end:
+                    return #                                                                                    return #
+                self.__latest[segment.index] = result.end
+                self.__on_result(result)
+                return #                                                                                        return #
+
+            self.__done[segment.index] = result
+            while self.__next_final in self.__done:
+                self.__on_result(self.__done.pop(self.__next_final))
+                self.__latest.pop(self.__next_final, None)
+                self.__next_final += 1
+            self.__delivered.notify_all()
+    # end                                                                                                     _deliver #
+# end                                                                                              TranscriptionStream #
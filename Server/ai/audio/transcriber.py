@@ -0,0 +1,155 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import os
+import time
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib            import Path
+from typing             import Callable, Optional
+
+import numpy as np
+
+from Server.config.read_config import Config
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.audio.decoding import SAMPLE_RATE
+from Server.ai.core.errors    import ModelFailedToLoad
+from Server.ai.utils.metrics  import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# --------------------------------------------------- transcriber ---------------------------------------------------- #
+
+# (mono float32 samples at 16 kHz) -> text
+SpeechModel = Callable[[np.ndarray], str]
+
+def whisper_model(model: str, directory: Path, threads: int = 1) -> SpeechModel:
+    """ whisper_model
+        whisper_model - loads a whisper.cpp model (downloaded into `directory` on first use)
+
+        Raises:
+            ModelFailedToLoad: if whispercpp is not installed or the model can not be loaded
+    """
+    try:
+        from whispercpp import Whisper
+    except ImportError:
+        raise ModelFailedToLoad("whispercpp is not installed, speech transcription is unavailable")
+
+    start: float = time.perf_counter()
+
+    try:
+        whisper = Whisper.from_pretrained(model, basedir=str(directory))
+        whisper.params.with_num_threads(threads)
+    except Exception as e:
+        raise ModelFailedToLoad(f"Whisper model failed to load: {model} -> {e}")
+
+    Metrics.observe("transcription.load_seconds", time.perf_counter() - start)
+    logger.info(f"whisper model {model} loaded with {threads} threads")
+    return whisper.transcribe #                                                                                 return #
+# end                                                                                                whisper_model #
+
+class Transcriber:
+    """ Transcriber
+        Transcriber - a bounded pool of speech models, every worker thread loads its own model on its first job
+                      (a whisper context is not thread safe) and keeps it for the life of the process
+
+        at most `max_pending` segments are queued or running. `submit` waits for a slot, which pushes back on the
+        audio being streamed in, `submit(..., block=False)` gives up instead, for partial results that are
+        worthless once they are late
+
+        ```python
+        >>> transcriber = Transcriber.shared()
+        >>> transcriber.submit(samples).result()     # mono float32 at 16 kHz
+        ' The second law says entropy never decreases.'
+        ```
+
+        Args:
+            factory (Callable[[], SpeechModel]): loads one model, called once per worker
+            workers (int): the number of models / segments transcribed in parallel
+            max_pending (int): segments queued or running at most
+    """
+
+    _instance: Optional["Transcriber"] = None
+    _instance_lock: threading.Lock      = threading.Lock()
+
+    def __init__(self, factory: Callable[[], SpeechModel], workers: int = 2, max_pending: int = 8) -> None:
+        self.__factory: Callable[[], SpeechModel] = factory
+        self.__local:   threading.local           = threading.local()
+        self.__slots:   threading.Semaphore       = threading.Semaphore(max(workers, max_pending))
+        self.__pool:    ThreadPoolExecutor        = ThreadPoolExecutor(workers, thread_name_prefix="whisper")
+        self.__lock:    threading.Lock            = threading.Lock()
+        self.__pending: int                       = 0
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def shared(cls) -> "Transcriber":
+        """ the process wide transcriber, whisper models from `[transcription]` """
+        with cls._instance_lock:
+            if cls._instance is None:
+                directory: Path = Path(Config.transcription_models_dir)
+                directory = directory if directory.is_absolute() else Path(os.getcwd(), directory)
+
+                cls._instance = cls(
+                    lambda: whisper_model(Config.transcription_model, directory, Config.transcription_threads),
+                    Config.transcription_workers,
+                    Config.transcription_max_pending,
+                )
+
+            return cls._instance #                                                                              return #
+    # end                                                                                                       shared #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def submit(self, audio: np.ndarray, block: bool = True) -> Optional["Future[str]"]:
+        """ Transcriber.submit
+            submit - queues a segment for transcription
+
+            Args:
+                audio (np.ndarray): mono float32 samples at 16 kHz
+                block (bool): wait for a free slot, otherwise return None when every slot is taken
+
+            Returns:
+                Optional[Future[str]]: the transcript, None if the pool was full and `block` is False
+        """
+        if not self.__slots.acquire(blocking=block):
+            Metrics.increment("transcription.skipped")
+            return None #                                                                                       return #
+
+        self._pending(+1)
+        future: "Future[str]" = self.__pool.submit(self._transcribe, audio)
+        future.add_done_callback(lambda _: (self.__slots.release(), self._pending(-1)))
+        return future #                                                                                         return #
+    # end                                                                                                       submit #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _transcribe(self, audio: np.ndarray) -> str:
+        if not hasattr(self.__local, "model"):
+            self.__local.model = self.__factory()
+
+        start: float = time.perf_counter()
+        text:  str   = self.__local.model(audio)
+
+        seconds:  float = time.perf_counter() - start
+        duration: float = len(audio) / SAMPLE_RATE
+
+        Metrics.observe("transcription.seconds", seconds)
+        Metrics.increment("transcription.audio_seconds", duration)
+        if duration > 0:
+            Metrics.observe("transcription.real_time_factor", seconds / duration)
+
+        return text #                                                                                           return #
+    # end                                                                                                  _transcribe #
+
+    def _pending(self, delta: int) -> None:
+        with self.__lock:
+            self.__pending += delta
+            Metrics.set_gauge("transcription.pending", self.__pending)
+    # end                                                                                                     _pending #
+# end                                                                                                      Transcriber #
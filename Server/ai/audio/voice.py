@@ -0,0 +1,200 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import time
+import threading
+
+from typing import TYPE_CHECKING, Callable, Iterator, Optional
+
+if TYPE_CHECKING:
+    from Server.ai.core.model_loader import Model
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.config.read_config      import Config
+from Server.ai.audio.segmenter      import Segmenter
+from Server.ai.audio.stream         import TranscriptionStream
+from Server.ai.audio.transcriber    import Transcriber
+from Server.ai.core.data_structures import AudioData, ChatRequest, ChatResponse, TranscribedText
+from Server.ai.utils.metrics        import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ------------------------------------------------------ voice ------------------------------------------------------- #
+
+def agreed_words(previous: list[str], current: list[str]) -> list[str]:
+    """ the words two consecutive transcripts of the same audio agree on, whisper rarely revises those again """
+    common: int = 0
+    while common < min(len(previous), len(current)) and previous[common] == current[common]:
+        common += 1
+
+    return current[:common] #                                                                                   return #
+# end                                                                                                    agreed_words #
+
+class VoiceQuestion:
+    """ VoiceQuestion
+        VoiceQuestion - one spoken question: the audio is transcribed live and, once the student stops, answered
+                        in the session of `request` like a typed question
+
+        when pipelined, the part of the transcript that stopped changing (what two consecutive partials agree on,
+        plus every final) is prefilled into the session's kv cache on a background thread while the student is
+        still talking. restoring the session and evaluating its history overlap with the speech, the answer only
+        evaluates the words after the last prefill. prefills never wait for the model, a busy model just skips
+        them
+
+        ```python
+        >>> question = VoiceQuestion(model, Transcriber.shared(), AudioData(format="pcm16"), request, print)
+        >>> question.feed(chunk)           # as the audio arrives, transcripts go to `on_result`
+        >>> question.finish()              # the student stopped talking
+        'What does the second law say about entropy?'
+        >>> for response in question.answer():
+        ...     print(response.content, end="")
+        ```
+
+        Args:
+            model (Model): answers the question, leased by the caller for the lifetime of the question
+            transcriber (Transcriber): the speech recognition pool
+            audio (AudioData): the format of the chunks
+            request (ChatRequest): the sampling settings and session of the answer, its text is replaced
+            on_result (Callable[[TranscribedText], None]): receives every partial and final transcript
+            segmenter (Optional[Segmenter]): the voice activity detection, `[transcription]` settings by default
+            pipelined (Optional[bool]): prefill while the question is spoken, `voice.pipelined` by default
+    """
+
+    def __init__(self,
+                 model: "Model",
+                 transcriber: Transcriber,
+                 audio: AudioData,
+                 request: ChatRequest,
+                 on_result: Callable[[TranscribedText], None],
+                 segmenter: Optional[Segmenter] = None,
+                 pipelined: Optional[bool] = None) -> None:
+        self.__model:     "Model"                           = model
+        self.__request:   ChatRequest                       = request
+        self.__on_result: Callable[[TranscribedText], None] = on_result
+        self.__pipelined: bool                              = Config.voice_pipelined if pipelined is None else pipelined
+        self.__min_words: int                               = max(1, Config.voice_prefill_min_words)
+
+        self.__finals:    list[str]                         = [] # words of every final so far
+        self.__partial:   list[str]                         = [] # words of the newest partial of the open segment
+        self.__segment:   int                               = -1 # the segment `__partial` belongs to
+        self.__question:  str                               = ""
+        self.__ended:     Optional[float]                   = None
+
+        self.__lock:      threading.Condition               = threading.Condition()
+        self.__pending:   Optional[str]                     = None # stable text waiting to be prefilled
+        self.__prefilled: int                               = 0    # words of the last prefill
+        self.__stopped:   bool                              = False
+        self.__prefiller: Optional[threading.Thread]        = None
+
+        # created last, results may arrive as soon as the first chunk is fed
+        self.__stream: TranscriptionStream = TranscriptionStream(transcriber, audio, self._on_result, segmenter)
+
+        if self.__pipelined:
+            self.__prefiller = threading.Thread(target=self._prefill, daemon=True, name="voice_prefill_thread")
+            self.__prefiller.start()
+    # end                                                                                                     __init__ #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def feed(self, data: bytes) -> None:
+        """ decodes, segments and transcribes a chunk of audio """
+        self.__stream.feed(data)
+    # end                                                                                                         feed #
+
+    def finish(self) -> str:
+        """ the student stopped talking: waits for the last final and returns the whole question """
+        self.__ended = time.perf_counter()
+        self.__stream.finish()
+        self._stop()
+
+        self.__question = " ".join(self.__finals)
+        return self.__question #                                                                                return #
+    # end                                                                                                       finish #
+
+    def answer(self) -> Iterator[ChatResponse]:
+        """ answers the question returned by `finish` in the request's session
+
+            Raises:
+                ValueError: if no speech was heard
+        """
+        if not self.__question:
+            raise ValueError("no speech was heard")
+
+        mode:    str         = "pipelined" if self.__pipelined else "sequential"
+        request: ChatRequest = self.__request.model_copy(update={"text": self.__question})
+        first:   bool        = True
+
+        for response in self.__model.predict(request, pipelined=self.__pipelined):
+            if first and response.content:
+                first = False
+                # from the end of the speech, the delay the student actually waits for
+                Metrics.observe("voice.ttft_seconds", time.perf_counter() - self.__ended, mode=mode)  # type:ignore
+            yield response #                                                                            yield return
+    # end                                                                                                       answer #
+
+    def close(self) -> None:
+        """ abandons the question, e.g. when the client disconnected """
+        self.__stream.close()
+        self._stop()
+    # end                                                                                                        close #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _on_result(self, result: TranscribedText) -> None:
+        """ called by the stream in transcript order, finals in segment order """
+        words: list[str] = result.text.split()
+
+        with self.__lock:
+            if result.final:
+                self.__finals += words
+                self.__partial = []
+                stable: list[str] = self.__finals
+            else:
+                agreed: list[str] = agreed_words(self.__partial if self.__segment == result.segment else [], words)
+                self.__partial, self.__segment = words, result.segment
+                stable = self.__finals + agreed
+
+            if self.__pipelined and len(stable) >= self.__prefilled + self.__min_words:
+                self.__pending = " ".join(stable)
+                self.__lock.notify()
+
+        self.__on_result(result)
+    # end                                                                                                   _on_result #
+
+    def _prefill(self) -> None:
+        """ prefills the newest stable text, older ones still waiting are superseded by it """
+        while True:
+            with self.__lock:
+                self.__lock.wait_for(lambda: self.__pending is not None or self.__stopped)
+                if self.__stopped:
+                    return #                                                                                    return #
+
+                text, self.__pending = self.__pending, None
+
+            try:
+                tokens: int = self.__model.prefill(self.__request.session_id, text)                    # type:ignore
+            except Exception as e: # the answer still works without the prefill
+                logger.warning(f"prefilling a spoken question failed: {e}")
+                Metrics.increment("voice.prefill_errors")
+                continue
+
+            if tokens > 0:
+                with self.__lock:
+                    self.__prefilled = len(text.split())                                               # type:ignore
+                Metrics.increment("voice.prefills")
+    # end                                                                                                     _prefill #
+
+    def _stop(self) -> None:
+        """ stops the prefill thread, waiting for a prefill in progress, it holds the model the answer needs """
+        with self.__lock:
+            self.__stopped = True
+            self.__lock.notify()
+
+        if self.__prefiller is not None and self.__prefiller is not threading.current_thread():
+            self.__prefiller.join()
+    # end                                                                                                        _stop #
+# end                                                                                                    VoiceQuestion #
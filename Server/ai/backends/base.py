@@ -0,0 +1,170 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+from pathlib import Path
+from typing  import TYPE_CHECKING, Any, Iterator, Optional, Protocol, Union
+
+from Server.config.read_config import Config
+
+if TYPE_CHECKING:
+    import numpy as np
+    from Server.ai.core.model_loader import Hub
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.core.errors import ModelTypeNotSupported
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# -------------------------------------------------- backend --------------------------------------------------------- #
+
+BACKENDS: tuple[str, ...] = ("llama", "mock", "remote")
+
+class InferenceBackend(Protocol):
+    """ InferenceBackend
+        InferenceBackend - the engine behind a `Model`: loads the weights, streams chat completions and holds the
+                           kv cache of one conversation at a time. `Model` keeps the sessions, the scheduling and
+                           the generation limits, a backend only runs what it is handed
+
+        `stream_chat` yields llama.cpp's (OpenAI's) `chat.completion.chunk` dicts: a first chunk with the role,
+        one chunk per token and a last one with the finish reason. closing the iterator stops the generation.
+        a backend that is not `stateful` keeps no kv state the server can move between sessions (a remote
+        server caches prompts on its own), `save_state` then returns None
+
+        ```python
+        >>> backend = create_backend("mock", Path("Server", "models", "any.gguf"))
+        >>> backend.load()
+        >>> for chunk in backend.stream_chat(messages, {"temperature": 0.2}, max_tokens=64, stop=[]):
+        ...     print(chunk["choices"][0]["delta"].get("content", ""), end="")
+        >>> state = backend.save_state()   # park the conversation, another one runs
+        >>> backend.load_state(state)      # and continue it
+        ```
+    """
+
+    name: str
+
+    def load(self) -> None:
+        """ loads the language model, blocking. raises `ModelFailedToLoad` """
+        ...
+
+    def load_projector(self) -> None:
+        """ loads the image projector of a `multimodal` backend, blocking, on its own thread next to `load` """
+        ...
+
+    def attach_projector(self) -> bool:
+        """ hands the projector to the language model once both are loaded, True once it is attached """
+        ...
+
+    def unload(self) -> None:
+        ...
+
+    def stream_chat(self,
+                    messages: list[dict[str, Any]],
+                    sampling: dict[str, Any],
+                    max_tokens: Optional[int],
+                    stop: list[str],
+                    pipelined: bool = False,
+                    session_id: Optional[str] = None) -> Iterator[dict[str, Any]]:
+        """ the completion of `messages` chunk by chunk, `pipelined` renders it the way `prefill` did. the
+            prompts of `session_id` may be rendered incrementally, only the messages added since its last turn
+        """
+        ...
+
+    def prefill(self, messages: list[dict[str, Any]], session_id: Optional[str] = None) -> int:
+        """ evaluates the prompt of `messages` up to the end of the last message's text into the kv cache,
+            returns the tokens evaluated (0 if the backend can not prefill)
+        """
+        ...
+
+    def tokenize(self, text: str, special: bool = False) -> list[int]:
+        ...
+
+    def embed(self, texts: list[str]) -> tuple["np.ndarray", list[int]]:
+        """ L2 normalized float32 rows, one per text, and the tokens of every text """
+        ...
+
+    def save_state(self, resumable: bool = False) -> Any:
+        """ the kv cache of the conversation in the backend. `resumable` also keeps what a generation in progress
+            needs to continue (the sampler), such a state stays in memory and is never pickled
+        """
+        ...
+
+    def load_state(self, state: Any) -> None:
+        ...
+
+    @property
+    def loaded(self) -> bool: ...
+
+    @property
+    def multimodal(self) -> bool:
+        """ a projector is configured, image requests wait for `attach_projector` """
+        ...
+
+    @property
+    def vision(self) -> bool:
+        """ the projector is attached, images are rendered by the backend's own chat handler """
+        ...
+
+    @property
+    def stateful(self) -> bool: ...
+
+    @property
+    def can_prefill(self) -> bool: ...
+
+    @property
+    def n_ctx(self) -> int: ...
+
+    @property
+    def n_tokens(self) -> int:
+        """ the tokens the kv cache holds, 0 if the backend does not know """
+        ...
+# end                                                                                                 InferenceBackend #
+
+def create_backend(kind: Optional[str],
+                   pretrained: Union[Path, "Hub"],
+                   projector: Optional[str] = None,
+                   url: Optional[str] = None,
+                   kv_type: Optional[str] = None,
+                   flash_attn: Optional[bool] = None) -> InferenceBackend:
+    """ create_backend
+        create_backend - the backend `kind` ("llama", "mock" or "remote", `[inference] backend` if None) for the
+                         model `pretrained`, imported only when it is used
+
+        Args:
+            kind (Optional[str]): the implementation
+            pretrained (Union[Path, Hub]): the gguf (or hub repository) of a llama backend, names the others
+            projector (Optional[str]): the clip projector of a llama backend
+            url (Optional[str]): the server of a remote backend, `[inference] remote_url` if None
+            kv_type (Optional[str]): the kv cache type of a llama backend, `[inference] kv_type` if None
+            flash_attn (Optional[bool]): flash attention for a llama backend, `[inference] flash_attn` if None
+
+        Raises:
+            ModelTypeNotSupported: if `kind` is unknown
+            ModelNotFoundError: if a llama backend's gguf does not exist
+    """
+    kind = kind or Config.inference_backend
+
+    if kind == "llama":
+        from Server.ai.backends.llama import LlamaBackend
+        return LlamaBackend(
+            pretrained,
+            projector,
+            kv_type    = kv_type or Config.inference_kv_type,
+            flash_attn = Config.inference_flash_attn if flash_attn is None else flash_attn,
+        ) #                                                                                                     return #
+
+    name: str = getattr(pretrained, "model_name", None) or Path(str(pretrained)).name
+
+    if kind == "mock":
+        from Server.ai.backends.mock import MockBackend
+        return MockBackend.from_config(name) #                                                                  return #
+
+    if kind == "remote":
+        from Server.ai.backends.remote import RemoteBackend
+        return RemoteBackend.from_config(name, url) #                                                           return #
+
+    raise ModelTypeNotSupported(f"unknown inference backend '{kind}', expected one of {', '.join(BACKENDS)}")
+# end                                                                                                   create_backend #
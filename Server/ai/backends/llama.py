@@ -0,0 +1,300 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import gc
+import os
+import time
+import threading
+
+from pathlib import Path
+from typing  import TYPE_CHECKING, Any, Iterator, Optional, Union
+
+from Server.config.read_config import Config
+
+# llama_cpp is imported where the model is actually loaded, importing it here costs hundreds of ms and MBs of
+# RSS for every process that only needs the server package (tests, the gateway, `start.py` checks)
+if TYPE_CHECKING:
+    import numpy as np
+    from llama_cpp                   import Llama
+    from llama_cpp.llama_chat_format import Llava15ChatHandler
+    from Server.ai.core.embeddings   import Embedder
+    from Server.ai.core.model_loader import Hub
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.context.chat_context import ChatContext
+from Server.ai.core.chat_template   import ChatTemplate, has_images
+from Server.ai.core.errors          import ModelFailedToLoad, ModelNotFoundError
+from Server.ai.core.kv_cache        import KV_TYPES, cache_types
+from Server.ai.utils.metrics        import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ------------------------------------------------------ llama ------------------------------------------------------- #
+
+class ResumableState:
+    """ the kv state of a generation in progress and its sampler, llama-cpp-python keeps the sampler of the
+        running generation on the instance and the next request replaces it
+    """
+    __slots__ = ("state", "sampler")
+
+    def __init__(self, state: Any, sampler: Any) -> None:
+        self.state:   Any = state
+        self.sampler: Any = sampler
+    # end                                                                                                     __init__ #
+# end                                                                                                   ResumableState #
+
+class LlamaBackend:
+    """ LlamaBackend
+        LlamaBackend - llama.cpp in this process through llama-cpp-python, the weights are memory mapped from a
+                       local gguf (or downloaded from a hub repository first)
+
+        the clip projector of a vision model loads on its own thread next to the language model and is handed
+        to the llama instance by `attach_projector`. embeddings open the same gguf a second time in embedding
+        mode on first use, the mapped weights are shared
+
+        Args:
+            pretrained (Union[Path, Hub]): the gguf or the hub repository
+            projector (Optional[str]): the clip projector, a file name pattern for hub repositories
+            kv_type (str): the kv cache type, one of `KV_TYPES`
+            flash_attn (bool): use flash attention, needed to quantize the V cache
+    """
+
+    def __init__(self,
+                 pretrained: Union[Path, "Hub"],
+                 projector: Optional[str] = None,
+                 kv_type: str = "f16",
+                 flash_attn: bool = False) -> None:
+        self.__hub:       Optional["Hub"]                = None if isinstance(pretrained, Path) else pretrained
+        self.__projector: Optional[str]                  = projector
+        self.__model:     Optional["Llama"]              = None
+        self.__handler:   Optional["Llava15ChatHandler"] = None
+        self.__template:  Optional[ChatTemplate]         = None # the gguf's chat template, renders pipelined turns
+        self.__embedder:  Optional["Embedder"]           = None
+        self.__lock:      threading.Lock                 = threading.Lock()
+        self.__kv_types:  tuple[str, str]                = cache_types(kv_type, flash_attn) # K, V
+        self.__flash:     bool                           = flash_attn
+
+        if kv_type != "f16" and not flash_attn:
+            logger.warning(f"{kv_type} kv cache without flash attention, only the K cache is quantized")
+
+        if isinstance(pretrained, Path):
+            self.name: str = str(pretrained.absolute())
+            if not os.path.exists(self.name):
+                raise ModelNotFoundError(f"Model not found: {self.name}")
+        else:
+            self.name = pretrained.model_name
+    # end                                                                                                     __init__ #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def load(self) -> None:
+        from llama_cpp import Llama
+
+        if self.__hub is not None:
+            self.__model     = Llama.from_pretrained(
+                repo_id      = self.__hub.model_name,
+                filename     = self.__hub.file_name,
+                local_dir    = Path(os.getcwd(), "Server", "models"),
+
+                use_mlock    = Config.keep_in_mem,
+                n_ctx        = Config.max_tokens,
+                n_threads    = Config.inference_threads or None,
+                type_k       = KV_TYPES[self.__kv_types[0]][0],
+                type_v       = KV_TYPES[self.__kv_types[1]][0],
+                flash_attn   = self.__flash,
+                n_gpu_layers = -1,
+                verbose      = False,
+            )
+        else:
+            self.__model     = Llama(
+                model_path   = self.name,
+
+                use_mlock    = Config.keep_in_mem,
+                n_ctx        = Config.max_tokens,
+                n_threads    = Config.inference_threads or None,
+                type_k       = KV_TYPES[self.__kv_types[0]][0],
+                type_v       = KV_TYPES[self.__kv_types[1]][0],
+                flash_attn   = self.__flash,
+                n_gpu_layers = -1,
+                verbose      = False,
+            )
+
+        if self.__model is None:
+            raise ModelFailedToLoad("Model failed to load")
+
+        self.__template = ChatTemplate.of(
+            self.__model, Config.tokenizer_prompt_sessions if Config.tokenizer_incremental_prompts else 0
+        )
+    # end                                                                                                         load #
+
+    def load_projector(self) -> None:
+        from llama_cpp.llama_chat_format import Llava15ChatHandler, MoondreamChatHandler
+
+        if self.__hub is not None:
+            self.__handler = MoondreamChatHandler.from_pretrained(
+                repo_id   = self.__hub.model_name,
+                filename  = self.__projector,
+                local_dir = Path(os.getcwd(), "Server", "models"),
+                verbose   = False,
+            )
+        else:
+            self.__handler = Llava15ChatHandler(
+                clip_model_path    = self.__projector,
+                verbose            = False
+            )
+    # end                                                                                               load_projector #
+
+    def attach_projector(self) -> bool:
+        with self.__lock:
+            if self.__model is None or self.__handler is None:
+                return False #                                                                                  return #
+
+            self.__model.chat_handler = self.__handler
+            return True #                                                                                       return #
+    # end                                                                                             attach_projector #
+
+    def unload(self) -> None:
+        self.__model, self.__handler, self.__template, self.__embedder = None, None, None, None
+        gc.collect()
+    # end                                                                                                       unload #
+
+    def stream_chat(self,
+                    messages: list[dict[str, Any]],
+                    sampling: dict[str, Any],
+                    max_tokens: Optional[int],
+                    stop: list[str],
+                    pipelined: bool = False,
+                    session_id: Optional[str] = None) -> Iterator[dict[str, Any]]:
+        """ pipelined text chats are rendered through the chat template, like their `prefill` calls were, so
+            llama.cpp finds the prefilled tokens as the common prefix of the prompt. so are text chats when the
+            template renders a session's prompt incrementally. every other chat goes through
+            `create_chat_completion` (and the projector's handler if it has images)
+        """
+        llama: "Llama" = self.__model                                                                  # type:ignore
+        template: Optional[ChatTemplate] = self.__template
+
+        if template is not None and (pipelined or template.incremental) and (
+            not self.vision or not has_images(messages)
+        ):
+            # the private converter is what every llama.cpp chat handler streams its completion through
+            from llama_cpp.llama_chat_format import _convert_completion_to_chat
+
+            tokens, template_stop, criteria = template.prompt(ChatContext.text_only(messages), session_id)
+            return _convert_completion_to_chat(                                                        # type:ignore
+                llama.create_completion(
+                    prompt=tokens, max_tokens=max_tokens, stop=template_stop + stop, stopping_criteria=criteria,
+                    stream=True, **sampling
+                ),
+                stream=True,
+            ) #                                                                                                 return #
+
+        return llama.create_chat_completion(                                                           # type:ignore
+            messages=messages if self.vision else ChatContext.text_only(messages),
+
+            max_tokens=max_tokens,
+            stop=stop or None,
+            stream=True,
+            **sampling,
+        ) #                                                                                                     return #
+    # end                                                                                                  stream_chat #
+
+    def prefill(self, messages: list[dict[str, Any]], session_id: Optional[str] = None) -> int:
+        """ evaluates the template prefix of `messages`, reusing the longest prefix the kv cache already holds """
+        if self.__template is None:
+            return 0 #                                                                                          return #
+
+        llama:  "Llama"   = self.__model                                                               # type:ignore
+        tokens: list[int] = self.__template.prefix(ChatContext.text_only(messages), session_id)
+        if len(tokens) >= llama.n_ctx():
+            return 0 #                                                                                          return #
+
+        cached: list[int] = llama.input_ids[:llama.n_tokens].tolist()
+        common: int       = 0
+        while common < min(len(cached), len(tokens)) and cached[common] == tokens[common]:
+            common += 1
+
+        start: float = time.perf_counter()
+        llama.n_tokens = common # drops whatever followed the common prefix, e.g. a stale end of the question
+        if common < len(tokens):
+            llama.eval(tokens[common:])
+
+        Metrics.observe("prefill.seconds", time.perf_counter() - start)
+        Metrics.increment("prefill.tokens", len(tokens) - common)
+        Metrics.increment("prefill.reused_tokens", common)
+        return len(tokens) - common #                                                                           return #
+    # end                                                                                                      prefill #
+
+    def tokenize(self, text: str, special: bool = False) -> list[int]:
+        llama: "Llama" = self.__model                                                                  # type:ignore
+        return llama.tokenize(text.encode("utf-8"), add_bos=False, special=special) #                          return #
+    # end                                                                                                     tokenize #
+
+    def embed(self, texts: list[str]) -> tuple["np.ndarray", list[int]]:
+        from Server.ai.core.embeddings import Embedder
+
+        with self.__lock:
+            if self.__embedder is None:
+                self.__embedder = Embedder(Path(self.name), Config.embeddings_context)
+
+        return self.__embedder.embed(texts) #                                                                   return #
+    # end                                                                                                        embed #
+
+    def save_state(self, resumable: bool = False) -> Any:
+        llama: "Llama" = self.__model                                                                  # type:ignore
+        state: Any     = llama.save_state()
+
+        return ResumableState(state, getattr(llama, "_sampler", None)) if resumable else state #                return #
+    # end                                                                                                   save_state #
+
+    def load_state(self, state: Any) -> None:
+        llama: "Llama" = self.__model                                                                  # type:ignore
+
+        if isinstance(state, ResumableState):
+            llama.load_state(state.state)
+            if hasattr(llama, "_sampler"):
+                llama._sampler = state.sampler
+        else:
+            llama.load_state(state)
+    # end                                                                                                   load_state #
+
+    # -------------------------------------------------- properties -------------------------------------------------- #
+
+    @property
+    def loaded(self) -> bool:
+        return self.__model is not None
+    # end                                                                                                       loaded #
+
+    @property
+    def multimodal(self) -> bool:
+        return self.__projector is not None
+    # end                                                                                                   multimodal #
+
+    @property
+    def vision(self) -> bool:
+        return self.__model is not None and self.__model.chat_handler is not None
+    # end                                                                                                       vision #
+
+    @property
+    def stateful(self) -> bool:
+        return True
+    # end                                                                                                     stateful #
+
+    @property
+    def can_prefill(self) -> bool:
+        return self.__template is not None
+    # end                                                                                                  can_prefill #
+
+    @property
+    def n_ctx(self) -> int:
+        return self.__model.n_ctx() if self.__model is not None else Config.max_tokens
+    # end                                                                                                        n_ctx #
+
+    @property
+    def n_tokens(self) -> int:
+        return self.__model.n_tokens if self.__model is not None else 0
+    # end                                                                                                     n_tokens #
+# end                                                                                                     LlamaBackend #
@@ -0,0 +1,254 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import re
+import time
+import zlib
+import random
+
+from typing import TYPE_CHECKING, Any, Iterator, Optional
+
+from Server.config.read_config import Config
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.context.chat_context import ChatContext
+from Server.ai.core.chat_template   import PromptCache
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ------------------------------------------------------ mock -------------------------------------------------------- #
+
+WORDS: list[str] = (
+    "the entropy of an isolated system never decreases because heat flows from the hot body to the cold one and "
+    "every real engine loses part of the work it could do so the efficiency stays below the carnot limit which "
+    "depends only on the temperatures of the two reservoirs as the lecture showed with the example of a steam "
+    "turbine"
+).split()
+
+TOKEN: re.Pattern = re.compile(r"\w+|[^\w\s]")
+
+class MockBackend:
+    """ MockBackend
+        MockBackend - a deterministic stand-in for llama.cpp with its cost profile, for benchmarks and ci: the same
+                      messages and seed always get the same answer, and time is only spent where llama.cpp spends it
+
+        the kv cache is the list of prompt and answer tokens. a prompt pays `prefill_ms` per token after the
+        prefix it shares with the cache, every answer token pays `token_ms`, so session switches, prefills and
+        parked states cost what they would on the real model. words are tokens (crc32 of the word), embeddings
+        are bags of per token random vectors, texts sharing words are similar
+
+        ```python
+        >>> backend = MockBackend("mock", token_ms=0, reply_tokens=4)
+        >>> backend.load()
+        >>> for chunk in backend.stream_chat([{"role": "user", "content": "what is entropy?"}], {"seed": 0}, 16, []):
+        ...     print(chunk["choices"][0]["delta"].get("content", ""), end="") # four words of WORDS
+        ```
+
+        Args:
+            name (str): the model name in the responses
+            token_ms (float): decode cost per answer token
+            prefill_ms (float): prompt evaluation cost per token not in the cache
+            load_seconds (float): the time `load` takes
+            reply_tokens (int): answer length when neither max_tokens nor a stop sequence ends it
+            n_ctx (int): the context size
+            dimension (int): the size of the embeddings
+            sessions (int): sessions whose rendered prompt is kept, 0 renders every prompt in full
+    """
+
+    def __init__(self,
+                 name: str,
+                 token_ms: float = 20.0,
+                 prefill_ms: float = 0.5,
+                 load_seconds: float = 0.0,
+                 reply_tokens: int = 64,
+                 n_ctx: int = 8192,
+                 dimension: int = 64,
+                 sessions: int = 256) -> None:
+        self.name:            str       = name
+        self.__token_ms:      float     = token_ms
+        self.__prefill_ms:    float     = prefill_ms
+        self.__load_seconds:  float     = load_seconds
+        self.__reply_tokens:  int       = reply_tokens
+        self.__n_ctx:         int       = n_ctx
+        self.__dimension:     int       = dimension
+        self.__loaded:        bool      = False
+        self.__cache:         list[int] = [] # the kv cache
+        self.__prompts:       PromptCache = PromptCache(
+            self._render, lambda text, first: self.tokenize(text, special=True), sessions
+        )
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def from_config(cls, name: str) -> "MockBackend":
+        return cls(
+            name,
+            token_ms     = Config.inference_mock_token_ms,
+            prefill_ms   = Config.inference_mock_prefill_ms,
+            load_seconds = Config.inference_mock_load_seconds,
+            reply_tokens = Config.inference_mock_reply_tokens,
+            n_ctx        = Config.max_tokens,
+            dimension    = Config.inference_mock_dimension,
+            sessions     = Config.tokenizer_prompt_sessions if Config.tokenizer_incremental_prompts else 0,
+        ) #                                                                                                     return #
+    # end                                                                                                  from_config #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def load(self) -> None:
+        time.sleep(self.__load_seconds)
+        self.__loaded = True
+    # end                                                                                                         load #
+
+    def load_projector(self) -> None:
+        pass
+    # end                                                                                               load_projector #
+
+    def attach_projector(self) -> bool:
+        return False #                                                                                          return #
+    # end                                                                                             attach_projector #
+
+    def unload(self) -> None:
+        self.__loaded, self.__cache = False, []
+    # end                                                                                                       unload #
+
+    def stream_chat(self,
+                    messages: list[dict[str, Any]],
+                    sampling: dict[str, Any],
+                    max_tokens: Optional[int],
+                    stop: list[str],
+                    pipelined: bool = False,
+                    session_id: Optional[str] = None) -> Iterator[dict[str, Any]]:
+        messages = ChatContext.text_only(messages)
+        prompt:  list[int]     = self.__prompts.prompt(session_id, messages)
+        rng:     random.Random = random.Random(f"{sampling.get('seed')}|{messages[-1]['content']}")
+        created: int           = int(time.time())
+        chunk_id: str          = f"chatcmpl-mock-{rng.getrandbits(32):08x}"
+
+        def chunk(delta: dict[str, str], finish_reason: Optional[str] = None) -> dict[str, Any]:
+            return {
+                "id": chunk_id, "object": "chat.completion.chunk", "created": created, "model": self.name,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            } #                                                                                                 return #
+
+        self._evaluate(prompt)
+        yield chunk({"role": "assistant"}) #                                                            yield return
+
+        text:   str = ""
+        reason: str = "stop"
+        budget: int = min(max_tokens or self.__reply_tokens, self.__reply_tokens, self.__n_ctx - len(self.__cache))
+        for index in range(max(0, budget)):
+            word: str = " " + WORDS[(rng.randrange(len(WORDS)) + index) % len(WORDS)]
+            if any(sequence in text + word for sequence in stop):
+                break
+
+            time.sleep(self.__token_ms / 1000)
+            text += word
+            self.__cache.append(self._token(word.strip()))
+            yield chunk({"content": word}) #                                                            yield return
+        else:
+            reason = "length" if budget < self.__reply_tokens else "stop"
+
+        yield chunk({}, reason) #                                                                       yield return
+    # end                                                                                                  stream_chat #
+
+    def prefill(self, messages: list[dict[str, Any]], session_id: Optional[str] = None) -> int:
+        return self._evaluate(self.__prompts.prefix(session_id, ChatContext.text_only(messages))) #             return #
+    # end                                                                                                      prefill #
+
+    def tokenize(self, text: str, special: bool = False) -> list[int]:
+        return [self._token(word) for word in TOKEN.findall(text)] #                                            return #
+    # end                                                                                                     tokenize #
+
+    def embed(self, texts: list[str]) -> tuple["np.ndarray", list[int]]:
+        import numpy as np
+
+        matrix: np.ndarray = np.zeros((len(texts), self.__dimension), dtype=np.float32)
+        tokens: list[int]  = []
+
+        for row, text in enumerate(texts):
+            ids: list[int] = self.tokenize(text)
+            for token in ids:
+                matrix[row] += np.random.default_rng(token).standard_normal(self.__dimension, dtype=np.float32)
+            tokens.append(len(ids))
+
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        return matrix, tokens #                                                                                 return #
+    # end                                                                                                        embed #
+
+    def save_state(self, resumable: bool = False) -> Any:
+        return list(self.__cache) #                                                                             return #
+    # end                                                                                                   save_state #
+
+    def load_state(self, state: Any) -> None:
+        self.__cache = list(state)
+    # end                                                                                                   load_state #
+
+    # -------------------------------------------------- properties -------------------------------------------------- #
+
+    @property
+    def loaded(self) -> bool:
+        return self.__loaded
+    # end                                                                                                       loaded #
+
+    @property
+    def multimodal(self) -> bool:
+        return False
+    # end                                                                                                   multimodal #
+
+    @property
+    def vision(self) -> bool:
+        return False
+    # end                                                                                                       vision #
+
+    @property
+    def stateful(self) -> bool:
+        return True
+    # end                                                                                                     stateful #
+
+    @property
+    def can_prefill(self) -> bool:
+        return True
+    # end                                                                                                  can_prefill #
+
+    @property
+    def n_ctx(self) -> int:
+        return self.__n_ctx
+    # end                                                                                                        n_ctx #
+
+    @property
+    def n_tokens(self) -> int:
+        return len(self.__cache)
+    # end                                                                                                     n_tokens #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    @staticmethod
+    def _token(word: str) -> int:
+        return zlib.crc32(word.encode("utf-8")) & 0x7FFFFFFF #                                                  return #
+    # end                                                                                                       _token #
+
+    @staticmethod
+    def _render(messages: list[dict[str, str]], generation_prompt: bool = False) -> str:
+        """ a chat template: every message between its role and `<|end|>`, then the assistant's turn """
+        rendered: str = "".join(f"<|{message['role']}|>\n{message['content']}<|end|>\n" for message in messages)
+        return rendered + "<|assistant|>\n" if generation_prompt else rendered #                                return #
+    # end                                                                                                      _render #
+
+    def _evaluate(self, tokens: list[int]) -> int:
+        """ keeps the prefix the cache shares with `tokens` and pays for the rest """
+        common: int = 0
+        while common < min(len(self.__cache), len(tokens)) and self.__cache[common] == tokens[common]:
+            common += 1
+
+        time.sleep((len(tokens) - common) * self.__prefill_ms / 1000)
+        self.__cache = tokens[:self.__n_ctx]
+        return len(tokens) - common #                                                                           return #
+    # end                                                                                                    _evaluate #
+# end                                                                                                      MockBackend #
@@ -0,0 +1,236 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import json
+import time
+
+from typing import TYPE_CHECKING, Any, Iterator, Optional
+
+from Server.config.read_config import Config
+
+# httpx is only imported once a remote backend is configured
+if TYPE_CHECKING:
+    import httpx
+    import numpy as np
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.context.chat_context import ChatContext
+from Server.ai.core.errors          import ModelFailedToLoad
+from Server.ai.utils.metrics        import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ----------------------------------------------------- remote ------------------------------------------------------- #
+
+class RemoteBackend:
+    """ RemoteBackend
+        RemoteBackend - an OpenAI compatible server (llama.cpp's `llama-server`) in another process or on another
+                        host, reached over a pool of keep-alive connections
+
+        completions stream as server sent events and are passed on chunk by chunk as they are parsed, closing the
+        iterator closes the connection and the server stops generating. the server keeps the prompt cache of its
+        slots itself (`cache_prompt`), there is no kv state to move between sessions here, so the backend is not
+        `stateful` and can not prefill. `tokenize` and `embed` use llama-server's `/tokenize` and
+        `/v1/embeddings` (started with `--embedding`)
+
+        ```python
+        >>> backend = RemoteBackend("llama-3-8b", "http://127.0.0.1:8080")
+        >>> backend.load()            # waits until the server answers /health
+        >>> backend.n_ctx
+        8192
+        ```
+
+        Args:
+            name (str): the model name sent to the server
+            url (str): the server, without the /v1 suffix
+            api_key (str): sent as a bearer token if set
+            timeout (float): seconds to wait for the server, per read
+            max_connections (int): connections kept to the server
+    """
+
+    def __init__(self,
+                 name: str,
+                 url: str,
+                 api_key: str = "",
+                 timeout: float = 600.0,
+                 max_connections: int = 16) -> None:
+        self.name:               str                       = name
+        self.__url:              str                       = url.rstrip("/")
+        self.__api_key:          str                       = api_key
+        self.__timeout:          float                     = timeout
+        self.__max_connections:  int                       = max_connections
+        self.__client:           Optional["httpx.Client"]  = None
+        self.__props:            dict[str, Any]            = {}
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def from_config(cls, name: str, url: Optional[str] = None) -> "RemoteBackend":
+        return cls(
+            name,
+            url or Config.inference_remote_url,
+            api_key         = Config.inference_remote_api_key,
+            timeout         = Config.inference_remote_timeout,
+            max_connections = Config.inference_remote_max_connections,
+        ) #                                                                                                     return #
+    # end                                                                                                  from_config #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def load(self) -> None:
+        """ opens the connection pool and waits for the server to finish loading its model (503 until then) """
+        import httpx
+
+        self.__client = httpx.Client(
+            base_url = self.__url,
+            headers  = {"Authorization": f"Bearer {self.__api_key}"} if self.__api_key else None,
+            timeout  = httpx.Timeout(self.__timeout, connect=10.0),
+            limits   = httpx.Limits(max_connections=self.__max_connections,
+                                    max_keepalive_connections=self.__max_connections),
+        )
+
+        deadline: float = time.monotonic() + self.__timeout
+        while True:
+            try:
+                if self.__client.get("/health").status_code == 200:
+                    break
+            except httpx.TransportError as e:
+                if time.monotonic() >= deadline:
+                    raise ModelFailedToLoad(f"{self.__url} is unreachable: {e}")
+
+            if time.monotonic() >= deadline:
+                raise ModelFailedToLoad(f"{self.__url} did not become healthy in {self.__timeout:.0f}s")
+            time.sleep(0.5)
+
+        try:
+            self.__props = self.__client.get("/props").json()
+        except (httpx.HTTPError, ValueError): # an OpenAI compatible server that is not llama-server
+            self.__props = {}
+    # end                                                                                                         load #
+
+    def load_projector(self) -> None:
+        pass
+    # end                                                                                               load_projector #
+
+    def attach_projector(self) -> bool:
+        return False #                                                                                          return #
+    # end                                                                                             attach_projector #
+
+    def unload(self) -> None:
+        if self.__client is not None:
+            self.__client.close()
+        self.__client = None
+    # end                                                                                                       unload #
+
+    def stream_chat(self,
+                    messages: list[dict[str, Any]],
+                    sampling: dict[str, Any],
+                    max_tokens: Optional[int],
+                    stop: list[str],
+                    pipelined: bool = False,
+                    session_id: Optional[str] = None) -> Iterator[dict[str, Any]]:
+        body: dict[str, Any] = {
+            "model":        self.name,
+            "messages":     messages if self.vision else ChatContext.text_only(messages),
+            "stream":       True,
+            "cache_prompt": True,
+            **{name: value for name, value in sampling.items() if value is not None},
+        }
+        if max_tokens is not None:
+            body["max_tokens"] = max_tokens
+        if stop:
+            body["stop"] = stop
+
+        with self.__client.stream("POST", "/v1/chat/completions", json=body) as response:              # type:ignore
+            if response.status_code != 200:
+                response.read()
+                raise RuntimeError(f"{self.__url} answered {response.status_code}: {response.text[:200]}")
+
+            for line in response.iter_lines():
+                if not line.startswith("data:"):
+                    continue # comments, event names and the blank lines between events
+
+                data: str = line[len("data:"):].strip()
+                if data == "[DONE]": # read on to the end of the body, a drained connection goes back to the pool
+                    continue
+
+                chunk: dict[str, Any] = json.loads(data)
+                if chunk.get("choices"): # llama-server ends with a usage and timings chunk without choices
+                    yield chunk #                                                                       yield return
+    # end                                                                                                  stream_chat #
+
+    def prefill(self, messages: list[dict[str, Any]], session_id: Optional[str] = None) -> int:
+        return 0 #                                                                                              return #
+    # end                                                                                                      prefill #
+
+    def tokenize(self, text: str, special: bool = False) -> list[int]:
+        response = self.__client.post("/tokenize", json={                                            # type:ignore
+            "content": text, "add_special": False, "parse_special": special,
+        })
+        response.raise_for_status()
+        return list(response.json()["tokens"]) #                                                                return #
+    # end                                                                                                     tokenize #
+
+    def embed(self, texts: list[str]) -> tuple["np.ndarray", list[int]]:
+        import numpy as np
+
+        start:    float = time.perf_counter()
+        response        = self.__client.post("/v1/embeddings", json={"model": self.name, "input": texts}) # type:ignore
+        response.raise_for_status()
+
+        data: list[dict[str, Any]] = sorted(response.json()["data"], key=lambda item: item["index"])
+        matrix: np.ndarray = np.asarray([item["embedding"] for item in data], dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+        Metrics.observe("embeddings.seconds", time.perf_counter() - start)
+        return matrix, [len(self.tokenize(text)) for text in texts] #                                           return #
+    # end                                                                                                        embed #
+
+    def save_state(self, resumable: bool = False) -> Any:
+        return None #                                                                                           return #
+    # end                                                                                                   save_state #
+
+    def load_state(self, state: Any) -> None:
+        pass
+    # end                                                                                                   load_state #
+
+    # -------------------------------------------------- properties -------------------------------------------------- #
+
+    @property
+    def loaded(self) -> bool:
+        return self.__client is not None
+    # end                                                                                                       loaded #
+
+    @property
+    def multimodal(self) -> bool:
+        return False
+    # end                                                                                                   multimodal #
+
+    @property
+    def vision(self) -> bool:
+        return bool(self.__props.get("modalities", {}).get("vision", False))
+    # end                                                                                                       vision #
+
+    @property
+    def stateful(self) -> bool:
+        return False
+    # end                                                                                                     stateful #
+
+    @property
+    def can_prefill(self) -> bool:
+        return False
+    # end                                                                                                  can_prefill #
+
+    @property
+    def n_ctx(self) -> int:
+        return int(self.__props.get("default_generation_settings", {}).get("n_ctx") or Config.max_tokens)
+    # end                                                                                                        n_ctx #
+
+    @property
+    def n_tokens(self) -> int:
+        return 0
+    # end                                                                                                     n_tokens #
+# end                                                                                                    RemoteBackend #
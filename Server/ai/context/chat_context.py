@@ -1,11 +1,21 @@
 # ------------------------------------------------- regular imports -------------------------------------------------- #
 
 import json
+import base64
+import hashlib
 import logging
 
-from typing                    import Optional, Union
+from typing                    import TYPE_CHECKING, Optional, Union
 from Server.config.read_config import Config
 
+from Server.ai.context.images  import ImageStore, image_ref, is_image_ref, ref_digest
+from Server.ai.utils.metrics   import Metrics
+
+if TYPE_CHECKING:
+    from Server.database.access import ConversationStore
+    from Server.ai.context.compaction import CaptionCache
+    from Server.ai.core.tokenizer import Tokenizer
+
 # -------------------------------------------------- set up logging -------------------------------------------------- #
 
 import  logging
@@ -21,8 +31,13 @@ class SingleChatContent:
             - the content of the chat
             - a flag to check if text has been added to the chat
 
+        Images are interned in the process wide `ImageStore`, the content only holds a reference per image and
+        `get_content` turns them back into urls when the chat handler needs the pixels.
+
         Attributes:
             __text_added (bool): Flag indicating if text has been added.
+            __digests (list[str]): The image references this chat holds, released when it is garbage collected.
+            __tokens (dict[str, int]): The text tokens of the chat per tokenizer (model), see `token_count`.
             role (str): The role of the chat, e.g., 'user' or 'system'.
             content (list[dict[str, str | dict[str, str]]]): list to store the chat content.
     """
@@ -40,6 +55,8 @@ class SingleChatContent:
                 base64_images (Optional[list[str]]): list of base64 encoded images. Default is None.
         """
         self.__text_added: bool = False
+        self.__digests: list[str] = []
+        self.__tokens: dict[str, int] = {}
         self.role: str = role
         self.content: list[dict[str, Union[str, dict[str, str]]]] | str = []
 
@@ -58,6 +75,53 @@ class SingleChatContent:
                     ) if base64_images else 'None')
         # end                                                                                                 __init__ #
 
+    @classmethod
+    def from_content(
+        cls,
+        role: str,
+        content: Union[str, list[dict[str, Union[str, dict[str, str]]]]]
+    ) -> "SingleChatContent":
+        """
+            Rebuilds a SingleChatContent from the output of `get_content` without re-validating the parts.
+
+            Args:
+                role (str): The role of the chat.
+                content (str | list[dict[str, str | dict[str, str]]]): The content as returned by `get_content`.
+
+            Returns:
+                SingleChatContent: The rebuilt chat content.
+        """
+        single = cls(role)
+        single.__text_added = True
+
+        if isinstance(content, str):
+            single.content = content
+            return single
+
+        single.content = []
+        images = ImageStore.shared()
+
+        for part in content:
+            if part["type"] != "image_url":
+                single.content.append(part)
+                continue
+
+            url: str = part["image_url"]["url"]  # type:ignore
+
+            if is_image_ref(url) and images.acquire(ref_digest(url)):
+                digest: str = ref_digest(url)
+            elif is_image_ref(url):
+                logger.error(f"Image {url} is no longer stored, omitting...")
+                continue
+            else:
+                digest = images.intern(url)
+
+            single.__digests.append(digest)
+            single.content.append({"type": "image_url", "image_url": {"url": image_ref(digest)}})
+
+        return single
+    # end                                                                                                 from_content #
+
     def add_text(self, text: str) -> None:
         """
             Adds text to the chat content. Logs an error if text has already been added.
@@ -82,6 +146,7 @@ class SingleChatContent:
             self.content = text
 
         self.__text_added = True
+        self.__tokens     = {}
         logger.debug(f"Added text: {text}")
     # end                                                                                                     add_text #
 
@@ -90,11 +155,14 @@ class SingleChatContent:
             Checks if an image has already been added to the chat content.
 
             Args:
-                base64_uri (str): The base64 URI of the image to check.
+                base64_uri (str): The base64 URI or the image store reference of the image to check.
 
             Returns:
                 bool: True if the image has been added, False otherwise.
         """
+        if not is_image_ref(base64_uri):
+            base64_uri = image_ref(hashlib.sha256(base64.b64decode(base64_uri.split(",")[1])).hexdigest())
+
         for content in self.content:
             image_url = content.get("image_url") if content["type"] == "image_url" else None
 
@@ -120,9 +188,14 @@ class SingleChatContent:
             logger.error("Image is not in the correct format, omitting...")
             return
 
-        if self.is_image_added(base64_uri):
+        digest: str = ImageStore.shared().intern(base64_uri)
+
+        if self.is_image_added(image_ref(digest)):
+            ImageStore.shared().release(digest)
             return
 
+        self.__digests.append(digest)
+        self.__tokens = {} # the tag is text
         self.content.extend([
             {
                 "type": "text",
@@ -131,7 +204,7 @@ class SingleChatContent:
             {
                 "type": "image_url",
                 "image_url": {
-                    "url": base64_uri
+                    "url": image_ref(digest)
                 }
             }
         ])
@@ -158,19 +231,170 @@ class SingleChatContent:
         ))
     # end                                                                                                   add_images #
 
-    def get_content(self) -> dict[str, Union[str, list[dict[str, Union[str, dict[str, str]]]]]]:
+    @property
+    def text(self) -> Optional[str]:
+        """
+        The text of the chat without the image tags, None if no text was added.
+        """
+        if isinstance(self.content, str):
+            return self.content
+
+        for part in self.content:
+            if part["type"] == "text" and not str(part["text"]).startswith("tag="):
+                return str(part["text"])
+
+        return None
+    # end                                                                                                         text #
+
+    @property
+    def images(self) -> list[tuple[str, str]]:
+        """
+        The images of the chat as (tag, base64_uri) pairs in the order they were added, decoded from the store.
+        """
+        return [(tag, ImageStore.shared().url(digest, inline=True)) for tag, digest in self.image_refs]
+    # end                                                                                                       images #
+
+    @property
+    def image_refs(self) -> list[tuple[str, str]]:
+        """
+        The images of the chat as (tag, sha256) pairs in the order they were added, nothing is decoded.
+        """
+        if isinstance(self.content, str):
+            return []
+
+        images: list[tuple[str, str]] = []
+        tag: str = ""
+
+        for part in self.content:
+            if part["type"] == "text" and str(part["text"]).startswith("tag="):
+                tag = str(part["text"])[len("tag="):]
+            elif part["type"] == "image_url":
+                images.append((tag, ref_digest(part["image_url"]["url"])))  # type:ignore
+
+        return images
+    # end                                                                                                   image_refs #
+
+    def token_count(self, tokenizer: "Tokenizer") -> int:
+        """
+        The prompt tokens of the chat for the model of `tokenizer`. The text is tokenized once per model and
+        remembered, every later turn of the conversation only adds up the counts.
+
+        Args:
+            tokenizer (Tokenizer): The tokenizer of the model the prompt is for.
+
+        Returns:
+            int: The tokens of the text, the images and the chat template's markers around them.
+        """
+        if (text_tokens := self.__tokens.get(tokenizer.name)) is None:
+            text_tokens = self.__tokens[tokenizer.name] = tokenizer.count_content(self.content)
+
+        return text_tokens + len(self.__digests) * tokenizer.image_cost + tokenizer.message_overhead
+    # end                                                                                                  token_count #
+
+    def compacted(self, captions: "CaptionCache") -> Optional["SingleChatContent"]:
+        """
+        Builds a copy of this chat with every image whose caption is known replaced by `[image <tag>: <caption>]`.
+        Images without a caption are queued for captioning and kept. The chat itself is never modified, it may be
+        shared with other branches.
+
+        Args:
+            captions (CaptionCache): Where the captions are looked up.
+
+        Returns:
+            Optional[SingleChatContent]: The compacted chat, None if no image could be replaced yet.
+        """
+        if not self.__digests or isinstance(self.content, str):
+            return None
+
+        content: list[dict[str, Union[str, dict[str, str]]]] = []
+        replaced: int = 0
+
+        for part in self.content:
+            if part["type"] == "image_url":
+                digest: str = ref_digest(part["image_url"]["url"])  # type:ignore
+                tag_part = content[-1] if content and str(content[-1].get("text", "")).startswith("tag=") else None
+
+                if (caption := captions.get(digest)) is not None:
+                    tag: str = str(tag_part["text"])[len("tag="):] if tag_part else ""
+                    content[-1 if tag_part else len(content):] = [{"type": "text", "text": f"[image {tag}: {caption}]"}]
+                    replaced += 1
+                    continue
+
+            content.append(part)
+
+        return SingleChatContent.from_content(self.role, content) if replaced else None
+    # end                                                                                                    compacted #
+
+    def get_redacted_content(self) -> dict[str, Union[str, list[dict[str, Union[str, dict[str, str]]]]]]:
+        """
+        Retrieves the chat content with every image url replaced by its size, the images themselves are not copied.
+
+        Returns:
+            dict[str, str | list[dict[str, str | dict[str, str]]]]: The redacted chat content.
+        """
+        if isinstance(self.content, str):
+            return self.get_content()
+
+        return {
+            "role":    self.role,
+            "content": [
+                part
+                if part["type"] != "image_url"
+                else {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/png;base64,"
+                               f"{ImageStore.shared().size(ref_digest(part['image_url']['url']))}bytes"  # type:ignore
+                    }
+                }
+                for part in self.content
+            ]
+        }
+    # end                                                                                         get_redacted_content #
+
+    def get_content(self, inline: bool = False) -> dict[str, Union[str, list[dict[str, Union[str, dict[str, str]]]]]]:
         """
-        Retrieves the chat content.
+        Retrieves the chat content with every image reference materialized for the chat handler.
+
+        Args:
+            inline (bool): Materialize every image as a data uri, spilled images are `file://` urls otherwise.
 
         Returns:
             dict[str, str | list[dict[str, str | dict[str, str]]]]: The chat content.
         """
         logger.debug("Retrieved chat content.")
+
+        if not self.__digests:
+            return {
+                "role":    self.role,
+                "content": self.content
+            }
+
+        images = ImageStore.shared()
         return {
             "role":    self.role,
-            "content": self.content
+            "content": [
+                part
+                if part["type"] != "image_url"
+                else {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": images.url(ref_digest(part["image_url"]["url"]), inline=inline)  # type:ignore
+                    }
+                }
+                for part in self.content
+            ]
         }
     # end                                                                                            SingleChatContext #
+
+    def __del__(self) -> None:
+        # the last message referencing an image frees it, branches share messages and so keep their images
+        try:
+            for digest in self.__digests:
+                ImageStore.shared().release(digest)
+        except Exception:
+            pass
+    # end                                                                                                      __del__ #
 # end                                                                                                SingleChatContent #
 
 class ChatContext:
@@ -181,6 +405,9 @@ class ChatContext:
             base_prompt (dict[str, str]): The initial system prompt for the assistant.
             contexts (list[SingleChatContent]): A list to store chat content.
             total_images (int): The total number of images in the context.
+            session_id (str): The session this context belongs to.
+            window_start (int): The first message after the system prompt that is still sent to the model, older
+                                ones no longer fit its context.
     """
     base_prompt: dict[str, str] = {
         "role": "system",
@@ -195,8 +422,13 @@ class ChatContext:
         )
     }
 
-    def __init__(self) -> None:
-        """ Initializes the ChatContext with the base system prompt. """
+    def __init__(self, session_id: str = "default", store: Optional["ConversationStore"] = None) -> None:
+        """ Initializes the ChatContext with the base system prompt.
+
+            Args:
+                session_id (str): The session this context belongs to. Default is 'default'.
+                store (Optional[ConversationStore]): If given, every appended turn is persisted to it.
+        """
         self.contexts: list[SingleChatContent] = [
             SingleChatContent(
                 ChatContext.base_prompt["role"],
@@ -204,16 +436,53 @@ class ChatContext:
             )
         ]
         self.total_images: int = 0
+        self.session_id:   str = session_id
+        self.turn_offset:  int = 0 # persisted turns before the first loaded one, see `from_store`
+        self.window_start: int = 1 # moved on by `Model` once the conversation outgrows the context
+        self.__store: Optional["ConversationStore"] = store
 
         logger.debug("Initialized ChatContext with base system prompt.")
     # end                                                                                                     __init__ #
 
+    @classmethod
+    def from_store(
+        cls,
+        store: "ConversationStore",
+        session_id: str,
+        last: int,
+        images: bool = True
+    ) -> "ChatContext":
+        """ Rebuilds a session's context from the last `last` persisted turns.
+
+            Args:
+                store (ConversationStore): The store to read from, later turns are persisted to it as well.
+                session_id (str): The session to load.
+                last (int): How many of the most recent turns to load.
+                images (bool): Whether to restore the turns' images or only their text. Default is True.
+
+            Returns:
+                ChatContext: The restored context, empty apart from the system prompt for an unknown session.
+        """
+        context = cls(session_id, store)
+        turns   = store.load_last(session_id, last)
+
+        if turns:
+            context.turn_offset = turns[0]["turn"] - 1
+
+        for turn in turns:
+            context.append(turn["role"], turn["text"], (turn["images"] or None) if images else None, persist=False)
+
+        logger.debug(f"Loaded {len(context.contexts) - 1} turns for session {session_id} from the store.")
+        return context
+    # end                                                                                                   from_store #
+
     def append(
         self,
         /,
         role: str = "user",
         text: Optional[str] = None,
-        base64_images: Optional[list[str]] = None
+        base64_images: Optional[list[str]] = None,
+        persist: bool = True
     ) -> None:
         """ Appends new content to the chat context.
 
@@ -221,25 +490,42 @@ class ChatContext:
                 role (str): The role of the content, e.g., 'user', 'system' or 'assistant'. Default is 'user'.
                 text (Optional[str]): The text content to append.
                 base64_images (Optional[list[str]]): list of base64 encoded images.
+                persist (bool): Whether to queue the turn for the conversation store (if any). Default is True.
         """
+        # old images are swapped for their captions first, the window then has room for the new ones
+        if Config.images_compact_after_turns > 0 and len(self.contexts) > 1:
+            from Server.ai.context.compaction import CaptionCache
+
+            # compacting rewrites the prompt from the compacted turn on (and so its kv cache), it is done in
+            # batches: once an image is `compact_after` turns old, every image older than half of that goes
+            compact_after: int = Config.images_compact_after_turns
+            if self.total_images + len(base64_images or []) > Config.max_images:
+                compact_after = 0
+
+            if any(single.image_refs for single in self.contexts[1:max(1, len(self.contexts) - compact_after)]):
+                if (replaced := self.compact(compact_after // 2, CaptionCache.shared())):
+                    Metrics.increment("context.images_compacted", replaced)
+
         self.total_images += len(base64_images) if base64_images else 0
         if self.total_images > Config.max_images:
             logger.error(
                 f"Cannot add more than {Config.max_images} images to the context, omitting..."
             )
 
+        accepted_images: Optional[list[str]] = base64_images if self.total_images <= Config.max_images else None
+
         self.contexts.append(
             SingleChatContent(
                 role,
                 text,
-                (
-                    base64_images
-                    if self.total_images <= Config.max_images
-                    else None
-                )
+                accepted_images
             )
         )
 
+        # queued to the store's writer thread, this never blocks on disk
+        if persist and self.__store is not None:
+            self.__store.append(self.session_id, role, text, accepted_images)
+
         logger.debug(
             f"Appended new content: role={role}, text={text}, base64_images="
             + ' '.join(
@@ -251,18 +537,201 @@ class ChatContext:
 
     # end                                                                                                  add_context #
 
-    def get_context(self) -> list[dict[str, Union[str, list[dict[str, Union[str, dict[str, str]]]]]]]:
+    def get_context(
+        self,
+        inline: bool = False,
+        indices: Optional[list[int]] = None
+    ) -> list[dict[str, Union[str, list[dict[str, Union[str, dict[str, str]]]]]]]:
         """ Retrieves the current chat context.
 
+            Args:
+                inline (bool): Materialize every image as a data uri, needed when the context leaves the process.
+                indices (Optional[list[int]]): Only these messages, e.g. picked by `HistorySelector`. Default is all.
+
             Returns:
                 list[dict[str, str | list[dict[str, str | dict[str, str]]]]]: The current chat context.
         """
-        context = [context.get_content() for context in self.contexts]
+        selected = self.contexts if indices is None else [self.contexts[index] for index in indices]
+        context  = [context.get_content(inline) for context in selected]
         logger.debug("Retrieved current chat context.")
         return context
     # end                                                                                                  get_context #
 
-    # TODO: add edit context function
+    def token_count(self, tokenizer: "Tokenizer", indices: Optional[list[int]] = None) -> int:
+        """ Counts the prompt tokens of the context, every message is only tokenized the first time.
+
+            Args:
+                tokenizer (Tokenizer): The tokenizer of the model the prompt is for.
+                indices (Optional[list[int]]): Only these messages. Default is all.
+
+            Returns:
+                int: The tokens of the messages, see `SingleChatContent.token_count`.
+        """
+        selected = self.contexts if indices is None else [self.contexts[index] for index in indices]
+        return sum(single.token_count(tokenizer) for single in selected)
+    # end                                                                                                  token_count #
+
+    @classmethod
+    def from_messages(
+        cls,
+        messages: list[dict[str, Union[str, list[dict[str, Union[str, dict[str, str]]]]]]],
+        session_id: str = "default",
+        store: Optional["ConversationStore"] = None
+    ) -> "ChatContext":
+        """ Rebuilds a context from the output of `get_context` (system prompt included).
+
+            Args:
+                messages (list[dict[str, str | list[dict[str, str | dict[str, str]]]]]): The messages.
+                session_id (str): The session the context belongs to. Default is 'default'.
+                store (Optional[ConversationStore]): Where later turns are persisted.
+
+            Returns:
+                ChatContext: The rebuilt context.
+        """
+        context = cls(session_id, store)
+        context.contexts = [
+            SingleChatContent.from_content(str(message["role"]), message["content"]) for message in messages
+        ]
+        context.total_images = sum(
+            1
+            for message in messages if isinstance(message["content"], list)
+            for part in message["content"] if part["type"] == "image_url"  # type:ignore
+        )
+        return context
+    # end                                                                                                from_messages #
+
+    @staticmethod
+    def text_only(
+        messages: list[dict[str, Union[str, list[dict[str, Union[str, dict[str, str]]]]]]]
+    ) -> list[dict[str, str]]:
+        """ Flattens multimodal messages into plain strings, dropping images and their tags.
+
+            Args:
+                messages (list[dict[str, str | list[dict[str, str | dict[str, str]]]]]): The messages.
+
+            Returns:
+                list[dict[str, str]]: The messages with string content only.
+        """
+        return [
+            {
+                "role":    str(message["role"]),
+                "content": (
+                    message["content"]
+                    if isinstance(message["content"], str)
+                    else "\n".join(
+                        str(part["text"]) for part in message["content"]
+                        if part["type"] == "text" and not str(part["text"]).startswith("tag=")
+                    )
+                ),
+            }
+            for message in messages
+        ]
+    # end                                                                                                    text_only #
+
+    def fork(self, turn: int, session_id: str, persist: bool = True) -> "ChatContext":
+        """ Creates a new branch that shares the messages up to and including `turn` with this context.
+
+            The messages themselves are not copied, both contexts reference the same `SingleChatContent` objects
+            and only diverge from `turn` on. KV checkpoints rely on that identity to find their shared prefix.
+
+            Args:
+                turn (int): The last turn the branch keeps, 0 keeps only the system prompt.
+                session_id (str): The session id of the new branch.
+                persist (bool): Whether to copy the kept turns in the conversation store (if any). Default is True.
+
+            Returns:
+                ChatContext: The new branch.
+
+            Raises:
+                ValueError: If `turn` is not loaded in this context.
+        """
+        index: int = self._index(turn)
+
+        branch = ChatContext(session_id, self.__store)
+        branch.contexts     = self.contexts[:index + 1]
+        branch.turn_offset  = self.turn_offset if turn else 0 # the store keeps no turns of a branch at 0
+        branch.total_images = sum(len(context.image_refs) for context in branch.contexts)
+        branch.window_start = min(self.window_start, len(branch.contexts)) # shares the checkpointed prompt
+
+        if persist and self.__store is not None:
+            self.__store.fork(self.session_id, session_id, turn)
+
+        logger.debug(f"Forked session {self.session_id} at turn {turn} into {session_id}.")
+        return branch
+    # end                                                                                                         fork #
+
+    def rewind(self, turn: int, persist: bool = True) -> None:
+        """ Drops every turn after `turn`, e.g. to edit a question or regenerate an answer.
+
+            The message list is replaced rather than truncated in place, branches forked from this context keep
+            their messages.
+
+            Args:
+                turn (int): The last turn to keep, 0 keeps only the system prompt.
+                persist (bool): Whether to delete the dropped turns from the conversation store (if any).
+
+            Raises:
+                ValueError: If `turn` is not loaded in this context.
+        """
+        index: int = self._index(turn)
+
+        self.contexts     = self.contexts[:index + 1]
+        self.turn_offset  = self.turn_offset if turn else 0 # the store is truncated to no turns at 0
+        self.total_images = sum(len(context.image_refs) for context in self.contexts)
+        self.window_start = min(self.window_start, len(self.contexts)) # the prompt of `turn` is what it was
+
+        if persist and self.__store is not None:
+            self.__store.truncate(self.session_id, turn)
+
+        logger.debug(f"Rewound session {self.session_id} to turn {turn}.")
+    # end                                                                                                       rewind #
+
+    def compact(self, keep_turns: int, captions: "CaptionCache") -> int:
+        """ Replaces the images of every turn older than the last `keep_turns` with their cached captions.
+
+            Each image then costs a sentence instead of a full patch grid of prompt tokens and no longer counts
+            against `Config.max_images`. Captions are generated in the background, an image without one is kept
+            until a later turn. Only the prompt changes, the conversation store keeps the original images.
+
+            Args:
+                keep_turns (int): How many of the most recent turns keep their images.
+                captions (CaptionCache): Where the captions are looked up (and requested).
+
+            Returns:
+                int: The number of images that were replaced.
+        """
+        replaced: int = 0
+
+        for index in range(1, max(1, len(self.contexts) - keep_turns)):
+            if (compacted := self.contexts[index].compacted(captions)) is None:
+                continue
+
+            replaced += len(self.contexts[index].image_refs) - len(compacted.image_refs)
+            self.contexts[index] = compacted # the list is this context's own, branches keep the original
+
+        if replaced:
+            self.total_images -= replaced
+            logger.debug(f"Compacted {replaced} images of session {self.session_id} into captions.")
+
+        return replaced
+    # end                                                                                                      compact #
+
+    @property
+    def turn(self) -> int:
+        """ The number of the latest turn, as persisted in the conversation store. """
+        return self.turn_offset + len(self.contexts) - 1
+    # end                                                                                                         turn #
+
+    def _index(self, turn: int) -> int:
+        if turn == 0:
+            return 0
+
+        if not self.turn_offset < turn <= self.turn:
+            raise ValueError(f"turn {turn} is not loaded, session {self.session_id} holds turns "
+                             f"{self.turn_offset + 1} to {self.turn}")
+
+        return turn - self.turn_offset
+    # end                                                                                                       _index #
 
     def save_context(self, filepath: str = "context.json") -> None:
         """ Saves the current chat context to a file.
@@ -271,9 +740,8 @@ class ChatContext:
                 filepath (str): The path to the file where the context will be saved. Default is 'context.json'.
         """
         with open(filepath, "w") as file:
-            json.dump(self.get_context(), file, indent=4)
+            json.dump(self.get_context(inline=True), file, indent=4)
         logger.info(f"Context saved to {filepath}")
-        # FIXME: modify to use a database
     # end                                                                                                 save_context #
 
     def load_context(self, filepath: str = "context.json") -> None:
@@ -285,7 +753,6 @@ class ChatContext:
         with open(filepath, "r") as file:
             self.contexts = [SingleChatContent(context["role"], context["content"]) for context in json.load(file)]
         logger.info(f"Context loaded from {filepath}")
-        # FIXME: modify to use a database
     # end                                                                                                 load_context #
 
     def __repr__(self) -> str:
@@ -294,18 +761,10 @@ class ChatContext:
             Returns:
                 str: The string representation of the chat context with image URLs replaced by their byte size.
         """
-        modified_content: str = "\n" + json.dumps(self.get_context(), indent=4) + "\n"
-
-        # remove the image urls from the string and replace them with how many bytes the base64 is
-        for content in self.get_context():
-            if isinstance(content, list):
-                for chat in content["content"]:
-                    if chat["type"] == "image_url":  # type:ignore
-                        base64 = chat["image_url"]["url"]  # type:ignore
-                        modified_content = modified_content.replace(
-                            base64,
-                            f"data:image/png;base64,{str(len(bytes(base64.split(',')[1], 'utf-8')))}bytes",
-                        )
+        # images are replaced by their size per message, the full context is never serialized or copied
+        modified_content: str = (
+            "\n" + json.dumps([context.get_redacted_content() for context in self.contexts], indent=4) + "\n"
+        )
 
         logger.debug("Generated string representation of the chat context.")
         return modified_content
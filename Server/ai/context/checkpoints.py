@@ -0,0 +1,232 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import sys
+import time
+import threading
+
+from typing import Any, Optional
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.context.chat_context import SingleChatContent
+from Server.ai.utils.metrics        import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# --------------------------------------------------- checkpoints ---------------------------------------------------- #
+
+def state_size(state: Any) -> int:
+    """ the size of a llama kv state in bytes, `LlamaState` reports it, anything else is estimated """
+    return int(getattr(state, "llama_state_size", 0) or sys.getsizeof(state)) #                                 return #
+# end                                                                                                   state_size #
+
+class Checkpoint:
+    """ Checkpoint
+        Checkpoint - a kv state captured at a turn boundary together with the messages it was prefilled from.
+                     the messages are the very `SingleChatContent` objects of the context, forks share them, so
+                     identity tells how much of a checkpoint is still valid for a (rewound or forked) context
+    """
+
+    __slots__ = ("model", "messages", "state", "size", "last_used")
+
+    def __init__(self, model: str, messages: tuple[SingleChatContent, ...], state: Any) -> None:
+        self.model:     str                             = model
+        self.messages:  tuple[SingleChatContent, ...]   = messages
+        self.state:     Any                             = state
+        self.size:      int                             = state_size(state)
+        self.last_used: float                           = time.monotonic()
+    # end                                                                                                     __init__ #
+
+    @property
+    def turn(self) -> int:
+        return len(self.messages) - 1 #                                                                         return #
+    # end                                                                                                         turn #
+
+    def shared_prefix(self, messages: list[SingleChatContent]) -> int:
+        """ how many leading messages this checkpoint has in common with `messages` """
+        shared: int = 0
+
+        for own, other in zip(self.messages, messages):
+            if own is not other:
+                break
+            shared += 1
+
+        return shared #                                                                                         return #
+    # end                                                                                                shared_prefix #
+# end                                                                                                       Checkpoint #
+
+class CheckpointStore:
+    """ CheckpointStore
+        CheckpointStore - kv states taken at turn boundaries, so rewinding a session or forking it at turn K only
+                          prefills the edited turn instead of the whole history
+
+        a checkpoint holds the prefix of every turn it was prefilled from, llama.cpp keeps the longest common token
+        prefix after `load_state`, so any checkpoint that shares the first K turns with a context is as good as one
+        taken exactly at K. forks reference the checkpoints of their parent, nothing is copied
+
+        memory is bounded by `budget_bytes`. when it is exceeded checkpoints are evicted least recently used first,
+        except that every session keeps its latest checkpoint and those `2**n` turns before it (1, 2, 4, 8, ...)
+        for as long as possible, recent turns are rewound far more often than old ones
+
+        ```python
+        >>> checkpoints = CheckpointStore(512 * 1024 * 1024)
+        >>> checkpoints.put("student-42", "llama-3-8b-v", context.contexts, llama.save_state())
+        >>> checkpoints.best("student-42", "llama-3-8b-v", context.contexts)
+        (<llama_cpp.llama.LlamaState object at 0x...>, 7)
+        ```
+
+        Args:
+            budget_bytes (int): the most memory all checkpoints together may use, 0 disables checkpoints
+    """
+
+    def __init__(self, budget_bytes: int) -> None:
+        self.__budget:   int                          = budget_bytes
+        self.__lock:     threading.Lock               = threading.Lock()
+        self.__sessions: dict[str, list[Checkpoint]]  = {} # session -> checkpoints oldest first, shared by forks
+    # end                                                                                                     __init__ #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def put(self, session_id: str, model: str, messages: list[SingleChatContent], state: Any) -> bool:
+        """ CheckpointStore.put
+            put - records the kv state of `model` after it prefilled and generated `messages`
+
+            Returns:
+                bool: False if checkpoints are disabled or the state alone is larger than the budget
+        """
+        if not self.enabled:
+            return False #                                                                                      return #
+
+        checkpoint: Checkpoint = Checkpoint(model, tuple(messages), state)
+
+        if checkpoint.size > self.__budget:
+            logger.warning(f"kv checkpoint of {checkpoint.size} bytes exceeds the budget of {self.__budget} bytes")
+            return False #                                                                                      return #
+
+        with self.__lock:
+            # a checkpoint at the same turn of the same branch is superseded
+            self.__sessions[session_id] = [
+                existing for existing in self.__sessions.get(session_id, [])
+                if not (existing.model == model and existing.turn == checkpoint.turn
+                        and existing.shared_prefix(messages) == len(messages))
+            ] + [checkpoint]
+            self._evict()
+
+        Metrics.increment("checkpoints.taken", model=model)
+        return True #                                                                                           return #
+    # end                                                                                                          put #
+
+    def best(self, session_id: str, model: str, messages: list[SingleChatContent]) -> tuple[Optional[Any], int]:
+        """ CheckpointStore.best
+            best - finds the checkpoint sharing the most leading turns with `messages`
+
+            Returns:
+                tuple[Optional[Any], int]: the kv state (None if no checkpoint shares more than the system prompt)
+                                           and the number of turns that do not have to be prefilled again
+        """
+        with self.__lock:
+            best:   Optional[Checkpoint] = None
+            shared: int                  = 1 # the system prompt alone is reused by llama.cpp anyway
+
+            for checkpoint in self.__sessions.get(session_id, []):
+                if checkpoint.model != model:
+                    continue
+
+                prefix: int = checkpoint.shared_prefix(messages)
+
+                # on a tie the shorter checkpoint wins, it was taken closer to where the context diverges
+                if prefix > shared or (best is not None and prefix == shared and checkpoint.turn < best.turn):
+                    best, shared = checkpoint, prefix
+
+            if best is None:
+                Metrics.increment("checkpoints.miss", model=model)
+                return None, 0 #                                                                                return #
+
+            best.last_used = time.monotonic()
+
+        Metrics.increment("checkpoints.hit", model=model)
+        return best.state, shared - 1 #                                                                         return #
+    # end                                                                                                         best #
+
+    def fork(self, parent_id: str, child_id: str) -> None:
+        """ lets `child_id` use every checkpoint of `parent_id`, the states themselves are shared """
+        with self.__lock:
+            self.__sessions[child_id] = list(self.__sessions.get(parent_id, []))
+    # end                                                                                                         fork #
+
+    def drop(self, session_id: str) -> None:
+        with self.__lock:
+            self.__sessions.pop(session_id, None)
+    # end                                                                                                         drop #
+
+    # -------------------------------------------------- properties -------------------------------------------------- #
+
+    @property
+    def enabled(self) -> bool:
+        return self.__budget > 0 #                                                                              return #
+    # end                                                                                                      enabled #
+
+    @property
+    def used_bytes(self) -> int:
+        with self.__lock:
+            return sum(checkpoint.size for checkpoint in self._unique()) #                                      return #
+    # end                                                                                                   used_bytes #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _unique(self) -> list[Checkpoint]:
+        return list({
+            id(checkpoint): checkpoint for checkpoints in self.__sessions.values() for checkpoint in checkpoints
+        }.values()) #                                                                                           return #
+    # end                                                                                                      _unique #
+
+    def _kept(self) -> set[int]:
+        """ ids of the checkpoints the retention policy would like to keep, per session the latest one and those
+            a power of two turns before it
+        """
+        kept: set[int] = set()
+
+        for checkpoints in self.__sessions.values():
+            if not checkpoints:
+                continue
+
+            head: int = checkpoints[-1].turn
+            kept.update(
+                id(checkpoint) for checkpoint in checkpoints
+                if (distance := head - checkpoint.turn) == 0 or (distance > 0 and distance & (distance - 1) == 0)
+            )
+
+        return kept #                                                                                           return #
+    # end                                                                                                        _kept #
+
+    def _evict(self) -> None:
+        """ evicts until the unique checkpoints fit the budget, the caller holds the lock """
+        checkpoints: list[Checkpoint] = self._unique()
+        used:        int              = sum(checkpoint.size for checkpoint in checkpoints)
+
+        if used <= self.__budget:
+            Metrics.set_gauge("checkpoints.bytes", used)
+            return #                                                                                            return #
+
+        kept: set[int] = self._kept()
+
+        # outside of the retention policy first, least recently used first within each group
+        for victim in sorted(checkpoints, key=lambda checkpoint: (id(checkpoint) in kept, checkpoint.last_used)):
+            if used <= self.__budget:
+                break
+
+            for session_id in self.__sessions:
+                self.__sessions[session_id] = [
+                    checkpoint for checkpoint in self.__sessions[session_id] if checkpoint is not victim
+                ]
+
+            used -= victim.size
+            Metrics.increment("checkpoints.evicted", model=victim.model)
+
+        Metrics.set_gauge("checkpoints.bytes", used)
+    # end                                                                                                       _evict #
+# end                                                                                                  CheckpointStore #
@@ -0,0 +1,202 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import os
+import json
+import time
+import queue
+import threading
+
+from pathlib import Path
+from typing  import Callable, Optional
+
+from Server.config.read_config import Config
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.utils.metrics import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- compaction ---------------------------------------------------- #
+
+CAPTION_PROMPT: str = "Describe this image in one short sentence so it can be referred to later."
+
+# (sha256) -> caption, or None if the captioner is busy and the image should be retried later
+Captioner = Callable[[str], Optional[str]]
+
+class CaptionCache:
+    """ CaptionCache
+        CaptionCache - short captions of context images, memoized by the image's sha256 and generated once on a
+                       background thread, so compacting an old image into its caption never waits on the model
+
+        `get` never blocks, an unknown image is queued and the caption is available on a later turn. the captions
+        are written to a json sidecar so a restart does not caption the same slides again
+
+        ```python
+        >>> captions = CaptionCache.shared()
+        >>> captions.set_captioner(model.caption)           # registered once a vision model is ready
+        >>> captions.get("9f86d0...")                        # queued, not captioned yet
+        >>> captions.get("9f86d0...")                        # a few seconds later
+        'A slide showing the structure of a mitochondrion.'
+        ```
+
+        Args:
+            path (Optional[Path]): the json sidecar, None keeps captions in memory only
+            retry_interval (float): seconds to wait before retrying when the captioner is busy or missing, doubled
+                                    on every consecutive retry up to `max_retry_interval`
+            max_retry_interval (float): the longest wait between retries
+            max_failures (int): how often captioning an image may raise before it is given up on
+    """
+
+    _instance: Optional["CaptionCache"] = None
+    _instance_lock: threading.Lock       = threading.Lock()
+
+    def __init__(self, path: Optional[Path] = None, retry_interval: float = 1.0, max_retry_interval: float = 30.0,
+                 max_failures: int = 3) -> None:
+        self.__path:      Optional[Path]       = path
+        self.__retry:     float                = retry_interval
+        self.__max_retry: float                = max_retry_interval
+        self.__max_fails: int                  = max_failures
+        self.__failures:  dict[str, int]       = {}
+        self.__lock:      threading.Lock       = threading.Lock()
+        self.__ready:     threading.Condition  = threading.Condition(self.__lock)
+        self.__captions:  dict[str, str]       = {}
+        self.__pending:   set[str]             = set()
+        self.__queue:     queue.Queue[str]     = queue.Queue()
+        self.__captioner: Optional[Captioner]  = None
+
+        if path is not None and path.exists():
+            try:
+                with open(path, "r") as file:
+                    self.__captions = json.load(file)
+            except (OSError, ValueError) as e:
+                logger.warning(f"ignoring unreadable caption cache {path}: {e}")
+
+        self.__worker: threading.Thread = threading.Thread(target=self._work, daemon=True, name="caption_thread")
+        self.__worker.start()
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def shared(cls) -> "CaptionCache":
+        """ the process wide caption cache, created from `Config` on first use """
+        with cls._instance_lock:
+            if cls._instance is None:
+                path: Path = Path(Config.images_captions_path)
+                cls._instance = cls(path if path.is_absolute() else Path(os.getcwd(), path))
+
+            return cls._instance #                                                                              return #
+    # end                                                                                                       shared #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def get(self, digest: str) -> Optional[str]:
+        """ the caption of an image, None (and queued for captioning) if it was not generated yet """
+        with self.__lock:
+            if (caption := self.__captions.get(digest)) is not None:
+                Metrics.increment("captions.hit")
+                return caption #                                                                                return #
+
+            if digest not in self.__pending and self.__failures.get(digest, 0) < self.__max_fails:
+                self.__pending.add(digest)
+                self.__queue.put(digest)
+
+        Metrics.increment("captions.miss")
+        return None #                                                                                           return #
+    # end                                                                                                          get #
+
+    def wait(self, digest: str, timeout: Optional[float] = None) -> Optional[str]:
+        """ like `get` but blocks until the caption exists, None if it did not within `timeout` seconds """
+        if (caption := self.get(digest)) is not None:
+            return caption #                                                                                    return #
+
+        with self.__ready:
+            self.__ready.wait_for(lambda: digest in self.__captions, timeout)
+            return self.__captions.get(digest) #                                                                return #
+    # end                                                                                                         wait #
+
+    def set_captioner(self, captioner: Optional[Captioner]) -> None:
+        with self.__lock:
+            self.__captioner = captioner
+    # end                                                                                                set_captioner #
+
+    def clear_captioner(self, captioner: Captioner) -> None:
+        """ unregisters `captioner` if it is the current one, e.g. when its model is unloaded """
+        with self.__lock:
+            if self.__captioner == captioner:
+                self.__captioner = None
+    # end                                                                                              clear_captioner #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _work(self) -> None:
+        retries: int = 0 # consecutive retries because the captioner was busy or missing
+
+        while True:
+            digest: str = self.__queue.get()
+
+            with self.__lock:
+                captioner: Optional[Captioner] = self.__captioner
+
+            caption: Optional[str] = None
+            start:   float         = time.perf_counter()
+
+            if captioner is not None:
+                try:
+                    caption = captioner(digest)
+                except KeyError: # the image was released before its turn came
+                    with self.__lock:
+                        self.__pending.discard(digest)
+                    continue
+                except Exception as e:
+                    Metrics.increment("captions.errors")
+
+                    with self.__lock:
+                        self.__failures[digest] = failures = self.__failures.get(digest, 0) + 1
+
+                        if failures >= self.__max_fails: # uncaptionable, the image is kept as it is
+                            logger.error(f"captioning image {digest} failed {failures} times, giving up: {e}")
+                            self.__pending.discard(digest)
+                            continue
+
+                    logger.warning(f"captioning image {digest} failed: {e}")
+                    self.__queue.put(digest)
+                    continue
+
+            if caption is None: # no captioner yet or it is serving a request, try again later
+                time.sleep(min(self.__retry * 2 ** retries, self.__max_retry))
+                retries = min(retries + 1, 16) # keeps 2 ** retries a small number
+                self.__queue.put(digest)
+                continue
+
+            retries = 0
+
+            Metrics.observe("captions.generate_seconds", time.perf_counter() - start)
+
+            with self.__lock:
+                self.__captions[digest] = caption.strip()
+                self.__pending.discard(digest)
+                self.__failures.pop(digest, None)
+                self._save()
+                self.__ready.notify_all()
+    # end                                                                                                        _work #
+
+    def _save(self) -> None:
+        """ writes the sidecar atomically, the caller holds the lock """
+        if self.__path is None:
+            return #                                                                                            return #
+
+        temp_path: Path = self.__path.with_suffix(".tmp")
+
+        try:
+            self.__path.parent.mkdir(parents=True, exist_ok=True)
+            with open(temp_path, "w") as file:
+                json.dump(self.__captions, file)
+            os.replace(temp_path, self.__path)
+        except OSError as e:
+            logger.warning(f"failed to persist caption cache {self.__path}: {e}")
+    # end                                                                                                        _save #
+# end                                                                                                     CaptionCache #
@@ -0,0 +1,190 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import time
+import weakref
+import threading
+
+from typing import Optional
+
+import numpy as np
+
+from Server.config.read_config import Config
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.context.chat_context import ChatContext, SingleChatContent
+from Server.ai.core.embeddings      import Embedder
+from Server.ai.utils.metrics        import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ----------------------------------------------------- history ------------------------------------------------------ #
+
+def turn_text(single: SingleChatContent) -> str:
+    """ the text of a turn as the model reads it, image captions included and image tags left out """
+    if isinstance(single.content, str):
+        return single.content #                                                                                 return #
+
+    return "\n".join(
+        str(part["text"]) for part in single.content
+        if part["type"] == "text" and not str(part["text"]).startswith("tag=")
+    ) #                                                                                                         return #
+# end                                                                                                    turn_text #
+
+class TurnIndex:
+    """ TurnIndex
+        TurnIndex - the embeddings of one session's turns as rows of a float32 matrix, aligned with
+                    `ChatContext.contexts` and grown by doubling so appending a turn never copies the whole matrix
+    """
+
+    def __init__(self) -> None:
+        self.messages: list[SingleChatContent] = []
+        self.tokens:   list[int]               = []
+        self.matrix:   Optional[np.ndarray]    = None
+    # end                                                                                                     __init__ #
+
+    def sync(self, messages: list[SingleChatContent], vectors: np.ndarray, tokens: list[int], start: int) -> None:
+        """ replaces every row from `start` on with `vectors`, rows before it belong to unchanged messages """
+        rows: int = start + len(vectors)
+
+        if self.matrix is None or self.matrix.shape[0] < rows or self.matrix.shape[1] != vectors.shape[1]:
+            grown: np.ndarray = np.zeros((max(16, 2 * rows), vectors.shape[1]), dtype=np.float32)
+            if self.matrix is not None and self.matrix.shape[1] == vectors.shape[1]:
+                grown[:start] = self.matrix[:start]
+            self.matrix = grown
+
+        self.matrix[start:rows] = vectors
+        self.messages           = list(messages)
+        self.tokens             = self.tokens[:start] + tokens
+    # end                                                                                                         sync #
+
+    def common_prefix(self, messages: list[SingleChatContent]) -> int:
+        shared: int = 0
+
+        for own, other in zip(self.messages, messages):
+            if own is not other:
+                break
+            shared += 1
+
+        return shared #                                                                                         return #
+    # end                                                                                                common_prefix #
+# end                                                                                                        TurnIndex #
+
+class HistorySelector:
+    """ HistorySelector
+        HistorySelector - picks the turns of a long session that a new question actually needs: the system prompt,
+                          the last `recent_turns` turns and the `similar_turns` older turns whose embeddings are the
+                          most similar to the question, in their original order. a selected question brings its
+                          answer along (and the other way round) so the model never sees half an exchange
+
+        every turn is embedded once, vectors are cached per message (branches share them) and kept in a numpy
+        matrix per session, so a selection is one batched embed of the new turns and one matrix-vector product
+
+        ```python
+        >>> selector = HistorySelector.shared()
+        >>> indices = selector.select(context)   # None when every turn fits anyway
+        >>> messages = context.get_context(indices=indices)
+        ```
+
+        Args:
+            embedder (Embedder): embeds the turns
+            recent_turns (int): how many of the latest turns are always sent
+            similar_turns (int): how many older turns are picked by similarity
+    """
+
+    _instance: Optional["HistorySelector"] = None
+    _instance_lock: threading.Lock          = threading.Lock()
+
+    def __init__(self, embedder: Embedder, recent_turns: int = 6, similar_turns: int = 6) -> None:
+        self.__embedder: Embedder       = embedder
+        self.__recent:   int            = recent_turns
+        self.__similar:  int            = similar_turns
+        self.__lock:     threading.Lock = threading.Lock()
+
+        # both die with their context / message, branches share messages and so share their vectors
+        self.__indexes: weakref.WeakKeyDictionary[ChatContext, TurnIndex] = weakref.WeakKeyDictionary()
+        self.__vectors: weakref.WeakKeyDictionary[SingleChatContent, tuple[np.ndarray, int]] = (
+            weakref.WeakKeyDictionary()
+        )
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def shared(cls) -> "HistorySelector":
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(Embedder.shared(), Config.history_recent_turns, Config.history_similar_turns)
+
+            return cls._instance #                                                                              return #
+    # end                                                                                                       shared #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def select(self, context: ChatContext) -> Optional[list[int]]:
+        """ HistorySelector.select
+            select - chooses the turns to send for the question that was just appended to `context`
+
+            Returns:
+                Optional[list[int]]: indices into `context.contexts` in order, None if every turn is sent
+        """
+        messages: list[SingleChatContent] = list(context.contexts)
+        older:    int                     = len(messages) - 1 - self.__recent # turns 1..older are candidates
+
+        if older <= self.__similar:
+            return None #                                                                                       return #
+
+        start: float = time.perf_counter()
+
+        with self.__lock:
+            index: TurnIndex = self._index(context, messages)
+
+            scores: np.ndarray = index.matrix[1:older + 1] @ index.matrix[len(messages) - 1]     # type:ignore
+            best:   np.ndarray = (
+                np.argpartition(-scores, self.__similar - 1)[:self.__similar] + 1
+                if self.__similar > 0 else np.zeros(0, dtype=np.int64)
+            )
+
+            selected: set[int] = {0, *range(older + 1, len(messages))}
+            for turn in best.tolist():
+                selected.add(turn)
+
+                # keep question and answer together
+                partner: int = turn + 1 if messages[turn].role == "user" else turn - 1
+                if 1 <= partner <= older and messages[partner].role != messages[turn].role:
+                    selected.add(partner)
+
+            indices:       list[int] = sorted(selected)
+            saved_tokens:  int       = sum(tokens for turn, tokens in enumerate(index.tokens) if turn not in selected)
+
+        Metrics.observe("history.selection_seconds", time.perf_counter() - start)
+        Metrics.increment("history.prefill_tokens_saved", saved_tokens)
+        Metrics.increment("history.turns_dropped", len(messages) - len(indices))
+        logger.debug(f"history selection for {context.session_id}: {len(indices)} of {len(messages)} turns, "
+                     f"~{saved_tokens} prompt tokens saved")
+
+        return indices #                                                                                        return #
+    # end                                                                                                       select #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _index(self, context: ChatContext, messages: list[SingleChatContent]) -> TurnIndex:
+        """ brings the session's matrix up to date, only turns never embedded before reach the model """
+        index:  TurnIndex = self.__indexes.setdefault(context, TurnIndex())
+        shared: int       = index.common_prefix(messages)
+
+        missing: list[SingleChatContent] = [single for single in messages[shared:] if single not in self.__vectors]
+        if missing:
+            vectors, tokens = self.__embedder.embed([turn_text(single) for single in missing])
+            for single, vector, count in zip(missing, vectors, tokens):
+                self.__vectors[single] = (vector, count)
+
+        if shared < len(messages) or index.matrix is None:
+            rows: list[tuple[np.ndarray, int]] = [self.__vectors[single] for single in messages[shared:]]
+            index.sync(messages, np.vstack([vector for vector, _ in rows]), [count for _, count in rows], shared)
+
+        return index #                                                                                          return #
+    # end                                                                                                       _index #
+# end                                                                                                  HistorySelector #
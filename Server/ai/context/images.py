@@ -0,0 +1,278 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import os
+import mmap
+import base64
+import hashlib
+import threading
+
+from collections import OrderedDict
+from pathlib     import Path
+from typing      import Any, Optional, Union
+
+from Server.config.read_config import Config
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.utils.metrics import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ----------------------------------------------------- images ------------------------------------------------------- #
+
+DATA_URI_PREFIX:  str = "data:image/png;base64,"
+IMAGE_REF_PREFIX: str = "voxai-image:sha256:" # what a context message stores in place of the image url
+
+def is_image_ref(url: str) -> bool:
+    return url.startswith(IMAGE_REF_PREFIX) #                                                                   return #
+# end                                                                                                 is_image_ref #
+
+def image_ref(digest: str) -> str:
+    return IMAGE_REF_PREFIX + digest #                                                                          return #
+# end                                                                                                    image_ref #
+
+def ref_digest(url: str) -> str:
+    return url[len(IMAGE_REF_PREFIX):] #                                                                        return #
+# end                                                                                                   ref_digest #
+
+class _Image:
+    __slots__ = ("size", "refs", "data_uri", "path", "mapping")
+
+    def __init__(self, size: int, data_uri: str) -> None:
+        self.size:     int                   = size
+        self.refs:     int                   = 0
+        self.data_uri: Optional[str]         = data_uri # resident in RAM
+        self.path:     Optional[Path]        = None     # spilled to disk
+        self.mapping:  Optional[mmap.mmap]   = None
+    # end                                                                                                     __init__ #
+# end                                                                                                           _Image #
+
+class ImageStore:
+    """ ImageStore
+        ImageStore - a process wide, content addressed store for the images of every chat context. an image is
+                     kept once per sha256 of its decoded bytes no matter how many messages, sessions or branches
+                     reference it, messages only hold a `voxai-image:sha256:<hex>` reference
+
+        images stay in RAM (as the data uri the chat handler expects) until `ram_budget_bytes` is exceeded, then
+        the least recently used ones are written to `directory` and memory mapped. references are only turned
+        back into urls when a chat handler needs the pixels (`url`), spilled images are handed over as `file://`
+        urls so they are read from the page cache instead of being base64 encoded again
+
+        every reference is counted, `SingleChatContent` acquires one per image it holds and releases it when it
+        is garbage collected, an image is dropped (and its file deleted) once nothing references it anymore
+
+        ```python
+        >>> images = ImageStore.shared()
+        >>> digest = images.intern("data:image/png;base64,iVBOR...")    # refcount 1
+        >>> images.intern("data:image/png;base64,iVBOR...") == digest   # same slide, refcount 2, stored once
+        True
+        >>> images.url(digest)
+        'data:image/png;base64,iVBOR...'
+        ```
+
+        Args:
+            ram_budget_bytes (int): decoded bytes kept in RAM before images are spilled to disk
+            directory (Optional[Path]): where spilled images are written, None keeps everything in RAM
+    """
+
+    _instance: Optional["ImageStore"] = None
+    _instance_lock: threading.Lock     = threading.Lock()
+
+    def __init__(self, ram_budget_bytes: int = 256 * 1024 * 1024, directory: Optional[Path] = None) -> None:
+        self.__budget:    int                            = ram_budget_bytes
+        self.__directory: Optional[Path]                 = directory
+        self.__lock:      threading.Lock                 = threading.Lock()
+        self.__images:    OrderedDict[str, _Image]       = OrderedDict() # least recently used first
+        self.__ram_bytes: int                            = 0
+
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+
+            # nothing references the files of a previous run
+            for path in directory.glob("*.png"):
+                path.unlink(missing_ok=True)
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def shared(cls) -> "ImageStore":
+        """ the process wide image store, created from `Config` on first use """
+        with cls._instance_lock:
+            if cls._instance is None:
+                directory: Path = Path(Config.images_dir)
+                cls._instance = cls(
+                    int(Config.images_ram_budget_mb * 1024 * 1024),
+                    directory if directory.is_absolute() else Path(os.getcwd(), directory),
+                )
+
+            return cls._instance #                                                                              return #
+    # end                                                                                                       shared #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def intern(self, image: Union[str, bytes]) -> str:
+        """ ImageStore.intern
+            intern - adds a reference to an image, decoding and storing it only if it is not known yet
+
+            Args:
+                image (str | bytes): a `data:image/png;base64,...` uri or the decoded bytes
+
+            Returns:
+                str: the sha256 of the decoded image, pass it to `release` when the reference is dropped
+        """
+        data:   bytes = image if isinstance(image, bytes) else base64.b64decode(image.removeprefix(DATA_URI_PREFIX))
+        digest: str   = hashlib.sha256(data).hexdigest()
+
+        with self.__lock:
+            entry: Optional[_Image] = self.__images.get(digest)
+
+            if entry is None:
+                data_uri: str = image if isinstance(image, str) else DATA_URI_PREFIX + base64.b64encode(data).decode()
+                entry = self.__images[digest] = _Image(len(data), data_uri)
+                self.__ram_bytes += entry.size
+                Metrics.increment("images.stored")
+                self._spill()
+            else:
+                Metrics.increment("images.deduplicated")
+
+            entry.refs += 1
+            self.__images.move_to_end(digest)
+            self._report()
+
+        return digest #                                                                                         return #
+    # end                                                                                                       intern #
+
+    def acquire(self, digest: str) -> bool:
+        """ adds a reference to a stored image, False if it is unknown """
+        with self.__lock:
+            if (entry := self.__images.get(digest)) is None:
+                return False #                                                                                  return #
+
+            entry.refs += 1
+            return True #                                                                                       return #
+    # end                                                                                                      acquire #
+
+    def release(self, digest: str) -> None:
+        """ drops a reference, the image is deleted when it was the last one """
+        with self.__lock:
+            if (entry := self.__images.get(digest)) is None:
+                return #                                                                                        return #
+
+            entry.refs -= 1
+            if entry.refs > 0:
+                return #                                                                                        return #
+
+            del self.__images[digest]
+
+            if entry.data_uri is not None:
+                self.__ram_bytes -= entry.size
+
+            self._close(entry)
+            self._report()
+    # end                                                                                                      release #
+
+    def url(self, digest: str, inline: bool = False) -> str:
+        """ ImageStore.url
+            url - materializes a reference for the chat handler, a data uri for images in RAM and a `file://` url
+                  for spilled ones
+
+            Args:
+                digest (str): the sha256 returned by `intern`
+                inline (bool): always return a data uri, e.g. for anything written out of the process
+
+            Raises:
+                KeyError: if the image is not stored (anymore)
+        """
+        with self.__lock:
+            entry: _Image = self.__images[digest]
+            self.__images.move_to_end(digest)
+
+            if entry.data_uri is not None:
+                return entry.data_uri #                                                                         return #
+
+            if not inline:
+                return entry.path.as_uri() #                                                    type:ignore # return #
+
+            return DATA_URI_PREFIX + base64.b64encode(entry.mapping).decode() #                 type:ignore # return #
+    # end                                                                                                          url #
+
+    def data(self, digest: str) -> bytes:
+        """ the decoded bytes of an image, read straight from the mapping for spilled ones """
+        with self.__lock:
+            entry: _Image = self.__images[digest]
+
+            if entry.data_uri is not None:
+                return base64.b64decode(entry.data_uri.removeprefix(DATA_URI_PREFIX)) #                         return #
+
+            return bytes(entry.mapping) #                                                       type:ignore # return #
+    # end                                                                                                         data #
+
+    def size(self, digest: str) -> int:
+        with self.__lock:
+            entry: Optional[_Image] = self.__images.get(digest)
+            return entry.size if entry is not None else 0 #                                                     return #
+    # end                                                                                                         size #
+
+    def stats(self) -> dict[str, Any]:
+        with self.__lock:
+            return {
+                "images":       len(self.__images),
+                "references":   sum(entry.refs for entry in self.__images.values()),
+                "ram_bytes":    self.__ram_bytes,
+                "disk_bytes":   sum(entry.size for entry in self.__images.values() if entry.data_uri is None),
+            } #                                                                                                 return #
+    # end                                                                                                        stats #
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self.__images
+    # end                                                                                                 __contains__ #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _spill(self) -> None:
+        """ writes the least recently used RAM images to disk until the budget is met, the caller holds the lock """
+        if self.__directory is None:
+            return #                                                                                            return #
+
+        for digest, entry in self.__images.items():
+            if self.__ram_bytes <= self.__budget:
+                break
+
+            if entry.data_uri is None:
+                continue
+
+            path: Path = self.__directory / f"{digest}.png"
+
+            try:
+                with open(path, "wb") as file:
+                    file.write(base64.b64decode(entry.data_uri.removeprefix(DATA_URI_PREFIX)))
+
+                with open(path, "rb") as file:
+                    entry.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                logger.warning(f"failed to spill image {digest} to disk: {e}")
+                path.unlink(missing_ok=True)
+                continue
+
+            entry.path        = path
+            entry.data_uri    = None
+            self.__ram_bytes -= entry.size
+            Metrics.increment("images.spilled")
+    # end                                                                                                       _spill #
+
+    def _close(self, entry: _Image) -> None:
+        if entry.mapping is not None:
+            entry.mapping.close()
+
+        if entry.path is not None:
+            entry.path.unlink(missing_ok=True)
+    # end                                                                                                       _close #
+
+    def _report(self) -> None:
+        Metrics.set_gauge("images.count", len(self.__images))
+        Metrics.set_gauge("images.ram_bytes", self.__ram_bytes)
+    # end                                                                                                      _report #
+# end                                                                                                       ImageStore #
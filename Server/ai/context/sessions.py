@@ -0,0 +1,570 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import os
+import json
+import time
+import zlib
+import pickle
+import hashlib
+import threading
+import uuid
+
+from contextlib import contextmanager
+from pathlib    import Path
+from typing     import TYPE_CHECKING, Any, Iterator, Optional
+
+from Server.config.read_config import Config
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.context.chat_context import ChatContext
+from Server.ai.context.checkpoints  import CheckpointStore
+from Server.ai.core.errors          import SessionBusyError
+from Server.ai.utils.metrics        import Metrics
+
+if TYPE_CHECKING: # Server.database.access imports Server.ai (metrics), importing it here would be circular
+    from Server.database.access import ConversationStore
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- sessions ------------------------------------------------------ #
+
+DEFAULT_SESSION_ID: str = "default"
+
+HOT:  str = "hot"  # context and kv states in memory
+WARM: str = "warm" # context and kv states compressed on disk
+COLD: str = "cold" # text history only
+NEW:  str = "new"  # nothing saved, first turn or kv state never captured
+
+def _resolve(path: str) -> Path:
+    return Path(path) if os.path.isabs(path) else Path(os.getcwd(), path) #                                     return #
+# end                                                                                                     _resolve #
+
+class SessionManager:
+    """ SessionManager
+        SessionManager - maps session ids to their `ChatContext` and the llama kv states captured for them, shared
+                         by every model so a session keeps its history when a request is routed elsewhere
+
+        sessions move through three tiers:
+            - hot:  the context and any kv states are in memory, restoring is a `load_state` memcpy
+            - warm: after `warm_after` idle seconds (or when more than `max_hot_states` sessions hold a kv state)
+                    the context and kv states are pickled, zlib compressed and written to `directory`
+            - cold: after `cold_after` idle seconds the warm file is replaced by the text history only, the
+                    next turn re-prefills it (from the conversation store if enabled)
+
+        restoring is transparent, `get`/`lease` bring the session back from whichever tier holds it and record
+        the latency per tier in `sessions.restore_seconds`
+
+        sessions can be forked and rewound at a turn, branches share their messages and kv checkpoints (see
+        `CheckpointStore`) so editing a question or regenerating an answer only prefills the edited turn
+
+        ```python
+        >>> sessions = SessionManager.shared()
+        >>> with sessions.lease("student-42") as context:   # never hibernated while leased
+        ...     context.append(text="what is entropy?")
+        >>> sessions.fork("student-42", 3).session_id       # a new branch sharing turns 1 to 3
+        'student-42.5f0c1e2a'
+        ```
+
+        Args:
+            store (Optional["ConversationStore"]): where turns are persisted, None keeps sessions in memory only
+            history (int): how many turns to load when a session is restored from the store
+            directory (Optional[Path]): where hibernated sessions are written, None disables hibernation
+            warm_after (float): idle seconds before a hot session is written to disk
+            cold_after (float): idle seconds before a warm session drops its kv state and images
+            max_hot_states (int): how many sessions may keep kv states in memory at once
+            compression_level (int): zlib level used for warm files (1 is fast, kv data compresses poorly anyway)
+            checkpoint_budget (int): bytes of kv checkpoints kept for rewinding and forking, 0 disables them
+    """
+
+    _instance: Optional["SessionManager"] = None
+    _instance_lock: threading.Lock        = threading.Lock()
+
+    def __init__(self,
+                 store: Optional["ConversationStore"] = None,
+                 history: int                       = 50,
+                 /,
+                 directory: Optional[Path]          = None,
+                 warm_after: float                  = 600,
+                 cold_after: float                  = 6 * 3600,
+                 max_hot_states: int                = 4,
+                 compression_level: int             = 1,
+                 checkpoint_budget: int             = 512 * 1024 * 1024) -> None:
+        self.__store:       Optional["ConversationStore"]  = store
+        self.__history:     int                          = history
+        self.__directory:   Optional[Path]               = directory
+        self.__warm_after:  float                        = warm_after
+        self.__cold_after:  float                        = cold_after
+        self.__max_hot:     int                          = max_hot_states
+        self.__compression: int                          = compression_level
+        self.__checkpoints: CheckpointStore              = CheckpointStore(checkpoint_budget)
+
+        self.__contexts:    dict[str, ChatContext]       = {}
+        self.__states:      dict[str, dict[str, Any]]    = {} # session -> {model: llama state}
+        self.__last_used:   dict[str, float]             = {}
+        self.__leases:      dict[str, int]               = {}
+        self.__resident:    dict[str, str]               = {} # model -> session whose state lives in the model
+        self.__tiers:       dict[str, str]               = {} # only sessions that are warm or cold on disk
+        self.__lock:        threading.RLock              = threading.RLock()
+
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+            self._scan_directory()
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def shared(cls) -> "SessionManager":
+        """ the process wide session manager, created from `Config` on first use """
+        from Server.database.access import ConversationStore
+
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(
+                    ConversationStore(_resolve(Config.database_path)) if Config.database_enabled else None,
+                    Config.history_messages,
+                    directory         = _resolve(Config.sessions_dir) if Config.sessions_hibernate else None,
+                    warm_after        = Config.sessions_warm_after,
+                    cold_after        = Config.sessions_cold_after,
+                    max_hot_states    = Config.sessions_max_hot_states,
+                    compression_level = Config.sessions_compression_level,
+                    checkpoint_budget = int(Config.sessions_checkpoint_budget_mb * 1024 * 1024),
+                )
+
+                if Config.sessions_hibernate:
+                    cls._instance.start_sweeper(Config.sessions_sweep_interval)
+
+            return cls._instance #                                                                              return #
+    # end                                                                                                       shared #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def get(self, session_id: Optional[str] = None) -> ChatContext:
+        """ SessionManager.get
+            get - returns the context of a session, restoring it from disk or the store or creating it if needed
+
+            Args:
+                session_id (Optional[str]): the session, None means the default session
+        """
+        session_id = session_id or DEFAULT_SESSION_ID
+
+        with self.__lock:
+            self.__last_used[session_id] = time.monotonic()
+            context: Optional[ChatContext] = self.__contexts.get(session_id)
+
+            if context is not None:
+                return context #                                                                                return #
+
+            start: float = time.perf_counter()
+            tier:  str   = self.__tiers.pop(session_id, None) or self._tier_on_disk(session_id)
+
+            if tier == WARM:
+                context = self._restore_warm(session_id)
+            elif tier == COLD:
+                context = self._restore_cold(session_id)
+            elif self.__store is not None:
+                context = ChatContext.from_store(self.__store, session_id, self.__history)
+            else:
+                context = ChatContext(session_id)
+
+            self.__contexts[session_id] = context
+
+        Metrics.observe("sessions.restore_seconds", time.perf_counter() - start, tier=tier)
+        return context #                                                                                        return #
+    # end                                                                                                          get #
+
+    def peek(self, session_id: Optional[str] = None) -> Optional[ChatContext]:
+        """ the context of a hot session, None otherwise. unlike `get` nothing is created or restored and the
+            session is not marked as used
+        """
+        with self.__lock:
+            return self.__contexts.get(session_id or DEFAULT_SESSION_ID) #                                       return #
+    # end                                                                                                         peek #
+
+    @contextmanager
+    def lease(self, session_id: Optional[str] = None) -> Iterator[ChatContext]:
+        """ like `get`, but the session can not be hibernated until the context exits """
+        session_id = session_id or DEFAULT_SESSION_ID
+
+        with self.__lock:
+            context: ChatContext = self.get(session_id)
+            self.__leases[session_id] = self.__leases.get(session_id, 0) + 1
+
+        try:
+            yield context
+        finally:
+            with self.__lock:
+                self.__leases[session_id] -= 1
+                self.__last_used[session_id] = time.monotonic()
+    # end                                                                                                        lease #
+
+    def put_state(self, session_id: str, model: str, state: Any) -> None:
+        """ parks a llama kv state for `session_id`, demoting the least recently used sessions to the warm tier
+            once more than `max_hot_states` sessions hold a state in memory
+        """
+        with self.__lock:
+            self.__states.setdefault(session_id, {})[model] = state
+
+            if self.__directory is None:
+                return #                                                                                        return #
+
+            while len(self.__states) > self.__max_hot:
+                candidates: list[str] = [
+                    session for session in self.__states
+                    if session != session_id and self._can_hibernate(session)
+                ]
+                if not candidates:
+                    break
+
+                oldest: str = min(candidates, key=lambda session: self.__last_used.get(session, 0))
+                self.hibernate(oldest, reason="hot_limit")
+    # end                                                                                                    put_state #
+
+    def take_state(self, session_id: str, model: str) -> tuple[Optional[Any], str]:
+        """ SessionManager.take_state
+            take_state - removes and returns the kv state saved for `session_id` on `model` (the model owns it from
+                         now on) together with the tier it came from
+
+            Returns:
+                tuple[Optional[Any], str]: the state (None if there is none) and 'hot', 'warm', 'cold' or 'new'
+        """
+        with self.__lock:
+            tier: str = self.tier(session_id)
+            self.get(session_id) # brings warm sessions (and their states) back into memory
+
+            state: Optional[Any] = self.__states.get(session_id, {}).pop(model, None)
+
+            if session_id in self.__states and not self.__states[session_id]:
+                del self.__states[session_id]
+
+            return state, (tier if state is not None else NEW if tier == HOT else tier) #                       return #
+    # end                                                                                                   take_state #
+
+    def set_resident(self, model: str, session_id: Optional[str]) -> None:
+        """ records which session's kv state currently lives inside `model`, such sessions are not hibernated """
+        with self.__lock:
+            if session_id is None:
+                self.__resident.pop(model, None)
+            else:
+                self.__resident[model] = session_id
+    # end                                                                                                 set_resident #
+
+    def fork(self, session_id: str, turn: int, branch_id: Optional[str] = None) -> ChatContext:
+        """ SessionManager.fork
+            fork - starts a new session that shares turns 1 to `turn` of `session_id`, its messages, parked kv
+                   states and checkpoints are shared with the parent rather than copied
+
+            Args:
+                session_id (str): the session to fork
+                turn (int): the last shared turn, 0 shares only the system prompt
+                branch_id (Optional[str]): the id of the new session, generated from the parent's id if None
+
+            Returns:
+                ChatContext: the context of the new session
+
+            Raises:
+                ValueError: if `turn` does not exist or `branch_id` is already in use
+        """
+        branch_id = branch_id or f"{session_id}.{uuid.uuid4().hex[:8]}"
+
+        with self.__lock:
+            if branch_id in self.__contexts or self.tier(branch_id) != NEW:
+                raise ValueError(f"session {branch_id} already exists")
+
+            parent: ChatContext = self.get(session_id)
+
+            if turn > parent.turn:
+                raise ValueError(f"session {session_id} has no turn {turn}")
+
+            if turn > parent.turn_offset or turn == 0 or self.__store is None:
+                branch: ChatContext = parent.fork(turn, branch_id)
+            else: # the turn is older than the loaded history, branch in the store and load it from there
+                self.__store.fork(session_id, branch_id, turn)
+                self.__store.flush()
+                branch = ChatContext.from_store(self.__store, branch_id, self.__history)
+
+            self.__contexts[branch_id]  = branch
+            self.__last_used[branch_id] = time.monotonic()
+
+            # states are never mutated (only replaced), the branch can load the parent's as they are
+            if session_id in self.__states:
+                self.__states[branch_id] = dict(self.__states[session_id])
+
+            self.__checkpoints.fork(session_id, branch_id)
+
+        Metrics.increment("sessions.forked")
+        return branch #                                                                                         return #
+    # end                                                                                                         fork #
+
+    def rewind(self, session_id: str, turn: int) -> ChatContext:
+        """ SessionManager.rewind
+            rewind - drops every turn after `turn`, the kv states and checkpoints taken later are kept, llama.cpp
+                     reuses their common prefix with the rewound history
+
+            Raises:
+                SessionBusyError: if the session is generating a response
+                ValueError: if `turn` does not exist
+        """
+        with self.__lock:
+            context: ChatContext = self.get(session_id)
+
+            if self.__leases.get(session_id, 0) > 0:
+                raise SessionBusyError(f"session {session_id} is generating a response")
+
+            if turn > context.turn:
+                raise ValueError(f"session {session_id} has no turn {turn}")
+
+            if turn > context.turn_offset or turn == 0 or self.__store is None:
+                context.rewind(turn)
+            else: # the turn is older than the loaded history, truncate in the store and reload
+                self.__store.truncate(session_id, turn)
+                self.__store.flush()
+                context = ChatContext.from_store(self.__store, session_id, self.__history)
+                self.__contexts[session_id] = context
+
+        Metrics.increment("sessions.rewound")
+        return context #                                                                                        return #
+    # end                                                                                                       rewind #
+
+    def checkpoint(self, session_id: str, model: str, state: Any) -> bool:
+        """ records `state` as the kv checkpoint of `session_id` at its current turn, see `CheckpointStore.put` """
+        return self.__checkpoints.put(session_id, model, self.get(session_id).contexts, state) #               return #
+    # end                                                                                                   checkpoint #
+
+    def best_checkpoint(self, session_id: str, model: str) -> tuple[Optional[Any], int]:
+        """ the checkpoint sharing the most turns with the session's current history, see `CheckpointStore.best` """
+        return self.__checkpoints.best(session_id, model, self.get(session_id).contexts) #                      return #
+    # end                                                                                              best_checkpoint #
+
+    def hibernate(self, session_id: str, reason: str = "idle") -> bool:
+        """ SessionManager.hibernate
+            hibernate - writes a hot session (context + kv states) to the warm tier and frees its memory
+
+            Returns:
+                bool: False if the session is leased, resident in a model, not hot or hibernation is disabled
+        """
+        with self.__lock:
+            if self.__directory is None or session_id not in self.__contexts or not self._can_hibernate(session_id):
+                return False #                                                                                  return #
+
+            start:   float = time.perf_counter()
+            payload: bytes = zlib.compress(
+                pickle.dumps(
+                    {
+                        "messages":     self.__contexts[session_id].get_context(inline=True),
+                        "total_images": self.__contexts[session_id].total_images,
+                        "turn_offset":  self.__contexts[session_id].turn_offset,
+                        "states":       self.__states.get(session_id, {}),
+                    },
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                ),
+                self.__compression,
+            )
+
+            self._write(self._path(session_id, WARM), payload)
+
+            del self.__contexts[session_id]
+            self.__states.pop(session_id, None)
+            self.__checkpoints.drop(session_id) # the restored messages are new objects no checkpoint matches
+            self.__tiers[session_id] = WARM
+
+        Metrics.increment("sessions.hibernated", tier=WARM, reason=reason)
+        Metrics.observe("sessions.hibernate_seconds", time.perf_counter() - start, tier=WARM)
+        Metrics.observe("sessions.warm_bytes", len(payload))
+        logger.debug(f"session {session_id} hibernated to warm tier ({len(payload)} bytes, {reason})")
+        return True #                                                                                           return #
+    # end                                                                                                    hibernate #
+
+    def freeze(self, session_id: str) -> bool:
+        """ SessionManager.freeze
+            freeze - moves a warm session to the cold tier, only the text history is kept
+
+            Returns:
+                bool: False if the session is not warm
+        """
+        with self.__lock:
+            if self.__tiers.get(session_id) != WARM:
+                return False #                                                                                  return #
+
+            warm_path: Path = self._path(session_id, WARM)
+            with open(warm_path, "rb") as file:
+                messages: list[dict[str, Any]] = pickle.loads(zlib.decompress(file.read()))["messages"]
+
+            # with a store the text is already persisted and the cold file only marks the tier
+            self._write(
+                self._path(session_id, COLD),
+                json.dumps([] if self.__store is not None else ChatContext.text_only(messages)).encode(),
+            )
+            warm_path.unlink(missing_ok=True)
+            self.__tiers[session_id] = COLD
+
+        Metrics.increment("sessions.hibernated", tier=COLD, reason="idle")
+        logger.debug(f"session {session_id} moved to cold tier")
+        return True #                                                                                           return #
+    # end                                                                                                       freeze #
+
+    def sweep(self) -> None:
+        """ demotes idle sessions one tier, hot -> warm after `warm_after`, warm -> cold after `cold_after` """
+        now: float = time.monotonic()
+
+        with self.__lock:
+            idle_hot:  list[str] = [
+                session for session in self.__contexts
+                if now - self.__last_used.get(session, now) > self.__warm_after
+            ]
+            idle_warm: list[str] = [
+                session for session, tier in self.__tiers.items()
+                if tier == WARM and now - self.__last_used.get(session, now) > self.__cold_after
+            ]
+
+        for session_id in idle_hot:
+            self.hibernate(session_id)
+
+        for session_id in idle_warm:
+            self.freeze(session_id)
+
+        Metrics.set_gauge("sessions.count", len(self.__contexts), tier=HOT)
+        Metrics.set_gauge("sessions.count", sum(tier == WARM for tier in self.__tiers.values()), tier=WARM)
+        Metrics.set_gauge("sessions.count", sum(tier == COLD for tier in self.__tiers.values()), tier=COLD)
+    # end                                                                                                        sweep #
+
+    def start_sweeper(self, interval: float) -> threading.Thread:
+        def _run() -> None:
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.error(f"session sweep failed: {e}")
+
+        thread: threading.Thread = threading.Thread(target=_run, daemon=True, name="session_sweeper_thread")
+        thread.start()
+        return thread #                                                                                         return #
+    # end                                                                                                start_sweeper #
+
+    def drop(self, session_id: str) -> None:
+        """ forgets the in memory context and kv states of a session, persisted turns are kept """
+        with self.__lock:
+            self.__contexts.pop(session_id, None)
+            self.__states.pop(session_id, None)
+            self.__checkpoints.drop(session_id)
+    # end                                                                                                         drop #
+
+    def tier(self, session_id: str) -> str:
+        with self.__lock:
+            if session_id in self.__contexts:
+                return HOT #                                                                                    return #
+
+            return self.__tiers.get(session_id) or self._tier_on_disk(session_id) #                             return #
+    # end                                                                                                         tier #
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self.__contexts
+    # end                                                                                                 __contains__ #
+
+    # -------------------------------------------------- properties -------------------------------------------------- #
+
+    @property
+    def store(self) -> Optional["ConversationStore"]:
+        return self.__store
+    # end                                                                                                        store #
+
+    @property
+    def max_hot_states(self) -> int:
+        return self.__max_hot
+    # end                                                                                               max_hot_states #
+
+    @max_hot_states.setter
+    def max_hot_states(self, value: int) -> None:
+        """ applies from the next parked state on """
+        with self.__lock:
+            self.__max_hot = max(0, value)
+    # end                                                                                               max_hot_states #
+
+    @property
+    def checkpointing(self) -> bool:
+        return self.__checkpoints.enabled #                                                                     return #
+    # end                                                                                                checkpointing #
+
+    @property
+    def active(self) -> list[str]:
+        with self.__lock:
+            return list(self.__contexts) #                                                                      return #
+    # end                                                                                                       active #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _can_hibernate(self, session_id: str) -> bool:
+        return self.__leases.get(session_id, 0) == 0 and session_id not in self.__resident.values()
+    # end                                                                                               _can_hibernate #
+
+    def _path(self, session_id: str, tier: str) -> Path:
+        # session ids come from clients, hash them so they are always safe file names
+        return self.__directory / f"{hashlib.sha256(session_id.encode()).hexdigest()}.{tier}"      # type:ignore
+    # end                                                                                                        _path #
+
+    def _write(self, path: Path, payload: bytes) -> None:
+        temp_path: Path = path.with_suffix(".tmp")
+        with open(temp_path, "wb") as file:
+            file.write(payload)
+        os.replace(temp_path, path)
+    # end                                                                                                       _write #
+
+    def _restore_warm(self, session_id: str) -> ChatContext:
+        path: Path = self._path(session_id, WARM)
+
+        with open(path, "rb") as file:
+            payload: dict[str, Any] = pickle.loads(zlib.decompress(file.read()))
+
+        path.unlink(missing_ok=True)
+
+        if payload["states"]:
+            self.__states[session_id] = payload["states"]
+
+        context: ChatContext = ChatContext.from_messages(payload["messages"], session_id, self.__store)
+        context.total_images = payload["total_images"]
+        context.turn_offset  = payload.get("turn_offset", 0)
+        return context #                                                                                        return #
+    # end                                                                                                _restore_warm #
+
+    def _restore_cold(self, session_id: str) -> ChatContext:
+        path: Path = self._path(session_id, COLD)
+
+        with open(path, "r") as file:
+            messages: list[dict[str, Any]] = json.load(file)
+
+        path.unlink(missing_ok=True)
+
+        if self.__store is not None:
+            context: ChatContext = ChatContext.from_store(self.__store, session_id, self.__history, images=False)
+        else:
+            context = ChatContext.from_messages(messages, session_id)
+
+        return context #                                                                                        return #
+    # end                                                                                                _restore_cold #
+
+    def _tier_on_disk(self, session_id: str) -> str:
+        """ hibernated files survive restarts, a session unknown to this process may still be warm or cold """
+        if self.__directory is None:
+            return NEW #                                                                                        return #
+
+        for tier in (WARM, COLD):
+            if self._path(session_id, tier).exists():
+                return tier #                                                                                   return #
+
+        return NEW #                                                                                            return #
+    # end                                                                                                _tier_on_disk #
+
+    def _scan_directory(self) -> None:
+        """ removes half written files left by a previous run and counts the hibernated sessions on disk """
+        for path in self.__directory.glob("*.tmp"):                                                    # type:ignore
+            path.unlink(missing_ok=True)
+
+        for tier in (WARM, COLD):
+            count: int = len(list(self.__directory.glob(f"*.{tier}")))                                 # type:ignore
+            Metrics.set_gauge("sessions.on_disk", count, tier=tier)
+    # end                                                                                              _scan_directory #
+# end                                                                                                   SessionManager #
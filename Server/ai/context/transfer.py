@@ -0,0 +1,210 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import json
+import time
+import base64
+import hashlib
+
+from typing import Any, Iterator, Union
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.context.chat_context import SingleChatContent
+from Server.ai.context.images       import DATA_URI_PREFIX, ImageStore
+from Server.ai.context.sessions     import SessionManager
+from Server.ai.utils.metrics        import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- transfer ------------------------------------------------------ #
+
+EXPORT_FORMAT:  str = "voxai-context"
+EXPORT_VERSION: int = 1
+
+def export_session(sessions: SessionManager, session_id: str, inline_images: bool = False) -> Iterator[str]:
+    """ export_session
+        export_session - streams a session as NDJSON, one line per message, so memory is bounded by the largest
+                         message rather than the session. with a conversation store the whole persisted history
+                         is walked with a cursor, otherwise the in memory context is exported
+
+        ```
+        {"type": "session", "format": "voxai-context", "version": 1, "session_id": "student-42"}
+        {"type": "message", "turn": 1, "role": "user", "text": "what?", "images": [{"tag": "img1", "sha256": "9f.."}]}
+        {"type": "message", "turn": 2, "role": "assistant", "text": "a mitochondrion", "images": []}
+        ```
+
+        images are references by default (fetch them from `GET /images/{sha256}`), `inline_images` adds their
+        base64 as `"data"` to each reference
+
+        Args:
+            sessions (SessionManager): where the session lives
+            session_id (str): the session to export
+            inline_images (bool): embed image bytes instead of only referencing them
+
+        Yields:
+            str: one NDJSON line
+    """
+    start:    float = time.perf_counter()
+    messages: int   = 0
+
+    yield json.dumps(
+        {"type": "session", "format": EXPORT_FORMAT, "version": EXPORT_VERSION, "session_id": session_id}
+    ) + "\n"
+
+    store = sessions.store
+
+    if store is not None:
+        store.flush() # turns of the current request may still be queued
+
+        for message in store.iter_messages(session_id):
+            if inline_images:
+                for image in message["images"]:
+                    image["data"] = base64.b64encode(b"".join(store.iter_blob(image["sha256"]) or [])).decode()
+
+            messages += 1
+            yield json.dumps({"type": "message", **message}) + "\n"
+    else:
+        for turn, single in enumerate(sessions.get(session_id).contexts[1:], start=1): # skip the system prompt
+            messages += 1
+            yield json.dumps({"type": "message", **_message_record(turn, single, inline_images)}) + "\n"
+
+    Metrics.increment("transfer.exported_messages", messages)
+    Metrics.observe("transfer.export_seconds", time.perf_counter() - start)
+# end                                                                                               export_session #
+
+class ContextImporter:
+    """ ContextImporter
+        ContextImporter - rebuilds a session from an NDJSON export fed in arbitrary chunks (e.g. straight from the
+                          request body), each complete line is applied as soon as it arrives so only one line is
+                          ever buffered
+
+        images may be inline (`"data"`) or references to blobs already in the conversation store (uploaded with
+        `PUT /images`). with a store every message is appended there and the in memory session is dropped so it
+        reloads, without one the messages are appended to the in memory context
+
+        ```python
+        >>> importer = ContextImporter(SessionManager.shared(), "student-42")
+        >>> for chunk in body_chunks:
+        ...     importer.feed(chunk)
+        >>> importer.finish()
+        {'session_id': 'student-42', 'messages': 120, 'images': 14}
+        ```
+
+        Raises:
+            ValueError: on malformed lines, an unknown format, missing image data or a line above `max_line_bytes`
+    """
+
+    def __init__(self, sessions: SessionManager, session_id: str, max_line_bytes: int = 64 * 1024 * 1024) -> None:
+        self.__sessions:   SessionManager = sessions
+        self.__session_id: str            = session_id
+        self.__max_line:   int            = max_line_bytes
+        self.__buffer:     bytearray      = bytearray()
+        self.__line:       int            = 0
+        self.__messages:   int            = 0
+        self.__images:     int            = 0
+        self.__start:      float          = time.perf_counter()
+    # end                                                                                                     __init__ #
+
+    def feed(self, chunk: bytes) -> None:
+        self.__buffer.extend(chunk)
+
+        while (newline := self.__buffer.find(b"\n")) != -1:
+            line: bytes = bytes(self.__buffer[:newline])
+            del self.__buffer[:newline + 1]
+            self._apply(line)
+
+        if len(self.__buffer) > self.__max_line:
+            raise ValueError(f"line {self.__line + 1} is longer than {self.__max_line} bytes")
+    # end                                                                                                         feed #
+
+    def finish(self) -> dict[str, Any]:
+        """ applies a trailing line without newline and returns a summary of what was imported """
+        if self.__buffer.strip():
+            self._apply(bytes(self.__buffer))
+            self.__buffer.clear()
+
+        if self.__sessions.store is not None:
+            self.__sessions.store.flush()
+            self.__sessions.drop(self.__session_id)
+
+        Metrics.increment("transfer.imported_messages", self.__messages)
+        Metrics.observe("transfer.import_seconds", time.perf_counter() - self.__start)
+
+        return {"session_id": self.__session_id, "messages": self.__messages, "images": self.__images} #       return #
+    # end                                                                                                       finish #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _apply(self, line: bytes) -> None:
+        self.__line += 1
+
+        if not line.strip():
+            return #                                                                                            return #
+
+        try:
+            record: dict[str, Any] = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"line {self.__line} is not valid json: {e}")
+
+        if record.get("type") == "session":
+            if record.get("format") != EXPORT_FORMAT or record.get("version") != EXPORT_VERSION:
+                raise ValueError(f"unsupported export format {record.get('format')} v{record.get('version')}")
+            return #                                                                                            return #
+
+        if record.get("type") != "message" or "role" not in record:
+            raise ValueError(f"line {self.__line} is not a message")
+
+        store = self.__sessions.store
+        images: list[Union[str, tuple[str, str]]] = []
+
+        for image in record.get("images", []):
+            tag: str = str(image.get("tag", ""))
+
+            if image.get("data"):
+                data: bytes = base64.b64decode(image["data"])
+                digest: str = hashlib.sha256(data).hexdigest()
+
+                if image.get("sha256") and image["sha256"] != digest:
+                    raise ValueError(f"line {self.__line}: image {tag} does not match its sha256")
+
+                images.append((tag, store.put_blob(data)) if store is not None
+                              else f"{tag}|{DATA_URI_PREFIX}{image['data']}")
+
+            elif store is not None and image.get("sha256") and store.has_blob(image["sha256"]):
+                images.append((tag, image["sha256"]))
+
+            elif store is None and image.get("sha256") in ImageStore.shared(): # referenced by a live session
+                images.append(f"{tag}|{ImageStore.shared().url(image['sha256'], inline=True)}")
+
+            else:
+                raise ValueError(f"line {self.__line}: image {tag} has no data and is not a known blob")
+
+        if store is not None:
+            store.append(self.__session_id, record["role"], record.get("text"), images)
+        else:
+            self.__sessions.get(self.__session_id).append(
+                record["role"], record.get("text"), [str(image) for image in images] or None
+            )
+
+        self.__messages += 1
+        self.__images   += len(images)
+    # end                                                                                                       _apply #
+# end                                                                                                  ContextImporter #
+
+def _message_record(turn: int, single: SingleChatContent, inline_images: bool) -> dict[str, Any]:
+    images: list[dict[str, Any]] = []
+
+    for tag, digest in single.image_refs: # the image store is keyed by the same sha256, nothing is hashed here
+        image: dict[str, Any] = {"tag": tag, "sha256": digest, "size": ImageStore.shared().size(digest)}
+
+        if inline_images:
+            image["data"] = base64.b64encode(ImageStore.shared().data(digest)).decode()
+
+        images.append(image)
+
+    return {"turn": turn, "role": single.role, "text": single.text, "images": images} #                        return #
+# end                                                                                              _message_record #
@@ -0,0 +1,371 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from pathlib            import Path
+from typing             import Any, Callable, Optional
+
+from Server.config.read_config import Config
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.backends.base        import create_backend
+from Server.ai.context.sessions     import SessionManager
+from Server.ai.core.data_structures import ChatRequest
+from Server.ai.core.model_loader    import Model
+from Server.ai.core.model_registry  import ModelRegistry, ModelSpec
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ------------------------------------------------------ bulk -------------------------------------------------------- #
+
+MANIFEST_VERSION: int = 1
+
+# every worker answers in one session, rewound to its first turn before each conversation
+WORKER_SESSION: str = "bulk"
+
+# (index, request, the line's "id" if it had one)
+Item = tuple[int, ChatRequest, Optional[Any]]
+
+# one model per worker process, loaded by `_load_worker` when the process starts
+_model: Optional[Model] = None
+
+def _load_worker(config: Optional[str], spec: ModelSpec, threads: int) -> None:
+    global _model
+    if config is not None:
+        Config.load(config)
+    Config.inference_threads = threads
+
+    # conversations are answered once and forgotten: nothing is stored, checkpointed or parked
+    sessions: SessionManager = SessionManager(None, Config.history_messages, max_hot_states=0, checkpoint_budget=0)
+    _model = Model(
+        spec.path,
+        image_processor_path = spec.mmproj if spec.has_vision else None,
+        multi_model          = spec.has_vision,
+        sessions             = sessions,
+        backend              = create_backend(
+            spec.backend, spec.path, str(spec.mmproj) if spec.has_vision else None, spec.url,
+            spec.kv_type, spec.flash_attn,
+        ),
+    )
+    if not _model.wait_until_ready() or not _model.is_ready:
+        raise RuntimeError(f"{spec.name} did not load")
+# end                                                                                                 _load_worker #
+
+def _answer_conversation(items: list[Item]) -> tuple[list[dict[str, Any]], float]:
+    """ answers the requests of one conversation in order, each turn sees the answers before it. a failed
+        request ends the conversation, its later turns would be asked without the answer they follow
+    """
+    model:   Model = _model                                                                             # type:ignore
+    started: float = time.perf_counter()
+    results: list[dict[str, Any]] = []
+
+    model.sessions.rewind(WORKER_SESSION, 0) # keeps the kv cache, llama.cpp reuses the system prompt
+
+    for index, request, line_id in items:
+        start:  float = time.perf_counter()
+        result: dict[str, Any] = {"index": index, "id": line_id, "session_id": request.session_id}
+
+        try:
+            content: list[str] = []
+            reason:  Optional[str] = None
+            for response in model.predict(request.model_copy(update={"session_id": WORKER_SESSION})):
+                if response.content:
+                    content.append(response.content)
+                reason = response.finish_reason or reason
+        except Exception as e:
+            logger.error(f"request {index} failed: {e}")
+            results.append({**result, "error": str(e)})
+            break
+
+        # llama.cpp streams one token per chunk
+        results.append({**result, "content": "".join(content), "finish_reason": reason, "tokens": len(content),
+                        "seconds": round(time.perf_counter() - start, 3)})
+
+    return results, time.perf_counter() - started #                                                            return #
+# end                                                                                          _answer_conversation #
+
+class BulkJob:
+    """ BulkJob
+        BulkJob - answers files of `ChatRequest` lines offline at the model's full throughput: conversations are
+                  answered in parallel by `workers` processes, each with its own llama context and an equal share
+                  of the cores, the weights are memory mapped once for all of them
+
+        lines with the same `session_id` are one conversation and are answered in file order by one worker, lines
+        without are answered on their own. every worker keeps its kv cache between conversations, so the system
+        prompt is evaluated once per worker. requests are routed like the server routes them. answers are
+        appended to shards as conversations finish, an interrupted job answers only what is missing:
+
+        ```
+        <output>/manifest.json        the inputs' sizes and mtimes, a changed input starts the job over
+        <output>/shard-00000.jsonl    {"index", "id", "session_id", "model", "content", "finish_reason", "tokens",
+                                      "seconds"} per answer, in completion order, at most `shard_size` per shard
+        ```
+
+        ```python
+        >>> job = BulkJob([Path("question-bank.jsonl")], Path("answers"), workers=4)
+        >>> job.run()
+        {'requests': 2000, 'tokens': 412803, 'wall_seconds': 3120.4, 'tokens_per_s': 132.3, ...}
+        ```
+
+        Args:
+            paths (list[Path]): the JSONL files, one `ChatRequest` per line (an extra "id" is copied to its answer)
+            output (Path): where the shards and the manifest are written
+            workers (int): processes answering, each loads the model
+            threads (int): cpu threads of every worker's model, 0 splits the cores between the workers
+            shard_size (int): answers per shard
+            config (Optional[str]): the server.toml the workers load
+    """
+
+    def __init__(self,
+                 paths: list[Path],
+                 output: Path,
+                 /,
+                 workers: int = 1,
+                 threads: int = 0,
+                 shard_size: int = 1000,
+                 config: Optional[str] = None) -> None:
+        output.mkdir(parents=True, exist_ok=True)
+
+        self.__paths:      list[Path]         = paths
+        self.__output:     Path               = output
+        self.__workers:    int                = max(1, workers)
+        self.__threads:    int                = threads
+        self.__shard_size: int                = max(1, shard_size)
+        self.__config:     Optional[str]      = config
+        self.__registry:   ModelRegistry      = ModelRegistry.from_config()
+        self.__items:      list[Item]         = []
+        self.__done:       set[int]           = set()
+        self.__shard:      int                = 0
+        self.__written:    int                = 0 # answers in the current shard
+        self.__prepared:   bool               = False
+    # end                                                                                                     __init__ #
+
+    def prepare(self) -> None:
+        """ reads the requests and the answers of an earlier run of the job """
+        key: dict[str, Any] = {"version": MANIFEST_VERSION, "inputs": [
+            {"path": str(path.resolve()), "size": path.stat().st_size, "mtime": path.stat().st_mtime}
+            for path in self.__paths
+        ]}
+
+        manifest_path: Path = self.__output / "manifest.json"
+        manifest: dict[str, Any] = {}
+        if manifest_path.exists():
+            with open(manifest_path, "r") as file:
+                manifest = json.load(file)
+
+        if manifest != key:
+            if manifest:
+                logger.warning(f"the inputs changed since {self.__output} was written, answering everything again")
+            for shard in self._shards():
+                shard.unlink()
+
+            temp_path: Path = manifest_path.with_suffix(".tmp")
+            with open(temp_path, "w") as file:
+                json.dump(key, file)
+            os.replace(temp_path, manifest_path)
+
+        self.__items = []
+        for path in self.__paths:
+            with open(path, "r") as file:
+                for number, line in enumerate(file, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        entry: dict[str, Any] = json.loads(line)
+                        self.__items.append((len(self.__items), ChatRequest.model_validate(entry), entry.get("id")))
+                    except ValueError as e:
+                        raise ValueError(f"{path}:{number} is not a ChatRequest: {e}")
+
+        self._load_done()
+        self.__prepared = True
+    # end                                                                                                      prepare #
+
+    def run(self, progress: Optional[Callable[[int], None]] = None) -> dict[str, Any]:
+        """ BulkJob.run
+            run - answers every request not answered by an earlier run of the job
+
+            Args:
+                progress (Optional[Callable[[int], None]]): called with the number of requests of every conversation
+                                                            done
+
+            Returns:
+                dict[str, Any]: requests and tokens of this run, its wall seconds, tokens/s over all workers and the
+                                parallel speedup (seconds spent answering / wall seconds)
+        """
+        if not self.__prepared:
+            self.prepare()
+
+        start:    float          = time.perf_counter()
+        threads:  int            = self.__threads
+        busy:     float          = 0.0
+        tokens:   int            = 0
+        answered: int            = 0
+        failed:   int            = 0
+        reasons:  dict[str, int] = {}
+
+        for model_name, conversations in self._pending().items():
+            spec: ModelSpec = self.__registry.spec(model_name)
+            # every worker holds a kv cache of its own, as many as the kv budget allows
+            workers: int = min(self.__workers, len(conversations), self.__registry.max_sequences(model_name) or 1 << 30)
+            threads = self.__threads or max(1, (os.cpu_count() or 1) // workers)
+            logger.info(f"{model_name}: {sum(map(len, conversations))} requests on {workers} workers, "
+                        f"{threads} threads each")
+
+            with ProcessPoolExecutor(workers, initializer=_load_worker,
+                                     initargs=(self.__config, spec, threads)) as pool:
+                # longest conversations first keeps every worker busy until the end
+                conversations.sort(key=len, reverse=True)
+                futures: dict[Future, list[Item]] = {
+                    pool.submit(_answer_conversation, conversation): conversation for conversation in conversations
+                }
+
+                for future in as_completed(futures):
+                    results, seconds = future.result()
+                    busy += seconds
+
+                    for result in results:
+                        if "error" in result:
+                            failed += 1
+                            continue
+                        tokens   += result["tokens"]
+                        answered += 1
+                        reasons[result["finish_reason"]] = reasons.get(result["finish_reason"], 0) + 1
+                        self._record({**result, "model": model_name})
+
+                    if progress is not None:
+                        progress(len(futures[future]))
+
+        wall_seconds: float = time.perf_counter() - start
+        return {
+            "requests":       len(self.__items),
+            "answered":       answered,
+            "failed":         failed,
+            "workers":        self.__workers,
+            "threads":        threads,
+            "tokens":         tokens,
+            "wall_seconds":   round(wall_seconds, 2),
+            "tokens_per_s":   round(tokens / wall_seconds, 1) if wall_seconds and tokens else None,
+            "requests_per_s": round(answered / wall_seconds, 2) if wall_seconds and answered else None,
+            "speedup":        round(busy / wall_seconds, 2) if wall_seconds and busy else None,
+            "finish_reasons": reasons,
+        } #                                                                                                     return #
+    # end                                                                                                          run #
+
+    @property
+    def remaining(self) -> int:
+        """ the requests still to answer (every turn of a conversation not answered in full), known once the job
+            is prepared
+        """
+        pending: list[list[Item]] = [conversation for models in self._pending().values() for conversation in models]
+        return sum(map(len, pending)) #                                                                         return #
+    # end                                                                                                    remaining #
+
+    def _pending(self) -> dict[str, list[list[Item]]]:
+        """ the conversations with an unanswered request, by the model they are routed to. a conversation is
+            answered again from its first turn, its later turns need the answers they follow
+        """
+        conversations: dict[str, list[Item]] = {}
+        for item in self.__items:
+            session: str = item[1].session_id or f"\x00{item[0]}" # lines without a session stand alone
+            conversations.setdefault(session, []).append(item)
+
+        pending: dict[str, list[list[Item]]] = {}
+        for conversation in conversations.values():
+            if all(index in self.__done for index, _, _ in conversation):
+                continue
+            pending.setdefault(self.__registry.route(conversation[0][1]), []).append(conversation)
+
+        return pending #                                                                                        return #
+    # end                                                                                                     _pending #
+
+    def _shards(self) -> list[Path]:
+        return sorted(self.__output.glob("shard-*.jsonl")) #                                                    return #
+    # end                                                                                                      _shards #
+
+    def _load_done(self) -> None:
+        self.__done = set()
+        shards: list[Path] = self._shards()
+
+        for shard in shards:
+            with open(shard, "rb") as file:
+                data: bytes = file.read()
+
+            # drop the line being written when the job was interrupted
+            complete: int = data.rfind(b"\n") + 1
+            if complete < len(data):
+                os.truncate(shard, complete)
+
+            self.__done.update(json.loads(line)["index"] for line in data[:complete].splitlines())
+
+        # a new run starts a new shard, the shards of earlier runs are never appended to
+        self.__shard   = int(shards[-1].stem.split("-")[1]) + 1 if shards else 0
+        self.__written = 0
+    # end                                                                                                   _load_done #
+
+    def _record(self, result: dict[str, Any]) -> None:
+        """ appends an answer to the current shard, durable before it is counted as done """
+        if result["index"] in self.__done: # answered by an earlier run that stopped within its conversation
+            return #                                                                                            return #
+
+        if self.__written >= self.__shard_size:
+            self.__shard, self.__written = self.__shard + 1, 0
+
+        with open(self.__output / f"shard-{self.__shard:05d}.jsonl", "a") as file:
+            file.write(json.dumps(result) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.__done.add(result["index"])
+        self.__written += 1
+    # end                                                                                                      _record #
+# end                                                                                                          BulkJob #
+
+def main() -> int:
+    """ python -m Server.ai.core.bulk questions.jsonl [more.jsonl] [--out answers] [--workers 4] [--threads 4]
+
+        run it again with the same arguments after an interruption, answered requests are not asked twice
+    """
+    from rich.logging import RichHandler
+    from tqdm         import tqdm
+
+    logging.basicConfig(level="INFO", format="%(message)s", datefmt="[%X]", handlers=[RichHandler()])
+
+    parser = argparse.ArgumentParser(description="offline answering of ChatRequest JSONL files")
+    parser.add_argument("files",        type=Path, nargs="+")
+    parser.add_argument("--out",        type=Path, default=Path("answers"))
+    parser.add_argument("--config",     type=str,  default="server.toml")
+    parser.add_argument("--workers",    type=int,  default=None)
+    parser.add_argument("--threads",    type=int,  default=None, help="threads of every worker's model")
+    parser.add_argument("--shard-size", type=int,  default=None)
+    args = parser.parse_args()
+
+    Config.load(args.config)
+
+    job = BulkJob(
+        args.files, args.out,
+        workers    = args.workers or Config.inference_bulk_workers,
+        threads    = args.threads if args.threads is not None else Config.inference_threads,
+        shard_size = args.shard_size or Config.inference_bulk_shard_size,
+        config     = args.config,
+    )
+
+    job.prepare()
+    with tqdm(total=job.remaining, unit="req", desc="answering") as bar:
+        report: dict[str, Any] = job.run(progress=bar.update)
+
+    print(json.dumps(report, indent=4))
+    return 0 #                                                                                                  return #
+# end                                                                                                         main #
+
+if __name__ == "__main__":
+    sys.exit(main())
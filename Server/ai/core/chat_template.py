@@ -0,0 +1,337 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import time
+import threading
+
+from array       import array
+from collections import OrderedDict
+from typing      import TYPE_CHECKING, Any, Callable, Optional
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama, StoppingCriteriaList
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.utils.metrics import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# -------------------------------------------------- chat template --------------------------------------------------- #
+
+# marks the end of the last message while rendering a prefix, cut off before tokenizing
+PREFIX_MARK: str = "\x00vox-prefix-end\x00"
+
+# (messages, add_generation_prompt) -> the rendered prompt
+Render = Callable[[list[dict[str, str]], bool], str]
+
+# (text, starts_the_prompt) -> its tokens, special tokens parsed, a bos token only where the prompt starts
+Tokenize = Callable[[str, bool], list[int]]
+
+# a conversation every template can render: system prompt, two exchanges and a follow up question
+PROBE: list[dict[str, str]] = [
+    {"role": "system",    "content": "You are a helpful assistant."},
+    {"role": "user",      "content": "What is entropy?"},
+    {"role": "assistant", "content": "A measure of disorder.\n\nIt never decreases in an isolated system."},
+    {"role": "user",      "content": "And enthalpy?"},
+    {"role": "assistant", "content": "The heat content of a system at constant pressure."},
+    {"role": "user",      "content": "Thanks, one more: what is a Carnot cycle?"},
+]
+
+def has_images(messages: list[dict[str, Any]]) -> bool:
+    """ whether any message carries an image part """
+    return any(
+        part.get("type") == "image_url"
+        for message in messages if not isinstance(message["content"], str)
+        for part in message["content"]
+    ) #                                                                                                         return #
+# end                                                                                                       has_images #
+
+class _Prompt:
+    """ the messages of a session rendered so far (all but the last of its latest prompt) and their tokens """
+    __slots__ = ("messages", "tokens")
+
+    def __init__(self, messages: list[tuple[str, str]], tokens: array) -> None:
+        self.messages: list[tuple[str, str]] = messages
+        self.tokens:   array                 = tokens
+    # end                                                                                                     __init__ #
+# end                                                                                                          _Prompt #
+
+class PromptCache:
+    """ PromptCache
+        PromptCache - the rendered and tokenized history of every session, so a turn only renders and tokenizes
+                      the messages added since the previous one instead of the whole conversation again
+
+        the new messages are rendered after a short anchor (the system prompt and the last exchange) and cut
+        off where the anchor ends, their tokens are appended to the session's. the last message is rendered on
+        its own every time, it carries material for this turn only. a history that is not the start of the new
+        messages (a rewind, a fork, compaction, turns that no longer fit) is rendered in full again.
+        whether a template can be rendered message by message, and its tokens split at message boundaries,
+        is checked once on a probe conversation, a template that can not always renders in full
+
+        ```python
+        >>> cache  = PromptCache(render, tokenize)
+        >>> cache.incremental
+        True
+        >>> tokens = cache.prompt("student-1", messages)        # the first turn renders everything
+        >>> tokens = cache.prompt("student-1", messages + [answer, question])   # renders two messages
+        ```
+
+        Args:
+            render (Render): renders messages, with or without the generation prompt
+            tokenize (Tokenize): tokenizes rendered text
+            sessions (int): sessions whose prompt is kept, least recently used first
+            enabled (bool): False always renders in full, like llama.cpp does
+    """
+
+    def __init__(self, render: Render, tokenize: Tokenize, sessions: int = 256, enabled: bool = True) -> None:
+        self.__render:     Render                     = render
+        self.__tokenize:   Tokenize                   = tokenize
+        self.__sessions:   int                        = sessions
+        self.__lock:       threading.Lock             = threading.Lock()
+        self.__prompts:    OrderedDict[str, _Prompt]  = OrderedDict() # least recently used first
+        self.__generation: list[int]                  = []
+        self.__incremental: bool                      = enabled and sessions > 0 and self._probe()
+    # end                                                                                                     __init__ #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def prompt(self, session: Optional[str], messages: list[dict[str, str]]) -> list[int]:
+        """ the tokens of the whole prompt of `messages`, ending in the generation prompt """
+        if not self.__incremental or session is None:
+            return self.__tokenize(self.__render(messages, True), True) #                                       return #
+
+        history: Optional[array] = self._history(session, messages)
+        if history is None:
+            return self.__tokenize(self.__render(messages, True), True) #                                       return #
+
+        last: Optional[str] = self._segment(messages, len(messages) - 1)
+        if last is None:
+            return self.__tokenize(self.__render(messages, True), True) #                                       return #
+
+        return history.tolist() + self.__tokenize(last, False) + self.__generation #                            return #
+    # end                                                                                                       prompt #
+
+    def prefix(self, session: Optional[str], messages: list[dict[str, str]]) -> list[int]:
+        """ the tokens of the prompt of `messages` up to the end of the last message's text """
+        marked: list[dict[str, str]] = messages[:-1] + [
+            {**messages[-1], "content": messages[-1]["content"] + PREFIX_MARK}
+        ]
+
+        history: Optional[array] = self._history(session, messages) if self.__incremental and session else None
+        last:    Optional[str]   = self._segment(marked, len(marked) - 1) if history is not None else None
+
+        if history is None or last is None:
+            return self.__tokenize(self.__render(marked, False).split(PREFIX_MARK)[0], True) #                 return #
+
+        return history.tolist() + self.__tokenize(last.split(PREFIX_MARK)[0], False) #                          return #
+    # end                                                                                                       prefix #
+
+    def forget(self, session: str) -> None:
+        with self.__lock:
+            self.__prompts.pop(session, None)
+    # end                                                                                                       forget #
+
+    # -------------------------------------------------- properties -------------------------------------------------- #
+
+    @property
+    def incremental(self) -> bool:
+        return self.__incremental
+    # end                                                                                                  incremental #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _history(self, session: str, messages: list[dict[str, str]]) -> Optional[array]:
+        """ the tokens of every message but the last, from the session's cached prompt and the messages added
+            since. None if the template failed to render a segment
+        """
+        keys: list[tuple[str, str]] = [(message["role"], message["content"]) for message in messages[:-1]]
+
+        with self.__lock:
+            cached: Optional[_Prompt] = self.__prompts.get(session)
+            if cached is not None:
+                self.__prompts.move_to_end(session)
+
+        start: float = time.perf_counter()
+        if cached is not None and len(cached.messages) <= len(keys) and keys[:len(cached.messages)] == cached.messages:
+            tokens: array = cached.tokens
+            added:  int   = len(keys) - len(cached.messages)
+            Metrics.increment("template.renders", kind="incremental")
+
+            if added:
+                segment: Optional[str] = self._segment(messages[:len(keys)], len(cached.messages))
+                if segment is None:
+                    return None #                                                                               return #
+
+                tokens.extend(self.__tokenize(segment, False)) # the cached array, only this session uses it
+        else:
+            # the first turn, or the history was edited: everything is rendered again
+            tokens = array("i", self.__tokenize(self.__render(messages[:len(keys)], False), True) if keys else [])
+            Metrics.increment("template.renders", kind="full")
+
+        Metrics.observe("template.render_seconds", time.perf_counter() - start)
+
+        with self.__lock:
+            self.__prompts[session] = _Prompt(keys, tokens)
+            self.__prompts.move_to_end(session)
+            while len(self.__prompts) > self.__sessions:
+                self.__prompts.popitem(last=False)
+
+        return tokens #                                                                                         return #
+    # end                                                                                                     _history #
+
+    def _segment(self, messages: list[dict[str, str]], start: int) -> Optional[str]:
+        """ the rendering of `messages[start:]` as it appears in the rendering of all of `messages`, rendered
+            after an anchor instead of after the whole history. the anchor keeps the system prompt and starts
+            at a user message, templates that check the order of the roles accept it
+        """
+        first:  int = 1 if messages and messages[0]["role"] == "system" else 0
+        begin:  int = max(first, start - 1 - (start - 1 - first) % 2) if start > first else start
+        anchor: list[dict[str, str]] = messages[:first] + messages[begin:start]
+
+        try:
+            before: str = self.__render(anchor, False) if anchor else ""
+            after:  str = self.__render(anchor + messages[start:], False)
+        except Exception as e: # e.g. a template that wants the history to start with a user message
+            logger.debug(f"chat template can not render a segment, rendering in full: {e}")
+            return None #                                                                                       return #
+
+        return after[len(before):] if after.startswith(before) else None #                                      return #
+    # end                                                                                                     _segment #
+
+    def _probe(self) -> bool:
+        """ renders the probe conversation turn by turn like a session would and in full, incremental prompts
+            are only used if both give the same tokens
+        """
+        try:
+            full:   str = self.__render(PROBE, True)
+            closed: str = self.__render(PROBE, False)
+            if not full.startswith(closed):
+                raise ValueError("the generation prompt is not appended to the conversation")
+            self.__generation = self.__tokenize(full[len(closed):], False)
+
+            for turn in range(2, len(PROBE) + 1, 2):
+                messages: list[dict[str, str]] = PROBE[:turn]
+                if self._probe_prompt(messages) != self.__tokenize(self.__render(messages, True), True):
+                    raise ValueError(f"turn {turn // 2} renders differently message by message")
+        except Exception as e:
+            logger.info(f"chat template renders the whole conversation every turn: {e}")
+            self.__prompts.clear()
+            return False #                                                                                      return #
+
+        self.__prompts.clear()
+        return True #                                                                                           return #
+    # end                                                                                                       _probe #
+
+    def _probe_prompt(self, messages: list[dict[str, str]]) -> list[int]:
+        """ the incremental prompt of the probe session, before `incremental` is known """
+        history: Optional[array] = self._history("\x00probe", messages)
+        last:    Optional[str]   = self._segment(messages, len(messages) - 1)
+        if history is None or last is None:
+            raise ValueError("a segment could not be rendered")
+
+        return history.tolist() + self.__tokenize(last, False) + self.__generation #                            return #
+    # end                                                                                                _probe_prompt #
+# end                                                                                                      PromptCache #
+
+class ChatTemplate:
+    """ ChatTemplate
+        ChatTemplate - the chat template stored in the gguf file, rendered and tokenized exactly the way llama.cpp
+                       does for text chats (`chat_template.default`). prompts built here and prompts built by
+                       `create_chat_completion` share their tokens, so either finds the other's kv cache
+
+        the prompts of a session are rendered incrementally by a `PromptCache`, only the messages added since
+        its previous turn are rendered and tokenized
+
+        ```python
+        >>> template = ChatTemplate.of(llama)            # None if the gguf has no template
+        >>> tokens   = template.prefix(messages)         # up to the end of the last message's text
+        >>> tokens, stop, criteria = template.prompt(messages, "student-1")   # the whole prompt, ready for the answer
+        ```
+
+        Args:
+            llama (Llama): the loaded model, its vocabulary tokenizes the prompts
+            template (str): the jinja template
+            sessions (int): sessions whose rendered prompt is kept, 0 renders every prompt in full
+    """
+
+    def __init__(self, llama: "Llama", template: str, sessions: int = 256) -> None:
+        from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+
+        # the same special tokens `Llama.__init__` hands to the template
+        eos: int = llama.token_eos()
+        bos: int = llama.token_bos()
+
+        self.__llama = llama
+        self.__formatters: dict[bool, Jinja2ChatFormatter] = {
+            generation_prompt: Jinja2ChatFormatter(
+                template              = template,
+                eos_token             = llama._model.token_get_text(eos) if eos != -1 else "",
+                bos_token             = llama._model.token_get_text(bos) if bos != -1 else "",
+                stop_token_ids        = [eos],
+                add_generation_prompt = generation_prompt,
+            )
+            for generation_prompt in (True, False)
+        }
+
+        # the stop strings, criteria and bos handling only depend on the template, not on the messages
+        response = self.__formatters[True](messages=PROBE[:2])
+        self.__added_special: bool = response.added_special
+        self.__criteria: Optional["StoppingCriteriaList"] = response.stopping_criteria
+        self.__stop: list[str] = (
+            response.stop if isinstance(response.stop, list) else [response.stop] if response.stop else []
+        )
+        self.__prompts: PromptCache = PromptCache(self._render, self._tokenize, sessions)
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def of(cls, llama: "Llama", sessions: int = 256) -> Optional["ChatTemplate"]:
+        """ the template of `llama`'s gguf, None if the file has none (llama.cpp guesses a format then) """
+        template: Optional[str] = llama.metadata.get("tokenizer.chat_template")
+        if not template:
+            return None #                                                                                       return #
+
+        try:
+            return cls(llama, template, sessions) #                                                             return #
+        except Exception as e: # an exotic template must not keep the model from loading
+            logger.warning(f"chat template can not be rendered, prompts are built by llama.cpp only: {e}")
+            return None #                                                                                       return #
+    # end                                                                                                           of #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def prompt(self,
+               messages: list[dict[str, str]],
+               session: Optional[str] = None) -> tuple[list[int], list[str], Optional["StoppingCriteriaList"]]:
+        """ the tokens of the whole prompt, ending in the generation prompt, with its stop strings and criteria """
+        return self.__prompts.prompt(session, messages), list(self.__stop), self.__criteria #                  return #
+    # end                                                                                                       prompt #
+
+    def prefix(self, messages: list[dict[str, str]], session: Optional[str] = None) -> list[int]:
+        """ the tokens of the prompt up to the end of the last message's text, every prompt whose last message
+            starts with that text begins with them
+        """
+        return self.__prompts.prefix(session, messages) #                                                       return #
+    # end                                                                                                       prefix #
+
+    # -------------------------------------------------- properties -------------------------------------------------- #
+
+    @property
+    def incremental(self) -> bool:
+        return self.__prompts.incremental
+    # end                                                                                                  incremental #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _render(self, messages: list[dict[str, str]], generation_prompt: bool) -> str:
+        return self.__formatters[generation_prompt](messages=messages).prompt #                                 return #
+    # end                                                                                                      _render #
+
+    def _tokenize(self, prompt: str, first: bool) -> list[int]:
+        add_bos: bool = first and not self.__added_special
+        return self.__llama.tokenize(prompt.encode("utf-8"), add_bos=add_bos, special=True) #                  return #
+    # end                                                                                                    _tokenize #
+# end                                                                                                     ChatTemplate #
@@ -14,7 +14,10 @@ logger: logging.Logger = logging.getLogger("rich")
 # ---------------------------------------------------- models -------------------------------------------------------- #
 
 class AudioData(BaseModel):
-    ...
+    format:      Literal["pcm16", "f32", "opus"] = Field("pcm16", description="little endian 16 bit / float32 pcm, "
+                                                                             "or ogg / webm opus")
+    sample_rate: int                             = Field(16000, description="the sample rate of pcm audio")
+    channels:    int                             = Field(1, description="the interleaved channels of pcm audio")
 # end                                                                                                        AudioData #
 
 class ImageData(BaseModel):
@@ -23,7 +26,11 @@ class ImageData(BaseModel):
 # end                                                                                                        ImageData #
 
 class TranscribedText(BaseModel):
-    ...
+    segment: int   = Field(..., description="the index of the speech segment, shared by its partials and its final")
+    text:    str   = Field(..., description="the transcript of the segment so far")
+    final:   bool  = Field(..., description="whether the segment ended, later results never change its text")
+    start:   float = Field(..., description="the start of the segment in seconds since the stream began")
+    end:     float = Field(..., description="the end of the audio transcribed, in seconds since the stream began")
 # end                                                                                                  TranscribedText #
 
 class TrainingRequest(BaseModel):
@@ -57,6 +64,16 @@ class ChatRequest(BaseModel):
     
     seed:        Optional[int]             = Field(None, description="the random seed for sampling")
     images:      Optional[list[ImageData]] = Field(None, description="the images to use for chat")
+    model:       Optional[str]             = Field(None, description="the registered model to use, routed if omitted")
+    session_id:  Optional[str]             = Field(None, description="the conversation to continue, 'default' if omitted")
+
+    max_tokens:  Optional[int]             = Field(None, ge=1, description="the most tokens to generate, the server's "
+                                                                          "default if omitted, capped by the server")
+    deadline_ms: Optional[int]             = Field(None, ge=1, description="milliseconds the answer may take from the "
+                                                                          "request on, the server's default if omitted")
+    stop:        Optional[list[str]]       = Field(None, description="sequences that end the answer, not included in it")
+    priority:    Literal["interactive", "batch"] = Field("interactive", description="batch answers give the model up "
+                                                                                "to interactive ones between tokens")
 # end                                                                                                      ChatRequest #
 
 class ChatResponse(BaseModel):
@@ -70,6 +87,29 @@ class ChatResponse(BaseModel):
                                                           "'length', 'function_call'")
 # end                                                                                                     ChatResponse #
 
+class KnowledgeText(BaseModel):
+    source: str = Field(..., description="where the text comes from, e.g. the lecture or the book and page")
+    text:   str = Field(..., description="the transcript or page text to index")
+    kind:   Literal["transcript", "textbook"] = Field("transcript", description="what kind of material the text is")
+# end                                                                                                    KnowledgeText #
+
+class TokenizeRequest(BaseModel):
+    texts:      list[str]     = Field(..., description="the texts to count the tokens of")
+    model:      Optional[str] = Field(None, description="the registered model whose vocabulary to use, the default "
+                                                        "model if omitted")
+    session_id: Optional[str] = Field(None, description="also report how much of the context this conversation uses")
+    ids:        bool          = Field(False, description="return the token ids, not only their number")
+    special:    bool          = Field(False, description="parse special tokens like <|eot_id|> in the texts")
+# end                                                                                                  TokenizeRequest #
+
+class EmbeddingsRequest(BaseModel):
+    texts:  list[str]     = Field(..., description="the texts to embed")
+    model:  Optional[str] = Field(None, description="the registered model to embed with, the default model if omitted")
+    format: Literal["float", "base64", "binary"] = Field("float", description="'float' lists the numbers, 'base64' "
+                                                          "encodes every vector's little endian float32 bytes, "
+                                                          "'binary' answers with the raw float32 matrix")
+# end                                                                                                EmbeddingsRequest #
+
 
 
 # ----------------------------------------------------- utils -------------------------------------------------------- #
@@ -0,0 +1,277 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import os
+import time
+import threading
+
+from collections import OrderedDict
+from pathlib     import Path
+from typing      import TYPE_CHECKING, Optional
+
+from Server.config.read_config import Config
+
+# numpy and llama_cpp are only needed once something is embedded, the server starts without them
+if TYPE_CHECKING:
+    import numpy as np
+    from llama_cpp import Llama
+    from Server.ai.backends.base import InferenceBackend
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.core.errors    import ModelFailedToLoad, ModelNotFoundError
+from Server.ai.core.tokenizer import text_key
+from Server.ai.utils.metrics  import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- embeddings ---------------------------------------------------- #
+
+class Embedder:
+    """ Embedder
+        Embedder - a second llama instance of a local gguf opened in embedding mode. the weights are memory mapped,
+                   so embedding with the chat model's own file shares its pages and only costs the compute buffers
+
+        the model is loaded on first use, every call is serialized on one lock (a llama context is not thread safe)
+
+        ```python
+        >>> embedder = Embedder.shared()
+        >>> vectors, tokens = embedder.embed(["what is entropy?", "the second law of thermodynamics"])
+        >>> vectors.shape, tokens
+        ((2, 4096), [6, 7])
+        ```
+
+        Args:
+            model_path (Path): the gguf to embed with
+            n_ctx (int): the context size, longer texts are truncated
+    """
+
+    _instance: Optional["Embedder"] = None
+    _instance_lock: threading.Lock   = threading.Lock()
+
+    def __init__(self, model_path: Path, n_ctx: int = 512) -> None:
+        self.__path:  Path              = model_path
+        self.__n_ctx: int               = n_ctx
+        self.__lock:  threading.Lock    = threading.Lock()
+        self.__model: Optional["Llama"] = None
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def shared(cls) -> "Embedder":
+        """ the process wide embedder, `[embeddings] model` or the default chat model if it is not set """
+        with cls._instance_lock:
+            if cls._instance is None:
+                from Server.ai.core.model_registry import DEFAULT_MODEL_PATH
+
+                path: Path = Path(
+                    Config.embeddings_model
+                    or Config.models.get(Config.default_model, {}).get("path")
+                    or DEFAULT_MODEL_PATH
+                )
+                cls._instance = cls(path if path.is_absolute() else Path(os.getcwd(), path), Config.embeddings_context)
+
+            return cls._instance #                                                                              return #
+    # end                                                                                                       shared #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def embed(self, texts: list[str]) -> tuple["np.ndarray", list[int]]:
+        """ Embedder.embed
+            embed - embeds a batch of texts, token level outputs of models without pooling are mean pooled
+
+            Args:
+                texts (list[str]): the texts to embed
+
+            Returns:
+                tuple[np.ndarray, list[int]]: a float32 (len(texts), dim) matrix of L2 normalized rows and the
+                                              number of tokens of each text
+
+            Raises:
+                ModelNotFoundError: if the gguf does not exist
+                ModelFailedToLoad: if llama.cpp can not open it in embedding mode
+        """
+        import numpy as np
+
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32), [] #                                                     return #
+
+        with self.__lock:
+            model: "Llama" = self._load()
+            start: float   = time.perf_counter()
+
+            tokens: list[int] = [len(model.tokenize(text.encode("utf-8"), add_bos=False)) for text in texts]
+            raw = model.embed(texts, truncate=True)
+
+        rows: list[np.ndarray] = []
+        for item in raw:
+            vector: np.ndarray = np.asarray(item, dtype=np.float32)
+            rows.append(vector.mean(axis=0) if vector.ndim == 2 else vector)
+
+        matrix: np.ndarray = np.vstack(rows)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+        Metrics.observe("embeddings.seconds", time.perf_counter() - start)
+        Metrics.increment("embeddings.texts", len(texts))
+        return matrix, tokens #                                                                                 return #
+    # end                                                                                                        embed #
+
+    @property
+    def dimension(self) -> int:
+        with self.__lock:
+            return self._load().n_embd() #                                                                      return #
+    # end                                                                                                    dimension #
+
+    @property
+    def model_path(self) -> Path:
+        return self.__path
+    # end                                                                                                   model_path #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _load(self) -> "Llama":
+        """ opens the gguf on first use, the caller holds the lock """
+        if self.__model is not None:
+            return self.__model #                                                                               return #
+
+        if not self.__path.exists():
+            raise ModelNotFoundError(f"Embedding model not found: {self.__path}")
+
+        from llama_cpp import Llama
+
+        start: float = time.perf_counter()
+
+        try:
+            self.__model = Llama(
+                model_path   = str(self.__path),
+                embedding    = True,
+                n_ctx        = self.__n_ctx,
+                n_batch      = self.__n_ctx,
+                n_gpu_layers = -1,
+                verbose      = False,
+            )
+        except Exception as e:
+            raise ModelFailedToLoad(f"Embedding model failed to load: {self.__path} -> {e}")
+
+        Metrics.observe("embeddings.load_seconds", time.perf_counter() - start)
+        logger.info(f"embedding model loaded from {self.__path.name}")
+        return self.__model #                                                                                   return #
+    # end                                                                                                        _load #
+# end                                                                                                         Embedder #
+
+class EmbeddingCache:
+    """ EmbeddingCache
+        EmbeddingCache - the embeddings of a model's backend with a memo of the texts it has already embedded,
+                         for clients that send the same notes, questions and answers again and again
+
+        vectors are cached per text (keyed by its blake2b hash) as float32 rows, least recently used first,
+        until `budget_bytes` is exceeded. the texts that are not cached are sent to the backend `batch_size` at a
+        time, llama.cpp packs every call into as few decodes of its embedding context as the batch allows. a
+        text repeated in one request is embedded once
+
+        ```python
+        >>> embeddings = model.embeddings
+        >>> vectors, tokens = embeddings.embed(["what is entropy?", "the second law", "what is entropy?"])
+        >>> vectors.shape, vectors.dtype, tokens
+        ((3, 4096), dtype('float32'), [5, 3, 5])
+        ```
+
+        Args:
+            backend (InferenceBackend): the model whose embeddings are cached
+            budget_bytes (int): vectors kept in the cache
+            batch_size (int): texts sent to the backend per call
+    """
+
+    def __init__(self, backend: "InferenceBackend", budget_bytes: int = 64 * 1024 * 1024, batch_size: int = 64) -> None:
+        self.__backend: "InferenceBackend"                           = backend
+        self.__budget:  int                                          = budget_bytes
+        self.__batch:   int                                          = max(1, batch_size)
+        self.__lock:    threading.Lock                               = threading.Lock()
+        self.__cache:   OrderedDict[bytes, tuple["np.ndarray", int]] = OrderedDict() # least recently used first
+        self.__bytes:   int                                          = 0
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def from_config(cls, backend: "InferenceBackend") -> "EmbeddingCache":
+        return cls(
+            backend,
+            budget_bytes = int(Config.embeddings_cache_mb * 1024 * 1024),
+            batch_size   = Config.embeddings_batch_size,
+        ) #                                                                                                     return #
+    # end                                                                                                  from_config #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def embed(self, texts: list[str]) -> tuple["np.ndarray", list[int]]:
+        """ EmbeddingCache.embed
+            embed - embeds a batch of texts, texts seen before (or twice in the batch) are only looked up
+
+            Args:
+                texts (list[str]): the texts to embed
+
+            Returns:
+                tuple[np.ndarray, list[int]]: a float32 (len(texts), dim) matrix of L2 normalized rows and the
+                                              number of tokens of each text
+        """
+        import numpy as np
+
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32), [] #                                                     return #
+
+        keys:  list[bytes]                          = [text_key(text) for text in texts]
+        found: dict[bytes, tuple[np.ndarray, int]] = {}
+
+        with self.__lock:
+            for key in keys:
+                if key not in found and (item := self.__cache.get(key)) is not None:
+                    self.__cache.move_to_end(key)
+                    found[key] = item
+
+        missing: list[tuple[bytes, str]] = list({
+            key: text for key, text in zip(keys, texts) if key not in found
+        }.items())
+        for offset in range(0, len(missing), self.__batch):
+            batch: list[tuple[bytes, str]] = missing[offset:offset + self.__batch]
+            matrix, tokens = self.__backend.embed([text for _, text in batch])
+
+            # copies, a row of `matrix` would keep the whole batch alive
+            embedded: dict[bytes, tuple[np.ndarray, int]] = {
+                key: (np.array(matrix[row], dtype=np.float32), tokens[row]) for row, (key, _) in enumerate(batch)
+            }
+            self._store(embedded)
+            found.update(embedded)
+
+        Metrics.increment("embeddings.cache_hits", len(keys) - len(missing))
+        Metrics.increment("embeddings.cache_misses", len(missing))
+
+        return np.vstack([found[key][0] for key in keys]), [found[key][1] for key in keys] #                    return #
+    # end                                                                                                        embed #
+
+    # -------------------------------------------------- properties -------------------------------------------------- #
+
+    @property
+    def cached_bytes(self) -> int:
+        return self.__bytes
+    # end                                                                                                 cached_bytes #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _store(self, embedded: dict[bytes, tuple["np.ndarray", int]]) -> None:
+        with self.__lock:
+            for key, (vector, tokens) in embedded.items():
+                if key in self.__cache:
+                    continue
+
+                self.__cache[key] = (vector, tokens)
+                self.__bytes += vector.nbytes + len(key)
+
+            while self.__bytes > self.__budget and self.__cache:
+                key, (vector, _) = self.__cache.popitem(last=False)
+                self.__bytes -= vector.nbytes + len(key)
+                Metrics.increment("embeddings.evicted")
+
+            Metrics.set_gauge("embeddings.cached_bytes", self.__bytes, model=self.__backend.name)
+    # end                                                                                                       _store #
+# end                                                                                                   EmbeddingCache #
@@ -11,3 +11,9 @@ class ModelTypeNotSupported(Exception):
 
 class ModelTookTooLongToLoad(Exception):
     pass
+
+class SessionBusyError(Exception):
+    pass
+
+class SessionNotFoundError(Exception):
+    pass
@@ -0,0 +1,286 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import os
+import io
+import json
+import mmap
+import time
+import struct
+import threading
+
+from pathlib import Path
+from typing  import Any, BinaryIO, Callable, Optional
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.core.errors   import ModelNotFoundError, ModelTypeNotSupported
+from Server.ai.utils.metrics import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ------------------------------------------------------ gguf -------------------------------------------------------- #
+
+GGUF_MAGIC: bytes = b"GGUF"
+
+# value type id -> (struct format, size), strings (8) and arrays (9) are handled separately
+GGUF_SCALAR_TYPES: dict[int, tuple[str, int]] = {
+    0:  ("<B", 1), # uint8
+    1:  ("<b", 1), # int8
+    2:  ("<H", 2), # uint16
+    3:  ("<h", 2), # int16
+    4:  ("<I", 4), # uint32
+    5:  ("<i", 4), # int32
+    6:  ("<f", 4), # float32
+    7:  ("<?", 1), # bool
+    10: ("<Q", 8), # uint64
+    11: ("<q", 8), # int64
+    12: ("<d", 8), # float64
+}
+GGUF_STRING: int = 8
+GGUF_ARRAY:  int = 9
+
+def read_gguf_metadata(path: Path) -> dict[str, Any]:
+    """ read_gguf_metadata
+        read_gguf_metadata - parses the key/value header of a gguf file without touching the tensor data,
+                             arrays (e.g. the 128k entry token list) are skipped and only their length is kept
+
+        Args:
+            path (Path): the gguf file
+
+        Returns:
+            dict[str, Any]: every scalar and string key plus `{"type": ..., "length": ...}` for arrays
+
+        Raises:
+            ModelTypeNotSupported: if the file is not a gguf v2+ file or its header is truncated or corrupt
+    """
+    with open(path, "rb", buffering=1024 * 1024) as file:
+        try:
+            if file.read(4) != GGUF_MAGIC:
+                raise ModelTypeNotSupported(f"not a gguf file: {path}")
+
+            version: int = _unpack(file, "<I", 4)
+            if version < 2:
+                raise ModelTypeNotSupported(f"gguf v{version} is not supported: {path}")
+
+            tensor_count: int = _unpack(file, "<Q", 8)
+            kv_count:     int = _unpack(file, "<Q", 8)
+
+            metadata: dict[str, Any] = {"gguf.version": version, "gguf.tensor_count": tensor_count}
+
+            for _ in range(kv_count):
+                key:        str = _read_string(file)
+                value_type: int = _unpack(file, "<I", 4)
+
+                if value_type == GGUF_ARRAY:
+                    item_type: int = _unpack(file, "<I", 4)
+                    length:    int = _unpack(file, "<Q", 8)
+                    _skip_array(file, item_type, length)
+                    metadata[key] = {"type": item_type, "length": length}
+                else:
+                    metadata[key] = _read_value(file, value_type)
+
+            return metadata #                                                                                   return #
+        except (struct.error, UnicodeDecodeError, EOFError, OverflowError) as e: # truncated or corrupt header
+            raise ModelTypeNotSupported(f"corrupt gguf header: {path}: {e}") from e
+# end                                                                                           read_gguf_metadata #
+
+def summarize_gguf_metadata(metadata: dict[str, Any]) -> dict[str, Any]:
+    """ summarize_gguf_metadata
+        summarize_gguf_metadata - picks the architecture dependent keys the server actually needs
+
+        Returns:
+            dict[str, Any]: architecture, context length, layer/head counts, tokenizer info and chat template
+    """
+    arch:   str                 = str(metadata.get("general.architecture", "unknown"))
+    tokens: dict[str, Any] | Any = metadata.get("tokenizer.ggml.tokens", {})
+
+    return {
+        "architecture":     arch,
+        "name":             metadata.get("general.name"),
+        "file_type":        metadata.get("general.file_type"),
+        "context_length":   metadata.get(f"{arch}.context_length"),
+        "embedding_length": metadata.get(f"{arch}.embedding_length"),
+        "block_count":      metadata.get(f"{arch}.block_count"),
+        "head_count":       metadata.get(f"{arch}.attention.head_count"),
+        "head_count_kv":    metadata.get(f"{arch}.attention.head_count_kv", metadata.get(f"{arch}.attention.head_count")),
+        "key_length":       metadata.get(f"{arch}.attention.key_length"),
+        "value_length":     metadata.get(f"{arch}.attention.value_length"),
+        "tokenizer_model":  metadata.get("tokenizer.ggml.model"),
+        "vocab_size":       tokens.get("length") if isinstance(tokens, dict) else None,
+        "bos_token_id":     metadata.get("tokenizer.ggml.bos_token_id"),
+        "eos_token_id":     metadata.get("tokenizer.ggml.eos_token_id"),
+        "chat_template":    metadata.get("tokenizer.chat_template"),
+        "tensor_count":     metadata.get("gguf.tensor_count"),
+    } #                                                                                                         return #
+# end                                                                                      summarize_gguf_metadata #
+
+class GGUFIndex:
+    """ GGUFIndex
+        GGUFIndex - a json sidecar caching the summarized header of every gguf file the server has seen, keyed by
+                    absolute path and invalidated when the file size or mtime changes, so validation and `/health`
+                    never re-parse a multi-GB file after the first start
+
+        ```python
+        >>> index = GGUFIndex(Path("Server", "models", ".gguf_index.json"))
+        >>> index.get(Path("Server", "models", "ggml-model-Q4_K_M-llama-3-8B.gguf"))["context_length"]
+        8192
+        ```
+    """
+
+    def __init__(self, index_path: Path) -> None:
+        self.__path:    Path                      = index_path
+        self.__lock:    threading.Lock            = threading.Lock()
+        self.__entries: dict[str, dict[str, Any]] = {}
+
+        if index_path.exists():
+            try:
+                with open(index_path, "r") as file:
+                    self.__entries = json.load(file)
+            except (OSError, ValueError) as e:
+                logger.warning(f"ignoring unreadable gguf index {index_path}: {e}")
+    # end                                                                                                     __init__ #
+
+    def get(self, path: Path) -> dict[str, Any]:
+        """ GGUFIndex.get
+            get - returns the cached summary for `path`, parsing and persisting it on a miss
+
+            Raises:
+                ModelNotFoundError: if the file does not exist
+                ModelTypeNotSupported: if the file is not a gguf file
+        """
+        path = path.absolute()
+
+        if not path.exists():
+            raise ModelNotFoundError(f"Model not found: {path}")
+
+        stat: os.stat_result = path.stat()
+        key:  str            = str(path)
+
+        with self.__lock:
+            entry: Optional[dict[str, Any]] = self.__entries.get(key)
+
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                Metrics.increment("gguf_index.hit")
+                return entry["metadata"] #                                                                      return #
+
+        start:    float          = time.perf_counter()
+        metadata: dict[str, Any] = summarize_gguf_metadata(read_gguf_metadata(path))
+
+        Metrics.increment("gguf_index.miss")
+        Metrics.observe("gguf_index.parse_seconds", time.perf_counter() - start)
+
+        with self.__lock:
+            self.__entries[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "metadata": metadata}
+            self._save()
+
+        return metadata #                                                                                       return #
+    # end                                                                                                          get #
+
+    def _save(self) -> None:
+        """ writes the index atomically so a crash mid write never leaves a truncated sidecar """
+        temp_path: Path = self.__path.with_suffix(".tmp")
+
+        try:
+            self.__path.parent.mkdir(parents=True, exist_ok=True)
+            with open(temp_path, "w") as file:
+                json.dump(self.__entries, file)
+            os.replace(temp_path, self.__path)
+        except OSError as e:
+            logger.warning(f"failed to persist gguf index {self.__path}: {e}")
+    # end                                                                                                        _save #
+# end                                                                                                        GGUFIndex #
+
+# --------------------------------------------------- readahead ------------------------------------------------------ #
+
+def readahead(paths: list[Path], on_done: Optional[Callable[[Path, float], None]] = None) -> threading.Thread:
+    """ readahead
+        readahead - asks the kernel to start paging the given files into the page cache in the background, so
+                    the mmap in `Llama(...)` finds the weights resident instead of faulting them in one page at a
+                    time. uses posix_fadvise(WILLNEED) where available and falls back to madvise(WILLNEED) on a
+                    read only mapping (macOS)
+
+        Args:
+            paths (list[Path]): the files to read ahead, missing files are skipped
+            on_done (Optional[Callable[[Path, float], None]]): called with each file and the seconds it took
+
+        Returns:
+            threading.Thread: the (daemon) thread doing the work
+    """
+    def _run() -> None:
+        for path in paths:
+            if not path.exists():
+                continue
+
+            start: float = time.perf_counter()
+
+            try:
+                _advise_willneed(path)
+            except OSError as e:
+                logger.warning(f"readahead failed for {path}: {e}")
+                continue
+
+            elapsed: float = time.perf_counter() - start
+            Metrics.observe("startup.readahead_seconds", elapsed, file=path.name)
+            logger.info(f"readahead issued for {path.name} in {elapsed:.3f}s")
+
+            if on_done is not None:
+                on_done(path, elapsed)
+
+    thread: threading.Thread = threading.Thread(target=_run, daemon=True, name="gguf_readahead_thread")
+    thread.start()
+    return thread #                                                                                             return #
+# end                                                                                                    readahead #
+
+def _advise_willneed(path: Path) -> None:
+    with open(path, "rb") as file:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            return #                                                                                            return #
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            if hasattr(mapping, "madvise") and hasattr(mmap, "MADV_WILLNEED"):
+                mapping.madvise(mmap.MADV_WILLNEED)
+# end                                                                                             _advise_willneed #
+
+# ----------------------------------------------- private functions -------------------------------------------------- #
+
+def _unpack(file: BinaryIO, fmt: str, size: int) -> Any:
+    return struct.unpack(fmt, file.read(size))[0] #                                                             return #
+# end                                                                                                      _unpack #
+
+def _read_string(file: BinaryIO) -> str:
+    return file.read(_unpack(file, "<Q", 8)).decode("utf-8", errors="replace") #                                return #
+# end                                                                                                 _read_string #
+
+def _read_value(file: BinaryIO, value_type: int) -> Any:
+    if value_type == GGUF_STRING:
+        return _read_string(file) #                                                                             return #
+
+    if value_type not in GGUF_SCALAR_TYPES:
+        raise ModelTypeNotSupported(f"unknown gguf value type: {value_type}")
+
+    fmt, size = GGUF_SCALAR_TYPES[value_type]
+    return _unpack(file, fmt, size) #                                                                           return #
+# end                                                                                                  _read_value #
+
+def _skip_array(file: BinaryIO, item_type: int, length: int) -> None:
+    if item_type in GGUF_SCALAR_TYPES:
+        file.seek(GGUF_SCALAR_TYPES[item_type][1] * length, io.SEEK_CUR)
+        return #                                                                                                return #
+
+    if item_type == GGUF_STRING:
+        for _ in range(length):
+            file.seek(_unpack(file, "<Q", 8), io.SEEK_CUR)
+        return #                                                                                                return #
+
+    if item_type == GGUF_ARRAY:
+        for _ in range(length):
+            _skip_array(file, _unpack(file, "<I", 4), _unpack(file, "<Q", 8))
+        return #                                                                                                return #
+
+    raise ModelTypeNotSupported(f"unknown gguf array type: {item_type}")
+# end                                                                                                  _skip_array #
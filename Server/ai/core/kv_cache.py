@@ -0,0 +1,84 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+from typing import Any, Optional
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.core.errors import ModelTypeNotSupported
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- kv cache ------------------------------------------------------ #
+
+# the cache types llama.cpp accepts for `type_k` / `type_v`: the ggml type id and the bytes per element. q8_0 and
+# q4_0 store blocks of 32 values next to one f16 scale
+KV_TYPES: dict[str, tuple[int, float]] = {
+    "f16":  (1, 2.0),
+    "q8_0": (8, 34 / 32),
+    "q4_0": (2, 18 / 32),
+}
+
+def cache_types(kv_type: str, flash_attn: bool) -> tuple[str, str]:
+    """ cache_types
+        cache_types - the K and V cache types a model configured with `kv_type` gets. llama.cpp only quantizes
+                      the V cache with flash attention, without it V stays f16
+
+        Raises:
+            ModelTypeNotSupported: if `kv_type` is not one of `KV_TYPES`
+    """
+    if kv_type not in KV_TYPES:
+        raise ModelTypeNotSupported(f"unknown kv cache type '{kv_type}', expected one of {', '.join(KV_TYPES)}")
+
+    return kv_type, kv_type if flash_attn else "f16" #                                                          return #
+# end                                                                                                  cache_types #
+
+def kv_bytes(metadata: dict[str, Any], n_ctx: int, kv_type: str = "f16", flash_attn: bool = False) -> Optional[int]:
+    """ kv_bytes
+        kv_bytes - the kv cache of one sequence of `n_ctx` tokens of a model, from its summarized gguf header.
+                   every layer keeps a key and a value vector per kv head and token
+
+        Args:
+            metadata (dict[str, Any]): `summarize_gguf_metadata` of the model
+            n_ctx (int): the context size
+            kv_type (str): one of `KV_TYPES`
+            flash_attn (bool): whether the V cache can be quantized too
+
+        Returns:
+            Optional[int]: the bytes, None if the header lacks the layer or head counts or gives
+                           them per layer
+    """
+    layers:    Any = metadata.get("block_count")
+    heads:     Any = metadata.get("head_count")
+    heads_kv:  Any = metadata.get("head_count_kv") or heads
+    embedding: Any = metadata.get("embedding_length")
+
+    if not layers or not heads or not heads_kv or not embedding:
+        return None #                                                                                           return #
+
+    # some architectures give the head counts per layer, the header summary only keeps such an array's type and
+    # length ({"type", "length"}), so the size is unknown
+    if any(isinstance(metadata.get(key), dict) for key in ("block_count", "head_count", "head_count_kv",
+                                                             "embedding_length", "key_length", "value_length")):
+        return None #                                                                                           return #
+
+    key_length:   int = int(metadata.get("key_length") or int(embedding) // int(heads))
+    value_length: int = int(metadata.get("value_length") or int(embedding) // int(heads))
+
+    type_k, type_v = cache_types(kv_type, flash_attn)
+    per_token: float = int(heads_kv) * int(layers) * (
+        key_length * KV_TYPES[type_k][1] + value_length * KV_TYPES[type_v][1]
+    )
+    return int(n_ctx * per_token) #                                                                             return #
+# end                                                                                                     kv_bytes #
+
+def max_sequences(budget_bytes: int, per_sequence: Optional[int]) -> Optional[int]:
+    """ the sequences whose kv caches fit `budget_bytes`, at least one. None without a budget or a known size """
+    if budget_bytes <= 0 or not per_sequence:
+        return None #                                                                                           return #
+
+    return max(1, budget_bytes // per_sequence) #                                                               return #
+# end                                                                                                max_sequences #
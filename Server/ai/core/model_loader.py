@@ -2,30 +2,36 @@
 
 import gc
 import os
+import time
 import threading
 
 from pathlib            import Path
 from concurrent.futures import TimeoutError
-from typing             import Iterator, Optional, Union
-
-from llama_cpp import ChatCompletionRequestMessage
+from typing             import TYPE_CHECKING, Any, Iterator, Optional, Union
 
 from Server.config.read_config import Config
 
-try:
-    from llama_cpp                   import CreateChatCompletionStreamResponse, Llama
-    from llama_cpp.llama_chat_format import Llava15ChatHandler, MoondreamChatHandler
-    from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
-except ImportError:
-    pass
+if TYPE_CHECKING:
+    from Server.ai.backends.base import InferenceBackend
 
 # -------------------------------------------------- local imports --------------------------------------------------- #
 
 import logging
 
-from Server.ai.context.chat_context    import ChatContext
+from Server.ai.context.chat_context    import ChatContext, SingleChatContent
+from Server.ai.context.compaction      import CAPTION_PROMPT, CaptionCache
+from Server.ai.context.images          import ImageStore
+from Server.ai.context.sessions        import SessionManager
+from Server.ai.core.chat_template      import has_images
 from Server.ai.core.data_structures    import BaseChatConfig, ChatRequest, ChatResponse
+from Server.ai.core.embeddings         import EmbeddingCache
+from Server.ai.core.repetition         import RepetitionDetector
+from Server.ai.core.scheduler          import Scheduler, Slot
+from Server.ai.core.tokenizer          import Tokenizer
+from Server.ai.backends.base           import create_backend
 from Server.ai.core.errors             import ModelFailedToLoad, ModelNotFoundError, ModelTookTooLongToLoad
+from Server.ai.core.errors             import SessionNotFoundError
+from Server.ai.utils.metrics           import Metrics
 
 # -------------------------------------------------- set up logging -------------------------------------------------- #
 
@@ -41,6 +47,49 @@ class Hub:
     # end                                                                                                     __init__ #
 # end                                                                                                              Hub #
 
+class LoadTimeline:
+    """ LoadTimeline
+        LoadTimeline - records when each component of a model (the language model, the clip projector) started
+                       and finished loading, so overlapping loads can be inspected on `/health`
+    """
+
+    def __init__(self) -> None:
+        self.__lock:       threading.Lock                  = threading.Lock()
+        self.__origin:     float                           = time.perf_counter()
+        self.__components: dict[str, dict[str, Any]]       = {}
+    # end                                                                                                     __init__ #
+
+    def start(self, component: str) -> None:
+        with self.__lock:
+            self.__components[component] = {
+                "status":  "loading",
+                "started": round(time.perf_counter() - self.__origin, 3),
+            }
+    # end                                                                                                        start #
+
+    def finish(self, component: str, error: Optional[BaseException] = None) -> float:
+        """ marks a component as loaded (or failed) and returns how long it took in seconds """
+        with self.__lock:
+            entry: dict[str, Any] = self.__components[component]
+
+            entry["finished"] = round(time.perf_counter() - self.__origin, 3)
+            entry["seconds"]  = round(entry["finished"] - entry["started"], 3)
+            entry["status"]   = "failed" if error is not None else "ready"
+
+            if error is not None:
+                entry["error"] = str(error)
+
+        logger.info(f"{component} {entry['status']} after {entry['seconds']:.2f}s "
+                    f"(t={entry['started']:.2f}s -> t={entry['finished']:.2f}s)")
+        return entry["seconds"] #                                                                               return #
+    # end                                                                                                       finish #
+
+    def as_dict(self) -> dict[str, dict[str, Any]]:
+        with self.__lock:
+            return {component: dict(entry) for component, entry in self.__components.items()} #                return #
+    # end                                                                                                      as_dict #
+# end                                                                                                     LoadTimeline #
+
 class Model:
     """ this class will contain the high-level managed api for the following:
             - loading the model
@@ -108,6 +157,11 @@ class Model:
             timeout (Optional[int]): the time to wait for the model to load in
                                      seconds default is -1 (wait indefinitely)
 
+            sessions (Optional[SessionManager]): the sessions, the shared manager by default
+
+            backend (Optional[InferenceBackend]): the engine that runs the model, `[inference] backend`
+                                                  built for `pretrained` by default
+
         Raises:
             NotImplementedError:    incase a function is not implemented
             ModelNotFoundError:     if the model is not found
@@ -123,22 +177,21 @@ class Model:
                  /,
                  image_processor_path: Optional[Path] = None ,
                  multi_model: Optional[bool]          = False, # this is to not check for clip in pretrained
-                 timeout: Optional[int]               = -1   ) -> None:
+                 timeout: Optional[int]               = -1   ,
+                 sessions: Optional[SessionManager]   = None ,
+                 backend: Optional["InferenceBackend"] = None) -> None:
 
         self.__model_name: str = ""
         self.__is_hub: bool = False
 
-        self.__clip_model_path:  Optional[Llava15ChatHandler] = None
         self.__clip_path:        Optional[str]                = None
-        self.__context:          ChatContext                  = ChatContext()
+        self.__sessions:         SessionManager               = sessions or SessionManager.shared()
 
         if isinstance(pretrained, Hub):
             self.__is_hub = True
-            self.__file_name: str = pretrained.file_name
             self.__model_name = pretrained.model_name
 
             if multi_model:
-                self.__clip_model_path = None
                 self.__clip_path = pretrained.clip_name
 
         elif isinstance(pretrained, Path):
@@ -146,21 +199,37 @@ class Model:
             self.__model_name = str(pretrained.absolute())
             logger.info(f"Loading model: {self.__model_name}")
 
-            if not os.path.exists(self.__model_name):
-                raise ModelNotFoundError(f"Model not found: {self.__model_name}")
-
             if image_processor_path is not None:
-                self.__clip_model_path = None
                 self.__clip_path       = str(image_processor_path)
 
         else:
             raise ModelNotFoundError(f"Model not found: {pretrained}")
 
+        # a missing gguf is reported here by the llama backend, the others do not read it
+        self.__backend: "InferenceBackend" = backend or create_backend(None, pretrained, self.__clip_path)
+
+        self.__tokenizer:  Tokenizer      = Tokenizer.from_config(self.__backend)
+        self.__embeddings: EmbeddingCache = EmbeddingCache.from_config(self.__backend)
+
         self.__config:        Config  = Config
-        self.__multi_model:     bool  = True if self.__clip_path is not None else False
+        self.__multi_model:     bool  = self.__backend.multimodal
         self.__timeout:          int  = timeout if timeout is not None else -1
         self.__is_model_loaded: bool  = True
-        self.__model: Optional[Llama] = None
+        self.__ready: threading.Event = threading.Event() # set once the language model finished loading
+        self.__vision_ready: threading.Event = threading.Event() # set once the projector finished loading
+        self.__attach_lock: threading.Lock = threading.Lock()
+        self.__load_seconds: Optional[float] = None
+        self.__timeline: LoadTimeline = LoadTimeline()
+        self.__scheduler: Scheduler = Scheduler( # one generation at a time on the llama instance, most urgent first
+            preemption      = Config.scheduler_preemption,
+            time_slice_ms   = Config.scheduler_time_slice_ms,
+            max_preemptions = Config.scheduler_max_preemptions,
+        )
+        self.__active_session: Optional[str] = None    # whose kv state the llama instance currently holds
+        self.__head_state: Optional[Any] = None        # the active session's last checkpoint while the kv is unchanged
+
+        if not self.__multi_model:
+            self.__vision_ready.set()
         
         # create a new thread to load the model asynchronously with concurrent.futures
         logger.info("starting model load")
@@ -176,23 +245,19 @@ class Model:
 
         except Exception as e:
             raise ModelFailedToLoad(f"Model failed to load: {self.__model_name} -> {e}")
-
-        finally:
-            logger.info("starting garbage collection")
-            gc.collect() # collect garbage to free up memory
-            logger.info("garbage collection done")
     # end                                                                                                     __init__ #
 
     def __del__(self) -> None:
         self._unload_model()
     # end                                                                                                      __del__ #
 
-    def predict(self, request: ChatRequest) -> Iterator[ChatResponse]:
+    def predict(self, request: ChatRequest, pipelined: bool = False) -> Iterator[ChatResponse]:
         """ Generates predictions based on the given chat request using the loaded model.
             Yields chat responses as they are generated.
 
             Args:
                 request (ChatRequest): The chat request containing text and images.
+                pipelined (bool): The turn follows `prefill` calls for its question, render it the same way.
 
             Returns:
                 Iterator[ChatResponse]: An iterator of chat responses in web compatible format.
@@ -202,34 +267,158 @@ class Model:
                 ModelTookTooLongToLoad: If the model took too long to load.
         """
         logger.info("Predicting")
+        started: float = time.monotonic() # the deadline counts the wait for the model too
 
-        if self.__model is None:
+        if not self.__backend.loaded:
             # threading.Thread(target=self.__loaded_model.join, daemon=True, kwargs={"timeout": self.__timeout if self.__timeout > 0 else None}).start()
             logger.warning("Waiting for model to load")
 
         if self.__is_model_loaded is False:
             raise ModelFailedToLoad("Model did not start loading or is unloaded")
 
-        # time_counter: int = 0
-        while self.__model is None:
-            # time.sleep(1)
-            # time_counter += 1
-            #
-            # if time_counter >= self.__timeout: # and self.__timeout > 0:
-            #    self.__loaded_model.join(timeout=0.1)
-            #    raise ModelTookTooLongToLoad("Model took too long to load")
-            # FIXME this causes a segfault
-            pass
-
-        if self.__model is None:
+        # block on the event instead of spinning, a busy loop here steals the GIL from the load thread
+        if not self.wait_until_ready():
+            raise ModelTookTooLongToLoad("Model took too long to load")
+
+        if not self.__backend.loaded:
             raise ModelFailedToLoad("Model failed to load")
 
+        # text only requests are served as soon as the language model is up, anything that involves an image
+        # (now or earlier in the context) waits for the projector
+        context: ChatContext = self.__sessions.get(request.session_id)
+
+        if self.__multi_model and (request.images or context.total_images > 0):
+            if not self.__vision_ready.is_set():
+                logger.warning("Waiting for image processor to load")
+
+            if not self.wait_until_vision_ready():
+                raise ModelTookTooLongToLoad("Image processor took too long to load")
+
+        with self.__scheduler.slot(request.priority, context.session_id) as slot, \
+                self.__sessions.lease(context.session_id) as context:
+            self._switch_session(context.session_id)
+            yield from self._generate(context, request, pipelined, started, slot)
+    # end                                                                                                      predict #
+
+    def prefill(self, session_id: Optional[str], text: str) -> int:
+        """ Evaluates the prompt of a question that is still being asked, up to the end of `text`, into the kv
+            cache of the session. The pipelined turn that follows only evaluates what came after `text`.
+            Never waits: while the model is loading or generating nothing is done.
+
+            Args:
+                session_id (Optional[str]): The conversation the question belongs to, 'default' if None.
+                text (str): The beginning of the question, e.g. the stable part of a live transcript.
+
+            Returns:
+                int: The tokens evaluated, 0 if the prompt could not be prefilled now.
+        """
+        # relevant history mode picks the turns by the final question, a prefix of another history is wasted work
+        if not self.is_ready or not self.__backend.can_prefill or Config.history_mode == "relevant":
+            return 0 #                                                                                          return #
+
+        session_id = self.__sessions.get(session_id).session_id
+
+        with self.__scheduler.try_slot("interactive", session_id) as slot, self.__sessions.lease(session_id) as context:
+            if slot is None:
+                Metrics.increment("prefill.skipped", reason="busy")
+                return 0 #                                                                                      return #
+
+            # the turns the context no longer holds are not part of the pipelined turn's prompt either
+            window:   list[int] = [0, *range(context.window_start, len(context.contexts))]
+            messages: list[dict[str, Any]] = context.get_context(indices=window) + [{"role": "user", "content": text}]
+
+            # a vision model renders image turns through its own handler, its prompt differs from the template's
+            if self.__backend.vision and has_images(messages):
+                Metrics.increment("prefill.skipped", reason="images")
+                return 0 #                                                                                      return #
+
+            self._switch_session(context.session_id)
+            self.__head_state = None # the kv state is about to change
+
+            return self.__backend.prefill(messages, context.session_id) #                                       return #
+    # end                                                                                                      prefill #
+
+    def context_usage(self, session_id: Optional[str]) -> dict[str, int]:
+        """ How much of the model's context the conversation `session_id` takes up: `used` by the turns still
+            sent to the model, `reserved` for the next answer and what `remaining` for the next question. Every
+            message is tokenized once, later calls only add up its remembered count. Only loaded sessions are
+            counted, nothing is created or restored.
+
+            Raises:
+                ModelFailedToLoad: If the model is not loaded, its vocabulary is needed.
+                SessionNotFoundError: If the session is not loaded.
+        """
+        if not self.is_ready:
+            raise ModelFailedToLoad("Model is not loaded")
+
+        context: Optional[ChatContext] = self.__sessions.peek(session_id)
+        if context is None:
+            raise SessionNotFoundError(f"session {session_id} is not loaded")
+
+        # a generation may append to the session meanwhile, count a snapshot of its messages
+        messages: list[SingleChatContent] = list(context.contexts)
+        used:     int                     = sum(
+            single.token_count(self.__tokenizer)
+            for single in [messages[0], *messages[min(context.window_start, len(messages)):]]
+        )
+        reserve:  int                     = self._reserve(self._limits(ChatRequest(text=""))[0])
+
+        return {
+            "n_ctx":     self.__backend.n_ctx,
+            "used":      used,
+            "reserved":  reserve,
+            "remaining": max(0, self.__backend.n_ctx - used - reserve),
+        } #                                                                                                     return #
+    # end                                                                                                context_usage #
+
+    def _generate(self,
+                  context: ChatContext,
+                  request: ChatRequest,
+                  pipelined: bool = False,
+                  started: Optional[float] = None,
+                  slot: Optional[Slot] = None) -> Iterator[ChatResponse]:
+        """ runs one turn of `context` on the llama instance while holding the model's `slot`, a more urgent
+            request may suspend it between tokens. the turn ends at a stop sequence, after the token budget
+            ("length") or, checked between tokens, at the deadline ("deadline") or once the answer is stuck
+            repeating itself ("repetition")
+        """
         tokens_generated: int = 0
+        finish_reason:    str = "None"
         partial_response: dict[str, Union[str, int, list[dict[str, str | dict[str, str]]]]] = {
+            "id":      "",
+            "model":   self.__model_name,
+            "created": int(time.time()),
+            "role":    "assistant",
             "content": "",
         }
 
-        self.__context.append(
+        max_tokens, deadline_seconds, stop = self._limits(request)
+        deadline: Optional[float] = (started or time.monotonic()) + deadline_seconds if deadline_seconds else None
+        detector: Optional[RepetitionDetector] = RepetitionDetector(
+            ngram      = Config.generation_repetition_ngram,
+            repeats    = Config.generation_repetition_repeats,
+            min_tokens = Config.generation_repetition_min_tokens,
+            max_period = Config.generation_repetition_max_period,
+        ) if Config.generation_repetition else None
+
+        # the wait for the model used up the whole deadline, leave the conversation as it was
+        if deadline is not None and time.monotonic() >= deadline:
+            Metrics.increment("generation.finished", reason="deadline")
+            yield ChatResponse(**partial_response, index=0, finish_reason="deadline") #                 yield return
+            return #                                                                                            return #
+
+        # a question that does not fit next to the system prompt and room for the answer is refused, the
+        # conversation stays as it was
+        reserve: int = self._reserve(max_tokens)
+        if context.contexts[0].token_count(self.__tokenizer) + self._question_tokens(request) + reserve > \
+                self.__backend.n_ctx:
+            Metrics.increment("generation.finished", reason="context")
+            yield ChatResponse(**partial_response, index=0, finish_reason="length") #                   yield return
+            return #                                                                                            return #
+
+        self.__head_state = None # the kv state is about to change
+
+        context.append(
             text=request.text,
             base64_images=[
                 f"{img_data.img_id}|data:image/png;base64,{img_data.base64_img}"
@@ -237,25 +426,56 @@ class Model:
             ] if request.images else None
         )
 
-        stream: Iterator[CreateChatCompletionStreamResponse] = self.__model.create_chat_completion(
-            messages=self.__context.get_context(),
-
-            max_tokens=None,
-            temperature=request.temperature,
-            top_k=request.top_k,
-            top_p=request.top_p,
-            seed=request.seed,
-            stream=True,
+        indices:  Optional[list[int]] = self._select_history(context)
+        messages: list[dict[str, Any]] = context.get_context(indices=indices)
+        messages[-1] = self._retrieve(messages[-1], request.text)
+        messages     = self._fit(context, indices, messages, reserve)
+
+        stream: Iterator[dict[str, Any]] = self.__backend.stream_chat(
+            messages,
+            {"temperature": request.temperature, "top_k": request.top_k, "top_p": request.top_p, "seed": request.seed},
+            max_tokens,
+            stop,
+            pipelined,
+            context.session_id,
         )
 
         logger.info(f"Got the following config for this request - "
                     f"temperature: {request.temperature}, "
                     f"top_k: {request.top_k}, "
                     f"top_p: {request.top_p}, "
-                    f"seed: {request.seed} ")
+                    f"seed: {request.seed}, "
+                    f"max_tokens: {max_tokens}, "
+                    f"deadline_s: {deadline_seconds} ")
 
+        decode_start: float = 0.0 # when the first token arrived, the prompt evaluation is not decode time
         while True:
-            try: response: ChatCompletionRequestMessage = next(stream)
+            # a remote backend's stream can not be paused, the server schedules its own slots
+            if slot is not None and self.__backend.stateful and self.__scheduler.should_yield(slot):
+                self._suspend(slot, context)
+
+            if deadline is not None and time.monotonic() >= deadline:
+                finish_reason = "deadline"
+            elif detector is not None and detector.looping:
+                finish_reason = "repetition"
+
+            if finish_reason in ("deadline", "repetition"):
+                stream.close() # stops llama.cpp before the next token
+                yield ChatResponse(
+                    id=partial_response["id"],
+                    model=partial_response["model"],
+                    created=partial_response["created"],
+                    role=partial_response["role"],
+
+                    index=0,
+                    content="",
+                    finish_reason=finish_reason
+                ) #                                                                                         yield return
+                break
+
+            try: response: dict[str, Any] = next(stream)
+            except StopIteration:
+                break
             except IndexError:
                 logger.error("Model failed to generate a response due to consuming more tokens then max_ctx tokens")
                 return ChatResponse(
@@ -281,6 +501,13 @@ class Model:
                 continue
 
             if (content := str(dict(response_choice.get("delta")).get("content", ""))):
+                tokens_generated += 1
+                if not decode_start:
+                    decode_start = time.perf_counter()
+                    Metrics.observe("generation.ttft_seconds", time.monotonic() - (started or time.monotonic()),
+                                    priority=request.priority)
+                if detector is not None:
+                    detector.feed(content)
                 partial_response["content"] += content
                 partial_response["finish_reason"] = (
                     "None"
@@ -288,6 +515,8 @@ class Model:
                     else finish_reason
                 )
 
+            finish_reason = str(response_choice["finish_reason"])
+
             yield ChatResponse(
                 id=partial_response["id"],
                 model=partial_response["model"],
@@ -296,20 +525,36 @@ class Model:
 
                 index=int(str(response_choice["index"])),
                 content=content,
-                finish_reason=(
-                    "None"
-                    if (finish_reason := str(response_choice["finish_reason"])) == "None"
-                    else finish_reason
-                )
+                finish_reason=finish_reason
             ) #                                                                                             yield return
             
-            if response_choice["finish_reason"] == "stop":
-                self.__context.append(
-                    role=str(partial_response["role"]),
-                    text=str(partial_response["content"])
-                )
+            if finish_reason in ("stop", "length"):
                 break
-    # end                                                                                                      predict #
+
+        # an answer cut short by its budget or deadline was still shown, it stays part of the conversation. of a
+        # looping answer only the first copy is kept, the copies would make the next turns loop as well
+        text: str = str(partial_response["content"])
+        context.append(
+            role=str(partial_response["role"]),
+            text=text[:detector.loop_start] if finish_reason == "repetition" else text                 # type:ignore
+        )
+        self._checkpoint(context)
+
+        Metrics.increment("generation.finished", reason=finish_reason)
+        Metrics.observe("generation.tokens", tokens_generated)
+        if finish_reason in ("length", "deadline", "repetition"):
+            # what the answer could still have generated before its budget (or the context) was used up
+            avoided: int = self.__backend.n_ctx - self.__backend.n_tokens
+            if max_tokens is not None:
+                avoided = min(avoided, max_tokens - tokens_generated)
+            Metrics.increment("generation.tokens_avoided", avoided, reason=finish_reason)
+
+            if finish_reason == "repetition" and tokens_generated > 1:
+                seconds_per_token: float = (time.perf_counter() - decode_start) / (tokens_generated - 1)
+                Metrics.increment("repetition.detected")
+                Metrics.observe("repetition.period_tokens", detector.period)                            # type:ignore
+                Metrics.increment("repetition.decode_seconds_saved", avoided * seconds_per_token)
+    # end                                                                                                    _generate #
 
     def predict_batch(self, requests: list[ChatRequest]) -> list[ChatResponse]:
         """ Generates predictions based on the given chat requests using the loaded model.
@@ -328,6 +573,73 @@ class Model:
         raise NotImplementedError("predict_batch is not implemented")
     # end                                                                                                predict_batch #
 
+    def caption(self, digest: str) -> Optional[str]:
+        """ Generates a one sentence caption for an image of the image store, used to compact old images.
+            Runs on the caption thread and never waits for requests: if the model is generating, it gives up.
+
+            Args:
+                digest (str): The sha256 of the image in the `ImageStore`.
+
+            Returns:
+                Optional[str]: The caption, None if the model is busy or has no image processor.
+
+            Raises:
+                KeyError: If the image is no longer stored.
+        """
+        if not self.__backend.loaded or not self.__backend.vision:
+            return None
+
+        with self.__scheduler.try_slot("batch") as slot: # outside of every session
+            if slot is None:
+                return None
+
+            url: str = ImageStore.shared().url(digest)
+
+            # the caption prompt overwrites the kv cache, the session in it is parked like on a session switch
+            self._park_active_session()
+
+            chunks: Iterator[dict[str, Any]] = self.__backend.stream_chat(
+                [{
+                    "role": "user",
+                    "content": [
+                        {"type": "image_url", "image_url": {"url": url}},
+                        {"type": "text", "text": CAPTION_PROMPT},
+                    ],
+                }],
+                {"temperature": 0.0},
+                Config.images_caption_max_tokens,
+                [],
+            )
+            text: str = "".join(str(chunk["choices"][0]["delta"].get("content") or "") for chunk in chunks)
+
+        return text.strip() or None
+    # end                                                                                                      caption #
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """ Blocks until the model finished loading (successfully or not).
+
+            Args:
+                timeout (Optional[float]): seconds to wait, defaults to the model timeout, <= 0 waits forever
+
+            Returns:
+                bool: False if the timeout expired before loading finished
+        """
+        if timeout is None:
+            timeout = self.__timeout
+
+        return self.__ready.wait(timeout if timeout > 0 else None) #                                            return #
+    # end                                                                                             wait_until_ready #
+
+    def wait_until_vision_ready(self, timeout: Optional[float] = None) -> bool:
+        """ Blocks until the image processor finished loading (successfully or not), same timeout rules as
+            `wait_until_ready`. returns immediately for text only models.
+        """
+        if timeout is None:
+            timeout = self.__timeout
+
+        return self.__vision_ready.wait(timeout if timeout > 0 else None) #                                     return #
+    # end                                                                                      wait_until_vision_ready #
+
     # -------------------------------------------------- properties -------------------------------------------------- #
 
     @property
@@ -335,6 +647,26 @@ class Model:
         return self.__is_model_loaded
     # end                                                                                                    is_loaded #
 
+    @property
+    def is_ready(self) -> bool:
+        return self.__ready.is_set() and self.__backend.loaded
+    # end                                                                                                     is_ready #
+
+    @property
+    def is_vision_ready(self) -> bool:
+        return self.__multi_model and self.__backend.vision
+    # end                                                                                              is_vision_ready #
+
+    @property
+    def load_seconds(self) -> Optional[float]:
+        return self.__load_seconds
+    # end                                                                                                 load_seconds #
+
+    @property
+    def load_timeline(self) -> dict[str, dict[str, Any]]:
+        return self.__timeline.as_dict()
+    # end                                                                                                load_timeline #
+
     @property
     def model_name(self) -> str:
         return self.__model_name
@@ -364,6 +696,21 @@ class Model:
         self.__timeout = value
     # end                                                                                               timeout.setter #
 
+    @property
+    def tokenizer(self) -> Tokenizer:
+        return self.__tokenizer
+    # end                                                                                                    tokenizer #
+
+    @property
+    def embeddings(self) -> EmbeddingCache:
+        return self.__embeddings
+    # end                                                                                                   embeddings #
+
+    @property
+    def backend(self) -> "InferenceBackend":
+        return self.__backend
+    # end                                                                                                      backend #
+
     @property
     def model_path(self) -> Path:
         return Path(self.__model_name)
@@ -371,63 +718,291 @@ class Model:
 
     @property
     def context(self) -> ChatContext:
-        return self.__context
+        return self.__sessions.get()
+    # end                                                                                                      context #
+
+    @property
+    def sessions(self) -> SessionManager:
+        return self.__sessions
+    # end                                                                                                     sessions #
 
     # ----------------------------------------------- private functions ---------------------------------------------- #
 
     def _load_model(self) -> None:
-        if self.__is_hub:
-            if not os.path.exists(Path(os.getcwd(), "Server", "models")):
-                os.makedirs(Path(os.getcwd(), "Server", "models"), exist_ok=True)
-
-            if self.__multi_model:
-                self.__clip_model_path = MoondreamChatHandler.from_pretrained(
-                    repo_id   = self.__model_name,
-                    filename  = self.__clip_path,
-                    local_dir = Path(os.getcwd(), "Server", "models"),
-                    verbose   = False,
-                )
+        """ loads the clip projector on its own thread while the language model loads on this one, both are
+            independent and mostly waiting on disk. the projector is attached to the llama instance by
+            whichever of the two finishes last
+        """
+        if self.__is_hub and not os.path.exists(Path(os.getcwd(), "Server", "models")):
+            os.makedirs(Path(os.getcwd(), "Server", "models"), exist_ok=True)
 
-            self.__model     = Llama.from_pretrained(
-                repo_id      = self.__model_name,
-                filename     = self.__file_name,
-                chat_handler = self.__clip_model_path if self.__clip_model_path is not None else None,
-                local_dir    = Path(os.getcwd(), "Server", "models"),
+        if self.__multi_model:
+            threading.Thread(target=self._load_projector, daemon=True, name="load_projector_thread").start()
 
-                use_mlock    = self.__config.keep_in_mem,
-                n_ctx        = self.__config.max_tokens,
-                n_gpu_layers = -1,
-                verbose      = False,
-            )
-        else:
-            if self.__multi_model and self.__clip_path is not None:
-                self.__clip_model_path = Llava15ChatHandler(
-                    clip_model_path    = self.__clip_path,
-                    verbose            = False
-                )
+        self.__timeline.start("llm")
 
-            self.__model     = Llama(
-                model_path   = self.__model_name,
-                chat_handler = self.__clip_model_path if self.__clip_model_path is not None else None,
+        try:
+            self._load_llm()
+        except Exception as e:
+            self.__timeline.finish("llm", error=e)
+            logger.error(f"Model failed to load: {self.__model_name} -> {e}")
+            self.__is_model_loaded = False
+            self.__vision_ready.set() # nothing to attach to, release image requests so they fail fast
+            raise
+        finally:
+            self.__ready.set()
 
-                use_mlock    = self.__config.keep_in_mem,
-                n_ctx        = self.__config.max_tokens,
-                n_gpu_layers = -1,
-                verbose      = False,
-            )
+        self.__load_seconds = self.__timeline.finish("llm")
+        self._attach_projector()
 
-        if self.__model is None:
-            self.__is_model_loaded = False
-            raise ModelFailedToLoad("Model failed to load")
+        Metrics.observe("model.load_seconds", self.__load_seconds, model=Path(self.__model_name).name, component="llm")
     # end                                                                                                  _load_model #
 
+    def _load_llm(self) -> None:
+        try:
+            self.__backend.load()
+        except ModelFailedToLoad:
+            self.__is_model_loaded = False
+            raise
+    # end                                                                                                    _load_llm #
+
+    def _load_projector(self) -> None:
+        self.__timeline.start("projector")
+
+        try:
+            self.__backend.load_projector()
+        except Exception as e:
+            self.__timeline.finish("projector", error=e)
+            logger.error(f"Image processor failed to load, serving text only: {self.__clip_path} -> {e}")
+            self.__vision_ready.set()
+            return #                                                                                            return #
+
+        seconds: float = self.__timeline.finish("projector")
+        self._attach_projector()
+
+        Metrics.observe("model.load_seconds", seconds, model=Path(self.__model_name).name, component="projector")
+    # end                                                                                              _load_projector #
+
+    def _attach_projector(self) -> None:
+        """ hands the projector to the language model once both exist, image requests are released after this """
+        with self.__attach_lock:
+            if self.__vision_ready.is_set() or not self.__backend.attach_projector():
+                return #                                                                                        return #
+
+            self.__vision_ready.set()
+            logger.info("image processor attached")
+
+        # old context images can now be compacted into captions generated by this model
+        if Config.images_compact_after_turns > 0:
+            CaptionCache.shared().set_captioner(self.caption)
+    # end                                                                                            _attach_projector #
+
+    def _switch_session(self, session_id: str) -> None:
+        """ makes the backend hold the kv state of `session_id`. the state of the session currently in the
+            backend is parked in the session manager first (where it may later be hibernated to disk), then the
+            new session's state is restored from whichever tier holds it. sessions without a saved state simply
+            re-prefill, llama.cpp still reuses the common prefix (the system prompt) of the previous session.
+            a backend that is not `stateful` caches prompts itself, there is nothing to move
+        """
+        if self.__active_session == session_id or not self.__backend.loaded or not self.__backend.stateful:
+            return #                                                                                            return #
+
+        self._park_active_session()
+
+        self.__sessions.set_resident(self.__model_name, session_id)
+        self.__active_session = session_id
+
+        start: float = time.perf_counter()
+        state, tier = self.__sessions.take_state(session_id, self.__model_name)
+
+        # a new branch (or a session whose state was hibernated away) may still share turns with a checkpoint
+        if state is None:
+            state, reused_turns = self.__sessions.best_checkpoint(session_id, self.__model_name)
+            if state is not None:
+                tier = "checkpoint"
+                Metrics.observe("sessions.checkpoint_reused_turns", reused_turns)
+
+        if state is not None:
+            self.__backend.load_state(state)
+
+        Metrics.observe("sessions.state_restore_seconds", time.perf_counter() - start, tier=tier)
+        logger.debug(f"switched to session {session_id} (kv state from {tier} tier)")
+    # end                                                                                              _switch_session #
+
+    def _limits(self, request: ChatRequest) -> tuple[Optional[int], Optional[float], list[str]]:
+        """ the token budget, the deadline in seconds and the stop sequences of `request`, with the defaults and
+            caps of `[generation]` applied. None means unlimited
+        """
+        def bounded(asked: Optional[int], default: int, cap: int) -> Optional[int]:
+            value: Optional[int] = asked or default or None
+            return min(value or cap, cap) if cap > 0 else value #                                               return #
+
+        max_tokens:  Optional[int] = bounded(request.max_tokens, Config.generation_max_tokens,
+                                             Config.generation_max_tokens_cap)
+        deadline_ms: Optional[int] = bounded(request.deadline_ms, Config.generation_deadline_ms,
+                                             Config.generation_max_deadline_ms)
+        stop: list[str] = [*Config.generation_stop, *(request.stop or [])[:Config.generation_max_stop]]
+
+        return max_tokens, deadline_ms / 1000 if deadline_ms else None, [seq for seq in stop if seq] #         return #
+    # end                                                                                                      _limits #
+
+    def _suspend(self, slot: Slot, context: ChatContext) -> None:
+        """ hands the model to a more urgent request between two tokens of this turn and takes it back. the kv
+            cache, the logits and the sampler of the running generation are restored exactly, llama.cpp's token
+            stream then continues as if nothing happened
+        """
+        start: float = time.perf_counter()
+        state: Any   = self.__backend.save_state(resumable=True)
+
+        self.__sessions.set_resident(self.__model_name, None)
+        self.__active_session = None
+        Metrics.observe("scheduler.suspend_seconds", time.perf_counter() - start)
+
+        self.__scheduler.suspend(slot)
+
+        start = time.perf_counter()
+        self._park_active_session() # whoever ran meanwhile
+        self.__backend.load_state(state)
+
+        self.__sessions.set_resident(self.__model_name, context.session_id)
+        self.__active_session = context.session_id
+        Metrics.observe("scheduler.resume_seconds", time.perf_counter() - start)
+    # end                                                                                                     _suspend #
+
+    def _reserve(self, max_tokens: Optional[int]) -> int:
+        """ the context kept free for the answer, at most half of it """
+        return min(max_tokens or Config.tokenizer_answer_reserve, self.__backend.n_ctx // 2) #                 return #
+    # end                                                                                                     _reserve #
+
+    def _question_tokens(self, request: ChatRequest) -> int:
+        images: int = len(request.images or []) if self.__multi_model else 0
+        return self.__tokenizer.count(request.text) + images * self.__tokenizer.image_cost + \
+               self.__tokenizer.message_overhead #                                                              return #
+    # end                                                                                             _question_tokens #
+
+    def _fit(self,
+             context: ChatContext,
+             indices: Optional[list[int]],
+             messages: list[dict[str, Any]],
+             reserve: int) -> list[dict[str, Any]]:
+        """ drops the oldest turns of `messages` (the turns `indices` of `context`) until the prompt leaves
+            `reserve` tokens of the context for the answer. the window then starts a quarter of the context
+            later than needed, the turns after it keep the same prompt prefix (and so their kv cache) until the
+            conversation outgrows the context again
+        """
+        if not Config.tokenizer_fit_context:
+            return messages #                                                                                   return #
+
+        selected: list[int] = indices if indices is not None else list(range(len(context.contexts)))
+        budget:   int       = self.__backend.n_ctx - reserve
+
+        # every message but the last (knowledge retrieval may have added material to it) is counted once
+        costs: list[int] = [context.contexts[index].token_count(self.__tokenizer) for index in selected[:-1]]
+        costs.append(self.__tokenizer.count_message(messages[-1]))
+
+        def windowed() -> list[int]: # positions in `selected` the window keeps, the system prompt always
+            return [
+                position for position, index in enumerate(selected)
+                if index == 0 or index >= context.window_start or position == len(selected) - 1
+            ] #                                                                                                 return #
+
+        keep: list[int] = windowed()
+        if sum(costs[position] for position in keep) > budget:
+            target:  int = budget - self.__backend.n_ctx // 4
+            dropped: int = 0
+
+            while len(keep) > 2 and (sum(costs[position] for position in keep) > target
+                                     or messages[keep[1]]["role"] == "assistant"): # templates want a user turn
+                context.window_start = selected[keep[1]] + 1
+                keep.pop(1)
+                dropped += 1
+
+            Metrics.increment("context.fitted_turns", dropped)
+            logger.info(f"session {context.session_id} outgrew the context, the first {context.window_start - 1} "
+                        f"messages are no longer sent")
+
+        return [messages[position] for position in keep] #                                                      return #
+    # end                                                                                                         _fit #
+
+    def _select_history(self, context: ChatContext) -> Optional[list[int]]:
+        """ the turns of `context` to send in "relevant" history mode, None (every turn) otherwise or on failure """
+        if Config.history_mode != "relevant":
+            return None #                                                                                       return #
+
+        try:
+            from Server.ai.context.history import HistorySelector
+            return HistorySelector.shared().select(context) #                                                   return #
+        except Exception as e: # a missing embedding model must not fail the request, the full history still works
+            logger.warning(f"history selection failed, sending every turn: {e}")
+            Metrics.increment("history.selection_errors")
+            return None #                                                                                       return #
+    # end                                                                                              _select_history #
+
+    def _retrieve(self, message: dict[str, Any], question: str) -> dict[str, Any]:
+        """ the question `message` with the matching lecture material after it, for this turn only """
+        if not Config.knowledge_enabled:
+            return message #                                                                                    return #
+
+        try:
+            from Server.ai.knowledge.base import KnowledgeBase, with_material
+
+            knowledge = KnowledgeBase.shared()
+            hits      = knowledge.query(question)
+        except Exception as e: # like history selection, a broken knowledge base must not fail the request
+            logger.warning(f"knowledge retrieval failed, answering without it: {e}")
+            Metrics.increment("knowledge.errors")
+            return message #                                                                                    return #
+
+        return with_material(message, hits, knowledge) if hits else message #                                   return #
+    # end                                                                                                    _retrieve #
+
+    def _park_active_session(self) -> None:
+        """ hands the kv state of the session in the backend to the session manager, the backend then holds no
+            session and the next `_switch_session` restores whichever session it needs
+        """
+        if self.__active_session is None or not self.__backend.loaded:
+            return #                                                                                            return #
+
+        start: float = time.perf_counter()
+        # right after a turn the kv state still equals the checkpoint taken for it, no need to copy it again
+        state: Any = self.__head_state if self.__head_state is not None else self.__backend.save_state()
+        self.__sessions.put_state(self.__active_session, self.__model_name, state)
+        self.__sessions.set_resident(self.__model_name, None)
+        Metrics.observe("sessions.state_save_seconds", time.perf_counter() - start)
+
+        self.__active_session = None
+        self.__head_state     = None
+    # end                                                                                          _park_active_session #
+
+    def _checkpoint(self, context: ChatContext) -> None:
+        """ captures the kv state at the end of a turn, rewinding or forking to this turn later restores it """
+        if not self.__sessions.checkpointing or not self.__backend.stateful:
+            return #                                                                                            return #
+
+        start: float = time.perf_counter()
+        state: Any   = self.__backend.save_state()
+
+        if self.__sessions.checkpoint(context.session_id, self.__model_name, state):
+            self.__head_state = state
+
+        Metrics.observe("sessions.checkpoint_seconds", time.perf_counter() - start)
+    # end                                                                                                  _checkpoint #
+
     def _unload_model(self) -> None:
         logger.info("Unloading model")
-        del self.__model
+
+        # keep the active session's kv state, it stays valid for the next time this model file is loaded
+        if getattr(self, "_Model__active_session", None) is not None:
+            self._park_active_session()
+
+        if getattr(self, "_Model__multi_model", False) and Config.images_compact_after_turns > 0:
+            CaptionCache.shared().clear_captioner(self.caption)
+
+        if getattr(self, "_Model__backend", None) is not None:
+            self.__backend.unload() # drops the weights, further use fails as not loaded
         gc.collect()
 
         logger.info("Model unloaded")
         self.__is_model_loaded = False
-        self.__model = None # set the model to None to prevent further use
     # end                                                                                                _unload_model #
 # end                                                                                                        LoadModel #
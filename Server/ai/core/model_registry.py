@@ -0,0 +1,530 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import os
+import time
+import threading
+
+from collections import OrderedDict
+from contextlib  import contextmanager
+from pathlib     import Path
+from typing      import Any, Iterator, Optional
+
+from Server.config.read_config import Config
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.backends.base        import BACKENDS, create_backend
+from Server.ai.core.data_structures import ChatRequest
+from Server.ai.core.errors          import ModelNotFoundError, ModelTypeNotSupported
+from Server.ai.core.gguf_index      import GGUFIndex, readahead
+from Server.ai.core.kv_cache        import cache_types, kv_bytes, max_sequences
+from Server.ai.core.model_loader    import Model
+from Server.ai.utils.metrics        import Metrics, PROCESS_START
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- registry ------------------------------------------------------ #
+
+DEFAULT_MODEL_NAME: str = "default"
+DEFAULT_MODEL_PATH: Path = Path("Server", "models", "ggml-model-Q4_K_M-llama-3-8B.gguf")
+DEFAULT_MMPROJ_PATH: Path = Path("Server", "models", "mmproj-model-f16.gguf")
+GGUF_INDEX_PATH:    Path = Path("Server", "models", ".gguf_index.json")
+
+class ModelSpec:
+    """ ModelSpec
+        ModelSpec - a single `[models.<name>]` entry from `server.toml`
+
+        Args:
+            name (str): the name requests use to select the model
+            path (Path): the gguf weights, only the name of the model for a backend other than llama
+            mmproj (Optional[Path]): the clip projector, enables image input if it exists
+            pinned (bool): pinned models are never evicted
+            backend (Optional[str]): the inference backend, `[inference] backend` if None
+            url (Optional[str]): the server of a remote backend, `[inference] remote_url` if None
+            kv_type (Optional[str]): the kv cache type of a llama backend, `[inference] kv_type` if None
+            flash_attn (Optional[bool]): flash attention for a llama backend, `[inference] flash_attn` if None
+    """
+
+    def __init__(self,
+                 name: str,
+                 path: Path,
+                 mmproj: Optional[Path] = None,
+                 pinned: bool = False,
+                 backend: Optional[str] = None,
+                 url: Optional[str] = None,
+                 kv_type: Optional[str] = None,
+                 flash_attn: Optional[bool] = None) -> None:
+        self.name:   str            = name
+        self.path:   Path           = path if path.is_absolute() else Path(os.getcwd(), path)
+        self.mmproj: Optional[Path] = (
+            None
+            if mmproj is None
+            else mmproj if mmproj.is_absolute() else Path(os.getcwd(), mmproj)
+        )
+        self.pinned: bool           = pinned
+        self.backend: str           = backend or Config.inference_backend
+        self.url:    Optional[str]  = url
+        self.kv_type: str           = kv_type or Config.inference_kv_type
+        self.flash_attn: bool       = Config.inference_flash_attn if flash_attn is None else flash_attn
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def from_config(cls, name: str, entry: dict[str, Any]) -> "ModelSpec":
+        backend: str = entry.get("backend") or Config.inference_backend
+        if backend not in BACKENDS:
+            raise ModelTypeNotSupported(f"[models.{name}] has unknown backend '{backend}'")
+
+        # only llama.cpp in this process reads the weights, the other backends are named after the model
+        if "path" not in entry and backend == "llama":
+            raise ModelNotFoundError(f"[models.{name}] is missing 'path'")
+
+        cache_types(entry.get("kv_type") or Config.inference_kv_type, False) # an unknown kv_type fails here
+
+        return cls(
+            name,
+            Path(entry.get("path", name)),
+            mmproj  = Path(entry["mmproj"]) if entry.get("mmproj") else None,
+            pinned  = bool(entry.get("pinned", False)),
+            backend    = backend,
+            url        = entry.get("url"),
+            kv_type    = entry.get("kv_type"),
+            flash_attn = entry.get("flash_attn"),
+        ) #                                                                                                     return #
+    # end                                                                                                  from_config #
+
+    @property
+    def local(self) -> bool:
+        """ the weights are mapped into this process """
+        return self.backend == "llama"
+    # end                                                                                                        local #
+
+    @property
+    def has_vision(self) -> bool:
+        return self.local and self.mmproj is not None and self.mmproj.exists()
+    # end                                                                                                   has_vision #
+
+    @property
+    def size_bytes(self) -> int:
+        """ the resident size of the model is estimated from the files it maps into memory """
+        if not self.local:
+            return 0 #                                                                                          return #
+
+        size: int = self.path.stat().st_size if self.path.exists() else 0
+
+        if self.has_vision:
+            size += self.mmproj.stat().st_size                                                             # type:ignore
+
+        return size #                                                                                           return #
+    # end                                                                                                   size_bytes #
+# end                                                                                                        ModelSpec #
+
+class RoutingRule:
+    """ RoutingRule
+        RoutingRule - a single `[[routing]]` entry, a request matches when every condition given holds
+
+        ```toml
+        [[routing]]
+        has_images = true
+        model = "vision"
+
+        [[routing]]
+        max_text_length = 280
+        model = "fast"
+        ```
+    """
+
+    def __init__(self,
+                 model: str,
+                 /,
+                 has_images:      Optional[bool] = None,
+                 max_text_length: Optional[int]  = None,
+                 min_text_length: Optional[int]  = None) -> None:
+        self.model:           str            = model
+        self.has_images:      Optional[bool] = has_images
+        self.max_text_length: Optional[int]  = max_text_length
+        self.min_text_length: Optional[int]  = min_text_length
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def from_config(cls, rule: dict[str, Any]) -> "RoutingRule":
+        if "model" not in rule:
+            raise ModelNotFoundError(f"routing rule is missing 'model': {rule}")
+
+        return cls(
+            rule["model"],
+            has_images      = rule.get("has_images"),
+            max_text_length = rule.get("max_text_length"),
+            min_text_length = rule.get("min_text_length"),
+        ) #                                                                                                     return #
+    # end                                                                                                  from_config #
+
+    def matches(self, request: ChatRequest) -> bool:
+        if self.has_images is not None and bool(request.images) != self.has_images:
+            return False #                                                                                      return #
+
+        if self.max_text_length is not None and len(request.text) > self.max_text_length:
+            return False #                                                                                      return #
+
+        if self.min_text_length is not None and len(request.text) < self.min_text_length:
+            return False #                                                                                      return #
+
+        return True #                                                                                           return #
+    # end                                                                                                      matches #
+# end                                                                                                      RoutingRule #
+
+class ModelRegistry:
+    """ ModelRegistry
+        ModelRegistry - owns every configured model, loads them lazily on first use and evicts the least
+                        recently used unpinned models once the total size would exceed the memory budget
+
+        a model is never evicted while a request holds a lease on it, so a streaming response can not have
+        its model unloaded underneath it
+
+        ```python
+        >>> registry = ModelRegistry.from_config()
+        >>> name = registry.route(request)          # explicit `request.model` or the first matching rule
+        >>> with registry.lease(name) as model:
+        ...     for chunk in model.predict(request):
+        ...         print(chunk.content)
+        ```
+    """
+
+    def __init__(self,
+                 specs: dict[str, ModelSpec],
+                 /,
+                 default: str,
+                 routes: Optional[list[RoutingRule]] = None,
+                 memory_budget_bytes: int            = 0) -> None:
+        if default not in specs:
+            raise ModelNotFoundError(f"default model '{default}' is not registered")
+
+        for rule in routes or []:
+            if rule.model not in specs:
+                raise ModelNotFoundError(f"routing rule points to unregistered model '{rule.model}'")
+
+        self.__specs:   dict[str, ModelSpec]          = specs
+        self.__default: str                           = default
+        self.__routes:  list[RoutingRule]             = routes or []
+        self.__budget:  int                           = memory_budget_bytes
+        self.__loaded:  OrderedDict[str, Model]       = OrderedDict() # least recently used first
+        self.__leases:  dict[str, int]                = {}
+        self.__lock:    threading.RLock               = threading.RLock()
+        self.__index:   GGUFIndex                     = GGUFIndex(Path(os.getcwd(), GGUF_INDEX_PATH))
+        self.__ready_reported: bool                   = False
+
+        Metrics.set_gauge("registry.budget_bytes", self.__budget)
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def from_config(cls) -> "ModelRegistry":
+        """ ModelRegistry.from_config
+            from_config - builds the registry from `Config`, if no `[models]` are configured a single model named
+                          'default' is registered using the bundled llama-3 8B and mmproj paths
+        """
+        if not Config.models:
+            logger.warning("no [models] configured, registering the bundled model as 'default'")
+            return cls(
+                {DEFAULT_MODEL_NAME: ModelSpec(DEFAULT_MODEL_NAME, DEFAULT_MODEL_PATH, DEFAULT_MMPROJ_PATH, pinned=True)},
+                default             = DEFAULT_MODEL_NAME,
+                memory_budget_bytes = Config.memory_budget_mb * 1024 * 1024,
+            ) #                                                                                                 return #
+
+        specs: dict[str, ModelSpec] = {
+            name: ModelSpec.from_config(name, entry) for name, entry in Config.models.items()
+        }
+
+        return cls(
+            specs,
+            default             = Config.default_model or next(iter(specs)),
+            routes              = [RoutingRule.from_config(rule) for rule in Config.routing],
+            memory_budget_bytes = Config.memory_budget_mb * 1024 * 1024,
+        ) #                                                                                                     return #
+    # end                                                                                                  from_config #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def route(self, request: ChatRequest) -> str:
+        """ ModelRegistry.route
+            route - picks the model for a request, an explicit `request.model` always wins, then the first
+                    matching routing rule, then the default model
+
+            Raises:
+                ModelNotFoundError: if the request names a model that is not registered
+        """
+        if request.model is not None:
+            if request.model not in self.__specs:
+                raise ModelNotFoundError(f"unknown model '{request.model}'")
+
+            return request.model #                                                                              return #
+
+        for rule in self.__routes:
+            if rule.matches(request):
+                return rule.model #                                                                             return #
+
+        return self.__default #                                                                                 return #
+    # end                                                                                                        route #
+
+    @contextmanager
+    def lease(self, name: str) -> Iterator[Model]:
+        """ ModelRegistry.lease
+            lease - loads the model if needed, marks it most recently used and keeps it from being evicted until
+                    the context exits
+        """
+        with self.__lock:
+            model: Model = self._get_or_load(name)
+            self.__leases[name] = self.__leases.get(name, 0) + 1
+
+        try:
+            yield model
+        finally:
+            with self.__lock:
+                self.__leases[name] -= 1
+    # end                                                                                                        lease #
+
+    def preload(self) -> None:
+        """ starts loading every pinned model (and the default model) so the first request does not pay for it """
+        for name in self._startup_models():
+            with self.__lock:
+                model: Model = self._get_or_load(name)
+
+            if name == self.__default:
+                threading.Thread(target=self._report_ready, args=(model,), daemon=True, name="ready_thread").start()
+    # end                                                                                                      preload #
+
+    def readahead(self) -> threading.Thread:
+        """ ModelRegistry.readahead
+            readahead - starts paging the weights and projector of every startup model into the page cache in the
+                        background, call this as soon as the config is parsed
+        """
+        paths: list[Path] = []
+
+        for name in self._startup_models():
+            spec: ModelSpec = self.__specs[name]
+            if not spec.local:
+                continue
+
+            paths.append(spec.path)
+
+            if spec.has_vision:
+                paths.append(spec.mmproj)                                                                  # type:ignore
+
+        return readahead(paths) #                                                                               return #
+    # end                                                                                                    readahead #
+
+    def validate(self) -> None:
+        """ ModelRegistry.validate
+            validate - checks every registered model against its cached gguf header, logging models that are
+                       missing, not gguf, or have a smaller trained context than `Config.max_tokens`
+        """
+        for name, spec in self.__specs.items():
+            if not spec.local:
+                logger.info(f"'{name}': served by the {spec.backend} backend")
+                continue
+
+            metadata: Optional[dict[str, Any]] = self.metadata(name)
+
+            if metadata is None:
+                logger.error(f"'{name}': {spec.path} is missing or not a gguf file")
+                continue
+
+            if metadata["context_length"] and metadata["context_length"] < Config.max_tokens:
+                logger.warning(f"'{name}' was trained with a context of {metadata['context_length']} tokens, "
+                               f"max_tokens is {Config.max_tokens}")
+
+            logger.info(f"'{name}': {metadata['architecture']} ({metadata['name']}), "
+                        f"context_length={metadata['context_length']}, vocab_size={metadata['vocab_size']}")
+
+            per_sequence: Optional[int] = self.kv_bytes(name)
+            if per_sequence is not None:
+                logger.info(f"'{name}': {spec.kv_type} kv cache (flash attention {'on' if spec.flash_attn else 'off'})"
+                            f" of {per_sequence / 1024 ** 2:.0f}MB per sequence of {Config.max_tokens} tokens, "
+                            f"{self.max_sequences(name) or 'unlimited'} sequences fit the kv budget")
+    # end                                                                                                     validate #
+
+    def spec(self, name: str) -> ModelSpec:
+        """ the `[models.<name>]` entry of a registered model
+
+            Raises:
+                ModelNotFoundError: if the model is not registered
+        """
+        if name not in self.__specs:
+            raise ModelNotFoundError(f"unknown model '{name}'")
+
+        return self.__specs[name] #                                                                             return #
+    # end                                                                                                         spec #
+
+    def kv_bytes(self, name: str) -> Optional[int]:
+        """ the kv cache of one sequence of `name` at `Config.max_tokens`, None if it is not a readable local gguf """
+        spec: ModelSpec = self.spec(name)
+        metadata: Optional[dict[str, Any]] = self.metadata(name) if spec.local else None
+        if metadata is None:
+            return None #                                                                                       return #
+
+        return kv_bytes(metadata, Config.max_tokens, spec.kv_type, spec.flash_attn) #                           return #
+    # end                                                                                                     kv_bytes #
+
+    def max_sequences(self, name: str) -> Optional[int]:
+        """ ModelRegistry.max_sequences
+            max_sequences - how many sequences of `name` (its live context, parked session states, bulk workers)
+                            fit `[inference] kv_budget_mb`, at least one. None without a budget or for a model
+                            whose kv cache is not in this process
+        """
+        return max_sequences(int(Config.inference_kv_budget_mb * 1024 * 1024), self.kv_bytes(name)) #          return #
+    # end                                                                                                max_sequences #
+
+    def metadata(self, name: str) -> Optional[dict[str, Any]]:
+        """ the cached gguf header summary of a model, None if the file is missing or not a gguf file """
+        try:
+            return self.__index.get(self.__specs[name].path) #                                                  return #
+        except (ModelNotFoundError, ModelTypeNotSupported, OSError) as e:
+            logger.debug(f"'{name}': {e}")
+            return None #                                                                                       return #
+    # end                                                                                                     metadata #
+
+    def evict(self, name: str, reason: str = "manual") -> bool:
+        """ ModelRegistry.evict
+            evict - unloads a model if it is loaded and not leased
+
+            Returns:
+                bool: True if the model was unloaded
+        """
+        with self.__lock:
+            if name not in self.__loaded or self.__leases.get(name, 0) > 0:
+                return False #                                                                                  return #
+
+            model: Model = self.__loaded.pop(name)
+            model._unload_model()
+            del model
+
+            Metrics.increment("registry.evict", model=name, reason=reason)
+            Metrics.event("registry.evict", model=name, reason=reason, resident_bytes=self.resident_bytes)
+            Metrics.set_gauge("registry.resident_bytes", self.resident_bytes)
+            return True #                                                                                       return #
+    # end                                                                                                        evict #
+
+    def status(self) -> dict[str, dict[str, Any]]:
+        """ per model status for `/health` """
+        metadata: dict[str, Optional[dict[str, Any]]] = {name: self.metadata(name) for name in self.__specs}
+
+        with self.__lock:
+            return {
+                name: {
+                    "loaded":     name in self.__loaded and self.__loaded[name].is_ready,
+                    "pinned":     spec.pinned,
+                    "backend":    spec.backend,
+                    "vision":     spec.has_vision,
+                    "size_bytes": spec.size_bytes,
+                    "kv_type":    spec.kv_type if spec.local else None,
+                    "flash_attn": spec.flash_attn if spec.local else None,
+                    "kv_bytes":   self.kv_bytes(name),
+                    "max_sequences": self.max_sequences(name),
+                    "leases":     self.__leases.get(name, 0),
+                    "default":    name == self.__default,
+                    "vision_ready":   name in self.__loaded and self.__loaded[name].is_vision_ready,
+                    "load_seconds":   self.__loaded[name].load_seconds if name in self.__loaded else None,
+                    "load_timeline":  self.__loaded[name].load_timeline if name in self.__loaded else {},
+                    "architecture":   (metadata[name] or {}).get("architecture"),
+                    "context_length": (metadata[name] or {}).get("context_length"),
+                }
+                for name, spec in self.__specs.items()
+            } #                                                                                                 return #
+    # end                                                                                                       status #
+
+    # -------------------------------------------------- properties -------------------------------------------------- #
+
+    @property
+    def default(self) -> str:
+        return self.__default
+    # end                                                                                                      default #
+
+    @property
+    def names(self) -> list[str]:
+        return list(self.__specs)
+    # end                                                                                                        names #
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(self.__specs[name].size_bytes for name in self.__loaded)
+    # end                                                                                               resident_bytes #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _startup_models(self) -> list[str]:
+        return [name for name, spec in self.__specs.items() if spec.pinned or name == self.__default]
+    # end                                                                                              _startup_models #
+
+    def _report_ready(self, model: Model) -> None:
+        """ records the time from process start until the default model can serve its first request """
+        model.wait_until_ready(timeout=-1)
+
+        if not model.is_ready or self.__ready_reported:
+            return #                                                                                            return #
+
+        self.__ready_reported = True
+        time_to_ready: float = time.time() - PROCESS_START
+
+        Metrics.set_gauge("startup.time_to_ready_seconds", time_to_ready)
+        Metrics.event("startup.ready", model=self.__default, seconds=round(time_to_ready, 3))
+    # end                                                                                                _report_ready #
+
+    def _get_or_load(self, name: str) -> Model:
+        if name not in self.__specs:
+            raise ModelNotFoundError(f"unknown model '{name}'")
+
+        if name in self.__loaded:
+            self.__loaded.move_to_end(name)
+            Metrics.increment("registry.hit", model=name)
+            return self.__loaded[name] #                                                                        return #
+
+        spec: ModelSpec = self.__specs[name]
+
+        if spec.local and spec.mmproj is not None and not spec.has_vision:
+            logger.warning(f"Image processor not found at {spec.mmproj}. Multimodal capabilities will be disabled "
+                           f"for '{name}'.")
+
+        self._make_room(spec.size_bytes)
+
+        start: float = time.perf_counter()
+        model: Model = Model(
+            spec.path,
+            image_processor_path = spec.mmproj if spec.has_vision else None,
+            multi_model          = spec.has_vision,
+            backend              = create_backend(
+                spec.backend, spec.path, str(spec.mmproj) if spec.has_vision else None, spec.url,
+                spec.kv_type, spec.flash_attn,
+            ),
+        )
+
+        self.__loaded[name] = model
+
+        Metrics.increment("registry.load", model=name)
+        Metrics.observe("registry.load_start_seconds", time.perf_counter() - start, model=name)
+        Metrics.event("registry.load", model=name, size_bytes=spec.size_bytes, resident_bytes=self.resident_bytes)
+        Metrics.set_gauge("registry.resident_bytes", self.resident_bytes)
+        return model #                                                                                          return #
+    # end                                                                                                 _get_or_load #
+
+    def _make_room(self, incoming_bytes: int) -> None:
+        """ evicts least recently used, unpinned and unleased models until `incoming_bytes` fits the budget """
+        if self.__budget <= 0:
+            return #                                                                                            return #
+
+        for name in list(self.__loaded): # iterates oldest first
+            if self.resident_bytes + incoming_bytes <= self.__budget:
+                return #                                                                                        return #
+
+            if self.__specs[name].pinned:
+                continue
+
+            self.evict(name, reason="budget")
+
+        if self.resident_bytes + incoming_bytes > self.__budget:
+            logger.warning(f"loading {incoming_bytes} bytes exceeds the memory budget of {self.__budget} bytes, "
+                           "every resident model is pinned or in use")
+            Metrics.increment("registry.over_budget")
+    # end                                                                                                   _make_room #
+# end                                                                                                    ModelRegistry #
@@ -0,0 +1,119 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+from collections import deque
+from typing      import Optional
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- repetition ---------------------------------------------------- #
+
+BASE:    int = 1_000_003
+MODULUS: int = (1 << 61) - 1
+
+class RepetitionDetector:
+    """ RepetitionDetector
+        RepetitionDetector - spots an answer stuck in a loop (the same sentence or table row over and over) while
+                             it is generated, with constant work per token
+
+        every `ngram` tokens are hashed with a rolling hash, when the newest n-gram was seen before its distance is
+        a candidate period. the run of tokens equal to the token one period earlier then grows by one per token
+        and breaks at the first difference. the answer is looping once the run covers `repeats` copies of the
+        period and at least `min_tokens` tokens, so a short table separator or a repeated word is left alone
+
+        ```python
+        >>> detector = RepetitionDetector()
+        >>> for token in stream:
+        ...     if detector.feed(token):
+        ...         answer = answer[:detector.loop_start] # one copy of the repeated text is kept
+        ...         break
+        ```
+
+        Args:
+            ngram (int): tokens hashed together, shorter periods are still found through the run
+            repeats (int): copies of the period that make a loop, the first one included
+            min_tokens (int): repeated tokens needed at the least, whatever the period
+            max_period (int): longest repeated unit looked for, in tokens
+    """
+
+    def __init__(self, ngram: int = 8, repeats: int = 3, min_tokens: int = 48, max_period: int = 256) -> None:
+        self.__ngram:      int = max(1, ngram)
+        self.__repeats:    int = max(2, repeats)
+        self.__min_tokens: int = min_tokens
+        self.__max_period: int = max_period
+        self.__power:      int = pow(BASE, self.__ngram - 1, MODULUS) # weight of the token leaving the window
+
+        self.__tokens:  list[int]      = []         # the hashed tokens of the answer
+        self.__offsets: list[int]      = [0]        # character offset of every token in the answer
+        self.__window:  deque[int]     = deque()    # the last `ngram` tokens
+        self.__hash:    int            = 0
+        self.__seen:    dict[int, int] = {}         # n-gram hash -> the position it last ended at
+        self.__period:  int            = 0
+        self.__run:     int            = 0          # tokens equal to the token one period earlier
+        self.__looping: bool           = False
+    # end                                                                                                     __init__ #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def feed(self, text: str) -> bool:
+        """ adds the next token (a streamed chunk), returns True once the answer is looping """
+        if self.__looping:
+            return True #                                                                                       return #
+
+        token:    int = hash(text) & 0xFFFFFFFF
+        position: int = len(self.__tokens)
+        self.__tokens.append(token)
+        self.__offsets.append(self.__offsets[-1] + len(text))
+
+        self.__window.append(token)
+        self.__hash = (self.__hash * BASE + token + 1) % MODULUS
+        if len(self.__window) > self.__ngram:
+            self.__hash = (self.__hash - (self.__window.popleft() + 1) * self.__power * BASE) % MODULUS
+
+        if self.__period and self.__tokens[position - self.__period] == token:
+            self.__run += 1
+        else:
+            self.__period, self.__run = 0, 0
+
+        if len(self.__window) == self.__ngram:
+            previous: Optional[int] = self.__seen.get(self.__hash)
+            self.__seen[self.__hash] = position
+
+            # a new period starts with the n-gram that matched, an ongoing run is only replaced by a shorter one
+            if previous is not None and position - previous <= self.__max_period:
+                if not self.__period or position - previous < self.__period:
+                    self.__period, self.__run = position - previous, self.__ngram
+
+        self.__looping = bool(self.__period) and self.__run >= max(
+            self.__min_tokens, self.__period * (self.__repeats - 1)
+        )
+        return self.__looping #                                                                                 return #
+    # end                                                                                                         feed #
+
+    # -------------------------------------------------- properties -------------------------------------------------- #
+
+    @property
+    def looping(self) -> bool:
+        return self.__looping
+    # end                                                                                                      looping #
+
+    @property
+    def period(self) -> int:
+        """ the length of the repeated unit in tokens, 0 while nothing repeats """
+        return self.__period
+    # end                                                                                                       period #
+
+    @property
+    def loop_start(self) -> int:
+        """ the character offset where the copies after the first one begin, the whole answer while not looping """
+        if not self.__looping:
+            return self.__offsets[-1] #                                                                         return #
+
+        return self.__offsets[len(self.__tokens) - self.__run] #                                                return #
+    # end                                                                                                   loop_start #
+# end                                                                                               RepetitionDetector #
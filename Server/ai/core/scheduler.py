@@ -0,0 +1,183 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import time
+import itertools
+import threading
+
+from contextlib import contextmanager
+from typing     import Iterator, Optional
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.utils.metrics import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- scheduler ----------------------------------------------------- #
+
+PRIORITIES: dict[str, int] = {
+    "batch":       0, # bulk jobs, summaries, anything nobody watches token by token
+    "interactive": 1, # a student waiting for the first token
+}
+
+class Slot:
+    """ one generation's claim on the model, handed out by `Scheduler.slot` """
+    __slots__ = ("priority", "session_id", "sequence", "granted", "preemptions", "waited")
+
+    def __init__(self, priority: str, session_id: Optional[str], sequence: int) -> None:
+        self.priority:    str           = priority
+        self.session_id:  Optional[str] = session_id
+        self.sequence:    int           = sequence # arrival order, kept across preemptions
+        self.granted:     float         = 0.0      # when the slot last got the model
+        self.preemptions: int           = 0
+        self.waited:      float         = 0.0      # seconds spent waiting for the model in total
+    # end                                                                                                     __init__ #
+
+    @property
+    def rank(self) -> tuple[int, int]:
+        return PRIORITIES[self.priority], -self.sequence #                                                      return #
+    # end                                                                                                         rank #
+# end                                                                                                             Slot #
+
+class Scheduler:
+    """ Scheduler
+        Scheduler - hands the single llama instance to one generation at a time: the most urgent waiting one,
+                    first come first served within a priority
+
+        a running generation asks `should_yield` between tokens. once a more urgent request of another session
+        waits and the generation ran for at least `time_slice_ms`, it parks its kv state and calls `suspend`,
+        which lets the urgent request run and returns when the generation may continue where it stopped. a
+        suspended generation keeps its place in the queue and blocks its own session, a conversation never has
+        two turns in flight
+
+        ```python
+        >>> scheduler = Scheduler(time_slice_ms=200)
+        >>> with scheduler.slot("batch", "summaries") as slot:
+        ...     for token in generation:
+        ...         if scheduler.should_yield(slot):
+        ...             state = save()
+        ...             scheduler.suspend(slot)    # an interactive request runs meanwhile
+        ...             restore(state)
+        ```
+
+        Args:
+            preemption (bool): whether running generations are suspended at all, False only orders the queue
+            time_slice_ms (int): the least a generation runs before it can be suspended, bounds the save and
+                                 restore overhead to one per slice
+            max_preemptions (int): suspensions of one generation at most, 0 for no limit
+    """
+
+    def __init__(self, preemption: bool = True, time_slice_ms: int = 200, max_preemptions: int = 0) -> None:
+        self.__preemption:      bool                = preemption
+        self.__time_slice:      float               = time_slice_ms / 1000
+        self.__max_preemptions: int                 = max_preemptions
+
+        self.__lock:            threading.Condition = threading.Condition()
+        self.__sequence:        itertools.count     = itertools.count()
+        self.__holder:          Optional[Slot]      = None
+        self.__waiting:         list[Slot]          = []
+        self.__suspended:       dict[str, Slot]     = {} # session -> its generation waiting to resume
+    # end                                                                                                     __init__ #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    @contextmanager
+    def slot(self, priority: str, session_id: str) -> Iterator[Slot]:
+        """ waits for the model, it is held (apart from suspensions) until the context exits """
+        slot: Slot = Slot(priority, session_id, next(self.__sequence))
+        self._acquire(slot)
+
+        try:
+            yield slot
+        finally:
+            self._release(slot)
+            Metrics.observe("scheduler.wait_seconds", slot.waited, priority=priority)
+    # end                                                                                                         slot #
+
+    @contextmanager
+    def try_slot(self, priority: str, session_id: Optional[str] = None) -> Iterator[Optional[Slot]]:
+        """ the model if nobody holds it, waits for it or has a turn of the session suspended, None otherwise. for
+            work that is only worth doing right now, `session_id` is None for work outside of every session
+        """
+        slot: Optional[Slot] = Slot(priority, session_id, next(self.__sequence))
+
+        with self.__lock:
+            if self.__holder is not None or self.__waiting or session_id in self.__suspended:
+                slot = None
+            else:
+                self.__holder, slot.granted = slot, time.perf_counter()                                # type:ignore
+
+        try:
+            yield slot
+        finally:
+            if slot is not None:
+                self._release(slot)
+    # end                                                                                                     try_slot #
+
+    def should_yield(self, slot: Slot) -> bool:
+        """ whether the generation holding `slot` should suspend now, cheap enough to ask after every token """
+        if not self.__preemption or not self.__waiting:
+            return False #                                                                                      return #
+
+        if self.__max_preemptions and slot.preemptions >= self.__max_preemptions:
+            return False #                                                                                      return #
+
+        if time.perf_counter() - slot.granted < self.__time_slice:
+            return False #                                                                                      return #
+
+        with self.__lock:
+            waiting: Optional[Slot] = self._next(self.__waiting)
+            return waiting is not None and waiting.session_id != slot.session_id and \
+                PRIORITIES[waiting.priority] > PRIORITIES[slot.priority] #                                      return #
+    # end                                                                                                 should_yield #
+
+    def suspend(self, slot: Slot) -> None:
+        """ gives the model to the most urgent waiting request and waits until `slot` may continue """
+        slot.preemptions += 1
+        Metrics.increment("scheduler.preemptions", priority=slot.priority)
+
+        with self.__lock:
+            self.__suspended[slot.session_id] = slot
+        self._release(slot)
+        self._acquire(slot)
+    # end                                                                                                      suspend #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _acquire(self, slot: Slot) -> None:
+        start: float = time.perf_counter()
+
+        with self.__lock:
+            self.__waiting.append(slot)
+            self.__lock.wait_for(lambda: self.__holder is None and self._next(self.__waiting) is slot)
+
+            self.__waiting.remove(slot)
+            self.__suspended.pop(slot.session_id, None)
+            self.__holder = slot
+
+        slot.granted  = time.perf_counter()
+        slot.waited  += slot.granted - start
+    # end                                                                                                     _acquire #
+
+    def _release(self, slot: Slot) -> None:
+        with self.__lock:
+            if self.__holder is slot:
+                self.__holder = None
+            self.__lock.notify_all()
+    # end                                                                                                     _release #
+
+    def _next(self, candidates: list[Slot]) -> Optional[Slot]:
+        """ the most urgent of `candidates` that may run, the caller holds the lock. a session with a suspended
+            generation only runs that generation
+        """
+        eligible: list[Slot] = [
+            slot for slot in candidates
+            if self.__suspended.get(slot.session_id, slot) is slot
+        ]
+        return max(eligible, key=lambda slot: slot.rank, default=None) #                                        return #
+    # end                                                                                                        _next #
+# end                                                                                                        Scheduler #
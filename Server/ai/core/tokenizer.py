@@ -0,0 +1,199 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import time
+import hashlib
+import threading
+
+from array       import array
+from collections import OrderedDict
+from typing      import TYPE_CHECKING, Any, Union
+
+from Server.config.read_config import Config
+
+if TYPE_CHECKING:
+    from Server.ai.backends.base import InferenceBackend
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.utils.metrics import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- tokenizer ----------------------------------------------------- #
+
+TOKEN_BYTES: int = 4 # token ids are kept as int32
+
+def text_key(text: str, special: bool = False) -> bytes:
+    """ the cache key of `text`, 16 bytes whatever its length """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=15).digest() + (b"\x01" if special else b"\x00")
+# end                                                                                                         text_key #
+
+class Tokenizer:
+    """ Tokenizer
+        Tokenizer - the vocabulary of a loaded model with a memo of the texts it has already tokenized, so the
+                    token cost of a prompt is known before the model runs
+
+        token ids are cached per text (keyed by its blake2b hash) as int32 arrays, least recently used first,
+        until `budget_bytes` is exceeded. lecture transcripts, the system prompt and earlier turns are
+        tokenized once. a message's cost is its text, `image_tokens` per image when the model sees images,
+        and `message_overhead` for the role markers of the chat template (an estimate, templates differ)
+
+        ```python
+        >>> tokenizer = model.tokenizer
+        >>> tokenizer.count("what is entropy?")
+        5
+        >>> tokenizer.tokenize_batch(["the first law", "the second law"])
+        [[1820, 1176, 2383], [1820, 2132, 2383]]
+        >>> tokenizer.count_content([{"type": "text", "text": "this slide"}, {"type": "image_url", ...}])
+        578
+        ```
+
+        Args:
+            backend (InferenceBackend): the model whose vocabulary is used, it has to be loaded
+            budget_bytes (int): token ids kept in the cache
+            message_overhead (int): tokens the chat template adds around every message
+            image_tokens (int): tokens the projector turns every image into
+    """
+
+    def __init__(self,
+                 backend: "InferenceBackend",
+                 budget_bytes: int = 64 * 1024 * 1024,
+                 message_overhead: int = 8,
+                 image_tokens: int = 576) -> None:
+        self.__backend:  "InferenceBackend"            = backend
+        self.__budget:   int                           = budget_bytes
+        self.__overhead: int                           = message_overhead
+        self.__images:   int                           = image_tokens
+        self.__lock:     threading.Lock                = threading.Lock()
+        self.__cache:    OrderedDict[bytes, array]     = OrderedDict() # least recently used first
+        self.__bytes:    int                           = 0
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def from_config(cls, backend: "InferenceBackend") -> "Tokenizer":
+        return cls(
+            backend,
+            budget_bytes     = int(Config.tokenizer_cache_mb * 1024 * 1024),
+            message_overhead = Config.tokenizer_message_overhead,
+            image_tokens     = Config.tokenizer_image_tokens,
+        ) #                                                                                                     return #
+    # end                                                                                                  from_config #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def tokenize(self, text: str, special: bool = False) -> list[int]:
+        return self.tokenize_batch([text], special)[0] #                                                        return #
+    # end                                                                                                     tokenize #
+
+    def tokenize_batch(self, texts: list[str], special: bool = False) -> list[list[int]]:
+        """ Tokenizer.tokenize_batch
+            tokenize_batch - the token ids of every text, texts seen before (or twice in the batch) are only
+                             looked up. the vocabulary is read only, this never waits for a generation
+
+            Args:
+                texts (list[str]): the texts
+                special (bool): parse special tokens like `<|eot_id|>` in the texts instead of treating them as text
+        """
+        keys:   list[bytes]              = [text_key(text, special) for text in texts]
+        found:  dict[bytes, array]       = {}
+
+        with self.__lock:
+            for key in keys:
+                if key not in found and (ids := self.__cache.get(key)) is not None:
+                    self.__cache.move_to_end(key)
+                    found[key] = ids
+
+        missing: dict[bytes, str] = {key: text for key, text in zip(keys, texts) if key not in found}
+
+        start: float = time.perf_counter()
+        tokenized: dict[bytes, array] = {
+            key: array("i", self.__backend.tokenize(text, special)) for key, text in missing.items()
+        }
+
+        if tokenized:
+            Metrics.observe("tokenizer.seconds", time.perf_counter() - start)
+            self._store(tokenized)
+
+        Metrics.increment("tokenizer.cache_hits", len(keys) - len(missing))
+        Metrics.increment("tokenizer.cache_misses", len(missing))
+
+        found.update(tokenized)
+        return [found[key].tolist() for key in keys] #                                                          return #
+    # end                                                                                               tokenize_batch #
+
+    def count(self, text: str) -> int:
+        """ the tokens of `text`, without special tokens """
+        key: bytes = text_key(text)
+
+        with self.__lock:
+            if (ids := self.__cache.get(key)) is not None:
+                self.__cache.move_to_end(key)
+                Metrics.increment("tokenizer.cache_hits")
+                return len(ids) #                                                                               return #
+
+        return len(self.tokenize(text)) #                                                                       return #
+    # end                                                                                                        count #
+
+    def count_content(self, content: Union[str, list[dict[str, Any]]]) -> int:
+        """ the text tokens of a message's content, image parts are counted by `image_cost` """
+        if isinstance(content, str):
+            return self.count(content) #                                                                        return #
+
+        return sum(self.count(str(part["text"])) for part in content if part["type"] == "text") #               return #
+    # end                                                                                                count_content #
+
+    def count_message(self, message: dict[str, Any]) -> int:
+        """ the prompt tokens of a message as `get_content` returns it, e.g. one changed by knowledge retrieval """
+        content: Union[str, list[dict[str, Any]]] = message["content"]
+        images:  int = 0 if isinstance(content, str) else sum(part["type"] == "image_url" for part in content)
+
+        return self.count_content(content) + images * self.image_cost + self.__overhead #                       return #
+    # end                                                                                                count_message #
+
+    # -------------------------------------------------- properties -------------------------------------------------- #
+
+    @property
+    def name(self) -> str:
+        """ the model whose vocabulary this is, token counts memoized by messages are keyed by it """
+        return self.__backend.name
+    # end                                                                                                         name #
+
+    @property
+    def message_overhead(self) -> int:
+        return self.__overhead
+    # end                                                                                             message_overhead #
+
+    @property
+    def image_cost(self) -> int:
+        """ the tokens of an image, 0 if the model does not see images (they are dropped from its prompts) """
+        return self.__images if self.__backend.vision else 0
+    # end                                                                                                   image_cost #
+
+    @property
+    def cached_bytes(self) -> int:
+        return self.__bytes
+    # end                                                                                                 cached_bytes #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _store(self, tokenized: dict[bytes, array]) -> None:
+        with self.__lock:
+            for key, ids in tokenized.items():
+                if key in self.__cache:
+                    continue
+
+                self.__cache[key] = ids
+                self.__bytes += len(ids) * TOKEN_BYTES + len(key)
+
+            while self.__bytes > self.__budget and self.__cache:
+                key, ids = self.__cache.popitem(last=False)
+                self.__bytes -= len(ids) * TOKEN_BYTES + len(key)
+                Metrics.increment("tokenizer.evicted")
+
+            Metrics.set_gauge("tokenizer.cached_bytes", self.__bytes, model=self.name)
+    # end                                                                                                       _store #
+# end                                                                                                        Tokenizer #
@@ -0,0 +1,375 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+from pathlib import Path
+from typing  import Any, Optional
+
+from Server.config.read_config import Config
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.context.compaction     import CaptionCache
+from Server.ai.context.images         import ImageStore
+from Server.ai.core.embeddings        import Embedder
+from Server.ai.knowledge.vector_index import VectorIndex
+from Server.ai.utils.metrics          import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ----------------------------------------------------- schema ------------------------------------------------------- #
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS chunks (
+    row           INTEGER PRIMARY KEY,
+    source        TEXT    NOT NULL,
+    kind          TEXT    NOT NULL,
+    position      INTEGER NOT NULL,
+    text          TEXT    NOT NULL,
+    image_sha256  TEXT,
+    created       REAL    NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source);
+"""
+
+KINDS: tuple[str, ...] = ("transcript", "slide", "textbook")
+
+MATERIAL_HEADER: str = "\nRelevant lecture material from your memory, use it if it helps to answer the question above:"
+
+# ---------------------------------------------------- retrieval ----------------------------------------------------- #
+
+def with_material(
+    message: dict[str, Any],
+    hits: list[dict[str, Any]],
+    knowledge: "KnowledgeBase"
+) -> dict[str, Any]:
+    """ a copy of the question `message` with the retrieved chunks (and their images) placed after it, the question
+        stays a prefix of the prompt so a prefill of it (see `Model.prefill`) is reused
+    """
+    content: list[dict[str, Any]] = (
+        [{"type": "text", "text": message["content"]}]
+        if isinstance(message["content"], str) else list(message["content"])
+    )
+
+    material: list[dict[str, Any]] = [{
+        "type": "text",
+        "text": MATERIAL_HEADER + "".join(f"\n\n[{hit['source']}, {hit['kind']}]\n{hit['text']}" for hit in hits),
+    }]
+
+    for hit in hits:
+        if hit["image"] is not None and knowledge.image_path(hit["image"]).exists():
+            material.append({"type": "text", "text": f"tag=knowledge:{hit['source']}"})
+            material.append({"type": "image_url", "image_url": {"url": knowledge.image_path(hit["image"]).as_uri()}})
+
+    return {**message, "content": content + material} #                                                         return #
+# end                                                                                                with_material #
+
+# -------------------------------------------------- knowledge base -------------------------------------------------- #
+
+class KnowledgeBase:
+    """ KnowledgeBase
+        KnowledgeBase - the lecture material the assistant answers from: transcripts, slide images and textbook
+                        pages are split into chunks, embedded in batches with the local `Embedder` and stored in a
+                        `VectorIndex`, the chunks themselves live in a sqlite table keyed by their vector's row
+
+        the embedding model is text only, so an image is indexed through its caption (given with the image or
+        generated by the vision model through the `CaptionCache`) and handed back to the chat model as an image
+
+        ```python
+        >>> knowledge = KnowledgeBase.shared()
+        >>> knowledge.ingest_text("thermo-lecture-3", transcript, kind="transcript")
+        42
+        >>> knowledge.ingest_image("thermo-lecture-3/slide-7", png_bytes)
+        '9f86d0...'
+        >>> knowledge.query("why does entropy increase?", 2)
+        [{'source': 'thermo-lecture-3', 'kind': 'transcript', 'position': 12, 'text': '...', 'score': 0.71, ...}]
+        ```
+
+        Args:
+            directory (Path): where the index, the chunk table and the images are stored
+            embedder (Embedder): embeds chunks and questions
+            chunk_words (int): words per text chunk
+            chunk_overlap (int): words shared by consecutive chunks, so a sentence is never only cut in half
+            batch_size (int): chunks embedded per call to the embedding model
+            ivf_threshold (int): chunks from which the index switches from exact to ivf search
+            nprobe (int): ivf lists scanned per query
+    """
+
+    _instance: Optional["KnowledgeBase"] = None
+    _instance_lock: threading.Lock        = threading.Lock()
+
+    def __init__(self,
+                 directory: Path,
+                 embedder: Embedder,
+                 /,
+                 chunk_words: int = 200,
+                 chunk_overlap: int = 40,
+                 batch_size: int = 64,
+                 ivf_threshold: int = 50_000,
+                 nprobe: int = 16) -> None:
+        if not 0 <= chunk_overlap < chunk_words:
+            raise ValueError("chunk_overlap must be smaller than chunk_words")
+
+        self.__directory:  Path            = directory
+        self.__embedder:   Embedder        = embedder
+        self.__words:      int             = chunk_words
+        self.__overlap:    int             = chunk_overlap
+        self.__batch_size: int             = batch_size
+        self.__write_lock: threading.Lock  = threading.Lock() # one ingestion at a time keeps rows and vectors aligned
+        self.__local:      threading.local = threading.local()
+
+        (directory / "images").mkdir(parents=True, exist_ok=True)
+        self.__index: VectorIndex = VectorIndex(directory, ivf_threshold, nprobe)
+
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+            self._recover(connection)
+
+        logger.info(f"knowledge base opened at {directory} with {len(self.__index)} chunks")
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def shared(cls) -> "KnowledgeBase":
+        """ the process wide knowledge base, created from `Config` on first use """
+        with cls._instance_lock:
+            if cls._instance is None:
+                directory: Path = Path(Config.knowledge_dir)
+                cls._instance = cls(
+                    directory if directory.is_absolute() else Path(os.getcwd(), directory),
+                    Embedder.shared(),
+                    chunk_words   = Config.knowledge_chunk_words,
+                    chunk_overlap = Config.knowledge_chunk_overlap,
+                    batch_size    = Config.knowledge_batch_size,
+                    ivf_threshold = Config.knowledge_ivf_threshold,
+                    nprobe        = Config.knowledge_nprobe,
+                )
+
+            return cls._instance #                                                                              return #
+    # end                                                                                                       shared #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def ingest_text(self, source: str, text: str, kind: str = "transcript") -> int:
+        """ KnowledgeBase.ingest_text
+            ingest_text - chunks, embeds and indexes a transcript or a textbook page
+
+            Args:
+                source (str): where the text comes from, e.g. the lecture or the book and page
+                text (str): the text
+                kind (str): one of `KINDS`
+
+            Returns:
+                int: the number of chunks added
+        """
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+
+        chunks: list[str] = self.chunk(text)
+        self._add(source, kind, chunks, [None] * len(chunks))
+        return len(chunks) #                                                                                    return #
+    # end                                                                                                  ingest_text #
+
+    def ingest_image(self,
+                     source: str,
+                     data: bytes,
+                     text: Optional[str] = None,
+                     kind: str = "slide",
+                     caption_timeout: float = 120) -> str:
+        """ KnowledgeBase.ingest_image
+            ingest_image - indexes a slide or a scanned textbook page by its caption (and `text`, e.g. the slide's
+                           own text or speaker notes). without `text` the caption is generated by the vision model
+
+            Args:
+                source (str): where the image comes from
+                data (bytes): the png bytes
+                text (Optional[str]): text to index the image by next to its caption
+                kind (str): one of `KINDS`
+                caption_timeout (float): seconds to wait for the vision model to caption the image
+
+            Returns:
+                str: the sha256 of the image
+
+            Raises:
+                TimeoutError: if no text was given and the image could not be captioned in time
+        """
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+
+        digest: str  = hashlib.sha256(data).hexdigest()
+        path:   Path = self.image_path(digest)
+
+        if not path.exists():
+            temp_path: Path = path.with_suffix(".tmp")
+            with open(temp_path, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, path)
+
+        # with its own text the image does not wait for the vision model, a known caption is still used
+        caption: Optional[str] = self._caption(digest, data, 0 if text else caption_timeout)
+
+        if caption is None and not text:
+            raise TimeoutError(f"image {digest} was not captioned within {caption_timeout}s, pass its text instead")
+
+        self._add(source, kind, ["\n".join(part for part in (caption, text) if part)], [digest])
+        return digest #                                                                                         return #
+    # end                                                                                                 ingest_image #
+
+    def query(self, text: str, k: Optional[int] = None, min_score: Optional[float] = None) -> list[dict[str, Any]]:
+        """ KnowledgeBase.query
+            query - the chunks most similar to `text`, best first
+
+            Args:
+                text (str): the question
+                k (Optional[int]): how many chunks at most, `[knowledge] top_k` by default
+                min_score (Optional[float]): the lowest cosine similarity returned, `[knowledge] min_score` by default
+
+            Returns:
+                list[dict[str, Any]]: source, kind, position, text, image (sha256 or None) and score of every hit
+        """
+        if len(self.__index) == 0:
+            return [] #                                                                                         return #
+
+        k         = Config.knowledge_top_k     if k         is None else k
+        min_score = Config.knowledge_min_score if min_score is None else min_score
+        start: float = time.perf_counter()
+
+        vectors, _ = self.__embedder.embed([text])
+        rows, scores = self.__index.search(vectors[0], k)
+
+        keep:   list[tuple[int, float]] = [(row, score) for row, score in zip(rows.tolist(), scores.tolist())
+                                           if score >= min_score]
+        chunks: dict[int, tuple]        = self._chunks([row for row, _ in keep])
+
+        hits: list[dict[str, Any]] = [
+            {
+                "source":   chunks[row][0],
+                "kind":     chunks[row][1],
+                "position": chunks[row][2],
+                "text":     chunks[row][3],
+                "image":    chunks[row][4],
+                "score":    round(score, 4),
+            }
+            for row, score in keep if row in chunks
+        ]
+
+        Metrics.observe("knowledge.query_seconds", time.perf_counter() - start)
+        Metrics.increment("knowledge.hits", len(hits))
+        return hits #                                                                                           return #
+    # end                                                                                                        query #
+
+    def chunk(self, text: str) -> list[str]:
+        """ splits `text` into windows of `chunk_words` words, consecutive windows share `chunk_overlap` words """
+        words: list[str] = text.split()
+        step:  int       = self.__words - self.__overlap
+
+        return [
+            " ".join(words[start:start + self.__words])
+            for start in range(0, max(1, len(words) - self.__overlap), step)
+        ] if words else [] #                                                                                    return #
+    # end                                                                                                        chunk #
+
+    def image_path(self, digest: str) -> Path:
+        return self.__directory / "images" / f"{digest}.png" #                                                  return #
+    # end                                                                                                   image_path #
+
+    def stats(self) -> dict[str, Any]:
+        return {"chunks": len(self.__index), **self.__index.stats()} #                                          return #
+    # end                                                                                                        stats #
+
+    def __len__(self) -> int:
+        return len(self.__index)
+    # end                                                                                                      __len__ #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _add(self, source: str, kind: str, texts: list[str], images: list[Optional[str]]) -> None:
+        """ embeds `texts` batch by batch and commits each batch's vectors and chunk rows together """
+        start: float = time.perf_counter()
+
+        with self.__write_lock:
+            connection: sqlite3.Connection = self._reader()
+            position:   int                = connection.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM chunks WHERE source = ?", (source,)
+            ).fetchone()[0]
+
+            for offset in range(0, len(texts), self.__batch_size):
+                batch:      list[str] = texts[offset:offset + self.__batch_size]
+                vectors, _            = self.__embedder.embed(batch)
+                rows:       range     = self.__index.add(vectors)
+
+                # the vectors are written first, rows without a chunk are cut off again by `_recover`
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO chunks (row, source, kind, position, text, image_sha256, created) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [
+                            (row, source, kind, position + offset + index, text, images[offset + index], time.time())
+                            for index, (row, text) in enumerate(zip(rows, batch))
+                        ]
+                    )
+
+        Metrics.observe("knowledge.ingest_seconds", time.perf_counter() - start, kind=kind)
+        Metrics.increment("knowledge.chunks_ingested", len(texts), kind=kind)
+        logger.info(f"ingested {len(texts)} {kind} chunks from {source}")
+    # end                                                                                                         _add #
+
+    def _caption(self, digest: str, data: bytes, timeout: float) -> Optional[str]:
+        """ the vision model's caption of an image, kept in the image store while it waits for its turn """
+        images: ImageStore = ImageStore.shared()
+        images.intern(data)
+
+        try:
+            return CaptionCache.shared().wait(digest, timeout) #                                                return #
+        finally:
+            images.release(digest)
+    # end                                                                                                     _caption #
+
+    def _chunks(self, rows: list[int]) -> dict[int, tuple]:
+        if not rows:
+            return {} #                                                                                         return #
+
+        return {
+            row[0]: row[1:]
+            for row in self._reader().execute(
+                f"SELECT row, source, kind, position, text, image_sha256 FROM chunks "
+                f"WHERE row IN ({', '.join('?' * len(rows))})", rows
+            )
+        } #                                                                                                     return #
+    # end                                                                                                      _chunks #
+
+    def _recover(self, connection: sqlite3.Connection) -> None:
+        """ brings vectors and chunks back in line after a crash in the middle of an ingestion """
+        rows: int = connection.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM chunks").fetchone()[0]
+
+        if rows < len(self.__index):
+            logger.warning(f"dropping {len(self.__index) - rows} vectors without chunks")
+            self.__index.truncate(rows)
+        elif rows > len(self.__index):
+            logger.warning(f"dropping {rows - len(self.__index)} chunks without vectors")
+            connection.execute("DELETE FROM chunks WHERE row >= ?", (len(self.__index),))
+    # end                                                                                                     _recover #
+
+    def _connect(self) -> sqlite3.Connection:
+        connection: sqlite3.Connection = sqlite3.connect(self.__directory / "knowledge.sqlite3", timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection #                                                                                     return #
+    # end                                                                                                     _connect #
+
+    def _reader(self) -> sqlite3.Connection:
+        """ one connection per thread, WAL lets queries run while a batch is being committed """
+        if not hasattr(self.__local, "connection"):
+            self.__local.connection = self._connect()
+
+        return self.__local.connection #                                                                        return #
+    # end                                                                                                      _reader #
+# end                                                                                                    KnowledgeBase #
@@ -0,0 +1,289 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import os
+import json
+import time
+import threading
+
+from pathlib import Path
+from typing  import Any, Optional
+
+import numpy as np
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.utils.metrics import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# -------------------------------------------------- vector index ---------------------------------------------------- #
+
+EXACT: str = "exact"
+IVF:   str = "ivf"
+
+class VectorIndex:
+    """ VectorIndex
+        VectorIndex - a persistent inner product index over L2 normalized float32 vectors (cosine similarity)
+
+        vectors are appended to a raw float32 file and read through a memory map, so the index opens instantly
+        and only the rows a query touches are paged in. below `ivf_threshold` rows every query is an exact
+        matrix-vector product, past it an inverted file (IVF) index is trained: spherical k-means puts every row
+        in one of ~sqrt(n) lists and a query only scans the `nprobe` lists closest to it. new rows are assigned to
+        the existing lists and the lists are retrained each time the index doubles
+
+        ```
+        <directory>/vectors.f32       n x dim float32, row i is the vector of chunk row i
+        <directory>/index.json        dim, rows and the ivf state
+        <directory>/centroids.npy     nlist x dim (ivf only)
+        <directory>/assignments.npy   the list of every row (ivf only)
+        ```
+
+        ```python
+        >>> index = VectorIndex(Path("Server", "database", "knowledge"))
+        >>> rows = index.add(vectors)            # range of the new row ids
+        >>> index.search(query, 5)
+        (array([812, 17, 4410, 3, 950]), array([0.83, 0.79, 0.77, 0.71, 0.70], dtype=float32))
+        ```
+
+        Args:
+            directory (Path): where the index lives, created if missing
+            ivf_threshold (int): rows from which an ivf index is used instead of exact search
+            nprobe (int): how many ivf lists a query scans
+    """
+
+    def __init__(self, directory: Path, ivf_threshold: int = 50_000, nprobe: int = 16) -> None:
+        self.__directory: Path           = directory
+        self.__threshold: int            = ivf_threshold
+        self.__nprobe:    int            = nprobe
+        self.__lock:      threading.Lock = threading.Lock()
+
+        self.__dim:          int                    = 0
+        self.__rows:         int                    = 0
+        self.__matrix:       Optional[np.ndarray]   = None # memory map over vectors.f32, rebuilt when rows change
+        self.__trained_rows: int                    = 0
+        self.__centroids:    Optional[np.ndarray]   = None
+        self.__assignments:  Optional[np.ndarray]   = None
+        self.__lists:        Optional[tuple[np.ndarray, np.ndarray]] = None # rows sorted by list, list offsets
+
+        directory.mkdir(parents=True, exist_ok=True)
+        self._open()
+    # end                                                                                                     __init__ #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def add(self, vectors: np.ndarray) -> range:
+        """ VectorIndex.add
+            add - appends L2 normalized vectors, returns the row ids they were given
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+        with self.__lock:
+            if self.__dim == 0:
+                self.__dim = vectors.shape[1]
+
+            if vectors.shape[1] != self.__dim:
+                raise ValueError(f"expected {self.__dim} dimensional vectors, got {vectors.shape[1]}")
+
+            start: int = self.__rows
+
+            with open(self._path("vectors.f32"), "ab") as file:
+                file.write(vectors.tobytes())
+
+            self.__rows  += len(vectors)
+            self.__matrix = None
+
+            if self.__centroids is not None:
+                self.__assignments = np.concatenate([self.__assignments, self._assign(vectors)])   # type:ignore
+                self.__lists       = None
+
+            if self.__rows >= self.__threshold and self.__rows >= 2 * self.__trained_rows:
+                self._train()
+
+            self._save()
+
+        Metrics.increment("knowledge.vectors_added", len(vectors))
+        Metrics.set_gauge("knowledge.vectors", self.__rows)
+        return range(start, start + len(vectors)) #                                                             return #
+    # end                                                                                                          add #
+
+    def search(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """ VectorIndex.search
+            search - the `k` rows with the highest inner product with `query`
+
+            Returns:
+                tuple[np.ndarray, np.ndarray]: the row ids and their scores, best first
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        start: float = time.perf_counter()
+
+        with self.__lock:
+            if self.__rows == 0 or k <= 0:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32) #                            return #
+
+            matrix: np.ndarray = self._matrix()
+
+            if self.__centroids is None:
+                candidates: Optional[np.ndarray] = None
+                scores:     np.ndarray           = matrix @ query
+            else:
+                candidates = self._candidates(query)
+                scores     = matrix[candidates] @ query
+
+            mode: str = EXACT if candidates is None else IVF
+
+        k    = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        rows = best if candidates is None else candidates[best]
+
+        Metrics.observe("knowledge.search_seconds", time.perf_counter() - start, mode=mode)
+        return rows.astype(np.int64), scores[best] #                                                            return #
+    # end                                                                                                       search #
+
+    def vector(self, row: int) -> np.ndarray:
+        with self.__lock:
+            return np.array(self._matrix()[row]) #                                                              return #
+    # end                                                                                                       vector #
+
+    def truncate(self, rows: int) -> None:
+        """ drops every row from `rows` on, used to undo vectors whose chunks were never committed """
+        with self.__lock:
+            if rows >= self.__rows:
+                return #                                                                                        return #
+
+            os.truncate(self._path("vectors.f32"), rows * self.__dim * 4)
+            self.__rows   = rows
+            self.__matrix = None
+
+            if self.__assignments is not None:
+                self.__assignments = self.__assignments[:rows]
+                self.__lists       = None
+
+            self._save()
+    # end                                                                                                     truncate #
+
+    def stats(self) -> dict[str, Any]:
+        with self.__lock:
+            return {
+                "rows":  self.__rows,
+                "dim":   self.__dim,
+                "mode":  EXACT if self.__centroids is None else IVF,
+                "lists": 0 if self.__centroids is None else len(self.__centroids),
+            } #                                                                                                 return #
+    # end                                                                                                        stats #
+
+    def __len__(self) -> int:
+        return self.__rows
+    # end                                                                                                      __len__ #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _path(self, name: str) -> Path:
+        return self.__directory / name #                                                                        return #
+    # end                                                                                                        _path #
+
+    def _open(self) -> None:
+        if not self._path("index.json").exists():
+            return #                                                                                            return #
+
+        with open(self._path("index.json"), "r") as file:
+            meta: dict[str, Any] = json.load(file)
+
+        self.__dim          = meta["dim"]
+        self.__trained_rows = meta.get("trained_rows", 0)
+
+        # a crash between appending vectors and saving index.json leaves extra rows, the file size is the truth
+        file_rows: int = os.path.getsize(self._path("vectors.f32")) // (4 * self.__dim) if self.__dim else 0
+        self.__rows    = file_rows
+
+        if self.__trained_rows and self._path("centroids.npy").exists():
+            self.__centroids   = np.load(self._path("centroids.npy"))
+            self.__assignments = np.load(self._path("assignments.npy"))
+
+            if len(self.__assignments) < self.__rows:
+                missing: np.ndarray = self._matrix()[len(self.__assignments):]
+                self.__assignments  = np.concatenate([self.__assignments, self._assign(missing)])
+            self.__assignments = self.__assignments[:self.__rows]
+
+        logger.info(f"vector index opened with {self.__rows} rows "
+                    f"({EXACT if self.__centroids is None else IVF} search)")
+    # end                                                                                                        _open #
+
+    def _save(self) -> None:
+        """ writes the metadata (and the ivf state) atomically, the caller holds the lock """
+        if self.__centroids is not None:
+            np.save(self._path("assignments.tmp.npy"), self.__assignments)
+            os.replace(self._path("assignments.tmp.npy"), self._path("assignments.npy"))
+
+        temp_path: Path = self._path("index.json.tmp")
+        with open(temp_path, "w") as file:
+            json.dump({"dim": self.__dim, "rows": self.__rows, "trained_rows": self.__trained_rows}, file)
+        os.replace(temp_path, self._path("index.json"))
+    # end                                                                                                        _save #
+
+    def _matrix(self) -> np.ndarray:
+        if self.__matrix is None or len(self.__matrix) != self.__rows:
+            self.__matrix = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r",
+                                      shape=(self.__rows, self.__dim))
+        return self.__matrix #                                                                                  return #
+    # end                                                                                                      _matrix #
+
+    def _assign(self, vectors: np.ndarray, batch: int = 65_536) -> np.ndarray:
+        """ the closest centroid of every vector, in batches so the score matrix stays small """
+        return np.concatenate([
+            np.argmax(vectors[start:start + batch] @ self.__centroids.T, axis=1).astype(np.int32)  # type:ignore
+            for start in range(0, len(vectors), batch)
+        ]) if len(vectors) else np.zeros(0, dtype=np.int32) #                                                   return #
+    # end                                                                                                      _assign #
+
+    def _train(self, iterations: int = 10, seed: int = 0) -> None:
+        """ spherical k-means on a sample of the rows, then assigns every row to its list """
+        start:  float               = time.perf_counter()
+        matrix: np.ndarray          = self._matrix()
+        nlist:  int                 = max(1, int(np.sqrt(self.__rows)))
+        rng:    np.random.Generator = np.random.default_rng(seed)
+        picked: np.ndarray          = rng.choice(self.__rows, min(self.__rows, 64 * nlist), replace=False)
+        sample: np.ndarray          = np.asarray(matrix[np.sort(picked)])
+
+        centroids: np.ndarray = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            labels: np.ndarray = np.argmax(sample @ centroids.T, axis=1)
+            sums:   np.ndarray = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+
+            empty: np.ndarray = ~np.any(sums, axis=1)
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))] # reseed lists that lost every row
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+        self.__centroids    = centroids.astype(np.float32)
+        self.__assignments  = self._assign(matrix)
+        self.__lists        = None
+        self.__trained_rows = self.__rows
+
+        np.save(self._path("centroids.npy"), self.__centroids)
+
+        Metrics.observe("knowledge.ivf_train_seconds", time.perf_counter() - start)
+        logger.info(f"ivf index trained with {nlist} lists over {self.__rows} rows "
+                    f"in {time.perf_counter() - start:.1f}s")
+    # end                                                                                                       _train #
+
+    def _candidates(self, query: np.ndarray) -> np.ndarray:
+        """ the rows of the `nprobe` lists closest to `query` """
+        if self.__lists is None:
+            order:   np.ndarray = np.argsort(self.__assignments, kind="stable")                         # type:ignore
+            offsets: np.ndarray = np.concatenate([[0], np.cumsum(np.bincount(self.__assignments,         # type:ignore
+                                                                             minlength=len(self.__centroids)))])
+            self.__lists = (order, offsets)
+
+        order, offsets = self.__lists
+        nprobe: int = min(self.__nprobe, len(self.__centroids))                                         # type:ignore
+        probes: np.ndarray = np.argpartition(-(self.__centroids @ query), nprobe - 1)[:nprobe]          # type:ignore
+
+        return np.sort(np.concatenate([order[offsets[probe]:offsets[probe + 1]] for probe in probes])) # return #
+    # end                                                                                                  _candidates #
+# end                                                                                                      VectorIndex #
@@ -0,0 +1,143 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import time
+import threading
+
+from collections import deque
+from typing      import Any, Optional
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+import  logging
+logger: logging.Logger = logging.getLogger("rich")
+
+# ----------------------------------------------------- metrics ------------------------------------------------------ #
+
+PROCESS_START: float = time.time() # first import of this module, used as the reference point for time-to-ready
+
+class Metrics:
+    """ Metrics
+        Metrics - process wide counters, gauges, summaries and a bounded event log. like `Config` this class is
+                  used directly and never instantiated, every method is thread safe
+
+        ```python
+        >>> Metrics.increment("registry.load", model="fast")
+        >>> Metrics.observe("registry.load_seconds", 2.31, model="fast")
+        >>> Metrics.event("registry.evict", model="fast", reason="budget")
+        >>> Metrics.snapshot()["counters"]["registry.load{model=fast}"]
+        1
+        ```
+    """
+
+    __lock:      threading.Lock                 = threading.Lock()
+    __counters:  dict[str, float]               = {}
+    __gauges:    dict[str, float]               = {}
+    __summaries: dict[str, dict[str, float]]    = {}
+    __events:    deque[dict[str, Any]]          = deque(maxlen=512)
+
+    def __init__(self) -> None:
+        raise Exception("This class is not meant to be instantiated.")
+    # end                                                                                                     __init__ #
+
+    @staticmethod
+    def key(name: str, **labels: Any) -> str:
+        """ Metrics.key
+            key - builds the flat key used to store a metric, labels are sorted so the key is stable
+
+            Args:
+                name (str): the metric name
+                **labels: optional labels, e.g. model="fast"
+
+            Returns:
+                str: `name{a=1,b=2}` or `name` if no labels are given
+        """
+        if not labels:
+            return name #                                                                                       return #
+
+        return name + "{" + ",".join(f"{label}={value}" for label, value in sorted(labels.items())) + "}"
+    # end                                                                                                          key #
+
+    @classmethod
+    def increment(cls, name: str, value: float = 1, **labels: Any) -> None:
+        key: str = cls.key(name, **labels)
+
+        with cls.__lock:
+            cls.__counters[key] = cls.__counters.get(key, 0) + value
+    # end                                                                                                    increment #
+
+    @classmethod
+    def set_gauge(cls, name: str, value: float, **labels: Any) -> None:
+        with cls.__lock:
+            cls.__gauges[cls.key(name, **labels)] = value
+    # end                                                                                                    set_gauge #
+
+    @classmethod
+    def observe(cls, name: str, value: float, **labels: Any) -> None:
+        """ Metrics.observe
+            observe - records a sample (usually a latency in seconds) into a running count/sum/min/max/last summary
+
+            Args:
+                name (str): the metric name
+                value (float): the observed value
+                **labels: optional labels
+        """
+        key: str = cls.key(name, **labels)
+
+        with cls.__lock:
+            summary: Optional[dict[str, float]] = cls.__summaries.get(key)
+
+            if summary is None:
+                cls.__summaries[key] = {"count": 1, "sum": value, "min": value, "max": value, "last": value}
+                return #                                                                                        return #
+
+            summary["count"] += 1
+            summary["sum"]   += value
+            summary["min"]    = min(summary["min"], value)
+            summary["max"]    = max(summary["max"], value)
+            summary["last"]   = value
+    # end                                                                                                      observe #
+
+    @classmethod
+    def event(cls, kind: str, **fields: Any) -> None:
+        """ Metrics.event
+            event - appends a timestamped event to the bounded event log and logs it
+
+            Args:
+                kind (str): the event kind, e.g. 'registry.evict'
+                **fields: extra data to attach to the event
+        """
+        with cls.__lock:
+            cls.__events.append({"kind": kind, "time": time.time(), **fields})
+
+        logger.info(f"[metrics] {kind} " + " ".join(f"{field}={value}" for field, value in fields.items()))
+    # end                                                                                                        event #
+
+    @classmethod
+    def snapshot(cls) -> dict[str, Any]:
+        """ Metrics.snapshot
+            snapshot - returns a json serializable copy of every metric
+
+            Returns:
+                dict[str, Any]: counters, gauges, summaries (with a derived mean) and the recent events
+        """
+        with cls.__lock:
+            return {
+                "counters":  dict(cls.__counters),
+                "gauges":    dict(cls.__gauges),
+                "summaries": {
+                    key: {**summary, "mean": summary["sum"] / summary["count"]}
+                    for key, summary in cls.__summaries.items()
+                },
+                "events":    list(cls.__events),
+            } #                                                                                                 return #
+    # end                                                                                                     snapshot #
+
+    @classmethod
+    def reset(cls) -> None:
+        with cls.__lock:
+            cls.__counters.clear()
+            cls.__gauges.clear()
+            cls.__summaries.clear()
+            cls.__events.clear()
+    # end                                                                                                        reset #
+# end                                                                                                          Metrics #
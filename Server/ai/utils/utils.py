@@ -2,7 +2,6 @@
 
 import base64
 import logging
-import requests
 import threading
 
 from   typing   import Callable
@@ -50,6 +49,8 @@ class UTILS:
     
     @staticmethod
     def convert_url_to_base64(url: str) -> str:
+        import requests
+
         response = requests.get(url)
 
         if response.status_code != 200:
@@ -4,6 +4,7 @@ import toml
 import logging
 import os
 from pathlib import Path
+from typing  import Any
 
 # -------------------------------------------------- set up logging -------------------------------------------------- #
 
@@ -28,6 +29,135 @@ class Config:
     log_to_file:     bool = False
     log_file:        str  = "voxai_server.log"
 
+    # [models] / [[routing]]
+    default_model:    str                       = ""
+    memory_budget_mb: int                       = 0
+    models:           dict[str, dict[str, Any]] = {}
+    routing:          list[dict[str, Any]]      = []
+
+    # [inference]
+    inference_backend:                str   = "llama"
+    inference_mock_token_ms:          float = 20.0
+    inference_mock_prefill_ms:        float = 0.5
+    inference_mock_load_seconds:      float = 0.0
+    inference_mock_reply_tokens:      int   = 64
+    inference_mock_dimension:         int   = 64
+    inference_remote_url:             str   = "http://127.0.0.1:8080"
+    inference_remote_api_key:         str   = ""
+    inference_remote_timeout:         float = 600.0
+    inference_remote_max_connections: int   = 16
+    inference_threads:                int   = 0
+    inference_kv_type:                str   = "f16"
+    inference_flash_attn:             bool  = False
+    inference_kv_budget_mb:           float = 0
+    inference_bulk_workers:           int   = 2
+    inference_bulk_shard_size:        int   = 1000
+
+    # [database]
+    database_enabled:  bool = True
+    database_path:     str  = "Server/database/voxai.sqlite3"
+    history_messages:  int  = 50
+
+    # [sessions]
+    sessions_hibernate:            bool  = True
+    sessions_dir:                  str   = "Server/database/sessions"
+    sessions_warm_after:           float = 600
+    sessions_cold_after:           float = 6 * 3600
+    sessions_max_hot_states:       int   = 4
+    sessions_compression_level:    int   = 1
+    sessions_sweep_interval:       float = 30
+    sessions_checkpoint_budget_mb: float = 512
+
+    # [images]
+    images_ram_budget_mb:       float = 256
+    images_dir:                 str   = "Server/database/images"
+    images_compact_after_turns: int   = 0
+    images_captions_path:       str   = "Server/database/captions.json"
+    images_caption_max_tokens:  int   = 48
+
+    # [history]
+    history_mode:          str = "all"
+    history_recent_turns:  int = 6
+    history_similar_turns: int = 6
+
+    # [embeddings]
+    embeddings_model:   str = ""
+    embeddings_context: int = 512
+    embeddings_cache_mb:   float = 64
+    embeddings_batch_size: int   = 64
+    embeddings_max_batch:  int   = 2048
+
+    # [knowledge]
+    knowledge_enabled:       bool  = True
+    knowledge_dir:           str   = "Server/database/knowledge"
+    knowledge_top_k:         int   = 4
+    knowledge_min_score:     float = 0.35
+    knowledge_chunk_words:   int   = 200
+    knowledge_chunk_overlap: int   = 40
+    knowledge_batch_size:    int   = 64
+    knowledge_ivf_threshold: int   = 50000
+    knowledge_nprobe:        int   = 16
+
+    # [transcription]
+    transcription_model:               str   = "base.en"
+    transcription_models_dir:          str   = "Server/models/whisper"
+    transcription_workers:             int   = 2
+    transcription_threads:             int   = 1
+    transcription_max_pending:         int   = 8
+    transcription_vad_threshold_db:    float = 10.0
+    transcription_min_speech_ms:       int   = 200
+    transcription_min_silence_ms:      int   = 500
+    transcription_max_segment_s:       float = 30.0
+    transcription_pad_ms:              int   = 200
+    transcription_partial_interval:    float = 1.0
+    transcription_batch_workers:       int   = 0
+    transcription_batch_chunk_seconds: float = 30.0
+
+    # [generation]
+    generation_max_tokens:            int       = 1024
+    generation_max_tokens_cap:        int       = 4096
+    generation_deadline_ms:           int       = 120000
+    generation_max_deadline_ms:       int       = 600000
+    generation_stop:                  list[str] = []
+    generation_max_stop:              int       = 8
+    generation_repetition:            bool      = True
+    generation_repetition_ngram:      int       = 8
+    generation_repetition_repeats:    int       = 3
+    generation_repetition_min_tokens: int       = 48
+    generation_repetition_max_period: int       = 256
+
+    # [tokenizer]
+    tokenizer_cache_mb:         float = 64
+    tokenizer_message_overhead: int   = 8
+    tokenizer_image_tokens:     int   = 576
+    tokenizer_answer_reserve:   int   = 1024
+    tokenizer_fit_context:      bool  = True
+    tokenizer_max_batch:        int   = 1024
+    tokenizer_incremental_prompts: bool = False
+    tokenizer_prompt_sessions:     int  = 256
+
+    # [scheduler]
+    scheduler_preemption:      bool = True
+    scheduler_time_slice_ms:   int  = 200
+    scheduler_max_preemptions: int  = 0
+
+    # [voice]
+    voice_pipelined:         bool = True
+    voice_prefill_min_words: int  = 3
+
+    # [gateway]
+    gateway_ip:               str       = "0.0.0.0"
+    gateway_port:             int       = 8280
+    gateway_backends:         list[str] = []
+    gateway_virtual_nodes:    int       = 160
+    gateway_load_factor:      float     = 1.25
+    gateway_affinity_entries: int       = 100_000
+    gateway_health_interval:  float     = 2.0
+    gateway_health_timeout:   float     = 1.0
+    gateway_connect_timeout:  float     = 2.0
+    gateway_max_connections:  int       = 256
+    gateway_max_keepalive:    int       = 64
+
     @classmethod
     def load(cls, file_path):
         if not os.path.exists(file_path):
@@ -56,6 +186,153 @@ class Config:
         cls.log_to_file     = logging_section.get('log_to_file', False)
         cls.log_file        = logging_section.get('log_file', "voxai_server.log")
         
+        # Load [models] section, every sub-table is a model entry ([models.<name>])
+        models_section = dict(config_data.get('models', {}))
+        cls.default_model    = models_section.get('default', "")
+        cls.memory_budget_mb = models_section.get('memory_budget_mb', 0)
+        cls.models           = {
+            name: dict(entry) for name, entry in models_section.items() if isinstance(entry, dict)
+        }
+        
+        # Load [[routing]] rules, evaluated in order
+        cls.routing          = [dict(rule) for rule in config_data.get('routing', [])]
+        
+        # Load [inference] section, the engine models run on unless their [models.<name>] entry names another
+        inference_section = dict(config_data.get('inference', {}))
+        cls.inference_backend                = inference_section.get('backend', "llama")
+        cls.inference_mock_token_ms          = inference_section.get('mock_token_ms', 20.0)
+        cls.inference_mock_prefill_ms        = inference_section.get('mock_prefill_ms', 0.5)
+        cls.inference_mock_load_seconds      = inference_section.get('mock_load_seconds', 0.0)
+        cls.inference_mock_reply_tokens      = inference_section.get('mock_reply_tokens', 64)
+        cls.inference_mock_dimension         = inference_section.get('mock_dimension', 64)
+        cls.inference_remote_url             = inference_section.get('remote_url', "http://127.0.0.1:8080")
+        cls.inference_threads                = inference_section.get('threads', 0)
+        cls.inference_kv_type                = inference_section.get('kv_type', "f16")
+        cls.inference_flash_attn             = inference_section.get('flash_attn', False)
+        cls.inference_kv_budget_mb           = inference_section.get('kv_budget_mb', 0)
+        cls.inference_bulk_workers           = inference_section.get('bulk_workers', 2)
+        cls.inference_bulk_shard_size        = inference_section.get('bulk_shard_size', 1000)
+        cls.inference_remote_api_key         = inference_section.get('remote_api_key', "")
+        cls.inference_remote_timeout         = inference_section.get('remote_timeout_seconds', 600.0)
+        cls.inference_remote_max_connections = inference_section.get('remote_max_connections', 16)
+        
+        # Load [database] section
+        database_section = dict(config_data.get('database', {}))
+        cls.database_enabled = database_section.get('enabled', True)
+        cls.database_path    = database_section.get('path', "Server/database/voxai.sqlite3")
+        cls.history_messages = database_section.get('history_messages', 50)
+        
+        # Load [sessions] section
+        sessions_section = dict(config_data.get('sessions', {}))
+        cls.sessions_hibernate            = sessions_section.get('hibernate', True)
+        cls.sessions_dir                  = sessions_section.get('dir', "Server/database/sessions")
+        cls.sessions_warm_after           = sessions_section.get('warm_after_seconds', 600)
+        cls.sessions_cold_after           = sessions_section.get('cold_after_seconds', 6 * 3600)
+        cls.sessions_max_hot_states       = sessions_section.get('max_hot_states', 4)
+        cls.sessions_compression_level    = sessions_section.get('compression_level', 1)
+        cls.sessions_sweep_interval       = sessions_section.get('sweep_interval_seconds', 30)
+        cls.sessions_checkpoint_budget_mb = sessions_section.get('checkpoint_budget_mb', 512)
+
+        # Load [images] section
+        images_section = dict(config_data.get('images', {}))
+        cls.images_ram_budget_mb       = images_section.get('ram_budget_mb', 256)
+        cls.images_dir                 = images_section.get('dir', "Server/database/images")
+        cls.images_compact_after_turns = images_section.get('compact_after_turns', 0)
+        cls.images_captions_path       = images_section.get('captions_path', "Server/database/captions.json")
+        cls.images_caption_max_tokens  = images_section.get('caption_max_tokens', 48)
+
+        # Load [history] section
+        history_section = dict(config_data.get('history', {}))
+        cls.history_mode          = history_section.get('mode', "all")
+        cls.history_recent_turns  = history_section.get('recent_turns', 6)
+        cls.history_similar_turns = history_section.get('similar_turns', 6)
+
+        # Load [embeddings] section
+        embeddings_section = dict(config_data.get('embeddings', {}))
+        cls.embeddings_model   = embeddings_section.get('model', "")
+        cls.embeddings_context = embeddings_section.get('context', 512)
+        cls.embeddings_cache_mb   = embeddings_section.get('cache_mb', 64)
+        cls.embeddings_batch_size = embeddings_section.get('batch_size', 64)
+        cls.embeddings_max_batch  = embeddings_section.get('max_batch', 2048)
+
+        # Load [knowledge] section
+        knowledge_section = dict(config_data.get('knowledge', {}))
+        cls.knowledge_enabled       = knowledge_section.get('enabled', True)
+        cls.knowledge_dir           = knowledge_section.get('dir', "Server/database/knowledge")
+        cls.knowledge_top_k         = knowledge_section.get('top_k', 4)
+        cls.knowledge_min_score     = knowledge_section.get('min_score', 0.35)
+        cls.knowledge_chunk_words   = knowledge_section.get('chunk_words', 200)
+        cls.knowledge_chunk_overlap = knowledge_section.get('chunk_overlap', 40)
+        cls.knowledge_batch_size    = knowledge_section.get('batch_size', 64)
+        cls.knowledge_ivf_threshold = knowledge_section.get('ivf_threshold', 50000)
+        cls.knowledge_nprobe        = knowledge_section.get('nprobe', 16)
+
+        # Load [transcription] section
+        transcription_section = dict(config_data.get('transcription', {}))
+        cls.transcription_model               = transcription_section.get('model', "base.en")
+        cls.transcription_models_dir          = transcription_section.get('models_dir', "Server/models/whisper")
+        cls.transcription_workers             = transcription_section.get('workers', 2)
+        cls.transcription_threads             = transcription_section.get('threads', 1)
+        cls.transcription_max_pending         = transcription_section.get('max_pending', 8)
+        cls.transcription_vad_threshold_db    = transcription_section.get('vad_threshold_db', 10.0)
+        cls.transcription_min_speech_ms       = transcription_section.get('min_speech_ms', 200)
+        cls.transcription_min_silence_ms      = transcription_section.get('min_silence_ms', 500)
+        cls.transcription_max_segment_s       = transcription_section.get('max_segment_s', 30.0)
+        cls.transcription_pad_ms              = transcription_section.get('pad_ms', 200)
+        cls.transcription_partial_interval    = transcription_section.get('partial_interval', 1.0)
+        cls.transcription_batch_workers       = transcription_section.get('batch_workers', 0)
+        cls.transcription_batch_chunk_seconds = transcription_section.get('batch_chunk_seconds', 30.0)
+
+        # Load [generation] section
+        generation_section = dict(config_data.get('generation', {}))
+        cls.generation_max_tokens            = generation_section.get('max_tokens', 1024)
+        cls.generation_max_tokens_cap        = generation_section.get('max_tokens_cap', 4096)
+        cls.generation_deadline_ms           = generation_section.get('deadline_ms', 120000)
+        cls.generation_max_deadline_ms       = generation_section.get('max_deadline_ms', 600000)
+        cls.generation_stop                  = list(generation_section.get('stop', []))
+        cls.generation_max_stop              = generation_section.get('max_stop', 8)
+        cls.generation_repetition            = generation_section.get('repetition', True)
+        cls.generation_repetition_ngram      = generation_section.get('repetition_ngram', 8)
+        cls.generation_repetition_repeats    = generation_section.get('repetition_repeats', 3)
+        cls.generation_repetition_min_tokens = generation_section.get('repetition_min_tokens', 48)
+        cls.generation_repetition_max_period = generation_section.get('repetition_max_period', 256)
+        
+        # Load [tokenizer] section
+        tokenizer_section = dict(config_data.get('tokenizer', {}))
+        cls.tokenizer_cache_mb         = tokenizer_section.get('cache_mb', 64)
+        cls.tokenizer_message_overhead = tokenizer_section.get('message_overhead', 8)
+        cls.tokenizer_image_tokens     = tokenizer_section.get('image_tokens', 576)
+        cls.tokenizer_answer_reserve   = tokenizer_section.get('answer_reserve', 1024)
+        cls.tokenizer_fit_context      = tokenizer_section.get('fit_context', True)
+        cls.tokenizer_max_batch        = tokenizer_section.get('max_batch', 1024)
+        cls.tokenizer_incremental_prompts = tokenizer_section.get('incremental_prompts', False)
+        cls.tokenizer_prompt_sessions     = tokenizer_section.get('prompt_sessions', 256)
+
+        # Load [scheduler] section
+        scheduler_section = dict(config_data.get('scheduler', {}))
+        cls.scheduler_preemption      = scheduler_section.get('preemption', True)
+        cls.scheduler_time_slice_ms   = scheduler_section.get('time_slice_ms', 200)
+        cls.scheduler_max_preemptions = scheduler_section.get('max_preemptions', 0)
+
+        # Load [voice] section
+        voice_section = dict(config_data.get('voice', {}))
+        cls.voice_pipelined         = voice_section.get('pipelined', True)
+        cls.voice_prefill_min_words = voice_section.get('prefill_min_words', 3)
+
+        # Load [gateway] section, only read by `start.py --gateway`
+        gateway_section = dict(config_data.get('gateway', {}))
+        cls.gateway_ip               = gateway_section.get('ip', "0.0.0.0")
+        cls.gateway_port             = gateway_section.get('port', 8280)
+        cls.gateway_backends         = list(gateway_section.get('backends', []))
+        cls.gateway_virtual_nodes    = gateway_section.get('virtual_nodes', 160)
+        cls.gateway_load_factor      = gateway_section.get('load_factor', 1.25)
+        cls.gateway_affinity_entries = gateway_section.get('affinity_entries', 100_000)
+        cls.gateway_health_interval  = gateway_section.get('health_interval_seconds', 2.0)
+        cls.gateway_health_timeout   = gateway_section.get('health_timeout_seconds', 1.0)
+        cls.gateway_connect_timeout  = gateway_section.get('connect_timeout_seconds', 2.0)
+        cls.gateway_max_connections  = gateway_section.get('max_connections', 256)
+        cls.gateway_max_keepalive    = gateway_section.get('max_keepalive', 64)
+        
         # Configure logging based on settings
         cls.configure_logging()
         
@@ -67,7 +344,29 @@ class Config:
                     f"server_ip: {cls.server_ip}, server_password: *****, "
                     f"server_port: {cls.server_port}, "
                     f"log_level: {cls.log_level}, log_to_file: {cls.log_to_file}, "
-                    f"log_file: {cls.log_file}")
+                    f"log_file: {cls.log_file}, default_model: {cls.default_model}, "
+                    f"memory_budget_mb: {cls.memory_budget_mb}, models: {list(cls.models)}, "
+                    f"routing: {cls.routing}, inference_backend: {cls.inference_backend}, "
+                    f"inference_kv_type: {cls.inference_kv_type}, inference_flash_attn: {cls.inference_flash_attn}, "
+                    f"inference_kv_budget_mb: {cls.inference_kv_budget_mb}, "
+                    f"database_enabled: {cls.database_enabled}, "
+                    f"database_path: {cls.database_path}, history_messages: {cls.history_messages}, "
+                    f"sessions_hibernate: {cls.sessions_hibernate}, sessions_dir: {cls.sessions_dir}, "
+                    f"sessions_warm_after: {cls.sessions_warm_after}, sessions_cold_after: {cls.sessions_cold_after}, "
+                    f"sessions_max_hot_states: {cls.sessions_max_hot_states}, "
+                    f"sessions_checkpoint_budget_mb: {cls.sessions_checkpoint_budget_mb}, "
+                    f"images_ram_budget_mb: {cls.images_ram_budget_mb}, images_dir: {cls.images_dir}, "
+                    f"images_compact_after_turns: {cls.images_compact_after_turns}, "
+                    f"history_mode: {cls.history_mode}, embeddings_model: {cls.embeddings_model or 'default model'}, "
+                    f"embeddings_cache_mb: {cls.embeddings_cache_mb}, "
+                    f"knowledge_enabled: {cls.knowledge_enabled}, knowledge_dir: {cls.knowledge_dir}, "
+                    f"transcription_model: {cls.transcription_model}, "
+                    f"transcription_workers: {cls.transcription_workers}, "
+                    f"generation_max_tokens: {cls.generation_max_tokens}/{cls.generation_max_tokens_cap}, "
+                    f"generation_deadline_ms: {cls.generation_deadline_ms}/{cls.generation_max_deadline_ms}, "
+                    f"tokenizer_fit_context: {cls.tokenizer_fit_context}, "
+                    f"scheduler_preemption: {cls.scheduler_preemption}, "
+                    f"voice_pipelined: {cls.voice_pipelined}, gateway_backends: {cls.gateway_backends}")
     
     @classmethod
     def configure_logging(cls):
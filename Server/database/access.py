@@ -0,0 +1,450 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import time
+import queue
+import base64
+import sqlite3
+import hashlib
+import threading
+
+from pathlib import Path
+from typing  import Any, Iterator, Optional, Union
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.ai.utils.metrics import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ----------------------------------------------------- schema ------------------------------------------------------- #
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id          TEXT    PRIMARY KEY,
+    created     REAL    NOT NULL,
+    updated     REAL    NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id  TEXT    NOT NULL REFERENCES sessions(id),
+    turn        INTEGER NOT NULL,
+    role        TEXT    NOT NULL,
+    text        TEXT,
+    created     REAL    NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS messages_session_turn ON messages (session_id, turn);
+
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256      TEXT    PRIMARY KEY,
+    mime        TEXT    NOT NULL,
+    size        INTEGER NOT NULL,
+    data        BLOB    NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS message_images (
+    message_id  INTEGER NOT NULL REFERENCES messages(id),
+    position    INTEGER NOT NULL,
+    tag         TEXT    NOT NULL,
+    sha256      TEXT    NOT NULL REFERENCES blobs(sha256),
+    PRIMARY KEY (message_id, position)
+);
+"""
+
+DATA_URI_PREFIX: str = "data:image/png;base64,"
+
+WRITES: tuple[str, ...] = ("append", "fork", "truncate") # queued operations the writer thread commits in batches
+
+# ------------------------------------------------------ store ------------------------------------------------------- #
+
+class ConversationStore:
+    """ ConversationStore
+        ConversationStore - an embedded sqlite (WAL mode) store for sessions and their messages
+
+        writes are append only (one row per turn) and are queued to a single background writer thread that
+        commits them in batches, so persisting a turn never blocks token streaming. images are decoded and
+        stored once as content addressed blobs (sha256 of the decoded bytes) no matter how many messages or
+        sessions reference them
+
+        ```python
+        >>> store = ConversationStore(Path("Server", "database", "voxai.sqlite3"))
+        >>> store.append("student-42", "user", "what is entropy?", ["img1|data:image/png;base64,iVBOR..."])
+        >>> store.flush()
+        >>> store.load_last("student-42", 20)
+        [{'turn': 1, 'role': 'user', 'text': 'what is entropy?', 'images': ['img1|data:image/png;base64,...']}]
+        ```
+
+        Args:
+            path (Path): the database file, created if missing
+            batch_size (int): the maximum number of queued writes committed in one transaction
+            flush_interval (float): seconds the writer waits to fill a batch before committing what it has
+    """
+
+    def __init__(self, path: Path, /, batch_size: int = 64, flush_interval: float = 0.05) -> None:
+        self.__path:           Path                         = path
+        self.__batch_size:     int                          = batch_size
+        self.__flush_interval: float                        = flush_interval
+        self.__queue:          queue.Queue[Optional[tuple]] = queue.Queue()
+        self.__local:          threading.local              = threading.local()
+        self.__turns:          dict[str, int]               = {} # only touched by the writer thread
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+        self.__writer: threading.Thread = threading.Thread(target=self._write_loop,
+                                                           daemon=True,
+                                                           name="db_writer_thread")
+        self.__writer.start()
+
+        logger.info(f"conversation store opened at {path}")
+    # end                                                                                                     __init__ #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    def append(self,
+               session_id: str,
+               role: str,
+               text: Optional[str],
+               images: Optional[list[Union[str, tuple[str, str]]]] = None) -> None:
+        """ ConversationStore.append
+            append - queues one turn for the writer thread and returns immediately
+
+            Args:
+                session_id (str): the session the turn belongs to
+                role (str): 'user', 'assistant' or 'system'
+                text (Optional[str]): the text of the turn
+                images (Optional[list[str | tuple[str, str]]]): tagged images in the `tag|data:image/png;base64,...`
+                                                                form, or `(tag, sha256)` of an already stored blob
+        """
+        self.__queue.put(("append", session_id, role, text, list(images or []), time.time()))
+    # end                                                                                                       append #
+
+    def fork(self, source_id: str, target_id: str, turn: int) -> None:
+        """ ConversationStore.fork
+            fork - queues copying the first `turn` turns of `source_id` into the new session `target_id`. the copy
+                   is ordered after every turn queued before it, images are shared blobs and are not copied
+        """
+        self.__queue.put(("fork", source_id, target_id, turn, time.time()))
+    # end                                                                                                         fork #
+
+    def truncate(self, session_id: str, turn: int) -> None:
+        """ queues deleting every turn of `session_id` after `turn`, the blobs they referenced are kept """
+        self.__queue.put(("truncate", session_id, turn))
+    # end                                                                                                     truncate #
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """ blocks until every write queued before this call is committed, returns False on timeout """
+        done: threading.Event = threading.Event()
+        self.__queue.put(("flush", done))
+        return done.wait(timeout) #                                                                             return #
+    # end                                                                                                        flush #
+
+    def load_last(self, session_id: str, count: int) -> list[dict[str, Any]]:
+        """ ConversationStore.load_last
+            load_last - reads the last `count` turns of a session in chronological order, using the
+                        (session_id, turn) index so the cost does not grow with the session length
+
+            Returns:
+                list[dict[str, Any]]: `{"turn", "role", "text", "images"}` with images in their tagged data uri form
+        """
+        connection: sqlite3.Connection = self._reader()
+
+        rows: list[tuple] = connection.execute(
+            "SELECT id, turn, role, text FROM messages WHERE session_id = ? ORDER BY turn DESC LIMIT ?",
+            (session_id, count),
+        ).fetchall()
+        rows.reverse()
+
+        if not rows:
+            return [] #                                                                                         return #
+
+        placeholders: str = ",".join("?" * len(rows))
+        images: dict[int, list[str]] = {}
+
+        for message_id, tag, data in connection.execute(
+            "SELECT message_images.message_id, message_images.tag, blobs.data "
+            "FROM message_images JOIN blobs ON blobs.sha256 = message_images.sha256 "
+            f"WHERE message_images.message_id IN ({placeholders}) "
+            "ORDER BY message_images.message_id, message_images.position",
+            [row[0] for row in rows],
+        ):
+            images.setdefault(message_id, []).append(f"{tag}|{DATA_URI_PREFIX}{base64.b64encode(data).decode()}")
+
+        return [
+            {"turn": turn, "role": role, "text": text, "images": images.get(message_id, [])}
+            for message_id, turn, role, text in rows
+        ] #                                                                                                     return #
+    # end                                                                                                    load_last #
+
+    def iter_messages(self, session_id: str, batch: int = 256) -> Iterator[dict[str, Any]]:
+        """ ConversationStore.iter_messages
+            iter_messages - walks every turn of a session in order, `batch` rows at a time, images are returned as
+                            `{"tag", "sha256", "size"}` references so memory stays bounded by the batch size
+
+            Yields:
+                dict[str, Any]: `{"turn", "role", "text", "images"}`
+        """
+        connection: sqlite3.Connection = self._connect() # own connection, the generator may outlive the caller's
+        last_turn:  int                = 0
+
+        try:
+            while True:
+                rows: list[tuple] = connection.execute(
+                    "SELECT id, turn, role, text FROM messages WHERE session_id = ? AND turn > ? "
+                    "ORDER BY turn LIMIT ?",
+                    (session_id, last_turn, batch),
+                ).fetchall()
+
+                if not rows:
+                    return #                                                                                    return #
+
+                placeholders: str = ",".join("?" * len(rows))
+                images: dict[int, list[dict[str, Any]]] = {}
+
+                for message_id, tag, digest, size in connection.execute(
+                    "SELECT message_images.message_id, message_images.tag, blobs.sha256, blobs.size "
+                    "FROM message_images JOIN blobs ON blobs.sha256 = message_images.sha256 "
+                    f"WHERE message_images.message_id IN ({placeholders}) "
+                    "ORDER BY message_images.message_id, message_images.position",
+                    [row[0] for row in rows],
+                ):
+                    images.setdefault(message_id, []).append({"tag": tag, "sha256": digest, "size": size})
+
+                for message_id, turn, role, text in rows:
+                    yield {"turn": turn, "role": role, "text": text, "images": images.get(message_id, [])}
+
+                last_turn = rows[-1][1]
+        finally:
+            connection.close()
+    # end                                                                                                iter_messages #
+
+    def has_blob(self, digest: str) -> bool:
+        return self._reader().execute("SELECT 1 FROM blobs WHERE sha256 = ?", (digest,)).fetchone() is not None
+    # end                                                                                                     has_blob #
+
+    def iter_blob(self, digest: str, chunk_size: int = 64 * 1024) -> Optional[Iterator[bytes]]:
+        """ ConversationStore.iter_blob
+            iter_blob - streams a stored blob in `chunk_size` pieces through sqlite's incremental blob io, the
+                        blob is never loaded whole
+
+            Returns:
+                Optional[Iterator[bytes]]: None if no blob with that digest exists
+        """
+        row: Optional[tuple] = self._reader().execute("SELECT rowid FROM blobs WHERE sha256 = ?", (digest,)).fetchone()
+
+        if row is None:
+            return None #                                                                                       return #
+
+        def _chunks() -> Iterator[bytes]:
+            connection: sqlite3.Connection = self._connect()
+
+            try:
+                if hasattr(connection, "blobopen"):
+                    with connection.blobopen("blobs", "data", row[0], readonly=True) as blob:
+                        while chunk := blob.read(chunk_size):
+                            yield chunk
+                else: # python < 3.11 has no incremental blob i/o, read the blob a slice at a time instead
+                    offset: int = 1 # substr counts from 1
+                    while chunk := (connection.execute(
+                        "SELECT substr(data, ?, ?) FROM blobs WHERE rowid = ?", (offset, chunk_size, row[0])
+                    ).fetchone() or (None,))[0]: # the row may be gone meanwhile
+                        yield chunk
+                        offset += len(chunk)
+            finally:
+                connection.close()
+
+        return _chunks() #                                                                                      return #
+    # end                                                                                                    iter_blob #
+
+    def put_blob(self, data: bytes, mime: str = "image/png") -> str:
+        """ stores a blob synchronously (it is usually referenced right after) and returns its sha256 """
+        digest: str = hashlib.sha256(data).hexdigest()
+
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO blobs (sha256, mime, size, data) VALUES (?, ?, ?, ?)",
+                (digest, mime, len(data), data),
+            )
+
+        return digest #                                                                                         return #
+    # end                                                                                                     put_blob #
+
+    def sessions(self) -> list[dict[str, Any]]:
+        return [
+            {"id": session_id, "created": created, "updated": updated}
+            for session_id, created, updated in self._reader().execute(
+                "SELECT id, created, updated FROM sessions ORDER BY updated DESC"
+            )
+        ] #                                                                                                     return #
+    # end                                                                                                     sessions #
+
+    def close(self) -> None:
+        self.__queue.put(None)
+        self.__writer.join()
+    # end                                                                                                        close #
+
+    @property
+    def path(self) -> Path:
+        return self.__path
+    # end                                                                                                         path #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    def _connect(self) -> sqlite3.Connection:
+        connection: sqlite3.Connection = sqlite3.connect(self.__path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL") # durable across process crashes, WAL keeps it consistent
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection #                                                                                     return #
+    # end                                                                                                     _connect #
+
+    def _reader(self) -> sqlite3.Connection:
+        """ one read connection per thread, WAL lets readers run concurrently with the writer """
+        if not hasattr(self.__local, "connection"):
+            self.__local.connection = self._connect()
+
+        return self.__local.connection #                                                                        return #
+    # end                                                                                                      _reader #
+
+    def _write_loop(self) -> None:
+        connection: sqlite3.Connection = self._connect()
+
+        while True:
+            batch: list[Optional[tuple]] = [self.__queue.get()]
+            deadline: float = time.monotonic() + self.__flush_interval
+
+            # keep filling the batch until it is full, the interval ran out or a flush/close was requested
+            while len(batch) < self.__batch_size and batch[-1] is not None and batch[-1][0] in WRITES:
+                try:
+                    batch.append(self.__queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            start: float = time.perf_counter()
+            writes: int = 0
+
+            try:
+                with connection:
+                    connection.execute("BEGIN")
+
+                    for item in batch:
+                        if item is None or item[0] not in WRITES:
+                            continue
+
+                        # every write has its own savepoint, a bad one (e.g. a malformed image) is dropped alone
+                        # instead of rolling back the other sessions' turns of the batch
+                        connection.execute("SAVEPOINT write")
+                        try:
+                            getattr(self, f"_{item[0]}")(connection, *item[1:])
+                        except Exception as e:
+                            connection.execute("ROLLBACK TO write")
+                            logger.error(f"failed to persist {item[0]} of session {item[1]}: {e!r}")
+                            Metrics.increment("db.write_errors")
+                            self.__turns.clear() # re-read turn counters, the savepoint rolled them back
+                        else:
+                            writes += 1
+                        finally:
+                            connection.execute("RELEASE write")
+            except sqlite3.Error as e: # the commit itself failed, the whole batch is rolled back
+                logger.error(f"failed to persist {writes} writes: {e}")
+                Metrics.increment("db.write_errors")
+                self.__turns.clear() # re-read turn counters, the failed transaction rolled them back
+                writes = 0
+
+            if writes:
+                Metrics.increment("db.turns_written", writes)
+                Metrics.observe("db.batch_commit_seconds", time.perf_counter() - start)
+
+            for item in batch:
+                if item is None:
+                    connection.close()
+                    return #                                                                                    return #
+
+                if item[0] == "flush":
+                    item[1].set()
+    # end                                                                                                  _write_loop #
+
+    def _append(self,
+                connection: sqlite3.Connection,
+                session_id: str,
+                role: str,
+                text: Optional[str],
+                images: list[Union[str, tuple[str, str]]],
+                created: float) -> None:
+        if session_id not in self.__turns:
+            connection.execute(
+                "INSERT OR IGNORE INTO sessions (id, created, updated) VALUES (?, ?, ?)", (session_id, created, created)
+            )
+            self.__turns[session_id] = connection.execute(
+                "SELECT COALESCE(MAX(turn), 0) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+
+        self.__turns[session_id] += 1
+
+        message_id: int = connection.execute(
+            "INSERT INTO messages (session_id, turn, role, text, created) VALUES (?, ?, ?, ?, ?)",
+            (session_id, self.__turns[session_id], role, text, created),
+        ).lastrowid                                                                                        # type:ignore
+
+        for position, image in enumerate(images):
+            if isinstance(image, tuple): # (tag, sha256) of a blob that is already stored
+                tag, digest = image
+            else:
+                tag, _, data_uri = image.partition("|")
+                data: bytes      = base64.b64decode(data_uri.strip().removeprefix(DATA_URI_PREFIX))
+                digest           = hashlib.sha256(data).hexdigest()
+
+                connection.execute(
+                    "INSERT OR IGNORE INTO blobs (sha256, mime, size, data) VALUES (?, 'image/png', ?, ?)",
+                    (digest, len(data), data),
+                )
+
+            connection.execute(
+                "INSERT INTO message_images (message_id, position, tag, sha256) VALUES (?, ?, ?, ?)",
+                (message_id, position, tag.strip(), digest),
+            )
+
+        connection.execute("UPDATE sessions SET updated = ? WHERE id = ?", (created, session_id))
+    # end                                                                                                      _append #
+
+    def _fork(self,
+              connection: sqlite3.Connection,
+              source_id: str,
+              target_id: str,
+              turn: int,
+              created: float) -> None:
+        connection.execute(
+            "INSERT OR IGNORE INTO sessions (id, created, updated) VALUES (?, ?, ?)", (target_id, created, created)
+        )
+        connection.execute(
+            "INSERT INTO messages (session_id, turn, role, text, created) "
+            "SELECT ?, turn, role, text, created FROM messages WHERE session_id = ? AND turn <= ? ORDER BY turn",
+            (target_id, source_id, turn),
+        )
+        connection.execute(
+            "INSERT INTO message_images (message_id, position, tag, sha256) "
+            "SELECT target.id, image.position, image.tag, image.sha256 FROM messages AS source "
+            "JOIN message_images AS image ON image.message_id = source.id "
+            "JOIN messages AS target ON target.session_id = ? AND target.turn = source.turn "
+            "WHERE source.session_id = ? AND source.turn <= ?",
+            (target_id, source_id, turn),
+        )
+        self.__turns.pop(target_id, None)
+    # end                                                                                                        _fork #
+
+    def _truncate(self, connection: sqlite3.Connection, session_id: str, turn: int) -> None:
+        connection.execute(
+            "DELETE FROM message_images WHERE message_id IN (SELECT id FROM messages WHERE session_id = ? AND turn > ?)",
+            (session_id, turn),
+        )
+        connection.execute("DELETE FROM messages WHERE session_id = ? AND turn > ?", (session_id, turn))
+        self.__turns.pop(session_id, None)
+    # end                                                                                                    _truncate #
+# end                                                                                                ConversationStore #
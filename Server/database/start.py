@@ -1,15 +1,18 @@
 import subprocess
-import rich
 import logging
 
+from importlib.util import find_spec
+
 logger = logging.getLogger()
 
 def check_surreal_installed() -> bool:
+    if find_spec("surrealdb") is None:
+        return False
+
     try:
-        import surrealdb
         subprocess.run(["surreal", "help"], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         return True
-    except (ImportError, FileNotFoundError):
+    except (FileNotFoundError, subprocess.CalledProcessError):
         return False
     
 def _test() -> None:
@@ -0,0 +1,255 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import math
+import time
+import asyncio
+
+from collections import OrderedDict
+from typing      import Any, Optional
+
+import httpx
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.config.read_config import Config
+from Server.gateway.ring       import HashRing
+from Server.ai.utils.metrics   import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ----------------------------------------------------- backends ----------------------------------------------------- #
+
+class Backend:
+    """ one server behind the gateway and its pool of keep-alive connections """
+
+    def __init__(self, url: str, client: httpx.AsyncClient) -> None:
+        self.url:       str               = url.rstrip("/")
+        self.client:    httpx.AsyncClient = client
+        self.healthy:   bool              = True # optimistic until the first health check, requests fail over
+        self.status:    str               = "unknown"
+        self.in_flight: int               = 0    # open requests and websockets through the gateway
+        self.checked:   float             = 0.0
+    # end                                                                                                     __init__ #
+
+    def describe(self) -> dict[str, Any]:
+        return {
+            "healthy":   self.healthy,
+            "status":    self.status,
+            "in_flight": self.in_flight,
+            "checked":   self.checked,
+        } #                                                                                                     return #
+    # end                                                                                                     describe #
+# end                                                                                                          Backend #
+
+class BackendPool:
+    """ BackendPool
+        BackendPool - picks the backend of every request: the one holding the session's context and kv cache if
+                      it is up, consistent hashing with bounded loads for sessions it has not seen yet
+
+        a new session goes to the first backend in ring order from its id whose in-flight requests are below
+        `ceil(load_factor * (in flight + 1) / healthy backends)`, so one busy lecture can not pile every new
+        session onto its node. the choice is remembered (up to `affinity_entries` sessions, least recently used
+        first out) and later turns stick to it whatever the load, moving a session loses its cache. only a
+        backend going down moves its sessions, to the next one on the ring
+
+        backends are checked with `GET /health` every `health_interval` seconds and taken out of the ring at the
+        first failed check or refused connection, a passing check brings them back
+
+        ```python
+        >>> pool = BackendPool.from_config()
+        >>> await pool.start()
+        >>> backend = pool.pick("lecture-42")
+        >>> pool.acquire(backend)
+        ...     # proxy the request over backend.client
+        >>> pool.release(backend)
+        ```
+
+        Args:
+            backends (list[str]): the backend urls, e.g. "http://10.0.0.2:8282"
+            virtual_nodes (int): ring points per backend
+            load_factor (float): how far above the average load a backend may be given new sessions, >= 1
+            affinity_entries (int): sessions whose backend is remembered
+            health_interval (float): seconds between health checks
+            health_timeout (float): seconds a health check may take
+            connect_timeout (float): seconds to open a connection to a backend
+            max_connections (int): connections per backend
+            max_keepalive (int): idle connections kept open per backend
+    """
+
+    def __init__(self,
+                 backends: list[str],
+                 virtual_nodes: int = 160,
+                 load_factor: float = 1.25,
+                 affinity_entries: int = 100_000,
+                 health_interval: float = 2.0,
+                 health_timeout: float = 1.0,
+                 connect_timeout: float = 2.0,
+                 max_connections: int = 256,
+                 max_keepalive: int = 64) -> None:
+        if not backends:
+            raise ValueError("the gateway needs at least one backend, see [gateway] backends")
+
+        self.__ring:             HashRing                    = HashRing(backends, virtual_nodes)
+        self.__load_factor:      float                       = max(1.0, load_factor)
+        self.__affinity_entries: int                         = affinity_entries
+        self.__health_interval:  float                       = health_interval
+        self.__health_timeout:   float                       = health_timeout
+
+        # generations stream for minutes, the backend enforces their deadline so reads never time out here
+        timeout: httpx.Timeout = httpx.Timeout(connect=connect_timeout, read=None, write=60.0, pool=None)
+        limits:  httpx.Limits  = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+
+        self.__backends:         dict[str, Backend]          = {
+            url: Backend(url, httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits))
+            for url in self.__ring.backends
+        }
+        self.__affinity:         OrderedDict[str, str]       = OrderedDict() # session -> backend url
+        self.__checker:          Optional[asyncio.Task]      = None
+    # end                                                                                                     __init__ #
+
+    @classmethod
+    def from_config(cls) -> "BackendPool":
+        return cls(
+            Config.gateway_backends,
+            virtual_nodes    = Config.gateway_virtual_nodes,
+            load_factor      = Config.gateway_load_factor,
+            affinity_entries = Config.gateway_affinity_entries,
+            health_interval  = Config.gateway_health_interval,
+            health_timeout   = Config.gateway_health_timeout,
+            connect_timeout  = Config.gateway_connect_timeout,
+            max_connections  = Config.gateway_max_connections,
+            max_keepalive    = Config.gateway_max_keepalive,
+        ) #                                                                                                     return #
+    # end                                                                                                  from_config #
+
+    # ----------------------------------------------- public functions ----------------------------------------------- #
+
+    async def start(self) -> None:
+        """ checks every backend once, then keeps checking them in the background """
+        await self.check()
+        self.__checker = asyncio.create_task(self._check_forever())
+    # end                                                                                                        start #
+
+    async def close(self) -> None:
+        if self.__checker is not None:
+            self.__checker.cancel()
+
+        await asyncio.gather(*(backend.client.aclose() for backend in self.__backends.values()))
+    # end                                                                                                        close #
+
+    def pick(self, session_id: Optional[str], exclude: frozenset[str] = frozenset()) -> Optional[Backend]:
+        """ the backend for a request of `session_id`, the least loaded one for requests outside of every session.
+            `exclude` holds backends that already failed this request. None if no backend is up
+        """
+        healthy: list[Backend] = [
+            backend for url, backend in self.__backends.items() if backend.healthy and url not in exclude
+        ]
+        if not healthy:
+            return None #                                                                                       return #
+
+        if session_id is None:
+            return min(healthy, key=lambda backend: backend.in_flight) #                                        return #
+
+        url: Optional[str] = self.__affinity.get(session_id)
+        if url is not None and url not in exclude and self.__backends[url].healthy:
+            self.__affinity.move_to_end(session_id)
+            return self.__backends[url] #                                                                       return #
+
+        total:    int = sum(backend.in_flight for backend in healthy)
+        capacity: int = math.ceil(self.__load_factor * (total + 1) / len(healthy))
+        chosen:   Optional[Backend] = None
+
+        for candidate in self.__ring.candidates(session_id):
+            backend: Backend = self.__backends[candidate]
+            if backend.healthy and candidate not in exclude and backend.in_flight < capacity:
+                chosen = backend
+                break
+
+        # some backend is always at or below the average, the fallback only guards against rounding
+        chosen = chosen or min(healthy, key=lambda backend: backend.in_flight)
+
+        if url is not None:
+            Metrics.increment("gateway.sessions_moved", source=url, target=chosen.url)
+            logger.warning(f"session {session_id} moved from {url} to {chosen.url}, its context cache is lost")
+        elif chosen.url != next(self.__ring.candidates(session_id)):
+            Metrics.increment("gateway.sessions_spilled", target=chosen.url)
+
+        self.assign(session_id, chosen)
+        return chosen #                                                                                         return #
+    # end                                                                                                         pick #
+
+    def assign(self, session_id: str, backend: Backend) -> None:
+        """ pins `session_id` to `backend`, e.g. a fork that was created on the backend of its parent """
+        self.__affinity[session_id] = backend.url
+        self.__affinity.move_to_end(session_id)
+
+        while len(self.__affinity) > self.__affinity_entries:
+            self.__affinity.popitem(last=False)
+    # end                                                                                                       assign #
+
+    def acquire(self, backend: Backend) -> None:
+        backend.in_flight += 1
+        Metrics.increment("gateway.requests", backend=backend.url)
+        Metrics.set_gauge("gateway.in_flight", backend.in_flight, backend=backend.url)
+    # end                                                                                                      acquire #
+
+    def release(self, backend: Backend) -> None:
+        backend.in_flight -= 1
+        Metrics.set_gauge("gateway.in_flight", backend.in_flight, backend=backend.url)
+    # end                                                                                                      release #
+
+    def failed(self, backend: Backend, error: Exception) -> None:
+        """ a request could not reach `backend`, it is out of the ring until it passes a health check """
+        if backend.healthy:
+            logger.warning(f"backend {backend.url} is unreachable ({error!r}), failing over")
+            Metrics.event("gateway.backend_down", backend=backend.url, reason=type(error).__name__)
+
+        backend.healthy = False
+        backend.status  = "unreachable"
+        Metrics.increment("gateway.failovers", backend=backend.url)
+    # end                                                                                                       failed #
+
+    async def check(self) -> None:
+        await asyncio.gather(*(self._check(backend) for backend in self.__backends.values()))
+    # end                                                                                                        check #
+
+    def status(self) -> dict[str, dict[str, Any]]:
+        return {url: backend.describe() for url, backend in self.__backends.items()} #                          return #
+    # end                                                                                                       status #
+
+    @property
+    def backends(self) -> list[Backend]:
+        return list(self.__backends.values())
+    # end                                                                                                     backends #
+
+    # ----------------------------------------------- private functions ---------------------------------------------- #
+
+    async def _check(self, backend: Backend) -> None:
+        healthy: bool = False
+
+        try:
+            response: httpx.Response = await backend.client.get("/health", timeout=self.__health_timeout)
+            healthy, backend.status = response.status_code == 200, response.json().get("status", "unknown")
+        except (httpx.HTTPError, ValueError) as e:
+            backend.status = f"unreachable: {type(e).__name__}"
+
+        backend.checked = time.time()
+        if healthy != backend.healthy:
+            Metrics.event("gateway.backend_up" if healthy else "gateway.backend_down", backend=backend.url,
+                          reason=backend.status)
+        backend.healthy = healthy
+    # end                                                                                                       _check #
+
+    async def _check_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.__health_interval)
+            try:
+                await self.check()
+            except Exception as e: # a failed round must not stop the checks
+                logger.error(f"gateway health check failed: {e}")
+    # end                                                                                               _check_forever #
+# end                                                                                                      BackendPool #
@@ -0,0 +1,359 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import re
+import sys
+import json
+import asyncio
+import secrets
+
+from contextlib import asynccontextmanager
+from typing     import AsyncIterator, Optional
+
+import httpx
+
+from fastapi           import Depends, FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.security  import HTTPBasic, HTTPBasicCredentials
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+from Server.config.read_config  import Config
+from Server.gateway.backends    import Backend, BackendPool
+from Server.ai.context.sessions import DEFAULT_SESSION_ID
+from Server.ai.utils.metrics    import Metrics
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ----------------------------------------------------- gateway ------------------------------------------------------ #
+
+# hop-by-hop headers describe one connection, they are never forwarded (RFC 9110 7.6.1)
+HOP_BY_HOP: frozenset[str] = frozenset({
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer", "transfer-encoding",
+    "upgrade", "host",
+})
+
+SESSION_PATH: re.Pattern = re.compile(r"^/sessions/([^/]+)/")
+FORK_PATH:    re.Pattern = re.compile(r"^/sessions/[^/]+/fork$")
+
+# writes to state every backend keeps for itself (the image store and the knowledge base) go to all of them
+BROADCAST: frozenset[tuple[str, str]] = frozenset({
+    ("PUT",  "/images"),
+    ("POST", "/knowledge/text"),
+    ("PUT",  "/knowledge/images"),
+})
+
+# websockets whose session is only known from their first text message, the ChatRequest json
+FIRST_MESSAGE_SESSION: frozenset[str] = frozenset({"/voice/chat"})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    app.state.pool = BackendPool.from_config()
+    await app.state.pool.start()
+    try:
+        yield
+    finally:
+        await app.state.pool.close()
+# end                                                                                                         lifespan #
+
+app:      FastAPI   = FastAPI(
+    title="Vox AI gateway",
+    description="routes the requests of every session to the Vox AI server holding its context",
+    version="1.0.0",
+    lifespan=lifespan,
+)
+security: HTTPBasic = HTTPBasic()
+
+def authenticate(credentials: HTTPBasicCredentials = Depends(security)) -> str:
+    password_ok: bool = secrets.compare_digest(credentials.password.encode(), Config.server_password.encode())
+    if credentials.username != "admin" or not password_ok:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    return credentials.username #                                                                               return #
+# end                                                                                                     authenticate #
+
+def session_of(path: str, query: dict[str, str], body: Optional[dict] = None) -> Optional[str]:
+    """ the session a request belongs to, None for requests outside of every session. a chat without a session
+        continues the backends' default session, which lives on one backend like any other
+    """
+    match: Optional[re.Match] = SESSION_PATH.match(path)
+    if match is not None:
+        return match.group(1) #                                                                                 return #
+
+    if query.get("session_id"):
+        return query["session_id"] #                                                                            return #
+
+    if body is not None and body.get("session_id"):
+        return str(body["session_id"]) #                                                                        return #
+
+    return DEFAULT_SESSION_ID if path == "/chat" or path in FIRST_MESSAGE_SESSION else None #                   return #
+# end                                                                                                       session_of #
+
+def forwarded_headers(request: Request | WebSocket) -> dict[str, str]:
+    headers: dict[str, str] = {
+        name: value for name, value in request.headers.items() if name not in HOP_BY_HOP
+    }
+    client: str = request.client.host if request.client is not None else ""
+    headers["x-forwarded-for"] = ", ".join(filter(None, [request.headers.get("x-forwarded-for"), client]))
+    return headers #                                                                                            return #
+# end                                                                                                forwarded_headers #
+
+def passthrough(response: Response, upstream: httpx.Response, backend: Backend, *drop: str) -> Response:
+    """ copies the backend's response headers (repeated ones included) onto `response` """
+    response.raw_headers += [
+        (name.encode("latin-1"), value.encode("latin-1"))
+        for name, value in upstream.headers.multi_items()
+        if name not in HOP_BY_HOP and name not in drop
+    ]
+    response.raw_headers.append((b"x-gateway-backend", backend.url.encode("latin-1")))
+    return response #                                                                                           return #
+# end                                                                                                      passthrough #
+
+def unavailable(detail: str, code: int = status.HTTP_503_SERVICE_UNAVAILABLE) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=code) #                                                 return #
+# end                                                                                                      unavailable #
+
+async def relay(upstream: httpx.Response, backend: Backend, pool: BackendPool) -> AsyncIterator[bytes]:
+    """ the backend's body chunk by chunk as it arrives, a client that leaves closes the backend's stream too """
+    try:
+        async for chunk in upstream.aiter_raw():
+            yield chunk #                                                                               yield return
+    finally:
+        await upstream.aclose()
+        pool.release(backend)
+# end                                                                                                            relay #
+
+async def broadcast(request: Request, pool: BackendPool) -> Response:
+    """ sends a write to every healthy backend at once, answers with the first success. backends down at the time
+        miss the write, they have to be re-ingested once they are back
+    """
+    body:     bytes         = await request.body()
+    backends: list[Backend] = [backend for backend in pool.backends if backend.healthy]
+    if not backends:
+        return unavailable("no backend available") #                                                            return #
+
+    async def send(backend: Backend) -> httpx.Response:
+        pool.acquire(backend)
+        try:
+            return await backend.client.request(
+                request.method, request.url.path, params=request.query_params, content=body,
+                headers=forwarded_headers(request),
+            ) #                                                                                                 return #
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            pool.failed(backend, e)
+            raise
+        finally:
+            pool.release(backend)
+
+    results = await asyncio.gather(*(send(backend) for backend in backends), return_exceptions=True)
+    replies: list[tuple[Backend, httpx.Response]] = [
+        (backend, result) for backend, result in zip(backends, results) if isinstance(result, httpx.Response)
+    ]
+    if not replies:
+        return unavailable("no backend could be reached", status.HTTP_502_BAD_GATEWAY) #                        return #
+
+    stored: int = sum(reply.is_success for _, reply in replies)
+    Metrics.increment("gateway.broadcasts", path=request.url.path)
+    if stored < len(pool.backends):
+        logger.warning(f"{request.method} {request.url.path} reached {stored} of {len(pool.backends)} backends")
+        Metrics.increment("gateway.broadcasts_incomplete", path=request.url.path)
+
+    backend, reply = next(((backend, reply) for backend, reply in replies if reply.is_success), replies[0])
+    response: Response = passthrough(
+        Response(reply.content, status_code=reply.status_code), reply, backend, "content-length", "content-encoding"
+    )
+    response.headers["x-gateway-replicas"] = f"{stored}/{len(pool.backends)}"
+    return response #                                                                                           return #
+# end                                                                                                        broadcast #
+
+# ----------------------------------------------------- routes ------------------------------------------------------- #
+
+@app.get("/health")
+def health(request: Request):
+    backends = request.app.state.pool.status()
+    return {
+        "status":   "healthy" if any(backend["healthy"] for backend in backends.values()) else "unavailable",
+        "backends": backends,
+        "version":  "1.0.0",
+    }
+
+@app.get("/gateway/metrics")
+def gateway_metrics(username: str = Depends(authenticate)):
+    # the gateway's own metrics, every backend still serves its /metrics
+    return Metrics.snapshot()
+
+@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"])
+async def proxy(request: Request, path: str) -> Response:
+    # the body is only read up front when the session is in it, everything else streams through both ways
+    pool: BackendPool = request.app.state.pool
+    if (request.method, request.url.path) in BROADCAST:
+        return await broadcast(request, pool)
+
+    payload: Optional[bytes] = None
+    body:    Optional[dict]  = None
+    if request.method == "POST" and request.headers.get("content-type", "").startswith("application/json"):
+        payload = await request.body()
+        try:
+            body = json.loads(payload) if payload else None
+        except ValueError: # the backend answers with the validation error
+            pass
+
+    session: Optional[str] = session_of(
+        request.url.path, dict(request.query_params), body if isinstance(body, dict) else None
+    )
+    started: bool          = False
+
+    async def stream() -> AsyncIterator[bytes]:
+        nonlocal started
+        started = True
+        async for chunk in request.stream():
+            yield chunk #                                                                               yield return
+
+    has_body: bool    = payload is not None or request.headers.get("content-length", "0") != "0" or \
+        "transfer-encoding" in request.headers
+    tried:    set[str] = set()
+
+    while True:
+        backend: Optional[Backend] = pool.pick(session, frozenset(tried))
+        if backend is None:
+            return unavailable("no backend available") #                                                        return #
+
+        pool.acquire(backend)
+        try:
+            upstream: httpx.Response = await backend.client.send(backend.client.build_request(
+                request.method, request.url.path, params=request.query_params, headers=forwarded_headers(request),
+                content=payload if payload is not None else stream() if has_body else None,
+            ), stream=True)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            pool.release(backend)
+            pool.failed(backend, e)
+            tried.add(backend.url)
+            if started: # the body is gone, it can not be sent again
+                return unavailable(f"backend failed: {e!r}", status.HTTP_502_BAD_GATEWAY) #                     return #
+            continue
+        except httpx.HTTPError as e:
+            pool.release(backend)
+            return unavailable(f"backend failed: {e!r}", status.HTTP_502_BAD_GATEWAY) #                         return #
+        break
+
+    if FORK_PATH.match(request.url.path) and upstream.status_code == 200:
+        # the branch was created next to its parent, its turns have to go there too
+        try:
+            reply: bytes = await upstream.aread()
+            pool.assign(json.loads(reply)["session_id"], backend)
+        finally:
+            await upstream.aclose()
+            pool.release(backend)
+        return passthrough(Response(reply, status_code=200), upstream, backend, "content-length") #            return #
+
+    return passthrough(
+        StreamingResponse(relay(upstream, backend, pool), status_code=upstream.status_code), upstream, backend
+    ) #                                                                                                         return #
+
+@app.websocket("/{path:path}")
+async def proxy_websocket(websocket: WebSocket, path: str):
+    # the backend authenticates the socket, a rejected handshake is passed on as the close code it stands for
+    from websockets.asyncio.client import ClientConnection, connect
+    from websockets.exceptions     import ConnectionClosed, InvalidHandshake, InvalidStatus
+
+    pool: BackendPool = websocket.app.state.pool
+    await websocket.accept()
+
+    first:   Optional[str] = None
+    session: Optional[str] = session_of(websocket.url.path, dict(websocket.query_params))
+    if websocket.url.path in FIRST_MESSAGE_SESSION:
+        try:
+            first = await websocket.receive_text()
+            body  = json.loads(first)
+            session = str(body.get("session_id") or DEFAULT_SESSION_ID) if isinstance(body, dict) else session
+        except WebSocketDisconnect:
+            return
+        except ValueError: # the backend closes the socket with the validation error
+            pass
+
+    headers: dict[str, str] = {
+        name: value for name, value in forwarded_headers(websocket).items()
+        if name in ("authorization", "x-forwarded-for", "user-agent")
+    }
+    tried:    set[str] = set()
+    upstream: Optional[ClientConnection] = None
+
+    while upstream is None:
+        backend: Optional[Backend] = pool.pick(session, frozenset(tried))
+        if backend is None:
+            await websocket.close(code=1013, reason="no backend available")
+            return
+
+        pool.acquire(backend)
+        target: str = "ws" + backend.url[len("http"):] + websocket.url.path + \
+            (f"?{websocket.url.query}" if websocket.url.query else "")
+        try:
+            upstream = await connect(target, additional_headers=headers, max_size=None, compression=None)
+        except InvalidStatus as e:
+            pool.release(backend)
+            rejected: bool = e.response.status_code == status.HTTP_403_FORBIDDEN
+            await websocket.close(code=1008 if rejected else 1011, reason="rejected by the backend")
+            return
+        except (OSError, TimeoutError, InvalidHandshake) as e:
+            pool.release(backend)
+            pool.failed(backend, e)
+            tried.add(backend.url)
+
+    async def to_backend() -> None:
+        while (message := await websocket.receive())["type"] != "websocket.disconnect":
+            if message.get("bytes") is not None:
+                await upstream.send(message["bytes"])
+            elif message.get("text") is not None:
+                await upstream.send(message["text"])
+
+    async def to_client() -> None:
+        try:
+            async for message in upstream:
+                if isinstance(message, bytes):
+                    await websocket.send_bytes(message)
+                else:
+                    await websocket.send_text(message)
+        except ConnectionClosed:
+            pass
+
+        # 1005 and 1006 only describe a missing close frame, they can not be sent
+        code: int = upstream.close_code if upstream.close_code not in (None, 1005, 1006) else 1011
+        await websocket.close(code=code, reason=upstream.close_reason or "")
+
+    try:
+        if first is not None:
+            await upstream.send(first)
+
+        tasks = [asyncio.create_task(to_backend()), asyncio.create_task(to_client())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            if task.exception() is not None and not isinstance(task.exception(), WebSocketDisconnect):
+                logger.warning(f"websocket {websocket.url.path} via {backend.url} failed: {task.exception()!r}")
+    finally:
+        await upstream.close()
+        pool.release(backend)                                                                          # type:ignore
+
+def main() -> None:
+    import uvicorn
+
+    try:
+        Config.load("server.toml")
+        logger.info(f"Starting gateway on {Config.gateway_ip}:{Config.gateway_port} for {Config.gateway_backends}")
+        uvicorn.run(app, host=Config.gateway_ip, port=Config.gateway_port, log_level="info")
+    except KeyboardInterrupt:
+        logger.info("Gateway shutdown requested")
+    except Exception as e:
+        logger.error(f"Gateway error: {e}")
+        sys.exit(1)
+# end                                                                                                             main #
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import bisect
+import hashlib
+
+from typing import Iterable, Iterator
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+import logging
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+logger: logging.Logger = logging.getLogger("rich")
+
+# ------------------------------------------------------- ring ------------------------------------------------------- #
+
+def point(key: str) -> int:
+    """ the position of `key` on the ring, the same in every process (python's `hash` is salted per process) """
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big") #                       return #
+# end                                                                                                            point #
+
+class HashRing:
+    """ HashRing
+        HashRing - consistent hashing of session ids onto backends, adding or removing a backend only moves the
+                   sessions of the ring segments it gains or loses
+
+        every backend is placed `virtual_nodes` times so the segments even out, `candidates` walks clockwise from
+        the key and yields every backend once: the first is the session's home, the rest are the order it fails
+        over (or spills over under load) in
+
+        ```python
+        >>> ring = HashRing(["http://10.0.0.2:8282", "http://10.0.0.3:8282"])
+        >>> next(ring.candidates("lecture-42"))
+        'http://10.0.0.3:8282'
+        ```
+
+        Args:
+            backends (Iterable[str]): the backend urls
+            virtual_nodes (int): points per backend on the ring
+    """
+
+    def __init__(self, backends: Iterable[str], virtual_nodes: int = 160) -> None:
+        self.__backends: list[str]             = list(dict.fromkeys(url.rstrip("/") for url in backends))
+        self.__points:   list[tuple[int, str]] = sorted(
+            (point(f"{backend}#{replica}"), backend)
+            for backend in self.__backends for replica in range(max(1, virtual_nodes))
+        )
+        self.__keys:     list[int]             = [key for key, _ in self.__points]
+    # end                                                                                                     __init__ #
+
+    def candidates(self, key: str) -> Iterator[str]:
+        """ every backend once, in ring order from `key` """
+        if not self.__points:
+            return #                                                                                            return #
+
+        seen:  set[str] = set()
+        start: int      = bisect.bisect(self.__keys, point(key))
+
+        for index in range(len(self.__points)):
+            backend: str = self.__points[(start + index) % len(self.__points)][1]
+            if backend not in seen:
+                seen.add(backend)
+                yield backend #                                                                         yield return
+
+                if len(seen) == len(self.__backends):
+                    return #                                                                                    return #
+    # end                                                                                                   candidates #
+
+    @property
+    def backends(self) -> list[str]:
+        return list(self.__backends)
+    # end                                                                                                     backends #
+# end                                                                                                         HashRing #
@@ -1,27 +1,28 @@
 # ------------------------------------------------- regular imports -------------------------------------------------- #
 
-import os
 import sys
 import json
+import base64
+import asyncio
 import logging
-import uvicorn
-import requests
 import time
 
-from typing            import Iterator
-from fastapi           import FastAPI, Depends, HTTPException, status
+from contextlib        import ExitStack
+from typing            import Iterator, Optional
+from fastapi           import FastAPI, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.security  import HTTPBasic, HTTPBasicCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pathlib           import Path
+from fastapi.responses import Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from rich.logging      import RichHandler
-from rich.traceback    import install
 
 # -------------------------------------------------- local imports --------------------------------------------------- #
 
 from Server.config.read_config import Config
-from Server.ai                 import Model, ChatRequest, ChatResponse, ImageData
-from Server.tests.tests_runner import run_server_tests
+from Server.ai                 import ModelRegistry, ModelNotFoundError, Metrics, SessionManager, ChatRequest, ChatResponse, ImageData
+from Server.ai                 import KnowledgeText, AudioData, TranscribedText, TokenizeRequest, EmbeddingsRequest
+from Server.ai                 import ModelFailedToLoad
+from Server.ai                 import ContextImporter, export_session, SessionBusyError, SessionNotFoundError, ImageStore
 
 # ------------------------------------------------------ set up ------------------------------------------------------ #
 
@@ -49,33 +50,14 @@ app.add_middleware(
 # Security
 security = HTTPBasic()
 
-# Load the model asynchronously
-def get_model():
-    model_path = Path(os.getcwd(), "Server", "models", "ggml-model-Q4_K_M-llama-3-8B.gguf")
-    image_path = Path(os.getcwd(), "Server", "models", "mmproj-model-f16.gguf")
-    
-    if not model_path.exists():
-        logger.error(f"Model not found at {model_path}. Please download the model and place it in the correct location.")
-        raise FileNotFoundError(f"Model not found at {model_path}")
+MAX_IMAGE_BYTES: int = 32 * 1024 * 1024
 
-    if not image_path.exists() and Config.max_images > 0:
-        logger.warning(f"Image processor not found at {image_path}. Multimodal capabilities will be disabled.")
-    
-    return Model(
-        model_path,
-        image_processor_path=image_path if image_path.exists() else None,
-        multi_model=image_path.exists()
-    )
-
-def get_model_lazy():
-    if not hasattr(get_model_lazy, "model"):
-        logger.info("Initializing model for the first time")
-        try:
-            get_model_lazy.model = get_model()
-        except Exception as e:
-            logger.error(f"Failed to initialize model: {e}")
-            get_model_lazy.model = None
-    return get_model_lazy.model
+# Load the model registry lazily, models themselves load on first use
+def get_registry() -> ModelRegistry:
+    if not hasattr(get_registry, "registry"):
+        logger.info("Initializing model registry for the first time")
+        get_registry.registry = ModelRegistry.from_config()
+    return get_registry.registry
 
 def authenticate(credentials: HTTPBasicCredentials = Depends(security)):
     if credentials.username != "admin" or credentials.password != Config.server_password:
@@ -86,22 +68,36 @@ def authenticate(credentials: HTTPBasicCredentials = Depends(security)):
         )
     return credentials.username
 
-def normalize_chat_request(request: ChatRequest, model: Model) -> Iterator[str]:
+def authenticate_websocket(websocket: WebSocket) -> Optional[str]:
+    # HTTPBasic only handles plain requests, websockets carry the same Authorization header
+    scheme, _, encoded = websocket.headers.get("authorization", "").partition(" ")
     try:
-        for response in model.predict(request):
-            yield response.model_dump_json() + "\n"
+        username, _, password = base64.b64decode(encoded).decode().partition(":")
+    except ValueError:
+        return None
+    if scheme.lower() != "basic" or username != "admin" or password != Config.server_password:
+        return None
+    return username
+
+def error_response(e: Exception) -> ChatResponse:
+    return ChatResponse(
+        id="error",
+        model="error",
+        created=int(time.time()),
+        index=0,
+        role="assistant",
+        content=f"Error processing your request: {str(e)}",
+        finish_reason="error"
+    )
+
+def normalize_chat_request(request: ChatRequest, registry: ModelRegistry, model_name: str) -> Iterator[str]:
+    try:
+        with registry.lease(model_name) as model:
+            for response in model.predict(request):
+                yield response.model_dump_json() + "\n"
     except Exception as e:
         logger.error(f"Error in chat prediction: {e}")
-        error_response = ChatResponse(
-            id="error",
-            model="error",
-            created=int(time.time()),
-            index=0,
-            role="assistant",
-            content=f"Error processing your request: {str(e)}",
-            finish_reason="error"
-        )
-        yield error_response.model_dump_json() + "\n"
+        yield error_response(e).model_dump_json() + "\n"
 
 # --------------------------------------------------- server --------------------------------------------------------- #
 
@@ -111,15 +107,91 @@ def root():
 
 @app.post("/chat")
 def chat(request: ChatRequest, username: str = Depends(authenticate)) -> StreamingResponse:
-    model = get_model_lazy()
-    if model is None:
+    try:
+        registry = get_registry()
+        model_name = registry.route(request)
+    except ModelNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Model registry not available: {e}")
         raise HTTPException(status_code=503, detail="Model not available")
     
-    generator: Iterator[str] = normalize_chat_request(request, model)
+    generator: Iterator[str] = normalize_chat_request(request, registry, model_name)
     return StreamingResponse(
         generator, 
         media_type="application/json",
-        headers={"X-User": username}
+        headers={"X-User": username, "X-Model": model_name}
+    )
+
+@app.post("/tokenize")
+def tokenize(request: TokenizeRequest, username: str = Depends(authenticate)):
+    # counts against the model's vocabulary without waiting for a generation, clients can check a question
+    # (and the context left in their conversation) before sending it
+    if len(request.texts) > Config.tokenizer_max_batch:
+        raise HTTPException(status_code=413, detail=f"More than {Config.tokenizer_max_batch} texts")
+
+    registry = get_registry()
+    model_name = request.model or registry.default
+    if model_name not in registry.names:
+        raise HTTPException(status_code=404, detail=f"unknown model '{model_name}'")
+
+    with registry.lease(model_name) as model:
+        if not model.wait_until_ready() or not model.is_ready:
+            raise HTTPException(status_code=503, detail="Model not available")
+
+        tokens = model.tokenizer.tokenize_batch(request.texts, request.special)
+        response = {"model": model_name, "counts": [len(ids) for ids in tokens]}
+        if request.ids:
+            response["tokens"] = tokens
+        if request.session_id is not None:
+            try:
+                response["context"] = model.context_usage(request.session_id)
+            except SessionNotFoundError as e:
+                raise HTTPException(status_code=404, detail=str(e))
+    return response
+
+@app.post("/embeddings")
+def embeddings(request: EmbeddingsRequest, username: str = Depends(authenticate)):
+    # the model's gguf in embedding mode, batched and cached per text. "binary" answers with the little endian
+    # float32 rows back to back, the shape and the token counts are in the headers
+    if len(request.texts) > Config.embeddings_max_batch:
+        raise HTTPException(status_code=413, detail=f"More than {Config.embeddings_max_batch} texts")
+
+    registry = get_registry()
+    model_name = request.model or registry.default
+    if model_name not in registry.names:
+        raise HTTPException(status_code=404, detail=f"unknown model '{model_name}'")
+
+    with registry.lease(model_name) as model:
+        if not model.wait_until_ready() or not model.is_ready:
+            raise HTTPException(status_code=503, detail="Model not available")
+
+        try:
+            vectors, tokens = model.embeddings.embed(request.texts)
+        except (ModelNotFoundError, ModelFailedToLoad) as e:
+            raise HTTPException(status_code=503, detail=str(e))
+
+    vectors = vectors.astype("<f4", copy=False)
+    if request.format == "binary":
+        return Response(
+            content=vectors.tobytes(),
+            media_type="application/octet-stream",
+            headers={
+                "X-User": username, "X-Model": model_name,
+                "X-Embedding-Shape": f"{vectors.shape[0]},{vectors.shape[1]}",
+                "X-Tokens": ",".join(map(str, tokens)),
+            }
+        )
+
+    if request.format == "base64":
+        data = [base64.b64encode(row.tobytes()).decode("ascii") for row in vectors]
+    else:
+        data = vectors.tolist()
+
+    # serialized here, fastapi's encoder walks every float of a large batch on its own
+    return Response(
+        content=json.dumps({"model": model_name, "dimension": vectors.shape[1], "embeddings": data, "tokens": tokens}),
+        media_type="application/json",
     )
 
 @app.post("/login")
@@ -128,19 +200,273 @@ def login(username: str = Depends(authenticate)):
 
 @app.get("/health")
 def health_check():
-    model = get_model_lazy()
+    models = get_registry().status()
+    default_loaded = any(info["loaded"] for info in models.values() if info["default"])
     return {
-        "status": "healthy" if model and model.is_loaded else "initializing",
-        "model_loaded": bool(model and model.is_loaded),
+        "status": "healthy" if default_loaded else "initializing",
+        "model_loaded": default_loaded,
+        "models": models,
         "version": "1.0.0"
     }
 
+@app.get("/metrics")
+def metrics(username: str = Depends(authenticate)):
+    return {**Metrics.snapshot(), "images": ImageStore.shared().stats()}
+
+@app.get("/sessions/{session_id}/export")
+def export_context(session_id: str, images: str = "ref", username: str = Depends(authenticate)) -> StreamingResponse:
+    if images not in ("ref", "inline"):
+        raise HTTPException(status_code=422, detail="images must be 'ref' or 'inline'")
+
+    return StreamingResponse(
+        export_session(SessionManager.shared(), session_id, inline_images=images == "inline"),
+        media_type="application/x-ndjson",
+        headers={"X-User": username}
+    )
+
+@app.post("/sessions/{session_id}/import")
+async def import_context(session_id: str, request: Request, username: str = Depends(authenticate)):
+    # the body is applied line by line as it arrives, so a large export is never held in memory
+    importer = ContextImporter(SessionManager.shared(), session_id)
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(importer.feed, chunk)
+        return await run_in_threadpool(importer.finish)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.post("/sessions/{session_id}/fork")
+def fork_session(session_id: str, turn: int, branch_id: Optional[str] = None, username: str = Depends(authenticate)):
+    # the branch shares turns 1..turn with the session, chat on it with its session_id to edit the next question
+    try:
+        branch = SessionManager.shared().fork(session_id, turn, branch_id)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"session_id": branch.session_id, "turn": branch.turn}
+
+@app.post("/sessions/{session_id}/rewind")
+def rewind_session(session_id: str, turn: int, username: str = Depends(authenticate)):
+    # rewind to the turn before an answer and resend the question to regenerate it
+    try:
+        context = SessionManager.shared().rewind(session_id, turn)
+    except SessionBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"session_id": session_id, "turn": context.turn}
+
+@app.get("/images/{sha256}")
+def get_image(sha256: str, username: str = Depends(authenticate)) -> StreamingResponse:
+    store = SessionManager.shared().store
+    chunks = store.iter_blob(sha256) if store is not None else None
+    if chunks is None and sha256 in ImageStore.shared():
+        chunks = iter([ImageStore.shared().data(sha256)])
+    if chunks is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return StreamingResponse(chunks, media_type="image/png", headers={"Cache-Control": "max-age=31536000, immutable"})
+
+@app.put("/images")
+async def put_image(request: Request, username: str = Depends(authenticate)):
+    store = SessionManager.shared().store
+    if store is None:
+        raise HTTPException(status_code=503, detail="Conversation store is disabled")
+
+    data = bytearray()
+    async for chunk in request.stream():
+        data.extend(chunk)
+        if len(data) > MAX_IMAGE_BYTES:
+            raise HTTPException(status_code=413, detail=f"Image is larger than {MAX_IMAGE_BYTES} bytes")
+
+    sha256 = await run_in_threadpool(store.put_blob, bytes(data))
+    return {"sha256": sha256, "size": len(data)}
+
+@app.post("/knowledge/text")
+def ingest_knowledge_text(request: KnowledgeText, username: str = Depends(authenticate)):
+    from Server.ai.knowledge.base import KnowledgeBase
+    chunks = KnowledgeBase.shared().ingest_text(request.source, request.text, request.kind)
+    return {"source": request.source, "chunks": chunks}
+
+@app.put("/knowledge/images")
+async def ingest_knowledge_image(request: Request, source: str, text: Optional[str] = None, kind: str = "slide",
+                                 username: str = Depends(authenticate)):
+    # slides and scanned pages are indexed by their caption, without `text` the vision model has to caption them
+    from Server.ai.knowledge.base import KnowledgeBase
+
+    data = bytearray()
+    async for chunk in request.stream():
+        data.extend(chunk)
+        if len(data) > MAX_IMAGE_BYTES:
+            raise HTTPException(status_code=413, detail=f"Image is larger than {MAX_IMAGE_BYTES} bytes")
+
+    try:
+        sha256 = await run_in_threadpool(KnowledgeBase.shared().ingest_image, source, bytes(data), text, kind)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except TimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"source": source, "sha256": sha256}
+
+@app.get("/knowledge/search")
+def search_knowledge(q: str, k: Optional[int] = None, username: str = Depends(authenticate)):
+    from Server.ai.knowledge.base import KnowledgeBase
+    return {"hits": KnowledgeBase.shared().query(q, k)}
+
+@app.websocket("/transcribe")
+async def transcribe(websocket: WebSocket, format: str = "pcm16", sample_rate: int = 16000, channels: int = 1):
+    # binary messages carry the audio, the text message "end" finishes the recording. every partial and final
+    # TranscribedText is sent back as json as soon as it is ready, the socket closes after the last final
+    from Server.ai.audio.stream      import TranscriptionStream
+    from Server.ai.audio.transcriber import Transcriber
+
+    if authenticate_websocket(websocket) is None:
+        await websocket.close(code=1008, reason="Incorrect username or password")
+        return
+
+    await websocket.accept()
+
+    loop    = asyncio.get_running_loop()
+    results: asyncio.Queue[Optional[TranscribedText]] = asyncio.Queue()
+
+    try:
+        stream = TranscriptionStream(
+            Transcriber.shared(),
+            AudioData(format=format, sample_rate=sample_rate, channels=channels),
+            lambda result: loop.call_soon_threadsafe(results.put_nowait, result),
+        )
+    except ValueError as e:
+        await websocket.close(code=1003, reason=str(e)[:120])
+        return
+
+    async def send_results():
+        while (result := await results.get()) is not None:
+            await websocket.send_json(result.model_dump())
+
+    sender = asyncio.create_task(send_results())
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes"):
+                await run_in_threadpool(stream.feed, message["bytes"])
+            elif message.get("text") == "end":
+                break
+
+        await run_in_threadpool(stream.finish)
+        results.put_nowait(None)
+        await sender
+        await websocket.close()
+    except WebSocketDisconnect:
+        stream.close()
+        sender.cancel()
+    except ValueError as e:
+        stream.close()
+        sender.cancel()
+        await websocket.close(code=1003, reason=str(e)[:120])
+
+@app.websocket("/voice/chat")
+async def voice_chat(websocket: WebSocket, format: str = "pcm16", sample_rate: int = 16000, channels: int = 1):
+    # the first text message is the ChatRequest json without its text (session, model, sampling), then the
+    # audio follows like on /transcribe. transcripts are sent while the student speaks, after "end" the last
+    # final is followed by the answer's ChatResponse chunks and the socket closes
+    from Server.ai.audio.transcriber import Transcriber
+    from Server.ai.audio.voice       import VoiceQuestion
+
+    if authenticate_websocket(websocket) is None:
+        await websocket.close(code=1008, reason="Incorrect username or password")
+        return
+
+    await websocket.accept()
+
+    try:
+        request    = ChatRequest.model_validate({**json.loads(await websocket.receive_text()), "text": ""})
+        registry   = get_registry()
+        model_name = registry.route(request)
+    except WebSocketDisconnect:
+        return
+    except (ValueError, ModelNotFoundError) as e: # malformed json, an invalid request or an unknown model
+        await websocket.close(code=1003, reason=str(e)[:120])
+        return
+
+    loop    = asyncio.get_running_loop()
+    results: asyncio.Queue[Optional[TranscribedText]] = asyncio.Queue()
+
+    # entering the lease may evict and load models under the registry lock, keep that off the event loop
+    lease = ExitStack()
+    model = await run_in_threadpool(lease.enter_context, registry.lease(model_name))
+
+    try:
+        try:
+            question = VoiceQuestion(
+                model,
+                Transcriber.shared(),
+                AudioData(format=format, sample_rate=sample_rate, channels=channels),
+                request,
+                lambda result: loop.call_soon_threadsafe(results.put_nowait, result),
+            )
+        except ValueError as e:
+            await websocket.close(code=1003, reason=str(e)[:120])
+            return
+
+        async def send_results():
+            while (result := await results.get()) is not None:
+                await websocket.send_json(result.model_dump())
+
+        sender = asyncio.create_task(send_results())
+
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+                if message.get("bytes"):
+                    await run_in_threadpool(question.feed, message["bytes"])
+                elif message.get("text") == "end":
+                    break
+
+            await run_in_threadpool(question.finish)
+            results.put_nowait(None)
+            await sender
+
+            answer = question.answer()
+            try:
+                while (response := await run_in_threadpool(next, answer, None)) is not None:
+                    await websocket.send_text(response.model_dump_json())
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logger.error(f"Error in voice chat prediction: {e}")
+                await websocket.send_text(error_response(e).model_dump_json())
+            finally: # releases the model lock if the client left in the middle of the answer
+                await run_in_threadpool(answer.close)
+            await websocket.close()
+        except WebSocketDisconnect:
+            question.close()
+            sender.cancel()
+        except ValueError as e:
+            question.close()
+            sender.cancel()
+            await websocket.close(code=1003, reason=str(e)[:120])
+    finally:
+        await run_in_threadpool(lease.close)
+
 def main() -> None:
+    import uvicorn
+
     try:
         Config.load("server.toml")
         logger.info(f"Starting server on {Config.server_ip}:{Config.server_port}")
-        # Initialize model in background
-        get_model_lazy()
+        # Page the weights in while the headers are validated, then start loading the pinned and default models
+        registry = get_registry()
+        registry.readahead()
+        registry.validate()
+        # the kv budget holds the default model's live context and the session states parked next to it
+        sequences = registry.max_sequences(registry.default)
+        if sequences is not None:
+            SessionManager.shared().max_hot_states = sequences - 1
+            logger.info(f"{sequences} kv caches fit the kv budget, {sequences - 1} sessions stay hot")
+        registry.preload()
         uvicorn.run(
             app, 
             host=Config.server_ip, 
@@ -156,8 +482,12 @@ def main() -> None:
         logger.error(f"Server error: {e}")
         sys.exit(1)
     finally:
+        # drain the conversation store's write queue so no turn is lost on shutdown
+        if SessionManager._instance is not None and SessionManager._instance.store is not None:
+            SessionManager._instance.store.close()
         logger.info("Server shutdown complete")
 
 # end                                                                                                             main #
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
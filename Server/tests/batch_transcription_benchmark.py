@@ -0,0 +1,92 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import os
+import sys
+import json
+import wave
+import argparse
+import tempfile
+
+from pathlib import Path
+from typing  import Any
+
+import numpy as np
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+from Server.ai.audio.batch                import SegmentModel, TranscriptionJob
+from Server.ai.audio.decoding             import SAMPLE_RATE
+from Server.tests.transcription_benchmark import lecture, stand_in_model
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+import  logging
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- benchmark ----------------------------------------------------- #
+
+def stand_in_segments(passes: int = 16) -> SegmentModel:
+    """ `stand_in_model` as a `SegmentModel`, loaded in every worker process of the job """
+    transcribe = stand_in_model(passes)
+    return lambda audio: [(0.0, len(audio) / SAMPLE_RATE, transcribe(audio))] #                                 return #
+# end                                                                                            stand_in_segments #
+
+def write_lecture(path: Path, seconds: float, seed: int) -> float:
+    audio, _ = lecture(seconds, np.random.default_rng(seed))
+
+    with wave.open(str(path), "wb") as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(SAMPLE_RATE)
+        file.writeframes((np.clip(audio, -1, 1) * 32767).astype("<i2").tobytes())
+
+    return len(audio) / SAMPLE_RATE #                                                                           return #
+# end                                                                                                write_lecture #
+
+def run(workers: int, source: Path, args: argparse.Namespace) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory() as output:
+        factory, options = (
+            ("Server.ai.audio.batch:whisper_segments",
+             {"model": args.model, "directory": args.models_dir, "threads": 1}) if args.model
+            else ("Server.tests.batch_transcription_benchmark:stand_in_segments", {"passes": args.passes})
+        )
+        job: TranscriptionJob = TranscriptionJob([source], Path(output), workers=workers,
+                                                 chunk_seconds=args.chunk_seconds, factory=factory, options=options)
+        return job.run() #                                                                                      return #
+# end                                                                                                          run #
+
+def main() -> int:
+    """ python -m Server.tests.batch_transcription_benchmark [--seconds 1800] [--workers 1 2 4] [--model base.en]
+
+        transcribes one synthetic (or --file) lecture with every worker count and reports the real time factor
+        and the speedup over one worker, without --model a stand-in with whisper's linear cost profile is used
+    """
+    parser = argparse.ArgumentParser(description="offline transcription scaling")
+    parser.add_argument("--file",          type=Path,  default=None, help="a recording instead of a synthetic one")
+    parser.add_argument("--seconds",       type=float, default=1800)
+    parser.add_argument("--workers",       type=int,   nargs="+", default=[1, 2, os.cpu_count() or 1])
+    parser.add_argument("--chunk-seconds", type=float, default=30.0)
+    parser.add_argument("--passes",        type=int,   default=16, help="cost of the stand-in model")
+    parser.add_argument("--model",         default="", help="a whisper.cpp model instead of the stand-in")
+    parser.add_argument("--models-dir",    default="Server/models/whisper")
+    parser.add_argument("--seed",          type=int,   default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level="WARNING")
+
+    with tempfile.TemporaryDirectory() as directory:
+        source: Path = args.file or Path(directory, "lecture.wav")
+        if args.file is None:
+            write_lecture(source, args.seconds, args.seed)
+
+        reports: list[dict[str, Any]] = [run(workers, source, args) for workers in sorted(set(args.workers))]
+
+    for report in reports:
+        report["speedup_vs_one_worker"] = round(reports[0]["wall_seconds"] / report["wall_seconds"], 2)
+
+    print(json.dumps(reports, indent=4))
+    return 0 #                                                                                                  return #
+# end                                                                                                         main #
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import threading
+import statistics
+
+from collections import Counter, defaultdict
+from typing      import Any, AsyncIterator
+
+import httpx
+import uvicorn
+
+from fastapi           import FastAPI, Request, WebSocket
+from fastapi.responses import StreamingResponse
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+from Server.config.read_config import Config
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+import  logging
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- benchmark ----------------------------------------------------- #
+
+class FakeBackend:
+    """ a server with the api of the real one and a fake model: a session it has not seen pays a cold prefill
+        (its context is not cached here), every token costs `token_ms`. it records which sessions it served and
+        over how many connections
+    """
+
+    def __init__(self, name: str, args: argparse.Namespace) -> None:
+        self.name:        str                 = name
+        self.sessions:    Counter[str]        = Counter()
+        self.connections: set[tuple[str, int]] = set()
+        self.images:      int                 = 0
+        self.app:         FastAPI             = FastAPI()
+        self.server:      uvicorn.Server      = serve(self.app)
+
+        @self.app.get("/health")
+        def health():
+            return {"status": "healthy", "model_loaded": True, "models": {}, "version": "1.0.0"}
+
+        @self.app.post("/chat")
+        async def chat(request: Request) -> StreamingResponse:
+            body: dict[str, Any] = await request.json()
+            session: str = body.get("session_id") or "default"
+            cold:    bool = session not in self.sessions
+            self.sessions[session] += 1
+            self.connections.add((request.client.host, request.client.port))                           # type:ignore
+
+            async def tokens() -> AsyncIterator[str]:
+                await asyncio.sleep((args.cold_prefill_ms if cold else args.warm_prefill_ms) / 1000)
+                for index in range(args.tokens):
+                    yield json.dumps({"content": f"token{index} ", "backend": self.name, "cold": cold}) + "\n"
+                    await asyncio.sleep(args.token_ms / 1000)
+                yield json.dumps({"content": "", "finish_reason": "stop", "backend": self.name}) + "\n"
+
+            return StreamingResponse(tokens(), media_type="application/json")
+
+        @self.app.put("/images")
+        async def put_image(request: Request):
+            self.images += 1
+            return {"sha256": "0" * 64, "size": len(await request.body())}
+
+        @self.app.websocket("/voice/chat")
+        async def voice_chat(websocket: WebSocket):
+            await websocket.accept()
+            session: str = json.loads(await websocket.receive_text()).get("session_id") or "default"
+            self.sessions[session] += 1
+            audio:   int = 0
+            while (message := await websocket.receive()).get("text") != "end":
+                audio += len(message.get("bytes") or b"")
+            await websocket.send_json({"content": f"heard {audio} bytes", "backend": self.name})
+            await websocket.close()
+    # end                                                                                                     __init__ #
+# end                                                                                                      FakeBackend #
+
+def serve(app: FastAPI) -> uvicorn.Server:
+    """ runs `app` on a free local port on its own thread """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port: int = probe.getsockname()[1]
+
+    # without proxy headers the backends see the gateway's own connections, not the client in x-forwarded-for
+    server: uvicorn.Server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", proxy_headers=False)
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+
+    return server #                                                                                             return #
+# end                                                                                                            serve #
+
+def url(server: uvicorn.Server) -> str:
+    return f"http://127.0.0.1:{server.config.port}" #                                                           return #
+# end                                                                                                              url #
+
+async def turn(client: httpx.AsyncClient, base: str, session: str) -> dict[str, Any]:
+    """ one chat turn, streamed: the time to the first chunk and to the end, and the backend that answered """
+    start: float = time.perf_counter()
+    first: float = 0.0
+    lines: list[dict[str, Any]] = []
+
+    async with client.stream("POST", f"{base}/chat", json={"text": "hello", "session_id": session}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            first = first or time.perf_counter() - start
+            lines.append(json.loads(line))
+
+    return {
+        "backend": lines[0]["backend"],
+        "cold":    lines[0]["cold"],
+        "ttfc_ms": first * 1000,
+        "total_ms": (time.perf_counter() - start) * 1000,
+    } #                                                                                                         return #
+# end                                                                                                             turn #
+
+async def conversations(base: str, sessions: list[str], turns: int, rng: random.Random,
+                        stop: threading.Event | None = None) -> tuple[list[dict[str, Any]], int]:
+    """ every session asks `turns` questions one after the other, all sessions at once. returns the turns and
+        the number of failed ones
+    """
+    results: list[dict[str, Any]] = []
+    failed:  int                  = 0
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        async def student(session: str) -> None:
+            nonlocal failed
+            for _ in range(turns):
+                await asyncio.sleep(rng.uniform(0, 0.05))
+                try:
+                    results.append({"session": session, **await turn(client, base, session)})
+                except (httpx.HTTPError, json.JSONDecodeError, KeyError, IndexError):
+                    failed += 1
+                if stop is not None:
+                    stop.set()
+
+        await asyncio.gather(*(student(session) for session in sessions))
+
+    return results, failed #                                                                                    return #
+# end                                                                                                    conversations #
+
+async def voice(base: str, session: str) -> dict[str, Any]:
+    """ a spoken question over the websocket, the session is only named in its first message """
+    from websockets.asyncio.client import connect
+
+    async with connect("ws" + base[len("http"):] + "/voice/chat") as websocket:
+        await websocket.send(json.dumps({"session_id": session}))
+        await websocket.send(bytes(3200))
+        await websocket.send("end")
+        return json.loads(await websocket.recv()) #                                                             return #
+# end                                                                                                            voice #
+
+def affinity(results: list[dict[str, Any]]) -> dict[str, Any]:
+    backends: dict[str, set[str]] = defaultdict(set)
+    for result in results:
+        backends[result["session"]].add(result["backend"])
+
+    placed: Counter[str] = Counter(next(iter(served)) for served in backends.values() if len(served) == 1)
+    return {
+        "sessions":              len(backends),
+        "sessions_moved":        sum(len(served) > 1 for served in backends.values()),
+        "sessions_per_backend":  dict(sorted(placed.items())),
+        "cold_turns":            sum(result["cold"] for result in results),
+        "turns":                 len(results),
+    } #                                                                                                         return #
+# end                                                                                                         affinity #
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    from Server.gateway.gateway import app
+
+    rng:      random.Random     = random.Random(args.seed)
+    backends: list[FakeBackend] = [FakeBackend(f"backend-{index}", args) for index in range(args.backends)]
+
+    Config.gateway_backends        = [url(backend.server) for backend in backends]
+    Config.gateway_health_interval = 0.2
+    gateway: uvicorn.Server = serve(app)
+    base:    str            = url(gateway)
+    report:  dict[str, Any] = {}
+
+    # affinity and balance: every session stays on one backend, sessions spread evenly
+    sessions: list[str] = [f"student-{index}" for index in range(args.sessions)]
+    results, failed = asyncio.run(conversations(base, sessions, args.turns, rng))
+    before: dict[str, str] = {result["session"]: result["backend"] for result in results}
+    report["affinity"] = {**affinity(results), "failed": failed}
+    report["affinity"]["connections"] = {
+        backend.name: len(backend.connections) for backend in backends
+    }
+
+    # streaming: the first chunk arrives as early as without the gateway, nothing is buffered on the way. new
+    # sessions both times, both wait for the same cold prefill
+    fresh:   range = range(args.sessions)
+    direct, _  = asyncio.run(conversations(url(backends[0].server), [f"direct-{i}" for i in fresh], 1, rng))
+    proxied, _ = asyncio.run(conversations(base, [f"proxied-{i}" for i in fresh], 1, rng))
+    report["streaming"] = {
+        "ttfc_ms_direct":  round(statistics.median(result["ttfc_ms"] for result in direct), 1),
+        "ttfc_ms_gateway": round(statistics.median(result["ttfc_ms"] for result in proxied), 1),
+        "total_ms_median": round(statistics.median(result["total_ms"] for result in proxied), 1),
+    }
+
+    # broadcast and websocket passthrough
+    with httpx.Client(timeout=30) as client:
+        replicas: str = client.put(f"{base}/images", content=b"\x89PNG").headers.get("x-gateway-replicas", "")
+    report["broadcast"] = {"replicas": replicas, "stored": sum(backend.images for backend in backends)}
+
+    spoken: dict[str, Any] = asyncio.run(voice(base, sessions[0]))
+    report["websocket"] = {"answer": spoken["content"], "same_backend": spoken["backend"] == before[sessions[0]]}
+
+    # failover: one backend stops while the students keep asking, its sessions move to the next on the ring
+    victim:  FakeBackend     = backends[0]
+    started: threading.Event = threading.Event()
+
+    def kill() -> None:
+        started.wait()
+        victim.server.should_exit = True
+
+    threading.Thread(target=kill, daemon=True).start()
+    results, failed = asyncio.run(conversations(base, sessions, args.turns, rng, started))
+    after:  dict[str, str] = {result["session"]: result["backend"] for result in results}
+    report["failover"] = {
+        "killed":                     victim.name,
+        "failed_turns":               failed,
+        "turns":                      len(results),
+        "sessions_moved_off_victim":  sum(before.get(s) == victim.name and after[s] != victim.name for s in after),
+        "other_sessions_moved":       sum(before.get(s) not in (None, victim.name, after[s]) for s in after),
+    }
+
+    gateway.should_exit = True
+    for backend in backends:
+        backend.server.should_exit = True
+    return report #                                                                                             return #
+# end                                                                                                              run #
+
+def main() -> int:
+    """ python -m Server.tests.gateway_benchmark [--backends 3] [--sessions 30] [--turns 4]
+
+        starts `--backends` local servers with a fake model and the gateway in front of them, then checks that
+        sessions stick to one backend, that streamed answers pass through without delay, that broadcast writes
+        reach every backend and that the sessions of a stopped backend fail over while the others stay put.
+        exits with 1 if a check fails
+    """
+    parser = argparse.ArgumentParser(description="session affinity, streaming and failover through the gateway")
+    parser.add_argument("--backends",        type=int,   default=3)
+    parser.add_argument("--sessions",        type=int,   default=30)
+    parser.add_argument("--turns",           type=int,   default=4)
+    parser.add_argument("--tokens",          type=int,   default=20)
+    parser.add_argument("--token-ms",        type=float, default=10)
+    parser.add_argument("--cold-prefill-ms", type=float, default=200, help="a session new to the backend")
+    parser.add_argument("--warm-prefill-ms", type=float, default=20,  help="a session cached on the backend")
+    parser.add_argument("--seed",            type=int,   default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level="WARNING")
+
+    report: dict[str, Any] = run(args)
+    print(json.dumps(report, indent=4))
+
+    checks: dict[str, bool] = {
+        "affinity":  report["affinity"]["sessions_moved"] == 0 and report["affinity"]["failed"] == 0,
+        "streaming": report["streaming"]["ttfc_ms_gateway"] < report["streaming"]["ttfc_ms_direct"] +
+                     args.tokens * args.token_ms / 2,
+        "broadcast": report["broadcast"]["stored"] == args.backends,
+        "websocket": report["websocket"]["same_backend"],
+        "failover":  report["failover"]["other_sessions_moved"] == 0 and
+                     report["failover"]["turns"] + report["failover"]["failed_turns"] == args.sessions * args.turns,
+    }
+    for check, passed in checks.items():
+        if not passed:
+            print(f"{check} check failed", file=sys.stderr)
+
+    return 0 if all(checks.values()) else 1 #                                                                   return #
+# end                                                                                                         main #
+
+if __name__ == "__main__":
+    sys.exit(main())
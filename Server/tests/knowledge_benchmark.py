@@ -0,0 +1,142 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+from pathlib import Path
+from typing  import Any
+
+import numpy as np
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+from Server.ai.knowledge.vector_index import VectorIndex
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+import  logging
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- benchmark ----------------------------------------------------- #
+
+def synthetic(rows: int, centers: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """ normalized vectors scattered around topic centers, closer to real chunk embeddings than uniform noise """
+    vectors: np.ndarray = centers[rng.integers(0, len(centers), rows)] + 0.6 * rng.standard_normal(
+        (rows, centers.shape[1]), dtype=np.float32
+    )
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors #                                                                                            return #
+# end                                                                                                    synthetic #
+
+def percentile(samples: list[float], q: float) -> float:
+    return float(np.percentile(samples, q) * 1000) if samples else 0.0 #                                        return #
+# end                                                                                                   percentile #
+
+def run(size: int, args: argparse.Namespace) -> dict[str, Any]:
+    """ run
+        run - ingests `size` synthetic chunks batch by batch and queries the index
+
+        Returns:
+            dict[str, Any]: ingest throughput, query latency / throughput of the index and of exact search, and
+                            the recall@k of the index against exact search
+    """
+    rng:     np.random.Generator = np.random.default_rng(args.seed)
+    centers: np.ndarray          = rng.standard_normal((args.topics, args.dim), dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as directory:
+        index: VectorIndex = VectorIndex(Path(directory), args.ivf_threshold, args.nprobe)
+
+        start: float = time.perf_counter()
+        for offset in range(0, size, args.batch):
+            index.add(synthetic(min(args.batch, size - offset), centers, rng))
+        ingest_seconds: float = time.perf_counter() - start
+
+        # questions are noisy copies of stored chunks, the way a question paraphrases the lecture
+        matrix:  np.ndarray = np.fromfile(Path(directory, "vectors.f32"), dtype=np.float32).reshape(size, args.dim)
+        queries: np.ndarray = matrix[rng.integers(0, size, args.queries)] + rng.standard_normal(
+            (args.queries, args.dim), dtype=np.float32
+        ) * (0.5 / np.sqrt(args.dim))
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        exact_latency: list[float] = []
+        index_latency: list[float] = []
+        recalls:       list[float] = []
+
+        for query in queries:
+            start = time.perf_counter()
+            scores: np.ndarray = matrix @ query
+            truth:  np.ndarray = np.argpartition(-scores, args.k - 1)[:args.k]
+            exact_latency.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            rows, _ = index.search(query, args.k)
+            index_latency.append(time.perf_counter() - start)
+
+            recalls.append(len(set(rows.tolist()) & set(truth.tolist())) / args.k)
+
+        return {
+            "chunks":              size,
+            "mode":                index.stats()["mode"],
+            "lists":               index.stats()["lists"],
+            "ingest_per_second":   size / ingest_seconds,
+            "ingest_seconds":      ingest_seconds,
+            "query_p50_ms":        percentile(index_latency, 50),
+            "query_p95_ms":        percentile(index_latency, 95),
+            "queries_per_second":  len(queries) / sum(index_latency),
+            "exact_p50_ms":        percentile(exact_latency, 50),
+            f"recall_at_{args.k}": float(np.mean(recalls)),
+        } #                                                                                                     return #
+# end                                                                                                          run #
+
+def embed_throughput(args: argparse.Namespace) -> dict[str, Any]:
+    """ chunks per second of the configured embedding model, the real bound on ingesting lecture material """
+    from Server.config.read_config import Config
+    from Server.ai.core.embeddings import Embedder
+
+    Config.load("server.toml")
+    embedder: Embedder  = Embedder.shared()
+    texts:    list[str] = [f"lecture {n}: " + "entropy measures the number of microstates " * 20
+                           for n in range(args.batch)]
+
+    embedder.embed(texts[:1]) # load the model outside of the measurement
+
+    start: float = time.perf_counter()
+    embedder.embed(texts)
+    seconds: float = time.perf_counter() - start
+
+    return {"model": embedder.model_path.name, "batch": len(texts), "chunks_per_second": len(texts) / seconds}
+# end                                                                                             embed_throughput #
+
+def main() -> int:
+    """ python -m Server.tests.knowledge_benchmark [--sizes 10000 100000 1000000] [--dim 384] [--embed]
+
+        prints one json report per index size, with --embed also the throughput of the embedding model
+    """
+    parser = argparse.ArgumentParser(description="knowledge base ingestion / query throughput")
+    parser.add_argument("--sizes",         type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim",           type=int, default=384)
+    parser.add_argument("--topics",        type=int, default=1000)
+    parser.add_argument("--batch",         type=int, default=10_000)
+    parser.add_argument("--queries",       type=int, default=200)
+    parser.add_argument("--k",             type=int, default=10)
+    parser.add_argument("--ivf-threshold", type=int, default=50_000)
+    parser.add_argument("--nprobe",        type=int, default=16)
+    parser.add_argument("--seed",          type=int, default=0)
+    parser.add_argument("--embed",         action="store_true", help="also measure the embedding model")
+    args = parser.parse_args()
+
+    logging.basicConfig(level="WARNING")
+
+    reports: list[dict[str, Any]] = [run(size, args) for size in args.sizes]
+    if args.embed:
+        reports.append({"embedding": embed_throughput(args)})
+
+    print(json.dumps(reports, indent=4))
+    return 0 #                                                                                                  return #
+# end                                                                                                         main #
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import sys
+import json
+import math
+import time
+import random
+import argparse
+
+from pathlib import Path
+from typing  import Any, Optional
+
+import numpy as np
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+from Server.ai.core.gguf_index        import read_gguf_metadata, summarize_gguf_metadata
+from Server.ai.core.kv_cache          import KV_TYPES, cache_types, kv_bytes, max_sequences
+from Server.ai.core.model_registry    import DEFAULT_MODEL_PATH
+from Server.tests.tokenizer_benchmark import lecture
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+import  logging
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- benchmark ----------------------------------------------------- #
+
+# natural text for the perplexity check, a quantized cache that hurts the model shows up as a higher perplexity
+PASSAGE: str = (
+    "The first law of thermodynamics states that the energy of an isolated system is constant. Energy can be "
+    "transformed from one form to another, but it can be neither created nor destroyed. When heat is added to a "
+    "gas in a cylinder, part of it raises the internal energy of the gas and the rest is done as work on the "
+    "piston. The second law adds a direction to these processes. Heat flows spontaneously from a hotter body to "
+    "a colder one and never the other way around, unless work is done on the system, as in a refrigerator. "
+    "Clausius expressed this with a new quantity, the entropy, which never decreases in an isolated system. A "
+    "heat engine that takes heat from a hot reservoir and rejects part of it to a cold reservoir can therefore "
+    "never turn all of the heat into work. The best it can do is the efficiency of a reversible Carnot cycle, "
+    "one minus the ratio of the absolute temperatures of the two reservoirs. A steam turbine working between "
+    "five hundred and three hundred kelvin can convert at most forty percent of the heat it receives into work, "
+    "and real turbines reach considerably less because friction and heat losses make every real process "
+    "irreversible. Boltzmann later showed that entropy counts the microscopic states compatible with what we "
+    "observe, which explains why disorder is so much more likely than order."
+)
+
+def options(args: argparse.Namespace) -> list[tuple[str, bool]]:
+    """ every kv type with and without flash attention, f16 without flash attention first as the baseline """
+    return [(kv_type, flash_attn) for kv_type in args.kv_types for flash_attn in args.flash_attn] #             return #
+# end                                                                                                          options #
+
+def measure(args: argparse.Namespace, kv_type: str, flash_attn: bool, filler: str) -> dict[str, Any]:
+    """ loads the model with one kv cache configuration: prefills `args.prefill` tokens, decodes `args.tokens`
+        greedily after them, then measures the perplexity of `PASSAGE` token by token in a fresh context
+    """
+    from llama_cpp import Llama
+
+    type_k, type_v = cache_types(kv_type, flash_attn)
+    start: float = time.perf_counter()
+    llama: Llama = Llama(
+        model_path   = args.model,
+        n_ctx        = args.ctx,
+        n_threads    = args.threads or None,
+        type_k       = KV_TYPES[type_k][0],
+        type_v       = KV_TYPES[type_v][0],
+        flash_attn   = flash_attn,
+        n_gpu_layers = args.gpu_layers,
+        verbose      = False,
+    )
+    load_seconds: float = time.perf_counter() - start
+
+    # decode speed and the greedy answer after a long prompt, where the cache type matters
+    prompt: list[int] = llama.tokenize(filler.encode("utf-8"))[:args.prefill]
+    start = time.perf_counter()
+    llama.eval(prompt)
+    prefill_seconds: float = time.perf_counter() - start
+
+    greedy: list[int] = []
+    start = time.perf_counter()
+    for _ in range(args.tokens):
+        greedy.append(int(np.argmax(llama.scores[llama.n_tokens - 1])))
+        llama.eval([greedy[-1]])
+    decode_seconds: float = time.perf_counter() - start
+    state_bytes: int = llama.save_state().llama_state_size
+
+    # teacher forced perplexity of the passage
+    llama.reset()
+    passage: list[int] = llama.tokenize(PASSAGE.encode("utf-8"))[:args.ppl_tokens + 1]
+    llama.eval(passage[:1])
+    nll: float = 0.0
+    for token in passage[1:]:
+        logits: np.ndarray = llama.scores[llama.n_tokens - 1].astype(np.float64)
+        nll += float(np.log(np.exp(logits - logits.max()).sum()) + logits.max() - logits[token])
+        llama.eval([token])
+
+    del llama
+    return {
+        "kv_type":         kv_type,
+        "flash_attn":      flash_attn,
+        "cache_types":     f"{type_k}/{type_v}",
+        "load_seconds":    round(load_seconds, 2),
+        "state_mb":        round(state_bytes / 1024 ** 2, 1), # the used cells of the cache as saved
+        "prefill_tok_s":   round(len(prompt) / prefill_seconds, 1),
+        "decode_tok_s":    round(args.tokens / decode_seconds, 2),
+        "perplexity":      round(math.exp(nll / max(1, len(passage) - 1)), 3),
+        "greedy":          greedy,
+    } #                                                                                                         return #
+# end                                                                                                          measure #
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    metadata: dict[str, Any] = summarize_gguf_metadata(read_gguf_metadata(Path(args.model)))
+    budget:   int            = int(args.budget_mb * 1024 * 1024)
+
+    report: dict[str, Any] = {
+        "model":     metadata.get("name") or Path(args.model).name,
+        "n_ctx":     args.ctx,
+        "budget_mb": args.budget_mb,
+        "options":   [],
+    }
+
+    rng:      random.Random  = random.Random(args.seed)
+    filler:   str            = " ".join(lecture(200, rng) for _ in range(args.prefill // 150 + 1))
+    baseline: Optional[list[int]] = None
+
+    for kv_type, flash_attn in options(args):
+        per_sequence: Optional[int] = kv_bytes(metadata, args.ctx, kv_type, flash_attn)
+        result: dict[str, Any] = {
+            "kv_type":       kv_type,
+            "flash_attn":    flash_attn,
+            "kv_mb":         round(per_sequence / 1024 ** 2, 1) if per_sequence else None, # a full context
+            "max_sequences": max_sequences(budget, per_sequence),
+        }
+
+        if not args.estimate_only:
+            try:
+                result.update(measure(args, kv_type, flash_attn, filler))
+            except Exception as e: # e.g. flash attention on a build or device without it
+                result["error"] = str(e)
+
+            greedy: Optional[list[int]] = result.pop("greedy", None)
+            if greedy is not None:
+                baseline = baseline if baseline is not None else greedy
+                # the share of greedy tokens equal to the first configuration's, 1.0 is the same answer
+                result["greedy_agreement"] = round(sum(a == b for a, b in zip(greedy, baseline)) / len(baseline), 3)
+
+        report["options"].append(result)
+
+    return report #                                                                                             return #
+# end                                                                                                              run #
+
+def main() -> int:
+    """ python -m Server.tests.kv_cache_benchmark [--model path.gguf] [--ctx 8192] [--prefill 4096] [--budget-mb 4096]
+
+        compares the kv cache types with and without flash attention on a local gguf: the kv cache of a full
+        context (from the header) and how many sequences fit the budget, the saved state after the prompt, prefill
+        and decode speed after a long prompt, the perplexity of a short passage and whether the greedy answer
+        after the prompt still matches the first configuration's. --estimate-only reads the header only
+    """
+    parser = argparse.ArgumentParser(description="kv cache types: memory per context, decode speed and quality")
+    parser.add_argument("--model",         type=str,   default=str(DEFAULT_MODEL_PATH))
+    parser.add_argument("--ctx",           type=int,   default=8192)
+    parser.add_argument("--kv-types",      nargs="+",  default=list(KV_TYPES), choices=list(KV_TYPES))
+    parser.add_argument("--flash-attn",    nargs="+",  default=[False, True], type=lambda value: value == "on",
+                        help="'on' and/or 'off'")
+    parser.add_argument("--prefill",       type=int,   default=4096, help="prompt tokens before decoding")
+    parser.add_argument("--tokens",        type=int,   default=64,   help="tokens decoded greedily")
+    parser.add_argument("--ppl-tokens",    type=int,   default=256)
+    parser.add_argument("--budget-mb",     type=float, default=4096, help="kv budget the sequences are counted for")
+    parser.add_argument("--threads",       type=int,   default=0)
+    parser.add_argument("--gpu-layers",    type=int,   default=-1)
+    parser.add_argument("--estimate-only", action="store_true")
+    parser.add_argument("--seed",          type=int,   default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level="WARNING")
+
+    print(json.dumps(run(args), indent=4))
+    return 0 #                                                                                                  return #
+# end                                                                                                         main #
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+
+from typing import Any
+
+import numpy as np
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+from Server.ai.core.scheduler import Scheduler
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+import  logging
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- benchmark ----------------------------------------------------- #
+
+def generation(scheduler: Scheduler, priority: str, session: str, tokens: int, args: argparse.Namespace) -> float:
+    """ a generation with llama.cpp's cost profile on one core: a prefill, then one decode step per token, a
+        suspension pays for a state save and a restore. returns the time to the first token
+    """
+    start: float = time.perf_counter()
+    first: float = 0.0
+
+    with scheduler.slot(priority, session) as slot:
+        time.sleep(args.prefill_ms / 1000)
+
+        for token in range(tokens):
+            if scheduler.should_yield(slot):
+                time.sleep(args.save_ms / 1000)
+                scheduler.suspend(slot)
+                time.sleep(args.restore_ms / 1000)
+
+            time.sleep(args.token_ms / 1000)
+            first = first or time.perf_counter() - start
+
+    return first #                                                                                              return #
+# end                                                                                                       generation #
+
+def run(preemption: bool, args: argparse.Namespace) -> dict[str, Any]:
+    """ `args.batch` bulk generations stay queued for the whole run while interactive questions arrive as a
+        poisson process, the interactive time to first token is what students notice
+    """
+    scheduler: Scheduler = Scheduler(preemption, args.time_slice_ms)
+    rng:       random.Random = random.Random(args.seed)
+    ttft:      list[float]   = []
+    stop:      threading.Event = threading.Event()
+
+    def bulk(worker: int) -> None:
+        while not stop.is_set():
+            generation(scheduler, "batch", f"bulk-{worker}", args.batch_tokens, args)
+
+    def interactive(index: int) -> None:
+        ttft.append(generation(scheduler, "interactive", f"student-{index}", args.interactive_tokens, args))
+
+    workers: list[threading.Thread] = [threading.Thread(target=bulk, args=(w,), daemon=True) for w in range(args.batch)]
+    for worker in workers:
+        worker.start()
+
+    students: list[threading.Thread] = []
+    for index in range(args.questions):
+        time.sleep(rng.expovariate(args.rate))
+        students.append(threading.Thread(target=interactive, args=(index,)))
+        students[-1].start()
+
+    for student in students:
+        student.join()
+    stop.set()
+
+    return {
+        "preemption":    preemption,
+        "questions":     len(ttft),
+        "ttft_ms_p50":   round(float(np.percentile(ttft, 50)) * 1000, 1),
+        "ttft_ms_p99":   round(float(np.percentile(ttft, 99)) * 1000, 1),
+        "ttft_ms_max":   round(max(ttft) * 1000, 1),
+    } #                                                                                                         return #
+# end                                                                                                              run #
+
+def main() -> int:
+    """ python -m Server.tests.scheduler_benchmark [--questions 60] [--rate 2] [--batch 2] [--time-slice-ms 200]
+
+        runs the same mixed workload through the scheduler with and without preemption, the model is simulated
+        with per token costs (defaults resemble an 8b q4 model on a laptop cpu) so only the scheduling is measured
+    """
+    parser = argparse.ArgumentParser(description="interactive time to first token under bulk load")
+    parser.add_argument("--questions",          type=int,   default=60)
+    parser.add_argument("--rate",               type=float, default=2.0, help="interactive questions per second")
+    parser.add_argument("--batch",              type=int,   default=2,   help="bulk generations always queued")
+    parser.add_argument("--batch-tokens",       type=int,   default=400)
+    parser.add_argument("--interactive-tokens", type=int,   default=20)
+    parser.add_argument("--prefill-ms",         type=float, default=40)
+    parser.add_argument("--token-ms",           type=float, default=8)
+    parser.add_argument("--save-ms",            type=float, default=15,  help="llama save_state of a busy context")
+    parser.add_argument("--restore-ms",         type=float, default=10)
+    parser.add_argument("--time-slice-ms",      type=int,   default=200)
+    parser.add_argument("--seed",               type=int,   default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level="WARNING")
+
+    print(json.dumps([run(preemption, args) for preemption in (False, True)], indent=4))
+    return 0 #                                                                                                  return #
+# end                                                                                                         main #
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+from typing import Any
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+import  logging
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- benchmark ----------------------------------------------------- #
+
+# modules that must never be imported just by importing the server, they are only needed once a model loads
+HEAVY_MODULES: list[str] = ["torch", "transformers", "llama_cpp", "whispercpp", "surrealdb"]
+
+# runs in a fresh interpreter with `-X importtime`, prints peak RSS and which heavy modules got pulled in
+PROBE: str = """
+import json, resource, sys
+import {target}
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{
+    "rss_kb": rss // 1024 if sys.platform == "darwin" else rss,
+    "heavy":  [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+def measure(target: str = "Server.server") -> dict[str, Any]:
+    """ measure
+        measure - imports `target` in a fresh interpreter and parses the `-X importtime` report
+
+        Args:
+            target (str): the module to import
+
+        Returns:
+            dict[str, Any]: total import time (ms), peak RSS (MB), heavy modules imported and the 10 slowest imports
+    """
+    result: subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(target=target, heavy=HEAVY_MODULES)],
+        capture_output=True,
+        text=True,
+        cwd=os.getcwd(),
+    )
+
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {target} failed:\n{result.stderr[-2000:]}")
+
+    # lines look like: "import time:       412 |      10342 |   Server.server"
+    imports: list[tuple[str, int, int]] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((name.rstrip(), int(self_us), int(cumulative_us)))
+
+    # top level imports are the ones without leading indentation in the package column
+    total_us: int = sum(cumulative for name, _, cumulative in imports if not name.startswith("  "))
+    probe:    dict[str, Any] = json.loads(result.stdout.strip().splitlines()[-1])
+
+    return {
+        "target":    target,
+        "import_ms": total_us / 1000,
+        "rss_mb":    probe["rss_kb"] / 1024,
+        "heavy":     probe["heavy"],
+        "slowest":   [
+            {"module": name.strip(), "self_ms": self_us / 1000}
+            for name, self_us, _ in sorted(imports, key=lambda item: item[1], reverse=True)[:10]
+        ],
+    } #                                                                                                         return #
+# end                                                                                                      measure #
+
+def main() -> int:
+    """ python -m Server.tests.startup_benchmark [--max-import-ms 1500] [--max-rss-mb 150] [--runs 3]
+
+        exits with 1 if the best of `--runs` imports is slower than the threshold, the peak RSS is above the
+        threshold, or any heavy optional module was imported eagerly
+    """
+    parser = argparse.ArgumentParser(description="startup import time / RSS regression check")
+    parser.add_argument("--target",        default="Server.server")
+    parser.add_argument("--max-import-ms", type=float, default=1500.0)
+    parser.add_argument("--max-rss-mb",    type=float, default=150.0)
+    parser.add_argument("--runs",          type=int,   default=3)
+    args = parser.parse_args()
+
+    runs: list[dict[str, Any]] = [measure(args.target) for _ in range(max(1, args.runs))]
+    best: dict[str, Any]       = min(runs, key=lambda run: run["import_ms"])
+
+    print(json.dumps(best, indent=4))
+
+    failures: list[str] = []
+    if best["import_ms"] > args.max_import_ms:
+        failures.append(f"import time {best['import_ms']:.1f}ms > {args.max_import_ms}ms")
+
+    if best["rss_mb"] > args.max_rss_mb:
+        failures.append(f"rss {best['rss_mb']:.1f}MB > {args.max_rss_mb}MB")
+
+    if best["heavy"]:
+        failures.append(f"heavy modules imported eagerly: {', '.join(best['heavy'])}")
+
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+
+    return 1 if failures else 0 #                                                                               return #
+# end                                                                                                         main #
+
+if __name__ == "__main__":
+    sys.exit(main())
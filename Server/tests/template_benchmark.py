@@ -0,0 +1,117 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import sys
+import json
+import time
+import random
+import argparse
+
+from typing import Any, Callable, Optional
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+from Server.ai.backends.mock         import MockBackend
+from Server.ai.core.chat_template    import ChatTemplate, PromptCache
+from Server.ai.core.model_registry   import DEFAULT_MODEL_PATH
+from Server.tests.tokenizer_benchmark import lecture
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+import  logging
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- benchmark ----------------------------------------------------- #
+
+# (messages, session) -> the tokens of the prompt
+Prompt = Callable[[list[dict[str, str]], Optional[str]], list[int]]
+
+def prompts(args: argparse.Namespace) -> tuple[str, Prompt, Prompt]:
+    """ the prompt builders rendering the whole history every turn and only the new messages """
+    if args.backend == "mock":
+        backend: MockBackend = MockBackend("mock")
+        tokenize = lambda text, first: backend.tokenize(text, special=True)
+        full:        PromptCache = PromptCache(backend._render, tokenize, enabled=False)
+        incremental: PromptCache = PromptCache(backend._render, tokenize)
+        if not incremental.incremental:
+            raise RuntimeError("the mock template failed the probe")
+
+        return "mock", lambda messages, session: full.prompt(session, messages), \
+            lambda messages, session: incremental.prompt(session, messages) #                                   return #
+
+    from llama_cpp import Llama
+
+    llama: Llama = Llama(model_path=args.model, vocab_only=True, verbose=False)
+    template: Optional[str] = llama.metadata.get("tokenizer.chat_template")
+    if not template:
+        raise RuntimeError(f"{args.model} has no chat template")
+
+    whole: ChatTemplate = ChatTemplate(llama, template, sessions=0)
+    added: ChatTemplate = ChatTemplate(llama, template)
+    if not added.incremental:
+        logger.warning("the template failed the probe, both sides render the whole history")
+
+    return args.model, lambda messages, session: whole.prompt(messages, session)[0], \
+        lambda messages, session: added.prompt(messages, session)[0] #                                          return #
+# end                                                                                                          prompts #
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    rng: random.Random = random.Random(args.seed)
+    model, full, incremental = prompts(args)
+
+    messages: list[dict[str, str]] = [{"role": "system", "content": lecture(args.words, rng)}]
+    timings:  dict[str, list[float]] = {"full": [], "incremental": []}
+    mismatches: int = 0
+
+    for _ in range(args.turns):
+        messages.append({"role": "user", "content": lecture(args.words // 4, rng)})
+
+        start = time.perf_counter()
+        expected: list[int] = full(messages, "benchmark")
+        timings["full"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        tokens: list[int] = incremental(messages, "benchmark")
+        timings["incremental"].append(time.perf_counter() - start)
+
+        mismatches += tokens != expected
+        messages.append({"role": "assistant", "content": lecture(args.words, rng)})
+
+    return {
+        "model":         model,
+        "turns":         args.turns,
+        "prompt_tokens": len(expected),
+        "mismatches":    mismatches, # turns whose incremental prompt differs from the full one, has to be 0
+        **{
+            kind: {
+                "ms_per_turn":  round(sum(seconds) / args.turns * 1000, 3),
+                "ms_last_turn": round(seconds[-1] * 1000, 3),
+                "ms_total":     round(sum(seconds) * 1000, 1),
+            }
+            for kind, seconds in timings.items()
+        },
+    } #                                                                                                         return #
+# end                                                                                                              run #
+
+def main() -> int:
+    """ python -m Server.tests.template_benchmark [--backend mock] [--model path.gguf] [--turns 100]
+
+        builds the prompt of every turn of a long conversation twice, rendering and tokenizing the whole
+        history like llama.cpp does and rendering only the messages added since the previous turn, and checks
+        that both give the same tokens. the llama backend only loads the vocabulary of the gguf
+    """
+    parser = argparse.ArgumentParser(description="chat template rendering cost per turn, full against incremental")
+    parser.add_argument("--backend", choices=("mock", "llama"), default="mock")
+    parser.add_argument("--model",   type=str, default=str(DEFAULT_MODEL_PATH))
+    parser.add_argument("--turns",   type=int, default=100)
+    parser.add_argument("--words",   type=int, default=200, help="words per answer, questions are a quarter")
+    parser.add_argument("--seed",    type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level="WARNING")
+
+    print(json.dumps(run(args), indent=4))
+    return 0 #                                                                                                  return #
+# end                                                                                                         main #
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import sys
+import json
+import time
+import random
+import argparse
+
+from pathlib import Path
+from typing  import Any
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+from Server.ai.backends.base         import BACKENDS, InferenceBackend, create_backend
+from Server.ai.context.chat_context  import ChatContext
+from Server.ai.core.model_registry   import DEFAULT_MODEL_PATH
+from Server.ai.core.tokenizer        import Tokenizer
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+import  logging
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- benchmark ----------------------------------------------------- #
+
+VOCABULARY: list[str] = (
+    "entropy enthalpy temperature pressure volume the a of and to in is that for it as with was on be by this "
+    "heat work energy system reservoir cycle carnot efficiency isothermal adiabatic reversible process gas "
+    "molecule particle state function integral derivative equation boltzmann constant kelvin joule per mole "
+    "therefore which means we can see from here if then so because however, note: (see slide 12) = + - 1 2 3"
+).split()
+
+def lecture(words: int, rng: random.Random) -> str:
+    """ a paragraph of transcript-like text """
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words)).capitalize() + "." #                          return #
+# end                                                                                                         lecture #
+
+def throughput(tokenizer: Tokenizer, texts: list[str], batch: int) -> dict[str, Any]:
+    start:  float = time.perf_counter()
+    tokens: int   = 0
+    for offset in range(0, len(texts), batch):
+        tokens += sum(len(ids) for ids in tokenizer.tokenize_batch(texts[offset:offset + batch]))
+    seconds: float = time.perf_counter() - start
+
+    return {
+        "seconds":       round(seconds, 3),
+        "tokens":        tokens,
+        "tokens_per_s":  round(tokens / seconds),
+        "texts_per_s":   round(len(texts) / seconds),
+        "mb_per_s":      round(sum(len(text) for text in texts) / seconds / 1e6, 2),
+    } #                                                                                                         return #
+# end                                                                                                   throughput #
+
+def conversation(tokenizer: Tokenizer, backend: InferenceBackend, turns: int, words: int,
+                 rng: random.Random) -> dict[str, Any]:
+    """ the cost of knowing the prompt size of every turn of a `turns` long conversation: remembered counts per
+        message against tokenizing the whole history again each turn
+    """
+    context: ChatContext = ChatContext("benchmark")
+    memo:    list[float] = []
+    full:    list[float] = []
+
+    for _ in range(turns):
+        context.append("user", lecture(words // 4, rng))
+        context.append("assistant", lecture(words, rng))
+
+        start = time.perf_counter()
+        counted: int = context.token_count(tokenizer)
+        memo.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        retokenized: int = sum(
+            len(backend.tokenize(str(message["content"])))
+            for message in context.get_context()
+        )
+        full.append(time.perf_counter() - start)
+
+    return {
+        "turns":                   turns,
+        "prompt_tokens":           counted,
+        "text_tokens":             retokenized,
+        "ms_per_turn_memoized":    round(sum(memo) / turns * 1000, 3),
+        "ms_per_turn_retokenized": round(sum(full) / turns * 1000, 3),
+        "ms_last_turn_memoized":   round(memo[-1] * 1000, 3),
+        "ms_last_turn_retokenized": round(full[-1] * 1000, 3),
+    } #                                                                                                         return #
+# end                                                                                                 conversation #
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    rng: random.Random = random.Random(args.seed)
+
+    backend: InferenceBackend = create_backend(args.backend, Path(args.model), url=args.url)
+    start:   float            = time.perf_counter()
+    backend.load()
+    load_seconds: float = time.perf_counter() - start
+
+    texts: list[str] = [lecture(args.words, rng) for _ in range(args.texts)]
+    # a fifth of the batch repeats earlier texts, like the system prompt and material sent with many questions
+    texts += [rng.choice(texts) for _ in range(args.texts // 5)]
+
+    tokenizer: Tokenizer = Tokenizer(backend, budget_bytes=int(args.cache_mb * 1024 * 1024))
+    report: dict[str, Any] = {
+        "backend":      args.backend,
+        "model":        backend.name,
+        "load_seconds": round(load_seconds, 2),
+        "texts":        len(texts),
+        "words_per_text": args.words,
+    }
+
+    # the backend alone, every text tokenized
+    start = time.perf_counter()
+    tokens: int = sum(len(backend.tokenize(text)) for text in texts)
+    report["uncached"] = {"tokens_per_s": round(tokens / (time.perf_counter() - start))}
+
+    report["cold"] = throughput(tokenizer, texts, args.batch) # only the repeats hit
+    report["warm"] = throughput(tokenizer, texts, args.batch) # everything hits
+    report["cache_mb"] = round(tokenizer.cached_bytes / 1e6, 2)
+    report["conversation"] = conversation(tokenizer, backend, args.turns, args.words, rng)
+
+    backend.unload()
+    return report #                                                                                             return #
+# end                                                                                                              run #
+
+def main() -> int:
+    """ python -m Server.tests.tokenizer_benchmark [--backend mock] [--model path.gguf] [--texts 5000]
+
+        tokenizes a batch of lecture-like paragraphs through the tokenization service, cold (nothing cached)
+        and warm (everything cached), next to the backend without the cache. then counts the prompt of a long
+        conversation every turn from remembered message counts and by tokenizing the history again
+    """
+    parser = argparse.ArgumentParser(description="tokenization throughput and memoized prompt counts")
+    parser.add_argument("--backend",  choices=BACKENDS, default="llama")
+    parser.add_argument("--model",    type=str,   default=str(DEFAULT_MODEL_PATH))
+    parser.add_argument("--url",      type=str,   default=None, help="the server of the remote backend")
+    parser.add_argument("--texts",    type=int,   default=5000)
+    parser.add_argument("--words",    type=int,   default=200)
+    parser.add_argument("--batch",    type=int,   default=1024)
+    parser.add_argument("--turns",    type=int,   default=100)
+    parser.add_argument("--cache-mb", type=float, default=64)
+    parser.add_argument("--seed",     type=int,   default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level="WARNING")
+
+    print(json.dumps(run(args), indent=4))
+    return 0 #                                                                                                  return #
+# end                                                                                                         main #
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from pathlib import Path
+from typing  import Any
+
+import numpy as np
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+from Server.ai.audio.decoding       import SAMPLE_RATE
+from Server.ai.audio.segmenter      import Segmenter
+from Server.ai.audio.stream         import TranscriptionStream
+from Server.ai.audio.transcriber    import SpeechModel, Transcriber, whisper_model
+from Server.ai.core.data_structures import AudioData, TranscribedText
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+import  logging
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- benchmark ----------------------------------------------------- #
+
+def stand_in_model(passes: int = 16) -> SpeechModel:
+    """ a speech model with whisper's cost profile and none of its weights: an stft of the segment followed by
+        `passes` dense layers over every frame, cpu time grows linearly with the audio like an encoder's does
+    """
+    rng:     np.random.Generator = np.random.default_rng(0)
+    weights: list[np.ndarray]    = [rng.standard_normal((1024, 1024), dtype=np.float32) / 32 for _ in range(passes)]
+    window:  np.ndarray          = np.hanning(400).astype(np.float32)
+
+    def transcribe(audio: np.ndarray) -> str:
+        frames:   int        = max(1, (len(audio) - 400) // 160 + 1)
+        padded:   np.ndarray = np.pad(audio, (0, max(0, 400 - len(audio))))
+        strided:  np.ndarray = np.lib.stride_tricks.sliding_window_view(padded, 400)[::160][:frames]
+        features: np.ndarray = np.abs(np.fft.rfft(strided * window, n=2046, axis=1)).astype(np.float32)
+
+        for weight in weights:
+            features = np.tanh(features @ weight)
+
+        return f" <{len(audio) / SAMPLE_RATE:.2f}s of speech>" #                                                return #
+
+    return transcribe #                                                                                         return #
+# end                                                                                               stand_in_model #
+
+def lecture(seconds: float, rng: np.random.Generator) -> tuple[np.ndarray, int]:
+    """ synthetic lecture audio: 1-6 s utterances of voiced harmonics separated by 0.6-2 s pauses over noise """
+    audio:      list[np.ndarray] = []
+    utterances: int              = 0
+    total:      int              = 0
+
+    while total < seconds * SAMPLE_RATE:
+        speech: int        = int(rng.uniform(1, 6) * SAMPLE_RATE)
+        time_:  np.ndarray = np.arange(speech) / SAMPLE_RATE
+        pitch:  float      = rng.uniform(100, 220)
+        voiced: np.ndarray = sum(np.sin(2 * np.pi * pitch * k * time_) / k for k in range(1, 6))        # type:ignore
+        voiced *= 0.2 * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * time_) ** 2) # syllable rate envelope
+        pause:  np.ndarray = np.zeros(int(rng.uniform(0.6, 2) * SAMPLE_RATE))
+
+        audio += [voiced, pause]
+        utterances += 1
+        total += speech + len(pause)
+
+    signal: np.ndarray = np.concatenate(audio).astype(np.float32)
+    signal += 0.003 * rng.standard_normal(len(signal)).astype(np.float32)
+    return signal, utterances #                                                                                 return #
+# end                                                                                                      lecture #
+
+def run(workers: int, audio: np.ndarray, args: argparse.Namespace) -> dict[str, Any]:
+    """ run
+        run - streams `audio` as pcm16 in 20 ms chunks as fast as it can be consumed through a pool of `workers`
+
+        Returns:
+            dict[str, Any]: the real time factor of the whole pipeline, the real time factor per core, the time
+                            from the end of the audio to the last final and the segments found
+    """
+    factory = (
+        (lambda: whisper_model(args.model, Path(args.models_dir), 1)) if args.model
+        else (lambda: stand_in_model(args.passes))
+    )
+    transcriber: Transcriber           = Transcriber(factory, workers, 2 * workers)
+    results:     list[TranscribedText] = []
+
+    transcriber.submit(np.zeros(SAMPLE_RATE, dtype=np.float32)).result() # load a model outside the measurement
+
+    stream: TranscriptionStream = TranscriptionStream(
+        transcriber, AudioData(format="pcm16"), results.append, Segmenter(partial_interval=args.partial_interval)
+    )
+    pcm:   bytes = (np.clip(audio, -1, 1) * 32767).astype("<i2").tobytes()
+    chunk: int   = SAMPLE_RATE // 50 * 2
+
+    start: float = time.perf_counter()
+    for offset in range(0, len(pcm), chunk):
+        stream.feed(pcm[offset:offset + chunk])
+    fed: float = time.perf_counter()
+    stream.finish()
+    end: float = time.perf_counter()
+
+    duration: float = len(audio) / SAMPLE_RATE
+    return {
+        "workers":               workers,
+        "real_time_factor":      (end - start) / duration,
+        "rtf_per_core":          (end - start) * workers / duration,
+        "speedup_vs_real_time":  duration / (end - start),
+        "tail_latency_ms":       (end - fed) * 1000,
+        "finals":                sum(result.final for result in results),
+        "partials":              sum(not result.final for result in results),
+    } #                                                                                                         return #
+# end                                                                                                          run #
+
+def main() -> int:
+    """ python -m Server.tests.transcription_benchmark [--seconds 120] [--workers 1 2 4] [--model base.en]
+
+        without --model a stand-in model with whisper's linear cost profile is used, so the pipeline (vad,
+        segmentation, pool, ordering) is measured on machines without whispercpp or model files
+    """
+    parser = argparse.ArgumentParser(description="streaming transcription real time factor")
+    parser.add_argument("--seconds",          type=float, default=120)
+    parser.add_argument("--workers",          type=int,   nargs="+", default=[1, 2, os.cpu_count() or 1])
+    parser.add_argument("--passes",           type=int,   default=16, help="cost of the stand-in model")
+    parser.add_argument("--partial-interval", type=float, default=1.0)
+    parser.add_argument("--model",            default="", help="a whisper.cpp model instead of the stand-in")
+    parser.add_argument("--models-dir",       default="Server/models/whisper")
+    parser.add_argument("--seed",             type=int,   default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level="WARNING")
+
+    audio, utterances = lecture(args.seconds, np.random.default_rng(args.seed))
+    reports: list[dict[str, Any]] = [run(workers, audio, args) for workers in sorted(set(args.workers))]
+
+    print(json.dumps({"audio_seconds": len(audio) / SAMPLE_RATE, "utterances": utterances, "runs": reports},
+                     indent=4))
+    return 0 #                                                                                                  return #
+# end                                                                                                         main #
+
+if __name__ == "__main__":
+    sys.exit(main())
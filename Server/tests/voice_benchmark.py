@@ -0,0 +1,164 @@
+# ------------------------------------------------- regular imports -------------------------------------------------- #
+
+import sys
+import json
+import time
+import argparse
+import statistics
+
+from pathlib import Path
+from typing  import Any
+
+import numpy as np
+
+# -------------------------------------------------- local imports --------------------------------------------------- #
+
+from Server.config.read_config            import Config
+from Server.ai.audio.decoding             import SAMPLE_RATE
+from Server.ai.audio.transcriber          import SpeechModel, Transcriber
+from Server.ai.audio.voice                import VoiceQuestion
+from Server.ai.context.sessions           import SessionManager
+from Server.ai.core.data_structures       import AudioData, ChatRequest
+from Server.ai.core.model_loader          import Model
+from Server.tests.transcription_benchmark import stand_in_model
+
+# -------------------------------------------------- set up logging -------------------------------------------------- #
+
+import  logging
+logger: logging.Logger = logging.getLogger("rich")
+
+# ---------------------------------------------------- benchmark ----------------------------------------------------- #
+
+QUESTIONS: list[str] = [
+    "what does the second law of thermodynamics say about the entropy of an isolated system",
+    "can you explain why a heat engine can never convert all of the heat it absorbs into work",
+    "how is the carnot efficiency related to the temperatures of the hot and the cold reservoir",
+    "why does the entropy of the universe increase when heat flows from a hot body to a cold one",
+]
+
+WORDS_PER_SECOND: float = 2.5
+
+class ScriptedSpeech:
+    """ a stand-in speech model that "recognizes" the words of the current question spoken so far, at the cost
+        of `stand_in_model`, so partial transcripts grow like whisper's do
+    """
+
+    def __init__(self, passes: int) -> None:
+        self.question: list[str] = []
+        self.__cost:   SpeechModel = stand_in_model(passes)
+    # end                                                                                                     __init__ #
+
+    def __call__(self, audio: np.ndarray) -> str:
+        self.__cost(audio)
+        words: int = int(len(audio) / SAMPLE_RATE * WORDS_PER_SECOND)
+        return " " + " ".join(self.question[:words]) #                                                          return #
+    # end                                                                                                     __call__ #
+# end                                                                                                   ScriptedSpeech #
+
+def spoken(words: int, rng: np.random.Generator) -> np.ndarray:
+    """ one utterance of voiced harmonics long enough for `words` words, with a lead-in and the pause ending it """
+    time_:  np.ndarray = np.arange(int(words / WORDS_PER_SECOND * SAMPLE_RATE)) / SAMPLE_RATE
+    pitch:  float      = rng.uniform(100, 220)
+    voiced: np.ndarray = sum(np.sin(2 * np.pi * pitch * k * time_) / k for k in range(1, 6))            # type:ignore
+    voiced *= 0.2 * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * time_) ** 2)
+    voiced *= (time_ * WORDS_PER_SECOND) % 1 < 0.8 # the gaps between words keep the vad's noise floor down
+
+    signal: np.ndarray = np.concatenate([np.zeros(SAMPLE_RATE // 2), voiced, np.zeros(SAMPLE_RATE)]).astype(np.float32)
+    return signal + 0.003 * rng.standard_normal(len(signal)).astype(np.float32) #                              return #
+# end                                                                                                           spoken #
+
+def ask(model: Model, transcriber: Transcriber, audio: np.ndarray, session: str, pipelined: bool) -> dict[str, float]:
+    """ streams `audio` in real time (20 ms chunks), then answers: the time to the first token after the end of
+        the audio is what the student waits for
+    """
+    question: VoiceQuestion = VoiceQuestion(
+        model, transcriber, AudioData(format="pcm16"), ChatRequest(text="", session_id=session, seed=0),
+        lambda _: None, pipelined=pipelined
+    )
+    pcm:   bytes = (np.clip(audio, -1, 1) * 32767).astype("<i2").tobytes()
+    chunk: int   = SAMPLE_RATE // 50 * 2
+
+    start: float = time.perf_counter()
+    for offset in range(0, len(pcm), chunk):
+        question.feed(pcm[offset:offset + chunk])
+        time.sleep(max(0.0, start + (offset + chunk) / 2 / SAMPLE_RATE - time.perf_counter()))
+
+    ended: float = time.perf_counter()
+    question.finish()
+    transcribed: float = time.perf_counter()
+
+    # only the first token is measured, the rest of the answer costs the same in both modes
+    answer = question.answer()
+    first: float = next(time.perf_counter() for response in answer if response.content)
+    answer.close()
+
+    return {
+        "transcript_ms": (transcribed - ended) * 1000,
+        "ttft_ms":       (first - ended) * 1000,
+    } #                                                                                                         return #
+# end                                                                                                              ask #
+
+def run(model: Model, transcriber: Transcriber, speech: ScriptedSpeech, pipelined: bool,
+        args: argparse.Namespace) -> dict[str, Any]:
+    rng:     np.random.Generator    = np.random.default_rng(args.seed)
+    results: list[dict[str, float]] = []
+    mode:    str                    = "pipelined" if pipelined else "sequential"
+
+    for repeat in range(args.repeats):
+        session: str = f"{mode}-{repeat}"
+        context = model.sessions.get(session)
+        for turn in range(args.history_turns): # a lecture conversation the question continues
+            context.append(role="user", text=" ".join(QUESTIONS[turn % len(QUESTIONS)].split()[::-1]))
+            context.append(role="assistant", text=" ".join(["the lecture explained this in detail"] * 20))
+
+        for text in QUESTIONS:
+            speech.question = text.split()
+            # another student's turn in between, the session's kv state is parked like on a shared server
+            list(model.predict(ChatRequest(text="say ok", session_id="other", seed=0)))
+            results.append(ask(model, transcriber, spoken(len(speech.question), rng), session, pipelined))
+
+    ttft: list[float] = [result["ttft_ms"] for result in results]
+    return {
+        "mode":              mode,
+        "questions":         len(results),
+        "ttft_ms_median":    round(statistics.median(ttft), 1),
+        "ttft_ms_p90":       round(float(np.percentile(ttft, 90)), 1),
+        "transcript_ms":     round(statistics.median(result["transcript_ms"] for result in results), 1),
+    } #                                                                                                         return #
+# end                                                                                                              run #
+
+def main() -> int:
+    """ python -m Server.tests.voice_benchmark --model path/to/model.gguf [--history-turns 4] [--repeats 2]
+
+        asks the same spoken questions sequentially (transcribe, then prefill and answer) and pipelined (prefill
+        while the question is spoken) and reports the time from the end of the speech to the first answer token
+    """
+    parser = argparse.ArgumentParser(description="voice question time to first token")
+    parser.add_argument("--model",         type=Path,  required=True, help="a gguf language model")
+    parser.add_argument("--history-turns", type=int,   default=4,  help="earlier turns of every session")
+    parser.add_argument("--repeats",       type=int,   default=2)
+    parser.add_argument("--passes",        type=int,   default=16, help="cost of the stand-in speech model")
+    parser.add_argument("--seed",          type=int,   default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level="WARNING")
+    Config.knowledge_enabled = False # retrieval costs the same in both modes, leave it out of the measurement
+
+    speech:      ScriptedSpeech = ScriptedSpeech(args.passes)
+    transcriber: Transcriber    = Transcriber(lambda: speech, 2, 4)
+    model:       Model          = Model(args.model, sessions=SessionManager())
+
+    if not model.wait_until_ready() or not model.is_ready:
+        print(f"{args.model} failed to load", file=sys.stderr)
+        return 1 #                                                                                              return #
+
+    list(model.predict(ChatRequest(text="say ok", session_id="warmup", seed=0)))
+    reports: list[dict[str, Any]] = [run(model, transcriber, speech, pipelined, args) for pipelined in (False, True)]
+    reports[1]["ttft_speedup"] = round(reports[0]["ttft_ms_median"] / max(reports[1]["ttft_ms_median"], 1e-3), 2)
+
+    print(json.dumps(reports, indent=4))
+    return 0 #                                                                                                  return #
+# end                                                                                                         main #
+
+if __name__ == "__main__":
+    sys.exit(main())
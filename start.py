@@ -6,9 +6,7 @@ import subprocess
 import platform
 import logging
 
-# -------------------------------------------------- local imports --------------------------------------------------- #
-
-from Server import main as server_main, Config, app
+from importlib.util import find_spec
 
 # ----------------------------------------------------- runtime ------------------------------------------------------ #
 
@@ -29,21 +27,33 @@ def check_python_version():
         return False
     return True
 
-def check_dependencies():
-    try:
-        import toml
-        import fastapi
-        import uvicorn
-        import rich
-        import pydantic
-        import transformers
-        import torch
-        logging.info("Basic dependencies verified")
-        return True
-    except ImportError as e:
-        logging.error(f"Missing dependency: {e}")
+# checked with find_spec so nothing is imported (and no RSS is paid) just to see that it exists
+REQUIRED_DEPENDENCIES = ["toml", "fastapi", "uvicorn", "rich", "pydantic"]
+OPTIONAL_DEPENDENCIES = {
+    "llama_cpp":  "local inference",
+    "httpx":      "the remote inference backend",
+    "whispercpp": "speech transcription",
+    "surrealdb":  "surrealdb storage",
+    "numpy":      "relevance selected history, knowledge retrieval and transcription",
+}
+GATEWAY_DEPENDENCIES = ["httpx", "websockets"]
+
+def check_dependencies(gateway=False):
+    required = REQUIRED_DEPENDENCIES + (GATEWAY_DEPENDENCIES if gateway else [])
+    missing = [name for name in required if find_spec(name) is None]
+    
+    if missing:
+        logging.error(f"Missing dependency: {', '.join(missing)}")
         logging.error("Please run: pip install -r requirements.txt")
         return False
+    
+    # the gateway only forwards requests, the inference dependencies live on its backends
+    for name, feature in ({} if gateway else OPTIONAL_DEPENDENCIES).items():
+        if find_spec(name) is None:
+            logging.warning(f"Optional dependency '{name}' not installed, {feature} will be unavailable")
+    
+    logging.info("Basic dependencies verified")
+    return True
 
 def check_models():
     models_dir = os.path.join(os.getcwd(), "Server", "models")
@@ -87,6 +97,8 @@ def check_config():
         return False
 
 def main():
+    # --gateway runs the session routing front of several servers (see [gateway] in server.toml) instead of a server
+    gateway = "--gateway" in sys.argv[1:]
     setup_basic_logging()
     
     print("\n" + "="*60)
@@ -99,16 +111,24 @@ def main():
     if not check_python_version():
         return 1
     
-    if not check_dependencies():
+    if not check_dependencies(gateway):
         return 1
     
-    check_models()  # Only warn, don't exit
+    if not gateway:
+        check_models()  # Only warn, don't exit
     
     if not check_config():
         return 1
     
     try:
+        if gateway:
+            logging.info("Starting Vox AI Gateway...")
+            from Server.gateway.gateway import main as gateway_main
+            gateway_main()
+            return 0
+
         logging.info("Starting Vox AI Server...")
+        from Server import main as server_main
         server_main()
         return 0
     except KeyboardInterrupt: